@@ -31,6 +31,15 @@ async def lifespan(fastapi_app: FastAPI):
     yield
     # Clean up on shutdown if needed
     logger.info("FastAPI application shutting down")
+    from ktem.components import docstores, vectorstores
+    from ktem.db.engine import engine
+
+    from kotaemon.storages.clients import close_shared_clients
+
+    docstores.close()
+    vectorstores.close()
+    close_shared_clients()
+    engine.dispose()
 
 
 def create_app():
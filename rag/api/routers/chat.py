@@ -7,6 +7,7 @@ from typing import Optional
 from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 
+from ktem.db.engine import run_sync
 from libs.services.chat_service import ChatService, ChatRequest
 from ..config import DEFAULT_SETTINGS, logger
 
@@ -57,7 +58,7 @@ async def chat_view(request: Request):
         )
 
         # Submit the chat message
-        submit_response = chat_service.submit_message(chat_request)
+        submit_response = await run_sync(chat_service.submit_message, chat_request)
 
         # Prefer generated name if it exists, otherwise use name potentially set by submit_message
         final_conv_name = generated_conv_name or submit_response.get('conv_name')
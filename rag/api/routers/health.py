@@ -13,3 +13,11 @@ async def health():
     """
     # Use the same format as Flask
     return JSONResponse(content={"status": "ready"})
+
+
+@router.get("/health/stores")
+async def stores():
+    """Resident document and vector stores, shared clients and memory."""
+    from ktem.components import store_stats
+
+    return JSONResponse(content=store_stats())
@@ -88,6 +88,11 @@ KH_USER_CAN_SEE_PUBLIC = None
 KH_ENABLE_ALEMBIC = False
 # KH_DATABASE = f"sqlite:///{KH_USER_DATA_DIR / 'sql.db'}"
 KH_DATABASE = str(config("KH_DATABASE"))
+# connection pool of each process, the blocking work of the API runs in a pool of
+# KH_SYNC_EXECUTOR_WORKERS threads (default to pool size + overflow)
+KH_DATABASE_POOL_SIZE = config("KH_DATABASE_POOL_SIZE", default=10, cast=int)
+KH_DATABASE_MAX_OVERFLOW = config("KH_DATABASE_MAX_OVERFLOW", default=20, cast=int)
+KH_DATABASE_POOL_RECYCLE = config("KH_DATABASE_POOL_RECYCLE", default=1800, cast=int)
 KH_FILESTORAGE_PATH = str(KH_USER_DATA_DIR / "files")
 KH_WEB_SEARCH_BACKEND = (
     "kotaemon.indices.retrievers.tavily_web_search.WebSearch"
@@ -100,6 +105,19 @@ if config("KH_DOCSTORE_NAME") == 'lance':
         "path": config("KH_DOCSTORE_LANCE_PATH"),
         "api_key": config("KH_DOCSTORE_LANCE_API_KEY")
     }
+elif config("KH_DOCSTORE_NAME") == 'sqlite':
+    # single-node full-text search (SQLite FTS5, BM25)
+    KH_DOCSTORE = {
+        "__type__": "kotaemon.storages.SQLiteDocumentStore",
+        "path": str(KH_USER_DATA_DIR / "docstore"),
+    }
+elif config("KH_DOCSTORE_NAME") == 'bm25':
+    # in-process BM25 index, "cjk" tokenizer for Chinese, Japanese and Korean
+    KH_DOCSTORE = {
+        "__type__": "kotaemon.storages.BM25DocumentStore",
+        "path": str(KH_USER_DATA_DIR / "docstore"),
+        "tokenizer": config("KH_DOCSTORE_BM25_TOKENIZER", default="simple"),
+    }
 else:
     KH_DOCSTORE = {
         # "__type__": "kotaemon.storages.ElasticsearchDocumentStore",
@@ -120,10 +138,127 @@ else:
         # "__type__": "kotaemon.storages.LanceDBVectorStore",
         "__type__": "kotaemon.storages.ChromaVectorStore",
         # "__type__": "kotaemon.storages.MilvusVectorStore",
+        # "__type__": "kotaemon.storages.NumpyVectorStore",
         # "__type__": "kotaemon.storages.QdrantVectorStore",
         "path": str(KH_USER_DATA_DIR / "vectorstore"),
     }
 
+# maximum number of collections (one per index) whose document and vector stores
+# stay open, the least recently used ones are closed beyond
+KH_DOCSTORE_REGISTRY_SIZE = config("KH_DOCSTORE_REGISTRY_SIZE", default=32, cast=int)
+KH_VECTORSTORE_REGISTRY_SIZE = config(
+    "KH_VECTORSTORE_REGISTRY_SIZE", default=32, cast=int
+)
+
+# cache of the query embeddings, shared by all embedding models. Keys include
+# the model spec, set to None to disable
+KH_QUERY_EMBEDDING_CACHE = {
+    "__type__": "kotaemon.embeddings.InMemoryEmbeddingCache",
+    "max_size": 10000,
+    "ttl": 7 * 24 * 3600,
+    "fallback": {
+        "__type__": "kotaemon.embeddings.SQLiteEmbeddingCache",
+        "path": str(KH_APP_DATA_DIR / "query_embedding_cache.db"),
+        "max_size": 200000,
+        "ttl": 7 * 24 * 3600,
+    },
+}
+
+# persistent cache of the chunk embeddings, keyed by the embedding model and the
+# sha256 of the chunk text, so re-indexing unchanged content skips the embedding
+# API. Set to None to disable
+KH_CHUNK_EMBEDDING_CACHE = {
+    "__type__": "kotaemon.embeddings.SQLiteEmbeddingCache",
+    "path": str(KH_APP_DATA_DIR / "chunk_embedding_cache.db"),
+}
+
+# concurrent batched embedding of the chunks during indexing, the concurrency is
+# halved on HTTP 429 and grows back on success
+KH_EMBEDDING_EXECUTOR = {
+    "__type__": "kotaemon.embeddings.EmbeddingExecutor",
+    "max_concurrency": 4,
+    "max_batch_size": 32,
+}
+
+# LLM relevance scoring of the retrieved documents: documents graded per LLM
+# call (1 to grade them one by one), and LLM scoring calls in flight per process
+KH_LLM_SCORING_BATCH_SIZE = config("KH_LLM_SCORING_BATCH_SIZE", default=10, cast=int)
+KH_LLM_SCORING_MAX_CONCURRENCY = config(
+    "KH_LLM_SCORING_MAX_CONCURRENCY", default=8, cast=int
+)
+
+# cascade reranking of the retrieved documents: the retrieval keeps the
+# `retrieval.top_k` best fused documents, the reranking model keeps
+# `reranking.top_k` of them, and only those are graded by the LLM scorer. A stage
+# drops the documents scoring under `min_score`, ends the cascade when all its
+# documents score at least `exit_score`, and the later stages are skipped when it
+# runs over its `budget` (seconds). When disabled, the reranking model reranks all
+# the retrieved documents and the LLM scorer grades them in the background
+KH_RERANKING_CASCADE = (
+    {
+        "retrieval": {"top_k": 50},
+        "reranking": {"top_k": 10, "budget": 2.0},
+        "llm": {"budget": 8.0},
+    }
+    if config("KH_USE_RERANKING_CASCADE", default=False, cast=bool)
+    else None
+)
+KH_RERANKING_CASCADE_MAX_CONCURRENCY = config(
+    "KH_RERANKING_CASCADE_MAX_CONCURRENCY", default=8, cast=int
+)
+
+# cache of the relevance scores of the (query, chunk) pairs computed by the
+# rerankers and the LLM scorers, shared by the processes through Redis when
+# KH_RELEVANCE_SCORE_CACHE_REDIS_URL is set (e.g. the Celery broker Redis)
+KH_RELEVANCE_SCORE_CACHE_REDIS_URL = config(
+    "KH_RELEVANCE_SCORE_CACHE_REDIS_URL", default=""
+)
+KH_RELEVANCE_SCORE_CACHE_TTL = config(
+    "KH_RELEVANCE_SCORE_CACHE_TTL", default=86400, cast=int
+)
+if KH_RELEVANCE_SCORE_CACHE_REDIS_URL:
+    KH_RELEVANCE_SCORE_CACHE = {
+        "__type__": "kotaemon.rerankings.RedisScoreCache",
+        "url": KH_RELEVANCE_SCORE_CACHE_REDIS_URL,
+        "ttl": KH_RELEVANCE_SCORE_CACHE_TTL,
+    }
+else:
+    KH_RELEVANCE_SCORE_CACHE = {
+        "__type__": "kotaemon.rerankings.InMemoryScoreCache",
+        "max_size": 100000,
+        "ttl": KH_RELEVANCE_SCORE_CACHE_TTL,
+    }
+
+# concurrent file ingestion: I/O fetches, parsing processes (default to the CPU
+# count), files being split/embedded/stored at once, and files in flight. The
+# parsed documents are streamed to indexing in windows of `window_size`
+# documents, at most `max_windows_in_flight` windows are buffered per file
+KH_INGESTION = {
+    "fetch_workers": 4,
+    "parse_workers": None,
+    "index_workers": 2,
+    "max_files_in_flight": 8,
+    "window_size": 16,
+    "max_windows_in_flight": 2,
+}
+
+# keep the chunk ids of each indexed file in one versioned row, cached in memory
+KH_INDEX_COMPACT_RELATIONS = config(
+    "KH_INDEX_COMPACT_RELATIONS", default=True, cast=bool
+)
+KH_INDEX_RELATIONS_CACHE_SIZE = config(
+    "KH_INDEX_RELATIONS_CACHE_SIZE", default=1024, cast=int
+)
+
+# content-addressed artifacts (chunks and embeddings) of the indexed files, keyed
+# by the file hash, the loader, the splitter and the embedding model: a file whose
+# content was already indexed is copied instead of parsed and embedded again.
+# Set to None to disable
+KH_INDEX_ARTIFACT_STORE = {
+    "__type__": "kotaemon.indices.ingests.artifacts.SQLiteArtifactStore",
+    "path": str(KH_APP_DATA_DIR / "index_artifacts.db"),
+}
+
 KH_LLMS = {}
 KH_EMBEDDINGS = {}
 KH_RERANKINGS = {}
@@ -301,6 +436,18 @@ KH_RERANKINGS["cohere"] = {
     },
     "default": True,
 }
+# cross-encoder running in process on CPU, for the deployments without network
+KH_RERANKINGS["local_cross_encoder"] = {
+    "spec": {
+        "__type__": "kotaemon.rerankings.OnnxCrossEncoderReranking",
+        "model_name": config(
+            "KH_LOCAL_RERANKING_MODEL", default="Xenova/ms-marco-MiniLM-L-6-v2"
+        ),
+        "model_path": config("KH_LOCAL_RERANKING_MODEL_PATH", default="") or None,
+        "threads": config("KH_LOCAL_RERANKING_THREADS", default=0, cast=int) or None,
+    },
+    "default": False,
+}
 
 KH_REASONINGS = [
     "ktem.reasoning.simple.FullQAPipeline",
@@ -390,11 +537,24 @@ KH_INDICES = [
 ]
 
 KH_USE_S3_STORAGE = config("KH_USE_S3_STORAGE", default=True, cast=bool)
+# how long the storage paths of the sources resolved for the previews are cached
+KH_SOURCE_PATH_CACHE_TTL = config("KH_SOURCE_PATH_CACHE_TTL", default=300.0, cast=float)
 AWS_STORAGE_BUCKET_NAME = config("AWS_STORAGE_BUCKET_NAME", default="")
 AWS_REGION = config("AWS_REGION", default="ap-south-1")
 AWS_ACCESS_KEY_ID = config("AWS_ACCESS_KEY_ID", default="")
 AWS_SECRET_ACCESS_KEY = config("AWS_SECRET_ACCESS_KEY", default="")
 AWS_S3_ENDPOINT_URL = config("AWS_S3_ENDPOINT_URL", default="")
+AWS_S3_MAX_POOL_CONNECTIONS = config(
+    "AWS_S3_MAX_POOL_CONNECTIONS", default=32, cast=int
+)
+# multipart transfers: size above which files are split, part size, parts in flight
+AWS_S3_MULTIPART_THRESHOLD = config(
+    "AWS_S3_MULTIPART_THRESHOLD", default=16 * 1024 * 1024, cast=int
+)
+AWS_S3_MULTIPART_CHUNKSIZE = config(
+    "AWS_S3_MULTIPART_CHUNKSIZE", default=8 * 1024 * 1024, cast=int
+)
+AWS_S3_MAX_CONCURRENCY = config("AWS_S3_MAX_CONCURRENCY", default=8, cast=int)
 KH_S3_PREFIX = config("KH_S3_PREFIX", default="documentlm/")
 
 KH_APP_NAME = "DocumentLM"
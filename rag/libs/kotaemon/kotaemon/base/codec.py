@@ -0,0 +1,231 @@
+"""Compact binary serialization of the documents
+
+`Document.to_dict` / `from_dict` through JSON loses the document class (a
+`RetrievedDocument` comes back as a `Document`), rebuilds every field through the
+pydantic validation, and writes the embeddings as decimal text. This codec writes
+the documents with msgpack (or as an Arrow table for columnar IPC), keeping:
+
+    - the document class, e.g. `RetrievedDocument` with its score
+    - every field that differs from its default, including metadata and
+      relationships
+    - the embeddings, as packed float64 arrays
+
+Documents are decoded without validation, so the round trip is both lossless and
+cheap.
+"""
+
+from __future__ import annotations
+
+import datetime
+import enum
+from array import array
+from typing import Any, Iterable, Optional
+
+import msgpack
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo
+
+from .schema import Document
+
+# msgpack extension types
+_EXT_FLOAT_ARRAY = 1
+
+# fields written in dedicated Arrow columns
+_ARROW_COLUMNS = ("id_", "text", "metadata", "embedding", "score")
+
+
+def _document_classes() -> dict[str, type[Document]]:
+    """The loaded `Document` subclasses by import path"""
+    classes: dict[str, type[Document]] = {}
+    stack: list[type[Document]] = [Document]
+    while stack:
+        cls = stack.pop()
+        classes[f"{cls.__module__}.{cls.__qualname__}"] = cls
+        stack.extend(cls.__subclasses__())
+    return classes
+
+
+def _resolve(type_name: str) -> type[Document]:
+    cls = _document_classes().get(type_name)
+    if cls is None:
+        # the subclass may live in a module that is not imported yet
+        from theflow.utils.modules import import_dotted_string
+
+        cls = import_dotted_string(type_name, safe=False)
+        if not (isinstance(cls, type) and issubclass(cls, Document)):
+            raise ValueError(f"{type_name} is not a Document class")
+    return cls
+
+
+def _default(obj: Any) -> Any:
+    """Turn the values that msgpack does not know into msgpack values"""
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "tolist"):
+        # numpy arrays and scalars
+        return obj.tolist()
+    if hasattr(obj, "dict"):
+        # pydantic models
+        return obj.dict()
+    raise TypeError(f"Cannot serialize {type(obj)}")
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code == _EXT_FLOAT_ARRAY:
+        return array("d", data).tolist()
+    return msgpack.ExtType(code, data)
+
+
+def _fields(doc: Document, skip: Iterable[str] = ()) -> dict:
+    """The fields of the document that differ from their defaults"""
+    output = {}
+    for name, field in type(doc).__fields__.items():
+        if name in skip:
+            continue
+        value = doc.__dict__.get(name)
+        if name == "content" and isinstance(value, str) and value == doc.text:
+            # restored from the text
+            continue
+        if field.default_factory is not None:
+            if name != "id_" and not value:
+                continue
+        elif value == field.default:
+            continue
+        output[name] = value
+    return output
+
+
+def _encode_fields(fields: dict) -> dict:
+    embedding = fields.get("embedding")
+    if embedding is not None:
+        fields["embedding"] = msgpack.ExtType(
+            _EXT_FLOAT_ARRAY, array("d", embedding).tobytes()
+        )
+    relationships = fields.get("relationships")
+    if relationships:
+        fields["relationships"] = {
+            getattr(key, "value", key): (
+                [info.dict() for info in value]
+                if isinstance(value, list)
+                else value.dict()
+            )
+            for key, value in relationships.items()
+        }
+    return fields
+
+
+def _decode_fields(cls: type[Document], fields: dict) -> Document:
+    relationships = fields.get("relationships")
+    if relationships:
+        fields["relationships"] = {
+            NodeRelationship(key): (
+                [RelatedNodeInfo(**info) for info in value]
+                if isinstance(value, list)
+                else RelatedNodeInfo(**value)
+            )
+            for key, value in relationships.items()
+        }
+    if "content" in cls.__fields__ and fields.get("content") is None:
+        fields["content"] = fields.get("text", "")
+    return cls.construct(_fields_set=set(fields), **fields)
+
+
+def _type_name(doc: Document) -> str:
+    cls = type(doc)
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def dumps(docs: list[Document]) -> bytes:
+    """Serialize the documents with msgpack"""
+    return msgpack.packb(
+        [[_type_name(doc), _encode_fields(_fields(doc))] for doc in docs],
+        default=_default,
+        use_bin_type=True,
+    )
+
+
+def loads(data: bytes) -> list[Document]:
+    """Deserialize the documents written by `dumps`"""
+    items = msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+    classes: dict[str, type[Document]] = {}
+    docs = []
+    for type_name, fields in items:
+        if type_name not in classes:
+            classes[type_name] = _resolve(type_name)
+        docs.append(_decode_fields(classes[type_name], fields))
+    return docs
+
+
+def to_arrow(docs: list[Document]):
+    """Convert the documents to an Arrow table, e.g. to send them to another
+    process without copying the embeddings
+
+    The id, text, embedding and score get their own columns, the metadata and
+    the other fields are msgpack-encoded.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("Please install pyarrow: 'pip install pyarrow'")
+
+    def pack(value: Any) -> Optional[bytes]:
+        if not value:
+            return None
+        return msgpack.packb(value, default=_default, use_bin_type=True)
+
+    return pa.table(
+        {
+            "type": pa.array([_type_name(doc) for doc in docs]).dictionary_encode(),
+            "id": pa.array([doc.doc_id for doc in docs], pa.string()),
+            "text": pa.array([doc.text for doc in docs], pa.large_string()),
+            "metadata": pa.array([pack(doc.metadata) for doc in docs], pa.binary()),
+            "embedding": pa.array(
+                [doc.embedding for doc in docs], pa.list_(pa.float64())
+            ),
+            "score": pa.array(
+                [getattr(doc, "score", None) for doc in docs], pa.float64()
+            ),
+            "fields": pa.array(
+                [
+                    pack(_encode_fields(_fields(doc, skip=_ARROW_COLUMNS)))
+                    for doc in docs
+                ],
+                pa.binary(),
+            ),
+        }
+    )
+
+
+def from_arrow(table) -> list[Document]:
+    """Convert back the Arrow table written by `to_arrow`"""
+    columns = {name: table.column(name).to_pylist() for name in table.column_names}
+    classes: dict[str, type[Document]] = {}
+    docs = []
+    for i, type_name in enumerate(columns["type"]):
+        if type_name not in classes:
+            classes[type_name] = _resolve(type_name)
+        cls = classes[type_name]
+
+        packed = columns["fields"][i]
+        fields = (
+            msgpack.unpackb(packed, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+            if packed
+            else {}
+        )
+        fields["id_"] = columns["id"][i]
+        fields["text"] = columns["text"][i]
+        metadata = columns["metadata"][i]
+        fields["metadata"] = (
+            msgpack.unpackb(metadata, raw=False, strict_map_key=False)
+            if metadata
+            else {}
+        )
+        if columns["embedding"][i] is not None:
+            fields["embedding"] = columns["embedding"][i]
+        if columns["score"][i] is not None and "score" in cls.__fields__:
+            fields["score"] = columns["score"][i]
+        docs.append(_decode_fields(cls, fields))
+    return docs
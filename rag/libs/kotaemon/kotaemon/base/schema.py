@@ -1,11 +1,13 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Literal, Optional, TypeVar
+from copy import copy
+from typing import TYPE_CHECKING, Any, Literal, Optional, Type, TypeVar
 
 from langchain.schema.messages import AIMessage as LCAIMessage
 from langchain.schema.messages import HumanMessage as LCHumanMessage
 from langchain.schema.messages import SystemMessage as LCSystemMessage
 from llama_index.core.bridge.pydantic import Field
+from llama_index.core.schema import BaseNode
 from llama_index.core.schema import Document as BaseDocument
 
 if TYPE_CHECKING:
@@ -15,8 +17,18 @@ if TYPE_CHECKING:
     )
 
 IO_Type = TypeVar("IO_Type", "Document", str)
+DocT = TypeVar("DocT", bound="Document")
 SAMPLE_TEXT = "A sample Document from kotaemon"
 
+# the fields commonly edited in place, copied when converting a document
+_COPIED_FIELDS = (
+    "metadata",
+    "relationships",
+    "excluded_embed_metadata_keys",
+    "excluded_llm_metadata_keys",
+    "retrieval_metadata",
+)
+
 
 class Document(BaseDocument):
     """
@@ -64,6 +76,30 @@ class Document(BaseDocument):
     def __bool__(self):
         return bool(self.content)
 
+    @classmethod
+    def from_document(cls: Type[DocT], doc: BaseNode, **updates) -> DocT:
+        """Convert a document of another kind, e.g. a `Document` fetched from a
+        store to a `RetrievedDocument`, or a llama-index node to a `Document`
+
+        Unlike `cls(**doc.to_dict())`, the fields are neither validated nor deep
+        copied: the text, content and embedding are shared with `doc`, and the
+        containers that are commonly edited in place (metadata, relationships...)
+        are copied shallowly. The fields that `cls` does not have are dropped.
+
+        Args:
+            doc: the document to convert
+            updates: the fields to set on the converted document
+        """
+        fields = cls.__fields__
+        values = {key: value for key, value in doc.__dict__.items() if key in fields}
+        for key in _COPIED_FIELDS:
+            if values.get(key) is not None:
+                values[key] = copy(values[key])
+        values.update(updates)
+        if "content" in fields and values.get("content") is None:
+            values["content"] = values.get("text")
+        return cls.construct(_fields_set=set(values), **values)
+
     @classmethod
     def example(cls) -> "Document":
         document = Document(
@@ -1,5 +1,12 @@
 from .base import BaseEmbeddings
+from .cache import (
+    BaseEmbeddingCache,
+    CachedEmbeddings,
+    InMemoryEmbeddingCache,
+    SQLiteEmbeddingCache,
+)
 from .endpoint_based import EndpointEmbeddings
+from .executor import EmbeddingExecutor
 from .fastembed import FastEmbedEmbeddings
 from .langchain_based import (
     LCAzureOpenAIEmbeddings,
@@ -13,6 +20,11 @@ from .tei_endpoint_embed import TeiEndpointEmbeddings
 
 __all__ = [
     "BaseEmbeddings",
+    "BaseEmbeddingCache",
+    "CachedEmbeddings",
+    "InMemoryEmbeddingCache",
+    "SQLiteEmbeddingCache",
+    "EmbeddingExecutor",
     "EndpointEmbeddings",
     "TeiEndpointEmbeddings",
     "LCOpenAIEmbeddings",
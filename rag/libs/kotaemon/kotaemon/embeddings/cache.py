@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from kotaemon.base import Document, DocumentWithEmbedding, Param
+
+from .base import BaseEmbeddings
+
+# params that don't change the produced embeddings
+_NON_MODEL_PARAMS = {"api_key", "timeout", "max_retries", "organization"}
+
+
+def model_spec_hash(embedding: BaseEmbeddings) -> str:
+    """Hash the class and the model-defining params of an embedding component"""
+    spec = embedding.dump()
+    params = {
+        key: value
+        for key, value in spec.get("params", {}).items()
+        if key not in _NON_MODEL_PARAMS
+    }
+    content = json.dumps(
+        {"function": spec.get("function"), "params": params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and collapse whitespaces, keep the letter case"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class BaseEmbeddingCache(ABC):
+    """Key-value cache of embeddings with hit/miss counters"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """Get the cached embeddings of the keys, missing keys are omitted"""
+        ...
+
+    @abstractmethod
+    def set_many(self, items: dict[str, list[float]]):
+        """Store the embeddings"""
+        ...
+
+    @abstractmethod
+    def clear(self):
+        """Remove all cached embeddings"""
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def _count(self, requested: int, found: int):
+        self.hits += found
+        self.misses += requested - found
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self),
+        }
+
+
+class InMemoryEmbeddingCache(BaseEmbeddingCache):
+    """LRU embedding cache kept in process memory
+
+    Args:
+        max_size: maximum number of embeddings to keep
+        ttl: seconds before an entry expires, None to never expire
+        fallback: slower cache (e.g. on-disk) to consult on misses, hits from
+            the fallback are promoted to memory
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl: Optional[float] = None,
+        fallback: Optional[BaseEmbeddingCache] = None,
+    ):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.fallback = fallback
+        self._store: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        now = time.time()
+        output: dict[str, list[float]] = {}
+        with self._lock:
+            for key in keys:
+                item = self._store.get(key)
+                if item is None:
+                    continue
+                created, embedding = item
+                if self.ttl is not None and now - created > self.ttl:
+                    del self._store[key]
+                    continue
+                self._store.move_to_end(key)
+                output[key] = embedding
+            self._count(len(keys), len(output))
+
+        if self.fallback is not None and len(output) < len(keys):
+            missing = [key for key in keys if key not in output]
+            promoted = self.fallback.get_many(missing)
+            if promoted:
+                self._put(promoted)
+                output.update(promoted)
+
+        return output
+
+    def set_many(self, items: dict[str, list[float]]):
+        self._put(items)
+        if self.fallback is not None:
+            self.fallback.set_many(items)
+
+    def _put(self, items: dict[str, list[float]]):
+        now = time.time()
+        with self._lock:
+            for key, embedding in items.items():
+                self._store[key] = (now, embedding)
+                self._store.move_to_end(key)
+            while len(self._store) > self.max_size:
+                self._store.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+        if self.fallback is not None:
+            self.fallback.clear()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def stats(self) -> dict:
+        output = super().stats()
+        if self.fallback is not None:
+            output["fallback"] = self.fallback.stats()
+        return output
+
+
+class SQLiteEmbeddingCache(BaseEmbeddingCache):
+    """Embedding cache persisted in a SQLite database
+
+    Embeddings are stored as float32 blobs, the least recently used entries are
+    evicted once `max_size` is exceeded.
+
+    Args:
+        path: path of the database file
+        max_size: maximum number of embeddings to keep, None for unbounded
+        ttl: seconds before an entry expires, None to never expire
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "embedding_cache.db",
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        super().__init__()
+        self.path = str(path)
+        self.max_size = max_size
+        self.ttl = ttl
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_accessed "
+                "ON embeddings (accessed)"
+            )
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        now = time.time()
+        output: dict[str, list[float]] = {}
+        expired: list[str] = []
+        with self._lock, self._conn:
+            # stay below the default SQLite host parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._conn.execute(
+                    "SELECT key, embedding, created FROM embeddings "
+                    f"WHERE key IN ({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob, created in rows:
+                    if self.ttl is not None and now - created > self.ttl:
+                        expired.append(key)
+                        continue
+                    output[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+            if expired:
+                self._conn.executemany(
+                    "DELETE FROM embeddings WHERE key = ?", [(k,) for k in expired]
+                )
+            if output:
+                self._conn.executemany(
+                    "UPDATE embeddings SET accessed = ? WHERE key = ?",
+                    [(now, key) for key in output],
+                )
+            self._count(len(keys), len(output))
+        return output
+
+    def set_many(self, items: dict[str, list[float]]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                [
+                    (key, np.asarray(embedding, dtype=np.float32).tobytes(), now, now)
+                    for key, embedding in items.items()
+                ],
+            )
+            if self.max_size is not None:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings "
+                    "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,),
+                )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(BaseEmbeddings):
+    """Wrap an embedding model with a cache keyed by (model spec, normalized text)
+
+    Only the texts missing from the cache are sent to the wrapped model, in a
+    single call, and the output keeps the input order.
+
+    Attributes:
+        embedding: the embedding model to cache
+        cache: the cache backend, e.g. `InMemoryEmbeddingCache(fallback=
+            SQLiteEmbeddingCache(path))` for an LRU in front of an on-disk cache
+        normalize: whether to normalize the text before hashing, disable it to
+            key on the exact content (e.g. for document chunks)
+    """
+
+    embedding: BaseEmbeddings
+    cache: BaseEmbeddingCache
+    normalize: bool = True
+
+    @Param.auto(depends_on=["embedding"])
+    def model_hash_(self) -> str:
+        return model_spec_hash(self.get_from_path("embedding"))
+
+    def cache_key(self, text: str) -> str:
+        if self.normalize:
+            text = normalize_text(text)
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_hash_}:{text_hash}"
+
+    def _lookup(
+        self, text: str | list[str] | Document | list[Document]
+    ) -> tuple[list[Document], list[str], dict[str, list[float]]]:
+        input_ = self.prepare_input(text)
+        keys = [self.cache_key(doc.text) for doc in input_]
+        return input_, keys, self.cache.get_many(keys)
+
+    def _merge(
+        self,
+        input_: list[Document],
+        keys: list[str],
+        cached: dict[str, list[float]],
+        computed: list[DocumentWithEmbedding],
+    ) -> list[DocumentWithEmbedding]:
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        new_items = {keys[i]: list(doc.embedding) for i, doc in zip(missing, computed)}
+        self.cache.set_many(new_items)
+        cached = {**cached, **new_items}
+        return [
+            DocumentWithEmbedding(content=doc, embedding=cached[key])
+            for doc, key in zip(input_, keys)
+        ]
+
+    def invoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_, keys, cached = self._lookup(text)
+        missing = [doc for doc, key in zip(input_, keys) if key not in cached]
+        embedding = self.get_from_path("embedding")
+        computed = embedding.invoke(missing, *args, **kwargs) if missing else []
+        return self._merge(input_, keys, cached, computed)
+
+    async def ainvoke(
+        self, text: str | list[str] | Document | list[Document], *args, **kwargs
+    ) -> list[DocumentWithEmbedding]:
+        input_, keys, cached = self._lookup(text)
+        missing = [doc for doc, key in zip(input_, keys) if key not in cached]
+        embedding = self.get_from_path("embedding")
+        computed = await embedding.ainvoke(missing, *args, **kwargs) if missing else []
+        return self._merge(input_, keys, cached, computed)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from kotaemon.base import Document, DocumentWithEmbedding
+
+from .base import BaseEmbeddings
+
+logger = logging.getLogger(__name__)
+
+
+def approximate_token_count(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Whether the exception is a HTTP 429 from openai, requests or aiohttp"""
+    if getattr(exc, "status_code", None) == 429 or getattr(exc, "status", None) == 429:
+        return True
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that halves on rate limit and grows back by one after
+    each round of `limit` successful requests (AIMD)
+
+    Args:
+        max_limit: the upper bound of concurrent requests
+        min_limit: the lower bound of concurrent requests
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            if self.limit >= self.max_limit:
+                return
+            self._successes += 1
+            if self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_rate_limit(self):
+        with self._cond:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
+            logger.warning("Embedding rate limited, concurrency set to %d", self.limit)
+
+
+class EmbeddingExecutor:
+    """Run an embedding model over many documents with concurrent batched requests
+
+    Documents are grouped into batches bounded by both a number of items and a
+    token budget, batches run concurrently in a thread pool and the output keeps
+    the input order. The number of requests in flight adapts to rate limiting:
+    it is halved on every HTTP 429 (the batch is retried after an exponential
+    backoff) and grows back by one after each round of successful requests. The
+    executor works with any `BaseEmbeddings` and can be shared between models and
+    pipelines.
+
+    Args:
+        max_concurrency: maximum number of requests in flight
+        max_batch_size: maximum number of documents per request
+        max_batch_tokens: maximum number of tokens per request
+        max_retries: number of retries of a rate-limited batch
+        backoff: base delay in seconds of the exponential backoff
+        token_counter: function to count the tokens of a text, default to a
+            character-based estimate
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_batch_size: int = 32,
+        max_batch_tokens: int = 100000,
+        max_retries: int = 6,
+        backoff: float = 1.0,
+        token_counter: Optional[Callable[[str], int]] = None,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.token_counter = token_counter or approximate_token_count
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="embedding"
+        )
+
+    def make_batches(
+        self, texts: list[str], context_length: Optional[int] = None
+    ) -> list[list[int]]:
+        """Group the text indices into batches within the size and token budget
+
+        Args:
+            texts: the texts to embed
+            context_length: maximum tokens per text of the model, longer texts
+                are truncated by the model so they count for `context_length`
+
+        Returns:
+            list of batches of indices, in input order
+        """
+        batches: list[list[int]] = []
+        batch: list[int] = []
+        batch_tokens = 0
+        for idx, text in enumerate(texts):
+            n_tokens = self.token_counter(text)
+            if context_length:
+                n_tokens = min(n_tokens, context_length)
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or batch_tokens + n_tokens > self.max_batch_tokens
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(idx)
+            batch_tokens += n_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _embed_batch(
+        self, embedding: BaseEmbeddings, docs: list[Document]
+    ) -> list[DocumentWithEmbedding]:
+        for attempt in range(self.max_retries + 1):
+            with self.limiter:
+                try:
+                    output = embedding.invoke(docs)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    self.limiter.on_rate_limit()
+                else:
+                    self.limiter.on_success()
+                    return output
+            time.sleep(self.backoff * 2**attempt * (1 + random.random()))
+        raise RuntimeError("unreachable")
+
+    def run(
+        self,
+        embedding: BaseEmbeddings,
+        text: str | list[str] | Document | list[Document],
+    ) -> list[DocumentWithEmbedding]:
+        """Embed the documents, return the embeddings in input order"""
+        docs = embedding.prepare_input(text)
+        if not docs:
+            return []
+
+        batches = self.make_batches(
+            [doc.text for doc in docs], getattr(embedding, "context_length", None)
+        )
+        if len(batches) == 1:
+            return self._embed_batch(embedding, docs)
+
+        futures = [
+            self._pool.submit(self._embed_batch, embedding, [docs[i] for i in batch])
+            for batch in batches
+        ]
+        output: list[DocumentWithEmbedding] = []
+        for future in futures:
+            output.extend(future.result())
+        return output
+
+    async def arun(
+        self,
+        embedding: BaseEmbeddings,
+        text: str | list[str] | Document | list[Document],
+    ) -> list[DocumentWithEmbedding]:
+        """Async version of `run`, the requests still run in the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.run, embedding, text)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -20,6 +20,7 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
         normalize (bool): Whether to normalize embeddings to unit length.
         truncate (bool): Whether to truncate embeddings
             to a fixed/default length.
+        batch_size (int): Maximum number of texts per request.
     """
 
     endpoint_url: str = Param(None, help="TEI embedding service api base URL")
@@ -31,6 +32,10 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
         True,
         help="Truncate embeddings to a fixed/default length",
     )
+    batch_size: int = Param(
+        32,
+        help="Maximum number of texts per request (TEI --max-client-batch-size)",
+    )
 
     async def client_(self, inputs: list[str]):
         async with aiohttp.ClientSession() as session:
@@ -42,6 +47,7 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
                     "truncate": self.truncate,
                 },
             ) as resp:
+                resp.raise_for_status()
                 embeddings = await resp.json()
         return embeddings
 
@@ -53,14 +59,8 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
         text = self.prepare_input(text)
 
         outputs = []
-        batch_size = 6
-        num_batch = max(len(text) // batch_size, 1)
-        for i in range(num_batch):
-            if i == num_batch - 1:
-                mini_batch = text[batch_size * i :]
-            else:
-                mini_batch = text[batch_size * i : batch_size * (i + 1)]
-            mini_batch = [x.content for x in mini_batch]
+        for i in range(0, len(text), self.batch_size):
+            mini_batch = [x.content for x in text[i : i + self.batch_size]]
             embeddings = await self.client_(mini_batch)  # type: ignore
             outputs.extend(
                 [
@@ -80,22 +80,18 @@ class TeiEndpointEmbeddings(BaseEmbeddings):
         text = self.prepare_input(text)
 
         outputs = []
-        batch_size = 6
-        num_batch = max(len(text) // batch_size, 1)
-        for i in range(num_batch):
-            if i == num_batch - 1:
-                mini_batch = text[batch_size * i :]
-            else:
-                mini_batch = text[batch_size * i : batch_size * (i + 1)]
-            mini_batch = [x.content for x in mini_batch]
-            embeddings = session.post(
+        for i in range(0, len(text), self.batch_size):
+            mini_batch = [x.content for x in text[i : i + self.batch_size]]
+            resp = session.post(
                 url=self.endpoint_url,
                 json={
                     "inputs": mini_batch,
                     "normalize": self.normalize,
                     "truncate": self.truncate,
                 },
-            ).json()
+            )
+            resp.raise_for_status()
+            embeddings = resp.json()
             outputs.extend(
                 [
                     DocumentWithEmbedding(content=doc, embedding=embedding)
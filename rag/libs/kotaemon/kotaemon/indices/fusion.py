@@ -0,0 +1,110 @@
+"""Fuse ranked result lists coming from several retrieval sources."""
+
+from __future__ import annotations
+
+from typing import Optional, Sequence
+
+from kotaemon.base import RetrievedDocument
+
+FUSION_SCORE_KEY = "fusion_score"
+
+
+def _fuse(
+    ranked_lists: Sequence[Sequence[RetrievedDocument]],
+    source_scores: Sequence[Sequence[float]],
+    top_k: Optional[int] = None,
+) -> list[RetrievedDocument]:
+    """Sum per-source scores by doc id and return the best documents first.
+
+    The first occurrence of a document is kept as its representative, so the
+    original score of the earliest source is preserved.
+    """
+    fused: dict[str, float] = {}
+    docs: dict[str, RetrievedDocument] = {}
+    for documents, scores in zip(ranked_lists, source_scores):
+        for doc, score in zip(documents, scores):
+            fused[doc.doc_id] = fused.get(doc.doc_id, 0.0) + score
+            docs.setdefault(doc.doc_id, doc)
+
+    # sorted() is stable, ties keep the order of the first source
+    doc_ids = sorted(fused, key=lambda doc_id: fused[doc_id], reverse=True)
+    if top_k is not None:
+        doc_ids = doc_ids[:top_k]
+
+    output = []
+    for doc_id in doc_ids:
+        doc = docs[doc_id]
+        doc.metadata[FUSION_SCORE_KEY] = fused[doc_id]
+        output.append(doc)
+    return output
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[Sequence[RetrievedDocument]],
+    weights: Optional[Sequence[float]] = None,
+    k: int = 60,
+    top_k: Optional[int] = None,
+) -> list[RetrievedDocument]:
+    """Merge ranked lists with weighted reciprocal rank fusion
+
+    Each document gets `sum(weight / (k + rank))` over the lists it appears in,
+    duplicates are collapsed by doc id.
+
+    Args:
+        ranked_lists: the result of each source, best first
+        weights: weight of each source, default to 1.0 for all
+        k: rank smoothing constant, larger values flatten the rank curve
+        top_k: maximum number of fused documents to return
+
+    Returns:
+        list[RetrievedDocument]: de-duplicated documents, best first, with the
+            fused score stored in `metadata["fusion_score"]`
+    """
+    if weights is None:
+        weights = [1.0] * len(ranked_lists)
+
+    source_scores = [
+        [weight / (k + rank) for rank in range(1, len(documents) + 1)]
+        for documents, weight in zip(ranked_lists, weights)
+    ]
+    return _fuse(ranked_lists, source_scores, top_k=top_k)
+
+
+def weighted_score_fusion(
+    ranked_lists: Sequence[Sequence[RetrievedDocument]],
+    scores: Sequence[Optional[Sequence[float]]],
+    weights: Optional[Sequence[float]] = None,
+    top_k: Optional[int] = None,
+) -> list[RetrievedDocument]:
+    """Merge ranked lists by the weighted sum of min-max normalized scores
+
+    Sources that don't provide scores (e.g. full-text search) fall back to a
+    linearly decaying score based on the rank.
+
+    Args:
+        ranked_lists: the result of each source, best first
+        scores: the raw scores of each source, or None if not available
+        weights: weight of each source, default to 1.0 for all
+        top_k: maximum number of fused documents to return
+
+    Returns:
+        list[RetrievedDocument]: de-duplicated documents, best first, with the
+            fused score stored in `metadata["fusion_score"]`
+    """
+    if weights is None:
+        weights = [1.0] * len(ranked_lists)
+
+    source_scores = []
+    for documents, raw_scores, weight in zip(ranked_lists, scores, weights):
+        n_docs = len(documents)
+        if raw_scores is None:
+            normalized = [1.0 - rank / n_docs for rank in range(n_docs)]
+        else:
+            low, high = min(raw_scores, default=0.0), max(raw_scores, default=0.0)
+            if high > low:
+                normalized = [(score - low) / (high - low) for score in raw_scores]
+            else:
+                normalized = [1.0] * len(raw_scores)
+        source_scores.append([weight * score for score in normalized])
+
+    return _fuse(ranked_lists, source_scores, top_k=top_k)
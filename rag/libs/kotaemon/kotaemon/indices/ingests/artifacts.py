@@ -0,0 +1,356 @@
+"""Content-addressed store of the indexing artifacts of the files
+
+Indexing the same file again (another user, another collection, a re-upload)
+produces the same chunks and embeddings as long as the file content, the loader,
+the splitter and the embedding model are the same. The artifacts of a file are
+kept under a key hashed from those, so that the next file with that key is
+indexed by copying them instead of parsing, splitting and embedding it again.
+
+Each file indexed from an artifact holds a reference on it, the artifact is
+deleted with its last reference.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from fsspec import AbstractFileSystem
+
+from kotaemon.base import Document, DocumentWithEmbedding
+from kotaemon.embeddings.cache import model_spec_hash
+
+# params that don't change the produced documents
+_NON_CONTENT_PARAMS = {
+    "api_key",
+    "credentials",
+    "endpoint",
+    "timeout",
+    "max_retries",
+    "organization",
+}
+
+
+def file_hash(
+    file_path: str | Path,
+    chunk_size: int = 1 << 20,
+    fs: Optional[AbstractFileSystem] = None,
+) -> str:
+    """The sha256 of the file content, read by chunks, through `fs` if given"""
+    digest = hashlib.sha256()
+    with (open if fs is None else fs.open)(str(file_path), "rb") as fi:
+        for chunk in iter(lambda: fi.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def component_spec(component: Any) -> dict:
+    """The class and the content-defining params of a loader or a splitter"""
+    if component is None:
+        return {}
+    if hasattr(component, "dump"):
+        spec = component.dump()
+        function = spec.get("function", spec.get("__type__"))
+        params = spec.get("params", {k: v for k, v in spec.items() if k != "__type__"})
+    else:
+        function = f"{type(component).__module__}.{type(component).__qualname__}"
+        params = {}
+    return {
+        "function": function,
+        "params": {
+            key: value
+            for key, value in params.items()
+            if key not in _NON_CONTENT_PARAMS
+        },
+    }
+
+
+def artifact_key(
+    content_hash: str,
+    loader: Any,
+    splitter: Any,
+    embedding: Any,
+    mode: str = "",
+) -> str:
+    """The key of the artifacts of a file
+
+    Args:
+        content_hash: the sha256 of the file content
+        loader: the loader of the file
+        splitter: the splitter of the text documents, None if not split
+        embedding: the embedding model of the chunks, None if not embedded
+        mode: the loader mode, e.g. the reader mode chosen by the user
+    """
+    content = json.dumps(
+        {
+            "file": content_hash,
+            "mode": mode,
+            "loader": component_spec(loader),
+            "splitter": component_spec(splitter),
+            "embedding": model_spec_hash(embedding) if embedding is not None else "",
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class BaseArtifactStore(ABC):
+    """Store the indexed documents of the files by artifact key
+
+    An artifact is written by one file (`begin`, `add`, `commit`) and read by
+    the next files with the same key (`get`). The references of the files on
+    the artifacts are counted by `acquire` and `release`.
+    """
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether a complete artifact is stored under the key"""
+        ...
+
+    @abstractmethod
+    def begin(self, key: str, source_id: str) -> bool:
+        """Start writing the artifact of the source, return False if it exists
+        or is being written by another source"""
+        ...
+
+    @abstractmethod
+    def add(self, key: str, source_id: str, docs: list[Document]):
+        """Append documents, with their embedding if any, to the artifact"""
+        ...
+
+    @abstractmethod
+    def commit(self, key: str, source_id: str):
+        """Mark the artifact complete, the source holds a reference on it"""
+        ...
+
+    @abstractmethod
+    def abort(self, key: str, source_id: str):
+        """Discard the artifact being written by the source"""
+        ...
+
+    @abstractmethod
+    def get(self, key: str) -> list[DocumentWithEmbedding]:
+        """The documents of the artifact, in the order they were added"""
+        ...
+
+    @abstractmethod
+    def acquire(self, key: str, source_id: str) -> int:
+        """Add a reference of the source on the artifact, return the refcount"""
+        ...
+
+    @abstractmethod
+    def release(self, source_ids: Iterable[str]) -> list[str]:
+        """Drop the references of the sources, return the keys of the artifacts
+        deleted because they have no reference left"""
+        ...
+
+
+class SQLiteArtifactStore(BaseArtifactStore):
+    """Artifact store persisted in a SQLite database
+
+    The documents are stored as their text and metadata, the embeddings as
+    float32 blobs.
+
+    Args:
+        path: path of the database file
+        stale_after: seconds after which an artifact still being written is
+            considered abandoned (e.g. the process died) and can be rewritten
+    """
+
+    def __init__(self, path: str | Path = "artifacts.db", stale_after: float = 3600.0):
+        self.path = str(path)
+        self.stale_after = stale_after
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    key TEXT PRIMARY KEY,
+                    writer TEXT NOT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    n_docs INTEGER NOT NULL DEFAULT 0,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS artifact_docs (
+                    key TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    embedding BLOB,
+                    PRIMARY KEY (key, idx)
+                );
+                CREATE TABLE IF NOT EXISTS artifact_refs (
+                    key TEXT NOT NULL,
+                    source_id TEXT NOT NULL,
+                    PRIMARY KEY (key, source_id)
+                );
+                CREATE INDEX IF NOT EXISTS artifact_refs_source
+                    ON artifact_refs (source_id);
+                """
+            )
+
+    def _delete(self, keys: list[str]):
+        for table in ("artifact_docs", "artifacts"):
+            self._conn.executemany(
+                f"DELETE FROM {table} WHERE key = ?", [(key,) for key in keys]
+            )
+
+    def exists(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT complete FROM artifacts WHERE key = ?", (key,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def begin(self, key: str, source_id: str) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT writer, complete, updated FROM artifacts WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                writer, complete, updated = row
+                if complete or (
+                    writer != source_id and now - updated < self.stale_after
+                ):
+                    return False
+                self._delete([key])
+            self._conn.execute(
+                "INSERT INTO artifacts (key, writer, updated) VALUES (?, ?, ?)",
+                (key, source_id, now),
+            )
+        return True
+
+    def add(self, key: str, source_id: str, docs: list[Document]):
+        if not docs:
+            return
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT n_docs FROM artifacts "
+                "WHERE key = ? AND writer = ? AND complete = 0",
+                (key, source_id),
+            ).fetchone()
+            if row is None:
+                return
+            start = row[0]
+            self._conn.executemany(
+                "INSERT INTO artifact_docs VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        key,
+                        start + i,
+                        doc.doc_id,
+                        doc.text or "",
+                        json.dumps(doc.metadata, default=str),
+                        (
+                            np.asarray(doc.embedding, dtype=np.float32).tobytes()
+                            if getattr(doc, "embedding", None)
+                            else None
+                        ),
+                    )
+                    for i, doc in enumerate(docs)
+                ],
+            )
+            self._conn.execute(
+                "UPDATE artifacts SET n_docs = ?, updated = ? WHERE key = ?",
+                (start + len(docs), time.time(), key),
+            )
+
+    def commit(self, key: str, source_id: str):
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE artifacts SET complete = 1, updated = ? "
+                "WHERE key = ? AND writer = ? AND complete = 0",
+                (time.time(), key, source_id),
+            ).rowcount
+            if updated:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO artifact_refs VALUES (?, ?)",
+                    (key, source_id),
+                )
+
+    def abort(self, key: str, source_id: str):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT 1 FROM artifacts "
+                "WHERE key = ? AND writer = ? AND complete = 0",
+                (key, source_id),
+            ).fetchone()
+            if row is not None:
+                self._delete([key])
+
+    def get(self, key: str) -> list[DocumentWithEmbedding]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, text, metadata, embedding FROM artifact_docs "
+                "WHERE key = ? ORDER BY idx",
+                (key,),
+            ).fetchall()
+        return [
+            DocumentWithEmbedding(
+                id_=doc_id,
+                text=text,
+                metadata=json.loads(metadata),
+                embedding=(
+                    np.frombuffer(blob, dtype=np.float32).tolist()
+                    if blob is not None
+                    else []
+                ),
+            )
+            for doc_id, text, metadata, blob in rows
+        ]
+
+    def acquire(self, key: str, source_id: str) -> int:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO artifact_refs VALUES (?, ?)", (key, source_id)
+            )
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM artifact_refs WHERE key = ?", (key,)
+            ).fetchone()[0]
+
+    def release(self, source_ids: Iterable[str]) -> list[str]:
+        source_ids = [str(source_id) for source_id in source_ids]
+        if not source_ids:
+            return []
+        params = json.dumps(source_ids)
+        with self._lock, self._conn:
+            keys = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT DISTINCT key FROM artifact_refs "
+                    "WHERE source_id IN (SELECT value FROM json_each(?))",
+                    (params,),
+                )
+            ]
+            self._conn.execute(
+                "DELETE FROM artifact_refs "
+                "WHERE source_id IN (SELECT value FROM json_each(?))",
+                (params,),
+            )
+            orphans = [
+                key
+                for key in keys
+                if not self._conn.execute(
+                    "SELECT 1 FROM artifact_refs WHERE key = ? LIMIT 1", (key,)
+                ).fetchone()
+            ]
+            self._delete(orphans)
+        return orphans
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
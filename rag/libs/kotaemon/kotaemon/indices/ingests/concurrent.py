@@ -0,0 +1,369 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable, Iterator, Optional
+
+from fsspec import AbstractFileSystem
+from llama_index.core.readers.base import BaseReader
+
+from kotaemon.base import Document
+from kotaemon.loaders import iter_data
+from kotaemon.loaders.utils.thumbnails import PARSE_WORKER_ENV
+
+logger = logging.getLogger(__name__)
+
+IngestionJob = Callable[[], Generator[Document, None, Any]]
+
+# how long a blocked worker or consumer waits before checking the other side
+_POLL_INTERVAL = 0.5
+
+
+def _init_parse_worker():
+    """Mark the parse worker process, so that the loaders running there bound the
+    process pools of their own (e.g. the PDF thumbnails rendering)"""
+    os.environ[PARSE_WORKER_ENV] = "1"
+
+
+def load_file(
+    loader: BaseReader,
+    file_path: str | Path,
+    extra_info: Optional[dict] = None,
+    fs: Optional[AbstractFileSystem] = None,
+) -> list[Document]:
+    """Parse a file with a loader, picklable entry point of the parse workers
+
+    `fs` is the fsspec file system of a file not stored locally, only passed to
+    the loaders when given.
+    """
+    kwargs = {} if fs is None else {"fs": fs}
+    return loader.load_data(file_path, extra_info=extra_info, **kwargs)
+
+
+def iter_file(
+    loader: BaseReader,
+    file_path: str | Path,
+    extra_info: Optional[dict] = None,
+    fs: Optional[AbstractFileSystem] = None,
+) -> Iterator[Document]:
+    """Parse a file lazily, picklable entry point of the streaming parse workers"""
+    kwargs = {} if fs is None else {"fs": fs}
+    return iter_data(loader, file_path, extra_info=extra_info, **kwargs)
+
+
+def iter_windows(docs: Iterable[Document], size: int) -> Iterator[list[Document]]:
+    """Group the documents into lists of at most `size` documents"""
+    window: list[Document] = []
+    for doc in docs:
+        window.append(doc)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def _put(windows, cancel, item) -> bool:
+    """Put an item on the bounded queue, give up if the consumer is gone"""
+    while not cancel.is_set():
+        try:
+            windows.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce_windows(windows, cancel, fn: Callable, args: tuple, size: int):
+    """Run in a parse worker: push the windows of `fn(*args)` to the queue"""
+    try:
+        for window in iter_windows(fn(*args), size):
+            if not _put(windows, cancel, ("window", window)):
+                return
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError(f"{type(e).__name__}: {e}")
+        _put(windows, cancel, ("error", e))
+        return
+    _put(windows, cancel, ("done", None))
+
+
+class WindowStream:
+    """Iterator over the document windows produced by a parse worker
+
+    The worker blocks once `max_windows_in_flight` windows wait in the queue, so
+    the memory used by a file is bounded whatever its size. Close the stream to
+    stop the worker if the windows are not consumed to the end.
+    """
+
+    def __init__(self, windows, cancel, future: Future, on_close: Callable):
+        self._windows = windows
+        self._cancel = cancel
+        self._future = future
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> list[Document]:
+        if self._closed:
+            raise StopIteration
+
+        while True:
+            try:
+                kind, value = self._windows.get(timeout=_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if self._future.done() and self._windows.empty():
+                    # the worker died without reporting, e.g. a broken pool
+                    self.close()
+                    exc = self._future.exception()
+                    raise exc or RuntimeError("The parse worker stopped early")
+
+        if kind == "window":
+            return value
+        self.close()
+        if kind == "error":
+            raise value
+        raise StopIteration
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._cancel.set()
+            self._on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConcurrentIngestion:
+    """Run many ingestion jobs through bounded fetch, parse and index stages
+
+    Each job is a generator function handling one file, it yields progress
+    `Document`s and wraps its steps with the stage helpers of this engine:
+
+        - `fetch(fn, *args)`: I/O work (download, database lookup), at most
+            `fetch_workers` at a time
+        - `parse(fn, *args)`: CPU-bound parsing in a process pool of
+            `parse_workers` processes, so it does not hold the GIL of the server
+        - `parse_iter(fn, *args)`: same as `parse` for a generator function, the
+            documents are streamed back in windows as they are produced
+        - `with indexing():`: split, embed and store, at most `index_workers`
+            files at a time
+
+    Up to `max_files_in_flight` jobs run concurrently, which also bounds the
+    number of parsed documents held in memory. `stream` forwards the progress
+    of all jobs as they come, and returns the job results in the input order.
+
+    Args:
+        fetch_workers: number of concurrent fetches
+        parse_workers: number of parsing processes, default to the CPU count, 0
+            to parse in the job thread
+        index_workers: number of files being split, embedded and stored at once
+        max_files_in_flight: number of jobs running concurrently
+        start_method: multiprocessing start method of the parse processes
+        window_size: number of documents per window of `parse_iter`
+        max_windows_in_flight: number of parsed windows a file can buffer before
+            its parse worker waits for the consumer
+    """
+
+    def __init__(
+        self,
+        fetch_workers: int = 4,
+        parse_workers: Optional[int] = None,
+        index_workers: int = 2,
+        max_files_in_flight: int = 8,
+        start_method: str = "spawn",
+        window_size: int = 16,
+        max_windows_in_flight: int = 2,
+    ):
+        self.fetch_workers = fetch_workers
+        self.parse_workers = (
+            (os.cpu_count() or 1) if parse_workers is None else parse_workers
+        )
+        self.index_workers = index_workers
+        self.max_files_in_flight = max_files_in_flight
+        self.start_method = start_method
+        self.window_size = window_size
+        self.max_windows_in_flight = max_windows_in_flight
+
+        self._fetch_slots = threading.BoundedSemaphore(fetch_workers)
+        # one running and one queued parse per worker
+        self._parse_slots = threading.BoundedSemaphore(max(self.parse_workers, 1) * 2)
+        self._index_slots = threading.BoundedSemaphore(index_workers)
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+        self._manager: Optional[Any] = None
+        self._lock = threading.Lock()
+
+    @property
+    def parse_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._parse_pool is None:
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_parse_worker,
+                )
+            return self._parse_pool
+
+    @property
+    def manager(self):
+        """The multiprocessing manager hosting the window queues"""
+        with self._lock:
+            if self._manager is None:
+                context = multiprocessing.get_context(self.start_method)
+                self._manager = context.Manager()
+            return self._manager
+
+    def fetch(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run the I/O-bound `fn` in the fetch stage"""
+        with self._fetch_slots:
+            return fn(*args, **kwargs)
+
+    def parse(self, fn: Callable, *args) -> Any:
+        """Run the CPU-bound `fn` in the parse process pool
+
+        `fn` and `args` must be picklable, otherwise `fn` runs in the calling
+        thread.
+        """
+        with self._parse_slots:
+            if self.parse_workers <= 0:
+                return fn(*args)
+            try:
+                pickle.dumps((fn, args))
+            except Exception as e:
+                logger.warning("Cannot parse in a subprocess, fallback: %s", e)
+                return fn(*args)
+
+            try:
+                return self.parse_pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                logger.exception("Parse process pool is broken, restarting it")
+                with self._lock:
+                    self._parse_pool = None
+                return fn(*args)
+
+    def parse_iter(
+        self, fn: Callable, *args, window_size: Optional[int] = None
+    ) -> Iterator[list[Document]]:
+        """Run the generator function `fn` in the parse process pool
+
+        The parsing starts right away, before the windows are consumed. `fn` and
+        `args` must be picklable, otherwise `fn` runs lazily in the calling
+        thread.
+
+        Returns:
+            an iterator over lists of at most `window_size` documents
+        """
+        window_size = window_size or self.window_size
+        if self.parse_workers <= 0:
+            return iter_windows(fn(*args), window_size)
+        try:
+            pickle.dumps((fn, args))
+        except Exception as e:
+            logger.warning("Cannot parse in a subprocess, fallback: %s", e)
+            return iter_windows(fn(*args), window_size)
+
+        self._parse_slots.acquire()
+        try:
+            windows = self.manager.Queue(maxsize=self.max_windows_in_flight)
+            cancel = self.manager.Event()
+            future = self.parse_pool.submit(
+                _produce_windows, windows, cancel, fn, args, window_size
+            )
+        except BrokenProcessPool:
+            self._parse_slots.release()
+            logger.exception("Parse process pool is broken, restarting it")
+            with self._lock:
+                self._parse_pool = None
+            return iter_windows(fn(*args), window_size)
+        except BaseException:
+            self._parse_slots.release()
+            raise
+
+        return WindowStream(windows, cancel, future, self._parse_slots.release)
+
+    @contextmanager
+    def indexing(self):
+        """Wrap the split, embed and store steps of a job"""
+        with self._index_slots:
+            yield
+
+    def stream(
+        self, jobs: Iterable[IngestionJob]
+    ) -> Generator[Document, None, list[Any]]:
+        """Run the jobs concurrently, yield their progress as it comes
+
+        Returns:
+            the return value of each job in the input order, or the exception
+                it raised
+        """
+        jobs = list(jobs)
+        results: list[Any] = [None] * len(jobs)
+        if not jobs:
+            return results
+
+        events: queue.Queue = queue.Queue()
+        stop = threading.Event()
+
+        def run_job(idx: int, job: IngestionJob):
+            try:
+                gen = job()
+                while True:
+                    if stop.is_set():
+                        gen.close()
+                        return
+                    try:
+                        events.put(("progress", idx, next(gen)))
+                    except StopIteration as e:
+                        events.put(("done", idx, e.value))
+                        return
+            except Exception as e:
+                logger.exception(e)
+                events.put(("done", idx, e))
+
+        pool = ThreadPoolExecutor(
+            max_workers=self.max_files_in_flight, thread_name_prefix="ingestion"
+        )
+        try:
+            for idx, job in enumerate(jobs):
+                pool.submit(run_job, idx, job)
+
+            n_running = len(jobs)
+            while n_running:
+                kind, idx, value = events.get()
+                if kind == "progress":
+                    yield value
+                else:
+                    results[idx] = value
+                    n_running -= 1
+        finally:
+            # the consumer stopped early, let the running jobs wind down
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(wait=True)
+                self._parse_pool = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
@@ -327,6 +327,7 @@ class AnswerWithContextPipeline(BaseComponent):
         spans = self.match_evidence_with_context(answer, docs)
         id2docs = {doc.doc_id: doc for doc in docs}
         not_detected = set(id2docs.keys()) - set(spans.keys())
+        Render.prefetch_sources(docs)
 
         # render highlight spans
         for _id, ss in spans.items():
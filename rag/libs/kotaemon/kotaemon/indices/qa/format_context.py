@@ -1,5 +1,8 @@
+import hashlib
 import html
-from functools import partial
+import logging
+from functools import lru_cache
+from typing import Optional
 
 import tiktoken
 
@@ -11,91 +14,155 @@ EVIDENCE_MODE_TABLE = 1
 EVIDENCE_MODE_CHATBOT = 2
 EVIDENCE_MODE_FIGURE = 3
 
+# characters on each side of the join of two blocks whose tokens may merge
+JOIN_WINDOW = 32
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache
+def get_encoding(encoding_name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """Number of tokens of the text, cached since the same evidence blocks come
+    back on regenerate and on follow-up questions"""
+    return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
+
+
+def join_tokens(left: str, right: str, encoding_name: str = "cl100k_base") -> int:
+    """Number of tokens added (negative if removed) by joining the two texts,
+    counted on `JOIN_WINDOW` characters around the join"""
+    tail, head = left[-JOIN_WINDOW:], right[:JOIN_WINDOW]
+    return (
+        count_tokens(tail + head, encoding_name)
+        - count_tokens(tail, encoding_name)
+        - count_tokens(head, encoding_name)
+    )
+
+
+def truncate_tokens(text: str, max_tokens: int, encoding_name: str) -> str:
+    """Keep the first `max_tokens` tokens of the text"""
+    encoding = get_encoding(encoding_name)
+    return encoding.decode(
+        encoding.encode(text, disallowed_special=())[: max(max_tokens, 0)]
+    )
+
 
 class PrepareEvidencePipeline(BaseComponent):
     """Prepare the evidence text from the list of retrieved documents
 
     This step usually happens after `DocumentRetrievalPipeline`.
 
+    Each document is formatted into an evidence block. The blocks are
+    de-duplicated by the hash of their content and packed in rank order while
+    they fit in `max_context_length` tokens: a block that does not fit is skipped
+    so that the next, shorter, blocks can still be packed, except the first
+    block which is truncated to the budget. The returned document's metadata
+    holds the token count of each packed block (`block_tokens`), the token count
+    of the final evidence (`tokens`) and the tiktoken encoding used to count them
+    (`encoding`). Each block is tokenized once: `tokens` is the sum of
+    `block_tokens` corrected by the tokens merged across the joins of the blocks,
+    which are counted around each join only. The evidence is only tokenized as a
+    whole when `trim_func` shortens it.
+
     Args:
-        trim_func: a callback function or a BaseComponent, that splits a large
-            chunk of text into smaller ones. The first one will be retained.
+        max_context_length: token budget of the evidence
+        max_tables: maximum number of tables in the evidence
+        encoding_name: the tiktoken encoding counting the tokens, should be the
+            one of the LLM
+        trim_func: a callback function or a BaseComponent, that splits the packed
+            evidence into smaller chunks. The first one will be retained.
     """
 
     max_context_length: int = 32000
+    max_tables: int = 5
+    encoding_name: str = "cl100k_base"
     trim_func: TokenSplitter | None = None
 
+    def format_block(
+        self, doc: RetrievedDocument
+    ) -> tuple[int, str, str, Optional[str]]:
+        """Format the document into an evidence block
+
+        Returns:
+            the evidence mode of the document, the content identifying duplicate
+            blocks, the block and the image of a figure
+        """
+        page = doc.metadata.get("page_label", None)
+        source = filename = doc.metadata.get("file_name", "-")
+        if page:
+            source += f" (Page {page})"
+
+        doc_type = doc.metadata.get("type", "")
+        if doc_type == "table":
+            content = doc.metadata.get("table_origin", doc.text)
+            block = f"<br><b>Table from {source}</b>\n" + content + "\n<br>"
+            return EVIDENCE_MODE_TABLE, content, block, None
+        if doc_type == "chatbot":
+            content = doc.metadata["window"]
+            block = (
+                f"<br><b>Chatbot scenario from {filename} (Row {page})</b>\n"
+                + content
+                + "\n<br>"
+            )
+            return EVIDENCE_MODE_CHATBOT, content, block, None
+        if doc_type == "image":
+            image = doc.metadata.get("image_origin", "")
+            caption = html.escape(doc.get_content())
+            block = (
+                f"<br><b>Figure from {source}</b>\n"
+                + "<img width='85%' src='<src>' "
+                + f"alt='{caption}'/>"
+                + "\n<br>"
+            )
+            return EVIDENCE_MODE_FIGURE, image + caption, block, image
+
+        content = doc.metadata["window"] if "window" in doc.metadata else doc.text
+        content = content.replace("\n", " ")
+        block = f"<br><b>Content from {source}: </b> " + content + " \n<br>"
+        return EVIDENCE_MODE_TEXT, content, block, None
+
     def run(self, docs: list[RetrievedDocument]) -> Document:
-        evidence = ""
         images = []
-        table_found = 0
         evidence_modes = []
+        blocks: list[str] = []
+        block_tokens: list[int] = []
+        block_ids: list[str] = []
+        seen: set[bytes] = set()
+        table_found = 0
+        budget = self.max_context_length
 
-        evidence_trim_func = (
-            self.trim_func
-            if self.trim_func
-            else TokenSplitter(
-                chunk_size=self.max_context_length,
-                chunk_overlap=0,
-                separator=" ",
-                tokenizer=partial(
-                    tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-                    allowed_special=set(),
-                    disallowed_special="all",
-                ),
-            )
-        )
+        for retrieved_item in docs:
+            mode, content, block, image = self.format_block(retrieved_item)
+            evidence_modes.append(mode)
+            if budget <= 0:
+                continue
+            if mode == EVIDENCE_MODE_TABLE and table_found >= self.max_tables:
+                continue
 
-        for _, retrieved_item in enumerate(docs):
-            retrieved_content = ""
-            page = retrieved_item.metadata.get("page_label", None)
-            source = filename = retrieved_item.metadata.get("file_name", "-")
-            if page:
-                source += f" (Page {page})"
-            if retrieved_item.metadata.get("type", "") == "table":
-                evidence_modes.append(EVIDENCE_MODE_TABLE)
-                if table_found < 5:
-                    retrieved_content = retrieved_item.metadata.get(
-                        "table_origin", retrieved_item.text
-                    )
-                    if retrieved_content not in evidence:
-                        table_found += 1
-                        evidence += (
-                            f"<br><b>Table from {source}</b>\n"
-                            + retrieved_content
-                            + "\n<br>"
-                        )
-            elif retrieved_item.metadata.get("type", "") == "chatbot":
-                evidence_modes.append(EVIDENCE_MODE_CHATBOT)
-                retrieved_content = retrieved_item.metadata["window"]
-                evidence += (
-                    f"<br><b>Chatbot scenario from {filename} (Row {page})</b>\n"
-                    + retrieved_content
-                    + "\n<br>"
-                )
-            elif retrieved_item.metadata.get("type", "") == "image":
-                evidence_modes.append(EVIDENCE_MODE_FIGURE)
-                retrieved_content = retrieved_item.metadata.get("image_origin", "")
-                retrieved_caption = html.escape(retrieved_item.get_content())
-                evidence += (
-                    f"<br><b>Figure from {source}</b>\n"
-                    + "<img width='85%' src='<src>' "
-                    + f"alt='{retrieved_caption}'/>"
-                    + "\n<br>"
-                )
-                images.append(retrieved_content)
-            else:
-                if "window" in retrieved_item.metadata:
-                    retrieved_content = retrieved_item.metadata["window"]
-                else:
-                    retrieved_content = retrieved_item.text
-                retrieved_content = retrieved_content.replace("\n", " ")
-                if retrieved_content not in evidence:
-                    evidence += (
-                        f"<br><b>Content from {source}: </b> "
-                        + retrieved_content
-                        + " \n<br>"
-                    )
+            digest = hashlib.sha1(content.encode("utf-8")).digest()
+            if digest in seen:
+                continue
+
+            n_tokens = count_tokens(block, self.encoding_name)
+            if n_tokens > budget:
+                if blocks:
+                    continue
+                block = truncate_tokens(block, budget, self.encoding_name)
+                n_tokens = count_tokens(block, self.encoding_name)
+
+            seen.add(digest)
+            blocks.append(block)
+            block_tokens.append(n_tokens)
+            block_ids.append(retrieved_item.doc_id)
+            budget -= n_tokens
+            if mode == EVIDENCE_MODE_TABLE:
+                table_found += 1
+            if image is not None:
+                images.append(image)
 
         # resolve evidence mode
         evidence_mode = EVIDENCE_MODE_TEXT
@@ -104,11 +171,31 @@ class PrepareEvidencePipeline(BaseComponent):
         elif EVIDENCE_MODE_TABLE in evidence_modes:
             evidence_mode = EVIDENCE_MODE_TABLE
 
-        # trim context by trim_len
-        print("len (original)", len(evidence))
-        if evidence:
-            texts = evidence_trim_func([Document(text=evidence)])
-            evidence = texts[0].text
-            print("len (trimmed)", len(evidence))
+        evidence = "".join(blocks)
+        tokens = sum(block_tokens) + sum(
+            join_tokens(left, right, self.encoding_name)
+            for left, right in zip(blocks, blocks[1:])
+        )
+        if evidence and self.trim_func:
+            trimmed = self.trim_func([Document(text=evidence)])[0].text
+            if trimmed != evidence:
+                # not cached, the trimmed evidence is rarely the same twice
+                evidence = trimmed
+                tokens = len(
+                    get_encoding(self.encoding_name).encode(
+                        evidence, disallowed_special=()
+                    )
+                )
+        logger.debug(
+            f"Packed {len(blocks)}/{len(docs)} evidence blocks, {tokens} tokens"
+        )
 
-        return Document(content=(evidence_mode, evidence, images))
+        return Document(
+            content=(evidence_mode, evidence, images),
+            metadata={
+                "tokens": tokens,
+                "block_tokens": block_tokens,
+                "block_ids": block_ids,
+                "encoding": self.encoding_name,
+            },
+        )
@@ -1,4 +1,5 @@
 from .base import BaseReranking
+from .cascade import CascadeReranking, CascadeStage
 from .cohere import CohereReranking
 from .llm import LLMReranking
 from .llm_scoring import LLMScoring
@@ -10,4 +11,6 @@ __all__ = [
     "LLMScoring",
     "BaseReranking",
     "LLMTrulensScoring",
+    "CascadeReranking",
+    "CascadeStage",
 ]
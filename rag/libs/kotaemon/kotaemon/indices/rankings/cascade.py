@@ -0,0 +1,229 @@
+"""Cascade of rerankers, from the cheapest to the most expensive
+
+Each stage prunes the candidates before the next, more expensive, stage sees
+them: e.g. the retrieval scores keep 50 documents, a cross-encoder keeps 10 of
+them and only those 10 are graded by an LLM. A stage can end the cascade early,
+when no document is relevant enough or when all of them are already relevant
+enough, and has a latency budget: a stage running over its budget gives back its
+input order and the later stages are skipped, so the latency of the cascade is
+bounded instead of being the sum of the latencies of all the stages.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Optional, Sequence
+
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import BaseComponent, Document
+
+from .base import BaseReranking
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache
+def cascade_executor() -> ThreadPoolExecutor:
+    """The thread pool running the stages that have a latency budget"""
+    return ThreadPoolExecutor(
+        max_workers=getattr(flowsettings, "KH_RERANKING_CASCADE_MAX_CONCURRENCY", 8),
+        thread_name_prefix="rerank-cascade",
+    )
+
+
+class CascadeStage(BaseComponent):
+    """A stage of the reranking cascade
+
+    Attributes:
+        name: name of the stage in the timings and the logs
+        reranker: the reranker of the stage, None to keep the order of the
+            previous stage (e.g. the retrieval scores) and only prune
+        top_k: maximum number of documents passed to the next stage
+        score_key: metadata key of the score set by the reranker, None to use
+            the `score` of the retrieved documents
+        min_score: documents scoring under are dropped, the cascade ends if none
+            is left
+        exit_score: the cascade ends after this stage if all its documents score
+            at least this much
+        budget: latency budget of the stage in seconds. When it runs over, the
+            stage keeps its input order and the later stages are skipped
+    """
+
+    name: str = ""
+    reranker: Optional[BaseReranking] = None
+    top_k: Optional[int] = None
+    score_key: Optional[str] = None
+    min_score: Optional[float] = None
+    exit_score: Optional[float] = None
+    budget: Optional[float] = None
+
+    def get_score(self, doc: Document) -> Optional[float]:
+        if self.score_key:
+            return doc.metadata.get(self.score_key)
+        return getattr(doc, "score", None)
+
+    def rerank(self, documents: list[Document], query: str) -> list[Document]:
+        """Run the reranker of the stage"""
+        if self.reranker is None or not documents:
+            return documents
+        return self.reranker(documents=documents, query=query)
+
+    def prune(self, documents: list[Document]) -> list[Document]:
+        """Drop the documents under `min_score` and keep the `top_k` first"""
+        if self.min_score is not None:
+            documents = [
+                doc
+                for doc in documents
+                if (score := self.get_score(doc)) is None or score >= self.min_score
+            ]
+        if self.top_k:
+            documents = documents[: self.top_k]
+        return documents
+
+    def should_exit(self, documents: list[Document]) -> bool:
+        """Whether the cascade can end after this stage"""
+        if not documents:
+            return True
+        if self.exit_score is None:
+            return False
+        for doc in documents:
+            score = self.get_score(doc)
+            if score is None or score < self.exit_score:
+                return False
+        return True
+
+    def run(self, documents: list[Document], query: str) -> list[Document]:
+        return self.prune(self.rerank(documents, query))
+
+
+class CascadeReranking(BaseReranking):
+    """Run the reranking stages in order, each on the documents kept by the
+    previous one
+
+    Attributes:
+        stages: the stages, from the cheapest to the most expensive
+        budget: latency budget of the whole cascade in seconds, the stage
+            running when it is exhausted is given the remaining time only
+    """
+
+    stages: Sequence[CascadeStage] = []
+    budget: Optional[float] = None
+
+    def _run_stage(
+        self,
+        stage: CascadeStage,
+        documents: list[Document],
+        query: str,
+        timeout: Optional[float],
+    ) -> Optional[list[Document]]:
+        """Rerank with the stage, None if it did not finish within `timeout`"""
+        if timeout is None or stage.reranker is None:
+            return stage.rerank(documents, query)
+
+        # the stage keeps running in the background after the timeout, it gets
+        # copies so that it does not edit the documents returned by the cascade
+        copies = [type(doc).from_document(doc) for doc in documents]
+        future = cascade_executor().submit(stage.rerank, copies, query)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # drop it if it is still waiting for a thread
+            future.cancel()
+            return None
+
+    def run_with_timings(
+        self, documents: list[Document], query: str
+    ) -> tuple[list[Document], list[dict]]:
+        """Rerank the documents and time each stage
+
+        Returns:
+            the reranked documents, and for each stage a dict with its `stage`
+            name, its `status` ("ok", "early_exit", "over_budget", "timeout" or
+            "skipped"), its number of `input` and `output` documents and its
+            `elapsed` time in seconds
+        """
+        start = time.perf_counter()
+        timings: list[dict] = []
+        stop = False
+        for idx, stage in enumerate(self.stages):
+            name = stage.name or f"stage_{idx}"
+            if stop:
+                timings.append(
+                    {
+                        "stage": name,
+                        "status": "skipped",
+                        "input": len(documents),
+                        "output": len(documents),
+                        "elapsed": 0.0,
+                    }
+                )
+                continue
+
+            timeout = stage.budget
+            if self.budget is not None:
+                remaining = self.budget - (time.perf_counter() - start)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            n_input = len(documents)
+            if timeout is not None and timeout <= 0 and stage.reranker is not None:
+                # the budget is exhausted, keep the order of the previous stage
+                stop = True
+                documents = documents[: stage.top_k] if stage.top_k else documents
+                timings.append(
+                    {
+                        "stage": name,
+                        "status": "skipped",
+                        "input": n_input,
+                        "output": len(documents),
+                        "elapsed": 0.0,
+                    }
+                )
+                continue
+
+            stage_start = time.perf_counter()
+            reranked = self._run_stage(stage, documents, query, timeout)
+            elapsed = time.perf_counter() - stage_start
+
+            status = "ok"
+            if reranked is None:
+                # keep the order of the previous stage
+                status, stop = "timeout", True
+                documents = documents[: stage.top_k] if stage.top_k else documents
+            else:
+                documents = stage.prune(reranked)
+                if timeout is not None and elapsed > timeout:
+                    status, stop = "over_budget", True
+                elif stage.should_exit(documents):
+                    status, stop = "early_exit", True
+
+            timings.append(
+                {
+                    "stage": name,
+                    "status": status,
+                    "input": n_input,
+                    "output": len(documents),
+                    "elapsed": elapsed,
+                }
+            )
+
+        return documents, timings
+
+    def run(self, documents: list[Document], query: str) -> list[Document]:
+        """Rerank the documents through the stages of the cascade"""
+        documents, timings = self.run_with_timings(documents, query)
+        for timing in timings:
+            logger.info(
+                "Reranking stage %s: %s, %d -> %d documents in %.3fs",
+                timing["stage"],
+                timing["status"],
+                timing["input"],
+                timing["output"],
+                timing["elapsed"],
+            )
+        self.log_progress(".timings", timings=timings)
+        return documents
@@ -5,7 +5,9 @@ from concurrent.futures import ThreadPoolExecutor
 from langchain.output_parsers.boolean import BooleanOutputParser
 
 from kotaemon.base import Document
+from kotaemon.embeddings.cache import model_spec_hash
 from kotaemon.llms import BaseLLM, PromptTemplate
+from kotaemon.rerankings.cache import cached_scores, scorer_id
 
 from .base import BaseReranking
 
@@ -26,38 +28,51 @@ class LLMReranking(BaseReranking):
     top_k: int = 3
     concurrent: bool = True
 
-    def run(
-        self,
-        documents: list[Document],
-        query: str,
-    ) -> list[Document]:
-        """Filter down documents based on their relevance to the query."""
-        filtered_docs = []
+    def scorer_key(self) -> str:
+        return scorer_id(
+            self,
+            model_spec_hash(self.get_from_path("llm")),
+            self.prompt_template.template,
+        )
+
+    def score_documents(self, documents: list[Document], query: str) -> list[bool]:
+        """Whether each document is relevant to the query"""
         output_parser = BooleanOutputParser()
+        prompts = [
+            self.prompt_template.populate(question=query, context=doc.get_content())
+            for doc in documents
+        ]
 
-        if self.concurrent:
+        if self.concurrent and len(prompts) > 1:
             with ThreadPoolExecutor() as executor:
-                futures = []
-                for doc in documents:
-                    _prompt = self.prompt_template.populate(
-                        question=query, context=doc.get_content()
-                    )
-                    futures.append(executor.submit(lambda: self.llm(_prompt).text))
-
+                futures = [
+                    executor.submit(lambda prompt: self.llm(prompt).text, _prompt)
+                    for _prompt in prompts
+                ]
                 results = [future.result() for future in futures]
         else:
-            results = []
-            for doc in documents:
-                _prompt = self.prompt_template.populate(
-                    question=query, context=doc.get_content()
-                )
-                results.append(self.llm(_prompt).text)
+            results = [self.llm(_prompt).text for _prompt in prompts]
 
         # use Boolean parser to extract relevancy output from LLM
-        results = [output_parser.parse(result) for result in results]
-        for include_doc, doc in zip(results, documents):
-            if include_doc:
-                filtered_docs.append(doc)
+        return [output_parser.parse(result) for result in results]
+
+    def run(
+        self,
+        documents: list[Document],
+        query: str,
+    ) -> list[Document]:
+        """Filter down documents based on their relevance to the query."""
+        cache = self.get_score_cache()
+        results = cached_scores(
+            cache,
+            self.scorer_key() if cache is not None else "",
+            query,
+            documents,
+            lambda docs: self.score_documents(docs, query),
+        )
+        filtered_docs = [
+            doc for include_doc, doc in zip(results, documents) if include_doc
+        ]
 
         # prevent returning empty result
         if len(filtered_docs) == 0:
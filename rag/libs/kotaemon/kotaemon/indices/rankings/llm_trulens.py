@@ -1,22 +1,28 @@
 from __future__ import annotations
 
+import json
+import logging
 import re
 from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from functools import lru_cache
+from typing import Callable, Optional, Sequence, TypeVar
 
 import tiktoken
+from theflow.settings import settings as flowsettings
 
 from kotaemon.base import Document, HumanMessage, SystemMessage
-from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.embeddings.cache import model_spec_hash
 from kotaemon.llms import BaseLLM, PromptTemplate
+from kotaemon.rerankings.cache import cached_scores, scorer_id
 
 from .llm import LLMReranking
 
-SYSTEM_PROMPT_TEMPLATE = PromptTemplate(
-    """You are a RELEVANCE grader; providing the relevance of the given CONTEXT to the given QUESTION.
-        Respond only as a number from 0 to 10 where 0 is the least relevant and 10 is the most relevant.
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
 
-        A few additional scoring guidelines:
+SCORING_GUIDELINES = """        A few additional scoring guidelines:
 
         - Long CONTEXTS should score equally well as short CONTEXTS.
 
@@ -31,8 +37,16 @@ SYSTEM_PROMPT_TEMPLATE = PromptTemplate(
         - CONTEXT that is RELEVANT to the entire QUESTION should get a score of 9 or 10. Higher score indicates more RELEVANCE.
 
         - CONTEXT must be relevant and helpful for answering the entire QUESTION to get a score of 10.
+"""  # noqa: E501
+
+SYSTEM_PROMPT_TEMPLATE = PromptTemplate(
+    """You are a RELEVANCE grader; providing the relevance of the given CONTEXT to the given QUESTION.
+        Respond only as a number from 0 to 10 where 0 is the least relevant and 10 is the most relevant.
 
-        - Never elaborate."""  # noqa: E501
+"""  # noqa: E501
+    + SCORING_GUIDELINES
+    + """
+        - Never elaborate."""
 )
 
 USER_PROMPT_TEMPLATE = PromptTemplate(
@@ -43,9 +57,32 @@ USER_PROMPT_TEMPLATE = PromptTemplate(
         RELEVANCE: """
 )  # noqa
 
+BATCH_SYSTEM_PROMPT_TEMPLATE = PromptTemplate(
+    """You are a RELEVANCE grader; providing the relevance of each of the given numbered CONTEXTS to the given QUESTION.
+        Grade each CONTEXT on its own, as a number from 0 to 10 where 0 is the least relevant and 10 is the most relevant.
+
+"""  # noqa: E501
+    + SCORING_GUIDELINES
+    + """
+        - Respond only with a JSON object mapping the number of every CONTEXT to its RELEVANCE, e.g. {{"1": 7, "2": 0, "3": 10}}. Never elaborate."""  # noqa: E501
+)
+
+BATCH_USER_PROMPT_TEMPLATE = PromptTemplate(
+    """QUESTION: {question}
+
+        CONTEXTS:
+
+{contexts}
+
+        RELEVANCE (JSON): """
+)  # noqa
+
 PATTERN_INTEGER: re.Pattern = re.compile(r"([+-]?[1-9][0-9]*|0)")
 """Regex that matches integers."""
 
+PATTERN_JSON_OBJECT: re.Pattern = re.compile(r"\{.*\}", re.DOTALL)
+"""Regex that matches the outermost JSON object of a string."""
+
 MAX_CONTEXT_LEN = 7500
 
 
@@ -93,22 +130,182 @@ def re_0_10_rating(s: str) -> int:
     return min(vals)
 
 
+def parse_batch_ratings(s: str, n_contexts: int) -> dict[int, int]:
+    """Extract the 0-10 ratings of the numbered contexts from a JSON answer.
+
+    The ratings out of the 0-10 range or of unknown contexts are left out.
+
+    Args:
+        s: String to extract the ratings from.
+        n_contexts: Number of the graded contexts, numbered from 1.
+
+    Returns:
+        dict: Extracted ratings by context index, from 0.
+
+    Raises:
+        ValueError: If the string does not contain a JSON object.
+    """
+
+    match = PATTERN_JSON_OBJECT.search(s)
+    if not match:
+        raise ValueError(f"No JSON object found in: {s}")
+    output = json.loads(match.group(0))
+    if isinstance(output, dict) and isinstance(output.get("scores"), (dict, list)):
+        output = output["scores"]
+    if isinstance(output, list):
+        output = {str(idx + 1): value for idx, value in enumerate(output)}
+    if not isinstance(output, dict):
+        raise ValueError(f"Unexpected JSON answer: {s}")
+
+    ratings = {}
+    for key, value in output.items():
+        try:
+            idx = int(str(key).strip("[] ")) - 1
+            rating = validate_rating(int(value))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= idx < n_contexts:
+            ratings[idx] = rating
+    return ratings
+
+
+@lru_cache
+def _encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+def trim_tokens(text: str, max_tokens: int) -> str:
+    """Truncate the text to its first `max_tokens` tokens"""
+    tokens = _encoding().encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return _encoding().decode(tokens[:max_tokens])
+
+
+@lru_cache
+def scoring_executor() -> ThreadPoolExecutor:
+    """The threads of the LLM scoring calls, shared by the scorers of the process
+    so that the number of concurrent calls stays bounded"""
+    return ThreadPoolExecutor(
+        max_workers=getattr(flowsettings, "KH_LLM_SCORING_MAX_CONCURRENCY", 8),
+        thread_name_prefix="llm-scoring",
+    )
+
+
 class LLMTrulensScoring(LLMReranking):
+    """Grade the relevance of the documents to the query with the LLM
+
+    The score, from 0 to 1, is set in the `llm_trulens_score` metadata and the
+    documents are returned most relevant first.
+
+    With `batch_size` > 1, one prompt grades up to `batch_size` documents and
+    the LLM answers with their scores as JSON. The documents whose score can't
+    be parsed from the answer are then graded with one call each.
+
+    Args:
+        llm: the grading LLM
+        concurrent: run the LLM calls in the shared scoring threads
+        normalize: the maximum grade
+        batch_size: number of documents graded per LLM call, 1 to grade the
+            documents one by one
+        max_context_tokens: maximum tokens of a document
+        batch_context_tokens: maximum tokens of the documents of a batch, split
+            evenly between them
+    """
+
     llm: BaseLLM
     system_prompt_template: PromptTemplate = SYSTEM_PROMPT_TEMPLATE
     user_prompt_template: PromptTemplate = USER_PROMPT_TEMPLATE
+    batch_system_prompt_template: PromptTemplate = BATCH_SYSTEM_PROMPT_TEMPLATE
+    batch_user_prompt_template: PromptTemplate = BATCH_USER_PROMPT_TEMPLATE
     concurrent: bool = True
     normalize: float = 10
-    trim_func: TokenSplitter = TokenSplitter.withx(
-        chunk_size=MAX_CONTEXT_LEN,
-        chunk_overlap=0,
-        separator=" ",
-        tokenizer=partial(
-            tiktoken.encoding_for_model("gpt-3.5-turbo").encode,
-            allowed_special=set(),
-            disallowed_special="all",
-        ),
-    )
+    batch_size: int = getattr(flowsettings, "KH_LLM_SCORING_BATCH_SIZE", 10)
+    max_context_tokens: int = MAX_CONTEXT_LEN
+    batch_context_tokens: int = 2 * MAX_CONTEXT_LEN
+
+    def _map(self, func: Callable[[T], R], items: Sequence[T]) -> list[R]:
+        if not self.concurrent or len(items) <= 1:
+            return [func(item) for item in items]
+        futures = [scoring_executor().submit(func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def score_document(self, query: str, doc: Document) -> float:
+        """Grade one document, return its normalized score"""
+        context = trim_tokens(doc.get_content(), self.max_context_tokens)
+        messages = [
+            SystemMessage(self.system_prompt_template.populate()),
+            HumanMessage(
+                self.user_prompt_template.populate(question=query, context=context)
+            ),
+        ]
+        return float(re_0_10_rating(self.llm(messages).text)) / self.normalize
+
+    def score_batch(self, query: str, docs: list[Document]) -> list[Optional[float]]:
+        """Grade the documents in one call, return their normalized scores, None
+        for the documents whose score can't be parsed from the answer"""
+        max_tokens = min(
+            self.max_context_tokens, self.batch_context_tokens // len(docs)
+        )
+        contexts = "\n\n".join(
+            f"[{idx + 1}]\n{trim_tokens(doc.get_content(), max_tokens)}"
+            for idx, doc in enumerate(docs)
+        )
+        messages = [
+            SystemMessage(self.batch_system_prompt_template.populate()),
+            HumanMessage(
+                self.batch_user_prompt_template.populate(
+                    question=query, contexts=contexts
+                )
+            ),
+        ]
+        answer = self.llm(messages).text
+        try:
+            ratings = parse_batch_ratings(answer, len(docs))
+        except ValueError:
+            logger.warning("Cannot parse the batch relevance scores: %s", answer)
+            ratings = {}
+        return [
+            ratings[idx] / self.normalize if idx in ratings else None
+            for idx in range(len(docs))
+        ]
+
+    def scorer_key(self) -> str:
+        return scorer_id(
+            self,
+            model_spec_hash(self.get_from_path("llm")),
+            self.system_prompt_template.template,
+            self.user_prompt_template.template,
+            self.batch_system_prompt_template.template,
+            self.normalize,
+        )
+
+    def score_documents(self, documents: list[Document], query: str) -> list[float]:
+        """Grade the documents, return their normalized scores"""
+        scores: list[Optional[float]] = [None] * len(documents)
+
+        if self.batch_size > 1 and len(documents) > 1:
+            batches = [
+                list(range(start, min(start + self.batch_size, len(documents))))
+                for start in range(0, len(documents), self.batch_size)
+            ]
+            batch_scores = self._map(
+                lambda batch: self.score_batch(query, [documents[i] for i in batch]),
+                batches,
+            )
+            for batch, output in zip(batches, batch_scores):
+                for idx, score in zip(batch, output):
+                    scores[idx] = score
+
+        # grade one by one the documents left out of the batch answers
+        missing = [idx for idx, score in enumerate(scores) if score is None]
+        for idx, score in zip(
+            missing,
+            self._map(lambda idx: self.score_document(query, documents[idx]), missing),
+        ):
+            scores[idx] = score
+
+        return scores  # type: ignore[return-value]
 
     def run(
         self,
@@ -116,62 +313,19 @@ class LLMTrulensScoring(LLMReranking):
         query: str,
     ) -> list[Document]:
         """Filter down documents based on their relevance to the query."""
-        filtered_docs = []
-
-        documents = sorted(documents, key=lambda doc: doc.get_content())
-        if self.concurrent:
-            with ThreadPoolExecutor() as executor:
-                futures = []
-                for doc in documents:
-                    chunked_doc_content = self.trim_func(
-                        [
-                            Document(content=doc.get_content())
-                            # skip metadata which cause troubles
-                        ]
-                    )[0].text
-
-                    messages = []
-                    messages.append(
-                        SystemMessage(self.system_prompt_template.populate())
-                    )
-                    messages.append(
-                        HumanMessage(
-                            self.user_prompt_template.populate(
-                                question=query, context=chunked_doc_content
-                            )
-                        )
-                    )
-
-                    def llm_call():
-                        return self.llm(messages).text
-
-                    futures.append(executor.submit(llm_call))
-
-                results = [future.result() for future in futures]
-        else:
-            results = []
-            for doc in documents:
-                messages = []
-                messages.append(SystemMessage(self.system_prompt_template.populate()))
-                messages.append(
-                    SystemMessage(
-                        self.user_prompt_template.populate(
-                            question=query, context=doc.get_content()
-                        )
-                    )
-                )
-                results.append(self.llm(messages).text)
-
-        # use Boolean parser to extract relevancy output from LLM
-        results = [
-            (r_idx, float(re_0_10_rating(result)) / self.normalize)
-            for r_idx, result in enumerate(results)
-        ]
-        results.sort(key=lambda x: x[1], reverse=True)
+        cache = self.get_score_cache()
+        scores = cached_scores(
+            cache,
+            self.scorer_key() if cache is not None else "",
+            query,
+            documents,
+            lambda docs: self.score_documents(docs, query),
+        )
 
-        for r_idx, score in results:
-            doc = documents[r_idx]
-            doc.metadata["llm_trulens_score"] = score
+        filtered_docs = []
+        for idx in sorted(range(len(documents)), key=lambda idx: -scores[idx]):
+            doc = documents[idx]
+            doc.metadata["llm_trulens_score"] = scores[idx]
             filtered_docs.append(doc)
 
         print(
@@ -7,11 +7,22 @@ from typing import Optional, Sequence, cast
 
 from theflow.settings import settings as flowsettings
 
-from kotaemon.base import BaseComponent, Document, RetrievedDocument
-from kotaemon.embeddings import BaseEmbeddings
+from kotaemon.base import (
+    BaseComponent,
+    Document,
+    DocumentWithEmbedding,
+    RetrievedDocument,
+)
+from kotaemon.embeddings import (
+    BaseEmbeddingCache,
+    BaseEmbeddings,
+    CachedEmbeddings,
+    EmbeddingExecutor,
+)
 from kotaemon.storages import BaseDocumentStore, BaseVectorStore
 
 from .base import BaseIndexing, BaseRetrieval
+from .fusion import reciprocal_rank_fusion, weighted_score_fusion
 from .rankings import BaseReranking, LLMReranking
 
 VECTOR_STORE_FNAME = "vectorstore"
@@ -25,12 +36,19 @@ class VectorIndexing(BaseIndexing):
     This pipeline supports the following set of inputs:
         - List of documents
         - List of texts
+
+    If `embedding_cache` is set, chunks are looked up by (embedding model, sha256
+    of the chunk text) first, so only unseen chunks are sent to the embedding model.
+    If `embedding_executor` is set, the chunks are embedded with concurrent batched
+    requests.
     """
 
     cache_dir: Optional[str] = getattr(flowsettings, "KH_CHUNKS_OUTPUT_DIR", None)
     vector_store: BaseVectorStore
     doc_store: Optional[BaseDocumentStore] = None
     embedding: BaseEmbeddings
+    embedding_cache: Optional[BaseEmbeddingCache] = None
+    embedding_executor: Optional[EmbeddingExecutor] = None
     count_: int = 0
 
     def to_retrieval_pipeline(self, *args, **kwargs):
@@ -81,16 +99,35 @@ class VectorIndexing(BaseIndexing):
             print("Adding documents to doc store")
             self.doc_store.add(docs)
 
-    def add_to_vectorstore(self, docs: list[Document]):
+    def embed_chunks(self, docs: list[Document]) -> list[DocumentWithEmbedding]:
+        if self.embedding_cache is None and self.embedding_executor is None:
+            return self.embedding(docs)
+
+        embedding = self.get_from_path("embedding")
+        if self.embedding_cache is not None:
+            embedding = CachedEmbeddings(
+                embedding=embedding, cache=self.embedding_cache, normalize=False
+            )
+        if self.embedding_executor is not None:
+            return self.embedding_executor.run(embedding, docs)
+        return embedding(docs)
+
+    def add_to_vectorstore(
+        self, docs: list[Document]
+    ) -> Optional[list[DocumentWithEmbedding]]:
+        """Embed the documents and add them to the vector store, return the
+        embedded documents"""
         # in case we want to skip embedding
         if self.vector_store:
             print(f"Getting embeddings for {len(docs)} nodes")
-            embeddings = self.embedding(docs)
+            embeddings = self.embed_chunks(docs)
             print("Adding embeddings to vector store")
             self.vector_store.add(
                 embeddings=embeddings,
                 ids=[t.doc_id for t in docs],
             )
+            return embeddings
+        return None
 
     def run(self, text: str | list[str] | Document | list[Document]):
         input_: list[Document] = []
@@ -109,12 +146,22 @@ class VectorIndexing(BaseIndexing):
 
         self.add_to_vectorstore(input_)
         self.add_to_docstore(input_)
+        if self.doc_store:
+            self.doc_store.refresh()
         self.write_chunk_to_file(input_)
         self.count_ += len(input_)
 
 
 class VectorRetrieval(BaseRetrieval):
-    """Retrieve list of documents from vector store"""
+    """Retrieve list of documents from vector store
+
+    In hybrid mode, the vector and full-text results are fused by doc id, either
+    with reciprocal rank fusion (`fusion_mode="rrf"`) or with weighted min-max
+    normalized scores (`fusion_mode="weighted"`). Only the best `fusion_top_k`
+    fused candidates are passed to the rerankers. The rerankers run in sequence on
+    all the candidates, use a `CascadeReranking` to prune the candidates between
+    rerankers and bound their latency.
+    """
 
     vector_store: BaseVectorStore
     doc_store: Optional[BaseDocumentStore] = None
@@ -123,6 +170,30 @@ class VectorRetrieval(BaseRetrieval):
     top_k: int = 5
     first_round_top_k_mult: int = 10
     retrieval_mode: str = "hybrid"  # vector, text, hybrid
+    fusion_mode: str = "rrf"  # rrf, weighted
+    rrf_k: int = 60
+    vector_weight: float = 1.0
+    text_weight: float = 1.0
+    # maximum number of fused candidates, default to the first round top_k
+    fusion_top_k: Optional[int] = None
+
+    def _query_docstore(
+        self,
+        query: str,
+        top_k: int,
+        scope: Optional[list] = None,
+        allowed_file_ids: Optional[list] = None,
+    ) -> list[Document]:
+        """Full-text search, scoped by file when the doc store supports it,
+        otherwise by the chunk ids of `scope`"""
+        assert self.doc_store is not None
+        if allowed_file_ids is not None and self.doc_store.file_scoped_query:
+            return self.doc_store.query(
+                query, top_k=top_k, file_ids=allowed_file_ids  # type: ignore
+            )
+        if scope:
+            return self.doc_store.query(query, top_k=top_k, doc_ids=scope)
+        return []
 
     def _filter_docs(
         self, documents: list[RetrievedDocument], top_k: int | None = None
@@ -131,6 +202,31 @@ class VectorRetrieval(BaseRetrieval):
             documents = documents[:top_k]
         return documents
 
+    def _fuse(
+        self,
+        vs_docs: list[RetrievedDocument],
+        vs_scores: list[float],
+        ds_docs: list[RetrievedDocument],
+        top_k: int,
+    ) -> list[RetrievedDocument]:
+        """Fuse the vector and full-text results into a de-duplicated list
+
+        Vector results come first so that documents found by both sources keep
+        their similarity score.
+        """
+        weights = [self.vector_weight, self.text_weight]
+        if self.fusion_mode == "rrf":
+            return reciprocal_rank_fusion(
+                [vs_docs, ds_docs], weights=weights, k=self.rrf_k, top_k=top_k
+            )
+        elif self.fusion_mode == "weighted":
+            return weighted_score_fusion(
+                [vs_docs, ds_docs], [vs_scores, None], weights=weights, top_k=top_k
+            )
+        raise ValueError(
+            f"Invalid fusion_mode {self.fusion_mode}, should be rrf or weighted"
+        )
+
     def run(
         self, text: str | Document, top_k: Optional[int] = None, **kwargs
     ) -> list[RetrievedDocument]:
@@ -163,8 +259,16 @@ class VectorRetrieval(BaseRetrieval):
         result: list[RetrievedDocument] = []
         # TODO: should declare scope directly in the run params
         scope = kwargs.pop("scope", None)
+        allowed_file_ids = kwargs.pop("allowed_file_ids", None)
         emb: list[float]
 
+        # let the vector store prefilter natively, by file when possible since
+        # it is much cheaper than passing every chunk id of the selected files
+        if allowed_file_ids is not None:
+            kwargs["allowed_file_ids"] = allowed_file_ids
+        elif scope is not None:
+            kwargs["allowed_ids"] = scope
+
         if self.retrieval_mode == "vector":
             emb = self.embedding(text)[0].embedding
             _, scores, ids = self.vector_store.query(
@@ -172,17 +276,15 @@ class VectorRetrieval(BaseRetrieval):
             )
             docs = self.doc_store.get(ids)
             result = [
-                RetrievedDocument(**doc.to_dict(), score=score)
+                RetrievedDocument.from_document(doc, score=score)
                 for doc, score in zip(docs, scores)
             ]
         elif self.retrieval_mode == "text":
             query = text.text if isinstance(text, Document) else text
-            docs = []
-            if scope:
-                docs = self.doc_store.query(
-                    query, top_k=top_k_first_round, doc_ids=scope
-                )
-            result = [RetrievedDocument(**doc.to_dict(), score=-1.0) for doc in docs]
+            docs = self._query_docstore(
+                query, top_k_first_round, scope, allowed_file_ids
+            )
+            result = [RetrievedDocument.from_document(doc, score=-1.0) for doc in docs]
         elif self.retrieval_mode == "hybrid":
             # similarity search section
             emb = self.embedding(text)[0].embedding
@@ -190,10 +292,6 @@ class VectorRetrieval(BaseRetrieval):
             vs_ids: list[str] = []
             vs_scores: list[float] = []
 
-            kwargs.update({
-                'doc_ids': scope
-            })
-
             def query_vectorstore():
                 nonlocal vs_docs
                 nonlocal vs_scores
@@ -214,10 +312,9 @@ class VectorRetrieval(BaseRetrieval):
 
                 assert self.doc_store is not None
                 query = text.text if isinstance(text, Document) else text
-                if scope:
-                    ds_docs = self.doc_store.query(
-                        query, top_k=top_k_first_round, doc_ids=scope
-                    )
+                ds_docs = self._query_docstore(
+                    query, top_k_first_round, scope, allowed_file_ids
+                )
 
             vs_query_thread = threading.Thread(target=query_vectorstore)
             ds_query_thread = threading.Thread(target=query_docstore)
@@ -228,17 +325,19 @@ class VectorRetrieval(BaseRetrieval):
             vs_query_thread.join()
             ds_query_thread.join()
 
-            result = [
-                RetrievedDocument(**doc.to_dict(), score=-1.0)
-                for doc in ds_docs
-                if doc not in vs_ids
-            ]
-            result += [
-                RetrievedDocument(**doc.to_dict(), score=score)
+            vs_result = [
+                RetrievedDocument.from_document(doc, score=score)
                 for doc, score in zip(vs_docs, vs_scores)
             ]
+            ds_result = [
+                RetrievedDocument.from_document(doc, score=-1.0) for doc in ds_docs
+            ]
+            result = self._fuse(
+                vs_result, vs_scores, ds_result, self.fusion_top_k or top_k_first_round
+            )
             print(f"Got {len(vs_docs)} from vectorstore")
             print(f"Got {len(ds_docs)} from docstore")
+            print(f"Got {len(result)} after fusion")
 
         # use additional reranker to re-order the document list
         if self.rerankers and text:
@@ -288,15 +387,19 @@ class VectorRetrieval(BaseRetrieval):
 
         for thumbnail_doc in linked_thumbnail_docs:
             text_doc = text_thumbnail_docs[thumbnail_doc.doc_id]
-            doc_dict = thumbnail_doc.to_dict()
-            doc_dict["_id"] = text_doc.doc_id
-            doc_dict["content"] = text_doc.content
-            doc_dict["metadata"]["type"] = "image"
-            for key in text_doc.metadata:
-                if key not in doc_dict["metadata"]:
-                    doc_dict["metadata"][key] = text_doc.metadata[key]
-
-            additional_docs.append(RetrievedDocument(**doc_dict, score=text_doc.score))
+            additional_docs.append(
+                RetrievedDocument.from_document(
+                    thumbnail_doc,
+                    content=text_doc.content,
+                    text=str(text_doc.content) if text_doc.content else "",
+                    metadata={
+                        **text_doc.metadata,
+                        **thumbnail_doc.metadata,
+                        "type": "image",
+                    },
+                    score=text_doc.score,
+                )
+            )
 
         result = additional_docs + non_thumbnail_docs
 
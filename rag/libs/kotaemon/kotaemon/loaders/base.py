@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, List, Type, Union
+from typing import TYPE_CHECKING, Any, Iterator, List, Type, Union
 
 from kotaemon.base import BaseComponent, Document
 
@@ -13,6 +13,18 @@ class BaseReader(BaseComponent):
     ...
 
 
+def iter_data(loader: Any, file: Union[Path, str], **kwargs: Any) -> Iterator[Document]:
+    """Iterate the documents of a file, lazily if the loader supports it
+
+    Loaders implementing `iter_data` (e.g. `PDFThumbnailReader`) yield their
+    documents as they are parsed, the other loaders parse the whole file first.
+    """
+    if hasattr(loader, "iter_data"):
+        yield from loader.iter_data(file, **kwargs)
+    else:
+        yield from loader.load_data(file, **kwargs)
+
+
 class AutoReader(BaseReader):
     """General auto reader for a variety of files. (based on llama-hub)"""
 
@@ -31,7 +43,7 @@ class AutoReader(BaseReader):
         documents = self._reader.load_data(file=file, **kwargs)
 
         # convert Document to new base class from kotaemon
-        converted_documents = [Document.from_dict(doc.to_dict()) for doc in documents]
+        converted_documents = [Document.from_document(doc) for doc in documents]
         return converted_documents
 
     def run(self, file: Union[Path, str], **kwargs: Any) -> List[Document]:
@@ -78,7 +90,7 @@ class LIReaderMixin(BaseComponent):
         documents = self._reader.load_data(*args, **kwargs)
 
         # convert Document to new base class from kotaemon
-        converted_documents = [Document.from_dict(doc.to_dict()) for doc in documents]
+        converted_documents = [Document.from_document(doc) for doc in documents]
         return converted_documents
 
     def run(self, *args, **kwargs: Any) -> List[Document]:
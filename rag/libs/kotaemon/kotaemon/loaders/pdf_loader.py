@@ -1,24 +1,23 @@
 import base64
 from io import BytesIO
 from pathlib import Path
-from typing import Dict, List, Optional
-import os 
-import tempfile
-import uuid
+from typing import Dict, Iterator, List, Optional
 
 from decouple import config
 from fsspec import AbstractFileSystem
+from llama_index.core.readers.file.base import get_default_fs, is_default_fs
 from llama_index.readers.file import PDFReader
 from PIL import Image
 
 from libs.kotaemon.kotaemon.base import Document
+from kotaemon.loaders.utils.thumbnails import get_thumbnailer
 
 PDF_LOADER_DPI = config("PDF_LOADER_DPI", default=120, cast=int)
 
 
 def get_page_thumbnails(
     file_path: Path, pages: list[int], dpi: int = PDF_LOADER_DPI
-) -> List[Image.Image]:
+) -> List[str]:
     """Get image thumbnails of the pages in the PDF file.
 
     Args:
@@ -26,42 +25,12 @@ def get_page_thumbnails(
         page_number (list[int]): list of page numbers to extract
 
     Returns:
-        list[Image.Image]: list of page thumbnails
+        list[str]: storage keys of the page thumbnails
     """
 
-    img: Image.Image
     suffix = file_path.suffix.lower()
     assert suffix == ".pdf", "This function only supports PDF files."
-    try:
-        import fitz
-    except ImportError:
-        raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
-
-    doc = fitz.open(file_path)
-
-    output_imgs = []
-    for page_number in pages:
-        page = doc.load_page(page_number)
-        pm = page.get_pixmap(dpi=dpi)
-        img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
-        print("inside pdf loader called")
-        # Generate a unique file hash using UUID
-        file_hash = str(uuid.uuid4())
-        # Save image to a temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-        temp_file_path = temp_file.name
-        temp_file.close()
-        img.save(temp_file_path, format="PNG")
-
-        #upload file
-        from libs.ktem.ktem.storage.s3_storage import S3Storage
-        s3_obj = S3Storage(prefix='thumbnails')
-        file_url = s3_obj.upload_file(temp_file_path, file_hash)
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
-        output_imgs.append(file_url)
-
-    return output_imgs
+    return get_thumbnailer(dpi).thumbnails(file_path, pages)
 
 
 def convert_image_to_base64(img: Image.Image) -> str:
@@ -83,52 +52,75 @@ class PDFThumbnailReader(PDFReader):
         """
         super().__init__(return_full_document=False)
 
-    def load_data(
+    def iter_data(
         self,
         file: Path,
         extra_info: Optional[Dict] = None,
         fs: Optional[AbstractFileSystem] = None,
-    ) -> List[Document]:
-        """Parse file."""
-        documents = super().load_data(file, extra_info, fs)
-
-        page_numbers_str = []
-        filtered_docs = []
-        is_int_page_number: dict[str, bool] = {}
+    ) -> Iterator[Document]:
+        """Parse the file page by page
 
-        for doc in documents:
-            if "page_label" in doc.metadata:
-                page_num_str = doc.metadata["page_label"]
-                page_numbers_str.append(page_num_str)
+        Each page yields its thumbnail then its text, so a consumer can index the
+        pages as they come without holding the whole file in memory. Pages
+        without an integer label are skipped.
+        """
+        if not isinstance(file, Path):
+            file = Path(file)
+
+        try:
+            import pypdf
+        except ImportError:
+            raise ImportError(
+                "pypdf is required to read PDF files: `pip install pypdf`"
+            )
+
+        extra_info = extra_info or {}
+        fs = fs or get_default_fs()
+        with fs.open(str(file), "rb") as fp:
+            # pypdf seeks in the file, a remote file is read by ranges
+            pdf = pypdf.PdfReader(fp)
+            pages = []
+            for page_number, page_label in enumerate(pdf.page_labels):
                 try:
-                    _ = int(page_num_str)
-                    is_int_page_number[page_num_str] = True
-                    filtered_docs.append(doc)
+                    _ = int(page_label)
+                    pages.append(page_number)
                 except ValueError:
-                    is_int_page_number[page_num_str] = False
                     continue
 
-        documents = filtered_docs
-        page_numbers = list(range(len(page_numbers_str)))
-
-        page_thumbnails = get_page_thumbnails(file, page_numbers)
-
-        documents.extend(
-            [
-                Document(
+            # the thumbnails are rendered and uploaded a few pages ahead, from a
+            # local copy of a remote file
+            thumbnails = get_thumbnailer(PDF_LOADER_DPI).iter_thumbnails(
+                file, pages, fs=None if is_default_fs(fs) else fs
+            )
+            for page_number, page_thumbnail in thumbnails:
+                page_label = pdf.page_labels[page_number]
+                yield Document(
                     text="Page thumbnail",
                     metadata={
                         "image_origin": page_thumbnail,
                         "type": "thumbnail",
-                        "page_label": page_number,
-                        **(extra_info if extra_info is not None else {}),
+                        "page_label": page_label,
+                        **extra_info,
                     },
                 )
-                for (page_thumbnail, page_number) in zip(
-                    page_thumbnails, page_numbers_str
+                yield Document(
+                    text=pdf.pages[page_number].extract_text(),
+                    metadata={
+                        "page_label": page_label,
+                        "file_name": file.name,
+                        **extra_info,
+                    },
                 )
-                if is_int_page_number[page_number]
-            ]
-        )
 
-        return documents
+    def load_data(
+        self,
+        file: Path,
+        extra_info: Optional[Dict] = None,
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> List[Document]:
+        """Parse file."""
+        documents = list(self.iter_data(file, extra_info, fs))
+        # keep the text pages first, followed by their thumbnails
+        return [doc for doc in documents if doc.metadata.get("type") != "thumbnail"] + [
+            doc for doc in documents if doc.metadata.get("type") == "thumbnail"
+        ]
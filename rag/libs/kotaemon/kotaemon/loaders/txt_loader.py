@@ -1,6 +1,8 @@
 from pathlib import Path
 from typing import Optional
 
+from fsspec import AbstractFileSystem
+
 from kotaemon.base import Document
 
 from .base import BaseReader
@@ -13,10 +15,18 @@ class TxtReader(BaseReader):
         return self.load_data(Path(file_path), extra_info=extra_info, **kwargs)
 
     def load_data(
-        self, file_path: Path, extra_info: Optional[dict] = None, **kwargs
+        self,
+        file_path: Path,
+        extra_info: Optional[dict] = None,
+        fs: Optional[AbstractFileSystem] = None,
+        **kwargs,
     ) -> list[Document]:
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
+        if fs is None:
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        else:
+            with fs.open(str(file_path), "rb") as f:
+                text = f.read().decode("utf-8")
 
         metadata = extra_info or {}
         return [Document(text=text, metadata=metadata)]
@@ -0,0 +1,379 @@
+"""Render, encode and upload the page thumbnails of PDF files"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Iterator, Optional, Protocol
+
+from decouple import config
+from fsspec import AbstractFileSystem
+from fsspec.implementations.local import LocalFileSystem
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# PIL format and MIME type of the supported thumbnail encodings
+IMAGE_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+PDF_THUMBNAIL_FORMAT = config("PDF_THUMBNAIL_FORMAT", default="webp")
+PDF_THUMBNAIL_MAX_SIZE = config("PDF_THUMBNAIL_MAX_SIZE", default=1024, cast=int)
+PDF_THUMBNAIL_QUALITY = config("PDF_THUMBNAIL_QUALITY", default=80, cast=int)
+PDF_THUMBNAIL_RENDER_WORKERS = config(
+    "PDF_THUMBNAIL_RENDER_WORKERS", default=min(os.cpu_count() or 1, 4), cast=int
+)
+PDF_THUMBNAIL_UPLOAD_WORKERS = config(
+    "PDF_THUMBNAIL_UPLOAD_WORKERS", default=8, cast=int
+)
+# rendering processes of each parse worker of the concurrent ingestion, which
+# already runs one parse per CPU
+PDF_THUMBNAIL_PARSE_WORKER_RENDER_WORKERS = config(
+    "PDF_THUMBNAIL_PARSE_WORKER_RENDER_WORKERS", default=2, cast=int
+)
+
+# set by `ConcurrentIngestion` in its parse worker processes
+PARSE_WORKER_ENV = "KH_INGESTION_PARSE_WORKER"
+# size of the reads copying a PDF file to the local disk
+SPILL_CHUNK_SIZE = 1 << 20
+
+
+def in_parse_worker() -> bool:
+    """Whether this process is a parse worker of the concurrent ingestion"""
+    return bool(os.environ.get(PARSE_WORKER_ENV))
+
+
+class ThumbnailStore(Protocol):
+    """Where the thumbnails are uploaded, e.g. `ktem.storage.s3_storage.S3Storage`"""
+
+    def get_key(self, file_hash: str, file_extension: str = "") -> str: ...
+
+    def exists(self, key: str) -> bool: ...
+
+    def upload_bytes(
+        self, data: bytes, file_hash: str, file_extension: str, mime_type: str
+    ) -> str: ...
+
+
+def _open_pdf(file_path: str | Path):
+    try:
+        import fitz
+    except ImportError:
+        raise ImportError("Please install PyMuPDF: 'pip install PyMuPDF'")
+
+    return fitz.open(file_path)
+
+
+@contextmanager
+def _local_pdf(
+    file_path: str | Path | bytes, fs: Optional[AbstractFileSystem] = None
+) -> Iterator[str | Path]:
+    """The path of the PDF file on the local disk, that the render processes open
+
+    The files given as bytes or stored on a remote file system are copied to a
+    temporary file, removed on exit.
+    """
+    if not isinstance(file_path, bytes) and (
+        fs is None or isinstance(fs, LocalFileSystem)
+    ):
+        yield file_path
+        return
+
+    fd, local_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as fo:
+            if isinstance(file_path, bytes):
+                fo.write(file_path)
+            else:
+                with fs.open(str(file_path), "rb") as fi:  # type: ignore
+                    shutil.copyfileobj(fi, fo, SPILL_CHUNK_SIZE)
+        yield local_path
+    finally:
+        Path(local_path).unlink(missing_ok=True)
+
+
+def page_content_hash(doc, page_number: int, salt: str = "") -> str:
+    """Hash what a page renders from: its size, content stream, fonts, images and
+    form XObjects, without rendering it
+
+    Args:
+        doc: the opened `fitz.Document`
+        page_number: the 0-based page index
+        salt: extra data to hash, e.g. the render settings
+    """
+    page = doc.load_page(page_number)
+    digest = hashlib.sha256(salt.encode("utf-8"))
+    digest.update(repr(tuple(page.rect)).encode("utf-8"))
+    digest.update(page.read_contents())
+    # subset fonts have a random name prefix, which keeps them apart
+    for _, ext, font_type, basefont, _, encoding in page.get_fonts():
+        digest.update(f"{ext}:{font_type}:{basefont}:{encoding}".encode("utf-8"))
+    for xref in [image[0] for image in page.get_images()] + [
+        xobject[0] for xobject in page.get_xobjects()
+    ]:
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    return digest.hexdigest()
+
+
+def render_pages(
+    file_path: str | Path,
+    page_numbers: list[int],
+    dpi: int,
+    image_format: str,
+    max_size: int,
+    quality: int,
+) -> list[bytes]:
+    """Render and encode pages of a PDF file, picklable entry point of the
+    render workers
+
+    The pages are rendered at `dpi`, or lower so that the longest side fits in
+    `max_size` pixels, which is cheaper than rendering then downscaling.
+    """
+    import fitz
+
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    doc = _open_pdf(file_path)
+    output = []
+    for page_number in page_numbers:
+        page = doc.load_page(page_number)
+        zoom = dpi / 72
+        if max_size:
+            zoom = min(zoom, max_size / max(page.rect.width, page.rect.height))
+        pm = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        img = Image.frombytes("RGB", [pm.width, pm.height], pm.samples)
+
+        img_bytes = BytesIO()
+        if pil_format == "PNG":
+            img.save(img_bytes, format=pil_format)
+        else:
+            img.save(img_bytes, format=pil_format, quality=quality)
+        output.append(img_bytes.getvalue())
+    return output
+
+
+class PageThumbnailer:
+    """Create the page thumbnails of PDF files, concurrently and incrementally
+
+    Thumbnails are keyed by a hash of the page content and the render settings,
+    so pages already uploaded (e.g. a re-indexed file, a page shared between
+    files) are neither rendered nor uploaded again. The missing pages are
+    rendered by batches in a process pool and uploaded concurrently through the
+    store, a bounded number of pages ahead of the consumer.
+
+    Args:
+        dpi: maximum render resolution
+        image_format: "webp", "jpeg" or "png"
+        max_size: maximum width and height in pixels, 0 for no limit
+        quality: encoder quality of webp and jpeg
+        render_workers: number of rendering processes, 0 to render in the
+            calling thread
+        parse_worker_render_workers: maximum number of rendering processes
+            inside each parse worker of the concurrent ingestion
+        upload_workers: number of batches checked, rendered and uploaded at once
+        pages_per_task: number of pages rendered by a process per task
+        store: the storage of the thumbnails, default to the S3 `thumbnails`
+            prefix
+        max_known_keys: number of existing thumbnail keys remembered to skip
+            the existence checks
+    """
+
+    def __init__(
+        self,
+        dpi: int = 120,
+        image_format: str = PDF_THUMBNAIL_FORMAT,
+        max_size: int = PDF_THUMBNAIL_MAX_SIZE,
+        quality: int = PDF_THUMBNAIL_QUALITY,
+        render_workers: int = PDF_THUMBNAIL_RENDER_WORKERS,
+        parse_worker_render_workers: int = PDF_THUMBNAIL_PARSE_WORKER_RENDER_WORKERS,
+        upload_workers: int = PDF_THUMBNAIL_UPLOAD_WORKERS,
+        pages_per_task: int = 4,
+        store: Optional[ThumbnailStore] = None,
+        max_known_keys: int = 100000,
+    ):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(
+                f"Unsupported thumbnail format {image_format}, "
+                f"choose from {list(IMAGE_FORMATS)}"
+            )
+        self.dpi = dpi
+        self.image_format = image_format
+        self.max_size = max_size
+        self.quality = quality
+        self.render_workers = render_workers
+        self.parse_worker_render_workers = parse_worker_render_workers
+        self.upload_workers = max(upload_workers, 1)
+        self.pages_per_task = max(pages_per_task, 1)
+        self.max_known_keys = max_known_keys
+        self._store = store
+
+        self._known: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+        self._render_pool: Optional[ProcessPoolExecutor] = None
+        self._upload_pool = ThreadPoolExecutor(
+            max_workers=self.upload_workers, thread_name_prefix="thumbnail"
+        )
+
+    @property
+    def store(self) -> ThumbnailStore:
+        if self._store is None:
+            from libs.ktem.ktem.storage.s3_storage import S3Storage
+
+            self._store = S3Storage(prefix="thumbnails")
+        return self._store
+
+    @property
+    def render_settings(self) -> str:
+        return f"{self.dpi}:{self.image_format}:{self.max_size}:{self.quality}"
+
+    @property
+    def file_extension(self) -> str:
+        return ".jpg" if self.image_format == "jpeg" else f".{self.image_format}"
+
+    @property
+    def max_render_workers(self) -> int:
+        """Number of rendering processes in this process"""
+        if in_parse_worker():
+            return min(self.render_workers, self.parse_worker_render_workers)
+        return self.render_workers
+
+    @property
+    def render_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._render_pool is None:
+                self._render_pool = ProcessPoolExecutor(
+                    max_workers=self.max_render_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._render_pool
+
+    def _exists(self, key: str) -> bool:
+        with self._lock:
+            if key in self._known:
+                self._known.move_to_end(key)
+                return True
+        if not self.store.exists(key):
+            return False
+        self._remember(key)
+        return True
+
+    def _remember(self, key: str):
+        with self._lock:
+            self._known[key] = None
+            self._known.move_to_end(key)
+            while len(self._known) > self.max_known_keys:
+                self._known.popitem(last=False)
+
+    def _render(self, file_path: str | Path, page_numbers: list[int]) -> list[bytes]:
+        args = (
+            file_path,
+            page_numbers,
+            self.dpi,
+            self.image_format,
+            self.max_size,
+            self.quality,
+        )
+        if self.max_render_workers <= 0:
+            return render_pages(*args)
+        try:
+            return self.render_pool.submit(render_pages, *args).result()
+        except BrokenProcessPool:
+            logger.exception("Thumbnail process pool is broken, restarting it")
+            with self._lock:
+                self._render_pool = None
+            return render_pages(*args)
+
+    def _process_batch(
+        self, file_path: str | Path, page_numbers: list[int], hashes: list[str]
+    ) -> list[str]:
+        keys = [self.store.get_key(h, self.file_extension) for h in hashes]
+        missing = [i for i, key in enumerate(keys) if not self._exists(key)]
+        if not missing:
+            return keys
+
+        images = self._render(file_path, [page_numbers[i] for i in missing])
+        _, mime_type = IMAGE_FORMATS[self.image_format]
+        for i, data in zip(missing, images):
+            keys[i] = self.store.upload_bytes(
+                data, hashes[i], self.file_extension, mime_type
+            )
+            self._remember(keys[i])
+        return keys
+
+    def iter_thumbnails(
+        self,
+        file_path: str | Path | bytes,
+        pages: list[int],
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> Iterator[tuple[int, str]]:
+        """Yield the page number and the thumbnail key of each page, in order
+
+        The file is given by its path, on `fs` if given, or by its content. A
+        file that is not on the local disk is copied to a temporary file, which
+        the render processes open. At most `upload_workers` batches of
+        `pages_per_task` pages are processed ahead of the consumer.
+        """
+        with _local_pdf(file_path, fs) as local_path:
+            doc = _open_pdf(local_path)
+            settings = self.render_settings
+            pending: deque[tuple[list[int], Future]] = deque()
+            try:
+                for start in range(0, len(pages), self.pages_per_task):
+                    batch = pages[start : start + self.pages_per_task]
+                    hashes = [page_content_hash(doc, n, settings) for n in batch]
+                    pending.append(
+                        (
+                            batch,
+                            self._upload_pool.submit(
+                                self._process_batch, local_path, batch, hashes
+                            ),
+                        )
+                    )
+                    while len(pending) > self.upload_workers:
+                        batch, future = pending.popleft()
+                        yield from zip(batch, future.result())
+
+                while pending:
+                    batch, future = pending.popleft()
+                    yield from zip(batch, future.result())
+            finally:
+                # the batches still running read the file
+                for _, future in pending:
+                    future.cancel()
+                wait_futures([future for _, future in pending])
+                doc.close()
+
+    def thumbnails(
+        self,
+        file_path: str | Path | bytes,
+        pages: list[int],
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> list[str]:
+        """Get the thumbnail keys of the pages"""
+        return [key for _, key in self.iter_thumbnails(file_path, pages, fs)]
+
+    def shutdown(self):
+        self._upload_pool.shutdown(wait=True)
+        with self._lock:
+            if self._render_pool is not None:
+                self._render_pool.shutdown(wait=True)
+                self._render_pool = None
+
+
+@lru_cache
+def get_thumbnailer(dpi: int = 120) -> PageThumbnailer:
+    """The thumbnailer shared by the loaders of this process"""
+    return PageThumbnailer(dpi=dpi)
@@ -1,5 +1,15 @@
 from .base import BaseReranking
+from .cache import BaseScoreCache, InMemoryScoreCache, RedisScoreCache
 from .cohere import CohereReranking
+from .onnx_cross_encoder import OnnxCrossEncoderReranking
 from .tei_fast_rerank import TeiFastReranking
 
-__all__ = ["BaseReranking", "TeiFastReranking", "CohereReranking"]
+__all__ = [
+    "BaseReranking",
+    "TeiFastReranking",
+    "CohereReranking",
+    "OnnxCrossEncoderReranking",
+    "BaseScoreCache",
+    "InMemoryScoreCache",
+    "RedisScoreCache",
+]
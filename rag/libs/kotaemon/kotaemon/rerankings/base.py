@@ -1,13 +1,31 @@
 from __future__ import annotations
 
 from abc import abstractmethod
+from typing import Optional
 
 from kotaemon.base import BaseComponent, Document
 
+from .cache import BaseScoreCache, get_score_cache
+
 
 class BaseReranking(BaseComponent):
+    """Re-rank or filter the documents by their relevance to the query
+
+    Attributes:
+        score_cache: the cache of the relevance scores, default to the cache
+            of the process set by `KH_RELEVANCE_SCORE_CACHE`
+    """
+
+    score_cache: Optional[BaseScoreCache] = None
+
     @abstractmethod
     def run(self, documents: list[Document], query: str) -> list[Document]:
         """Main method to transform list of documents
         (re-ranking, filtering, etc)"""
         ...
+
+    def get_score_cache(self) -> Optional[BaseScoreCache]:
+        """The cache of the relevance scores, None if the scores are not cached"""
+        if self.score_cache is not None:
+            return self.score_cache
+        return get_score_cache()
@@ -0,0 +1,356 @@
+"""Cache of the relevance scores of the (query, chunk) pairs
+
+The rerankers and the LLM scorers grade the same chunks against the same query
+again on regenerate, on follow-up questions rewritten to the same search query,
+and across the users asking the same question of a shared collection. The scores
+are cached by (scorer, normalized query, chunk), where the chunk is keyed by its
+id and the hash of its content, so that a chunk re-indexed with a new content
+never gets the score of the old one.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Iterable, Literal, Optional
+
+from theflow.settings import settings as flowsettings
+
+from kotaemon.base import Document
+from kotaemon.embeddings.cache import normalize_text
+
+
+def query_hash(query: str) -> str:
+    """Hash the query, ignoring the unicode forms, the whitespaces and the case"""
+    return hashlib.sha256(normalize_text(query).casefold().encode("utf-8")).hexdigest()
+
+
+def chunk_key(doc: Document, key_by: Literal["id", "content"] = "id") -> str:
+    """Key of the chunk in the cache
+
+    Args:
+        doc: the chunk
+        key_by: "id" to key by the chunk id and content hash, the scores can
+            then be invalidated by chunk id; "content" to key by the content
+            hash only, the scores are then shared by the identical chunks
+    """
+    content = doc.get_content()
+    if not isinstance(content, str):
+        content = str(content)
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+    if key_by == "content":
+        return f":{content_hash}"
+    return f"{doc.doc_id}:{content_hash}"
+
+
+def scorer_id(scorer: Any, *params: Any) -> str:
+    """Identify a scorer by its class and the params that change its scores,
+    e.g. the model name"""
+    cls = type(scorer)
+    content = json.dumps(
+        {"scorer": f"{cls.__module__}.{cls.__qualname__}", "params": params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+def cached_scores(
+    cache: Optional["BaseScoreCache"],
+    scorer: str,
+    query: str,
+    documents: list[Document],
+    compute: Callable[[list[Document]], list[Any]],
+) -> list[Any]:
+    """Get the scores of the documents, only the scores missing from the cache
+    are computed, with `compute(documents)`
+
+    Args:
+        cache: the score cache, None to compute all the scores
+        scorer: the scorer id, see `scorer_id`
+        query: the query
+        documents: the documents to score
+        compute: function returning the scores of the given documents, in order
+    """
+    if cache is None or not documents:
+        return compute(documents)
+
+    keys, cached = cache.lookup(scorer, query, documents)
+    missing = [idx for idx, key in enumerate(keys) if key not in cached]
+    if missing:
+        computed = compute([documents[idx] for idx in missing])
+        new_scores = {keys[idx]: score for idx, score in zip(missing, computed)}
+        cache.store(scorer, query, new_scores)
+        cached = {**cached, **new_scores}
+    return [cached[key] for key in keys]
+
+
+class BaseScoreCache(ABC):
+    """Cache of the relevance scores by (scorer, query, chunk) with hit/miss
+    counters
+
+    Args:
+        ttl: seconds before a score expires, None to never expire
+        key_by: how the chunks are keyed, see `chunk_key`
+    """
+
+    def __init__(
+        self, ttl: Optional[float] = None, key_by: Literal["id", "content"] = "id"
+    ):
+        self.ttl = ttl
+        self.key_by = key_by
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def get_many(self, scorer: str, query: str, chunks: list[str]) -> dict[str, Any]:
+        """Get the cached scores of the chunks for the query, missing chunks are
+        omitted"""
+        ...
+
+    @abstractmethod
+    def set_many(self, scorer: str, query: str, scores: dict[str, Any]):
+        """Store the scores of the chunks for the query"""
+        ...
+
+    @abstractmethod
+    def invalidate(self, chunk_ids: Iterable[str]) -> int:
+        """Remove the scores of the chunks, e.g. when they are deleted or
+        re-indexed, return the number of removed scores"""
+        ...
+
+    @abstractmethod
+    def clear(self):
+        """Remove all cached scores"""
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+    def lookup(
+        self, scorer: str, query: str, documents: list[Document]
+    ) -> tuple[list[str], dict[str, Any]]:
+        """Get the chunk keys of the documents and their cached scores"""
+        keys = [chunk_key(doc, self.key_by) for doc in documents]
+        return keys, self.get_many(scorer, query_hash(query), keys)
+
+    def store(self, scorer: str, query: str, scores: dict[str, Any]):
+        """Store the scores by the chunk keys returned by `lookup`"""
+        if scores:
+            self.set_many(scorer, query_hash(query), scores)
+
+    def _count(self, requested: int, found: int):
+        self.hits += found
+        self.misses += requested - found
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self),
+        }
+
+
+class InMemoryScoreCache(BaseScoreCache):
+    """LRU score cache kept in process memory
+
+    Args:
+        max_size: maximum number of scores to keep
+        ttl: seconds before a score expires, None to never expire
+        key_by: how the chunks are keyed, see `chunk_key`
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100000,
+        ttl: Optional[float] = 86400.0,
+        key_by: Literal["id", "content"] = "id",
+    ):
+        super().__init__(ttl=ttl, key_by=key_by)
+        self.max_size = max_size
+        self._store: OrderedDict[tuple[str, str, str], tuple[float, Any]] = (
+            OrderedDict()
+        )
+        # keys of the scores by chunk id, for the invalidation
+        self._chunks: dict[str, set[tuple[str, str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def _remove(self, key: tuple[str, str, str]):
+        del self._store[key]
+        chunk_id = key[2].rsplit(":", 1)[0]
+        keys = self._chunks.get(chunk_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._chunks[chunk_id]
+
+    def get_many(self, scorer: str, query: str, chunks: list[str]) -> dict[str, Any]:
+        now = time.time()
+        output: dict[str, Any] = {}
+        with self._lock:
+            for chunk in chunks:
+                key = (scorer, query, chunk)
+                item = self._store.get(key)
+                if item is None:
+                    continue
+                created, score = item
+                if self.ttl is not None and now - created > self.ttl:
+                    self._remove(key)
+                    continue
+                self._store.move_to_end(key)
+                output[chunk] = score
+            self._count(len(chunks), len(output))
+        return output
+
+    def set_many(self, scorer: str, query: str, scores: dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            for chunk, score in scores.items():
+                key = (scorer, query, chunk)
+                self._store[key] = (now, score)
+                self._store.move_to_end(key)
+                chunk_id = chunk.rsplit(":", 1)[0]
+                if chunk_id:
+                    self._chunks.setdefault(chunk_id, set()).add(key)
+            while len(self._store) > self.max_size:
+                self._remove(next(iter(self._store)))
+
+    def invalidate(self, chunk_ids: Iterable[str]) -> int:
+        removed = 0
+        with self._lock:
+            for chunk_id in chunk_ids:
+                for key in list(self._chunks.get(chunk_id, ())):
+                    self._remove(key)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+            self._chunks.clear()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __persist_flow__(self):
+        return {"max_size": self.max_size, "ttl": self.ttl, "key_by": self.key_by}
+
+
+class RedisScoreCache(BaseScoreCache):
+    """Score cache shared by the processes through Redis
+
+    Every score expires after `ttl`, and the least recently used scores are
+    evicted by Redis under its `maxmemory` limit when the server runs with an
+    LRU `maxmemory-policy` (e.g. `allkeys-lru`).
+
+    Args:
+        url: the Redis URL, e.g. "redis://localhost:6379/0"
+        ttl: seconds before a score expires
+        key_by: how the chunks are keyed, see `chunk_key`
+        prefix: prefix of the Redis keys
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        ttl: Optional[float] = 86400.0,
+        key_by: Literal["id", "content"] = "id",
+        prefix: str = "kh:score:",
+    ):
+        super().__init__(ttl=ttl, key_by=key_by)
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("Please install redis: 'pip install redis'")
+
+        from kotaemon.storages.clients import get_shared_client
+
+        self.url = url
+        self.prefix = prefix
+        self._client = get_shared_client("redis", url, redis.Redis.from_url)
+
+    def _key(self, scorer: str, query: str, chunk: str) -> str:
+        return f"{self.prefix}{scorer}:{query}:{chunk}"
+
+    def _chunk_index(self, chunk_id: str) -> str:
+        return f"{self.prefix}chunk:{chunk_id}"
+
+    @property
+    def _expire(self) -> Optional[int]:
+        return int(self.ttl) if self.ttl is not None else None
+
+    def get_many(self, scorer: str, query: str, chunks: list[str]) -> dict[str, Any]:
+        if not chunks:
+            return {}
+        values = self._client.mget([self._key(scorer, query, c) for c in chunks])
+        output = {
+            chunk: json.loads(value)
+            for chunk, value in zip(chunks, values)
+            if value is not None
+        }
+        self._count(len(chunks), len(output))
+        return output
+
+    def set_many(self, scorer: str, query: str, scores: dict[str, Any]):
+        pipe = self._client.pipeline(transaction=False)
+        for chunk, score in scores.items():
+            key = self._key(scorer, query, chunk)
+            pipe.set(key, json.dumps(score), ex=self._expire)
+            chunk_id = chunk.rsplit(":", 1)[0]
+            if chunk_id:
+                pipe.sadd(self._chunk_index(chunk_id), key)
+                if self._expire is not None:
+                    pipe.expire(self._chunk_index(chunk_id), self._expire)
+        pipe.execute()
+
+    def invalidate(self, chunk_ids: Iterable[str]) -> int:
+        indices = [self._chunk_index(chunk_id) for chunk_id in chunk_ids]
+        if not indices:
+            return 0
+        pipe = self._client.pipeline(transaction=False)
+        for index in indices:
+            pipe.smembers(index)
+        keys = [key for members in pipe.execute() for key in members]
+        removed = self._client.delete(*keys) if keys else 0
+        self._client.delete(*indices)
+        return removed
+
+    def clear(self):
+        keys = list(self._client.scan_iter(match=f"{self.prefix}*", count=1000))
+        for i in range(0, len(keys), 1000):
+            self._client.delete(*keys[i : i + 1000])
+
+    def __len__(self) -> int:
+        index_prefix = self._chunk_index("").encode("utf-8")
+        return sum(
+            1
+            for key in self._client.scan_iter(match=f"{self.prefix}*", count=1000)
+            if not key.startswith(index_prefix)
+        )
+
+    def __persist_flow__(self):
+        return {
+            "url": self.url,
+            "ttl": self.ttl,
+            "key_by": self.key_by,
+            "prefix": self.prefix,
+        }
+
+
+@lru_cache
+def get_score_cache() -> Optional[BaseScoreCache]:
+    """The score cache of the process, from `KH_RELEVANCE_SCORE_CACHE`, None if
+    the scores are not cached"""
+    spec = getattr(flowsettings, "KH_RELEVANCE_SCORE_CACHE", None)
+    if not spec:
+        return None
+    from theflow.utils.modules import deserialize
+
+    return deserialize(spec, safe=False)
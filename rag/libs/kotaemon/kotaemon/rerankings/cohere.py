@@ -5,6 +5,7 @@ from decouple import config
 from kotaemon.base import Document, Param
 
 from .base import BaseReranking
+from .cache import cached_scores, scorer_id
 
 
 class CohereReranking(BaseReranking):
@@ -38,19 +39,29 @@ class CohereReranking(BaseReranking):
             print("Cohere API key not found. Skipping rerankings.")
             return documents
 
-        cohere_client = cohere.Client(self.cohere_api_key)
-        compressed_docs: list[Document] = []
-
         if not documents:  # to avoid empty api call
-            return compressed_docs
+            return []
+
+        def score_documents(docs: list[Document]) -> list[float]:
+            cohere_client = cohere.Client(self.cohere_api_key)
+            response = cohere_client.rerank(
+                model=self.model_name, query=query, documents=[d.content for d in docs]
+            )
+            scores = [0.0] * len(docs)
+            for r in response.results:
+                scores[r.index] = r.relevance_score
+            return scores
 
-        _docs = [d.content for d in documents]
-        response = cohere_client.rerank(
-            model=self.model_name, query=query, documents=_docs
+        scores = cached_scores(
+            self.get_score_cache(),
+            scorer_id(self, self.model_name),
+            query,
+            documents,
+            score_documents,
         )
-        for r in response.results:
-            doc = documents[r.index]
-            doc.metadata["reranking_score"] = r.relevance_score
-            compressed_docs.append(doc)
+        for doc, score in zip(documents, scores):
+            doc.metadata["reranking_score"] = score
 
-        return compressed_docs
+        return sorted(
+            documents, key=lambda x: x.metadata["reranking_score"], reverse=True
+        )
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from kotaemon.base import Document, Param
+
+from .base import BaseReranking
+from .cache import cached_scores, scorer_id
+
+if TYPE_CHECKING:
+    from onnxruntime import InferenceSession
+    from tokenizers import Tokenizer
+
+
+def length_batches(
+    lengths: list[int], batch_size: int, max_batch_tokens: int
+) -> list[list[int]]:
+    """Group the inputs of similar lengths into batches
+
+    The inputs are sorted by length so that each batch is padded to the length
+    of its longest input with little waste. A batch holds at most `batch_size`
+    inputs and `max_batch_tokens` tokens once padded.
+
+    Args:
+        lengths: the number of tokens of each input
+        batch_size: maximum number of inputs per batch
+        max_batch_tokens: maximum number of padded tokens per batch
+
+    Returns:
+        list of batches of input indices
+    """
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        # sorted by length, the new input is the longest of the batch
+        if batch and (
+            len(batch) >= batch_size
+            or (len(batch) + 1) * lengths[idx] > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class OnnxCrossEncoderReranking(BaseReranking):
+    """Cross-encoder reranking model running locally on CPU with ONNX runtime
+
+    The model is an ONNX export (optionally quantized) of a cross-encoder, e.g.
+    from https://huggingface.co/Xenova, with its `tokenizer.json`. It is loaded
+    from `model_path`, or downloaded from the Hugging Face Hub on first use.
+    """
+
+    model_name: str = Param(
+        "Xenova/ms-marco-MiniLM-L-6-v2",
+        help=(
+            "Hugging Face Hub repository of the ONNX cross-encoder model and its "
+            "`tokenizer.json`"
+        ),
+        required=True,
+    )
+    model_file: str = Param(
+        "onnx/model_quantized.onnx",
+        help="Path of the ONNX model file in the repository or in `model_path`",
+    )
+    model_path: Optional[str] = Param(
+        None,
+        help=(
+            "Local directory of the model and its tokenizer, to run without "
+            "network access. If None, the model is downloaded from `model_name`"
+        ),
+    )
+    cache_dir: Optional[str] = Param(
+        None, help="Directory of the downloaded models, default to the HF cache"
+    )
+    max_length: int = Param(
+        512,
+        help=(
+            "Maximum number of tokens of a (query, document) pair, the longest of "
+            "the two is truncated first"
+        ),
+    )
+    batch_size: int = Param(32, help="Maximum number of documents per batch")
+    max_batch_tokens: int = Param(
+        8192,
+        help=(
+            "Maximum number of padded tokens per batch, the documents are batched "
+            "by similar lengths"
+        ),
+    )
+    threads: Optional[int] = Param(
+        None,
+        help=(
+            "Number of CPU threads of the model. If None, use default onnxruntime "
+            "threading"
+        ),
+    )
+
+    def _model_dir(self) -> Path:
+        if self.model_path:
+            return Path(self.model_path)
+
+        try:
+            from huggingface_hub import snapshot_download
+        except ImportError:
+            raise ImportError(
+                "Please install huggingface_hub: `pip install huggingface_hub`, "
+                "or set `model_path` to a local model directory"
+            )
+
+        return Path(
+            snapshot_download(
+                self.model_name,
+                cache_dir=self.cache_dir,
+                allow_patterns=[self.model_file, "*.json"],
+            )
+        )
+
+    @Param.auto(
+        depends_on=["model_name", "model_file", "model_path", "cache_dir", "threads"]
+    )
+    def session_(self) -> "InferenceSession":
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("Please install onnxruntime: `pip install onnxruntime`")
+
+        options = ort.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+        return ort.InferenceSession(
+            str(self._model_dir() / self.model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    @Param.auto(depends_on=["model_name", "model_path", "cache_dir", "max_length"])
+    def tokenizer_(self) -> "Tokenizer":
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("Please install tokenizers: `pip install tokenizers`")
+
+        tokenizer = Tokenizer.from_file(str(self._model_dir() / "tokenizer.json"))
+        tokenizer.no_padding()
+        tokenizer.enable_truncation(
+            max_length=self.max_length, strategy="longest_first"
+        )
+        return tokenizer
+
+    def score_documents(self, documents: list[Document], query: str) -> list[float]:
+        """Get the relevance scores of the documents, from 0 to 1"""
+        encodings = self.tokenizer_.encode_batch(
+            [(query, doc.get_content()) for doc in documents]
+        )
+        session = self.session_
+        input_names = {node.name for node in session.get_inputs()}
+
+        scores = np.zeros(len(documents), dtype=np.float32)
+        for batch in length_batches(
+            [len(encoding.ids) for encoding in encodings],
+            self.batch_size,
+            self.max_batch_tokens,
+        ):
+            length = max(len(encodings[idx].ids) for idx in batch)
+            inputs = {
+                name: np.zeros((len(batch), length), dtype=np.int64)
+                for name in ("input_ids", "attention_mask", "token_type_ids")
+            }
+            for row, idx in enumerate(batch):
+                encoding = encodings[idx]
+                n_tokens = len(encoding.ids)
+                inputs["input_ids"][row, :n_tokens] = encoding.ids
+                inputs["attention_mask"][row, :n_tokens] = encoding.attention_mask
+                inputs["token_type_ids"][row, :n_tokens] = encoding.type_ids
+
+            logits = session.run(
+                None,
+                {key: value for key, value in inputs.items() if key in input_names},
+            )[0]
+            if logits.ndim > 1:
+                # the last column is the relevant class of 2-class models
+                logits = logits[:, -1]
+            scores[batch] = 1 / (1 + np.exp(-logits))
+
+        return scores.tolist()
+
+    def run(self, documents: list[Document], query: str) -> list[Document]:
+        """Re-order the documents by their relevance score to the query"""
+        if not documents:
+            return []
+
+        scores = cached_scores(
+            self.get_score_cache(),
+            scorer_id(
+                self,
+                self.model_path or self.model_name,
+                self.model_file,
+                self.max_length,
+            ),
+            query,
+            documents,
+            lambda docs: self.score_documents(docs, query),
+        )
+        for doc, score in zip(documents, scores):
+            doc.metadata["reranking_score"] = score
+
+        return sorted(
+            documents, key=lambda x: x.metadata["reranking_score"], reverse=True
+        )
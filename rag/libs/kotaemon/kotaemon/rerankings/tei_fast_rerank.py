@@ -7,6 +7,7 @@ import requests
 from kotaemon.base import Document, Param
 
 from .base import BaseReranking
+from .cache import cached_scores, scorer_id
 
 session = requests.session()
 
@@ -40,18 +41,30 @@ class TeiFastReranking(BaseReranking):
     def client(self, query, texts):
         if self.is_truncated:
             max_tokens = self.max_tokens  # default is 512 tokens.
-            truncated_texts = [text[:max_tokens] for text in texts]
+            texts = [text[:max_tokens] for text in texts]
 
         response = session.post(
             url=self.endpoint_url,
             json={
                 "query": query,
-                "texts": truncated_texts,
+                "texts": texts,
                 "is_truncated": self.is_truncated,  # default is True
             },
         ).json()
         return response
 
+    def score_documents(self, documents: list[Document], query: str) -> list[float]:
+        """Get the relevance scores of the documents from the TEI service"""
+        batch_size = 6
+        scores: list[float] = [0.0] * len(documents)
+        for start in range(0, len(documents), batch_size):
+            mini_batch = documents[start : start + batch_size]
+            _docs = [d.content for d in mini_batch]
+            rerank_resp = self.client(query, _docs)
+            for r in rerank_resp:
+                scores[start + r["index"]] = r["score"]
+        return scores
+
     def run(self, documents: list[Document], query: str) -> list[Document]:
         """Use the deployed TEI rerankings service to re-order documents
         with their relevance score"""
@@ -59,30 +72,22 @@ class TeiFastReranking(BaseReranking):
             print("TEI API reranking URL not found. Skipping rerankings.")
             return documents
 
-        compressed_docs: list[Document] = []
-
         if not documents:  # to avoid empty api call
-            return compressed_docs
+            return []
 
         if isinstance(documents[0], str):
             documents = self.prepare_input(documents)
 
-        batch_size = 6
-        num_batch = max(len(documents) // batch_size, 1)
-        for i in range(num_batch):
-            if i == num_batch - 1:
-                mini_batch = documents[batch_size * i :]
-            else:
-                mini_batch = documents[batch_size * i : batch_size * (i + 1)]
-
-            _docs = [d.content for d in mini_batch]
-            rerank_resp = self.client(query, _docs)
-            for r in rerank_resp:
-                doc = mini_batch[r["index"]]
-                doc.metadata["reranking_score"] = r["score"]
-                compressed_docs.append(doc)
+        scores = cached_scores(
+            self.get_score_cache(),
+            scorer_id(self, self.endpoint_url, self.model_name, self.max_tokens),
+            query,
+            documents,
+            lambda docs: self.score_documents(docs, query),
+        )
+        for doc, score in zip(documents, scores):
+            doc.metadata["reranking_score"] = score
 
-        compressed_docs = sorted(
-            compressed_docs, key=lambda x: x.metadata["reranking_score"], reverse=True
+        return sorted(
+            documents, key=lambda x: x.metadata["reranking_score"], reverse=True
         )
-        return compressed_docs
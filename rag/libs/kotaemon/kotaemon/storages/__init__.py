@@ -1,9 +1,11 @@
 from .docstores import (
     BaseDocumentStore,
+    BM25DocumentStore,
     ElasticsearchDocumentStore,
     InMemoryDocumentStore,
     LanceDBDocumentStore,
     SimpleFileDocumentStore,
+    SQLiteDocumentStore,
 )
 from .vectorstores import (
     BaseVectorStore,
@@ -11,6 +13,7 @@ from .vectorstores import (
     InMemoryVectorStore,
     LanceDBVectorStore,
     MilvusVectorStore,
+    NumpyVectorStore,
     QdrantVectorStore,
     SimpleFileVectorStore,
 )
@@ -22,6 +25,8 @@ __all__ = [
     "ElasticsearchDocumentStore",
     "SimpleFileDocumentStore",
     "LanceDBDocumentStore",
+    "SQLiteDocumentStore",
+    "BM25DocumentStore",
     # Vector stores
     "BaseVectorStore",
     "ChromaVectorStore",
@@ -29,5 +34,6 @@ __all__ = [
     "SimpleFileVectorStore",
     "LanceDBVectorStore",
     "MilvusVectorStore",
+    "NumpyVectorStore",
     "QdrantVectorStore",
 ]
@@ -0,0 +1,44 @@
+"""Clients of the storage backends, shared by the stores of a process
+
+The stores of the different collections of a backend (e.g. one collection per
+index) connect to the same server or database directory. They share one client,
+hence one connection pool and one set of caches, per backend, uri and options.
+"""
+
+import threading
+from typing import Any, Callable
+
+_clients: dict[tuple[str, str, str], Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_shared_client(
+    backend: str, uri: str, factory: Callable[..., Any], **kwargs
+) -> Any:
+    """Get the client of the backend for this uri, created with
+    `factory(uri, **kwargs)` on first use"""
+    key = (backend, uri, repr(sorted(kwargs.items())))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = factory(uri, **kwargs)
+        return _clients[key]
+
+
+def shared_clients_stats() -> dict[str, int]:
+    """Number of shared clients by backend"""
+    with _clients_lock:
+        stats: dict[str, int] = {}
+        for backend, _, _ in _clients:
+            stats[backend] = stats.get(backend, 0) + 1
+        return stats
+
+
+def close_shared_clients():
+    """Close the shared clients, e.g. on shutdown"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        if callable(close):
+            close()
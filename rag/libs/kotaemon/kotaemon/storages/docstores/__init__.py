@@ -1,8 +1,10 @@
 from .base import BaseDocumentStore
+from .bm25 import BM25DocumentStore
 from .elasticsearch import ElasticsearchDocumentStore
 from .in_memory import InMemoryDocumentStore
 from .lancedb import LanceDBDocumentStore
 from .simple_file import SimpleFileDocumentStore
+from .sqlite import SQLiteDocumentStore
 
 __all__ = [
     "BaseDocumentStore",
@@ -10,4 +12,6 @@ __all__ = [
     "ElasticsearchDocumentStore",
     "SimpleFileDocumentStore",
     "LanceDBDocumentStore",
+    "SQLiteDocumentStore",
+    "BM25DocumentStore",
 ]
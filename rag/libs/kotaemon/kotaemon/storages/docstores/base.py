@@ -7,6 +7,9 @@ from kotaemon.base import Document
 class BaseDocumentStore(ABC):
     """A document store is in charged of storing and managing documents"""
 
+    # whether `query` accepts `file_ids` to restrict the search to some files
+    file_scoped_query: bool = False
+
     @abstractmethod
     def __init__(self, *args, **kwargs):
         ...
@@ -57,3 +60,13 @@ class BaseDocumentStore(ABC):
     def drop(self):
         """Drop the document store"""
         ...
+
+    def refresh(self):
+        """Make the pending writes searchable, for stores that defer the update
+        of their search index"""
+        pass
+
+    def close(self):
+        """Release the memory and the connections held by the store, which is
+        not used afterwards. The clients shared with other stores stay open"""
+        pass
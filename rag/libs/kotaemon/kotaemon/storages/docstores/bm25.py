@@ -0,0 +1,601 @@
+"""Document store with an in-process BM25 index over memory-mapped postings."""
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+from theflow.utils.modules import import_dotted_string
+
+from kotaemon.base import Document
+
+from .base import BaseDocumentStore
+
+MANIFEST_FNAME = "manifest.json"
+
+_WORD_RE = re.compile(r"\w+")
+# Han, Hiragana, Katakana and Hangul characters
+_CJK_RE = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+"
+)
+
+
+def _load_array(path: Path) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # empty arrays cannot be memory-mapped
+        return np.load(path)
+
+
+def simple_tokenize(text: str) -> list[str]:
+    """Lowercase words of the text"""
+    return _WORD_RE.findall(text.lower())
+
+
+def cjk_tokenize(text: str) -> list[str]:
+    """Lowercase words, with the runs of CJK characters split into overlapping
+    bigrams since these languages don't separate words with spaces"""
+    tokens = []
+    for word in _WORD_RE.findall(text.lower()):
+        start = 0
+        for match in _CJK_RE.finditer(word):
+            if match.start() > start:
+                tokens.append(word[start : match.start()])
+            run = match.group()
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+            start = match.end()
+        if start < len(word):
+            tokens.append(word[start:])
+    return tokens
+
+
+TOKENIZERS: dict[str, Callable[[str], list[str]]] = {
+    "simple": simple_tokenize,
+    "cjk": cjk_tokenize,
+}
+
+
+class _Segment:
+    """An immutable block of documents with its postings in CSR layout, plus its
+    (mutable) tombstone mask
+
+    The postings of the i-th term are `rows[offsets[i]:offsets[i + 1]]` with the
+    term frequencies `tfs[offsets[i]:offsets[i + 1]]`, rows are local to the
+    segment.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ids: list[str],
+        docs: list[Document],
+        doc_lens: np.ndarray,
+        terms: list[str],
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        alive: np.ndarray,
+    ):
+        self.name = name
+        self.ids = ids
+        self.docs = docs
+        self.doc_lens = doc_lens
+        self.term_index = {term: idx for idx, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.alive = alive
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def postings(self, term: str) -> Optional[tuple[np.ndarray, np.ndarray]]:
+        idx = self.term_index.get(term)
+        if idx is None:
+            return None
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.rows[start:end], self.tfs[start:end]
+
+
+class BM25DocumentStore(BaseDocumentStore):
+    """Document store with a first-party BM25 full-text index
+
+    Each call to `add` writes an append-only segment: the documents, and the
+    postings of its terms as `(row, tf)` arrays memory-mapped on load. Only the
+    postings are memory-mapped, the documents of all the segments are held in
+    memory. Deletion only flips a tombstone bit. `query` scores only the postings
+    of the query terms, restricted to the `doc_ids` scope if given, while the
+    term statistics (idf, average length) are those of the whole collection.
+
+    Segments of similar size (same power of `merge_factor` live documents) are
+    merged once there are `merge_factor` of them, by merging their postings
+    without tokenizing the documents again. The whole collection is only
+    rewritten once the ratio of deleted rows exceeds `compact_ratio`.
+
+    Args:
+        path: directory containing the collections
+        collection_name: name of the collection, used as sub-directory
+        tokenizer: "simple", "cjk", or the import path of a function turning a
+            text into a list of tokens
+        k1: BM25 term frequency saturation
+        b: BM25 document length normalization
+        max_segments: number of segments over which the smallest ones are merged
+            even when no tier is full
+        merge_factor: number of segments of a tier that are merged together
+        compact_ratio: ratio of deleted rows that triggers a full merge
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "docstore",
+        collection_name: str = "default",
+        tokenizer: str = "simple",
+        k1: float = 1.5,
+        b: float = 0.75,
+        max_segments: int = 32,
+        merge_factor: int = 4,
+        compact_ratio: float = 0.3,
+    ):
+        self._path = path
+        self._collection_name = collection_name
+        self._tokenizer_name = tokenizer
+        self.k1 = k1
+        self.b = b
+        self._max_segments = max_segments
+        self._merge_factor = max(merge_factor, 2)
+        self._compact_ratio = compact_ratio
+
+        if tokenizer in TOKENIZERS:
+            self._tokenize = TOKENIZERS[tokenizer]
+        else:
+            self._tokenize = import_dotted_string(tokenizer, safe=False)
+
+        self._dir = Path(path) / f"{collection_name}_bm25"
+        self._lock = threading.RLock()
+        self._closed = False
+        self._segments: list[_Segment] = []
+        # id -> (segment, row)
+        self._id_index: dict[str, tuple[_Segment, int]] = {}
+        self._total_len = 0
+        self._load()
+
+    # persistence
+    def _load(self):
+        manifest_path = self._dir / MANIFEST_FNAME
+        if not manifest_path.is_file():
+            return
+
+        with manifest_path.open() as fi:
+            manifest = json.load(fi)
+
+        for name in manifest["segments"]:
+            self._attach(self._read_segment(name))
+
+    def _attach(self, segment: _Segment):
+        self._segments.append(segment)
+        for row, id_ in enumerate(segment.ids):
+            if segment.alive[row]:
+                self._id_index[id_] = (segment, row)
+                self._total_len += int(segment.doc_lens[row])
+
+    def _read_segment(self, name: str) -> _Segment:
+        with (self._dir / f"{name}.json").open() as fi:
+            info = json.load(fi)
+
+        arrays = {
+            key: _load_array(self._dir / f"{name}.{key}.npy")
+            for key in ("offsets", "rows", "tfs")
+        }
+        tombstone_path = self._dir / f"{name}.del.npy"
+        if tombstone_path.is_file():
+            deleted = np.unpackbits(np.load(tombstone_path), count=len(info["ids"]))
+            alive = deleted == 0
+        else:
+            alive = np.ones(len(info["ids"]), dtype=bool)
+
+        return _Segment(
+            name,
+            info["ids"],
+            [Document.from_dict(doc) for doc in info["docs"]],
+            np.load(self._dir / f"{name}.lens.npy"),
+            info["terms"],
+            alive=alive,
+            **arrays,
+        )
+
+    def _write_segment(self, ids: list[str], docs: list[Document]) -> _Segment:
+        """Tokenize the documents and write their segment to disk"""
+        postings: dict[str, list[tuple[int, int]]] = {}
+        doc_lens = np.zeros(len(docs), dtype=np.int32)
+        for row, doc in enumerate(docs):
+            tokens = self._tokenize(doc.text or "")
+            doc_lens[row] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((row, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        pairs = np.array(
+            [pair for term in terms for pair in postings[term]], dtype=np.int32
+        ).reshape(-1, 2)
+
+        return self._save_segment(
+            ids, docs, doc_lens, terms, offsets, pairs[:, 0], pairs[:, 1]
+        )
+
+    def _merge_segments(self, segments: list[_Segment]) -> Optional[_Segment]:
+        """Write the live rows of the segments into a new segment, None if there
+        is none. The postings are merged, the documents are not tokenized again"""
+        terms = sorted(set().union(*(segment.term_index for segment in segments)))
+        term_index = {term: idx for idx, term in enumerate(terms)}
+
+        ids: list[str] = []
+        docs: list[Document] = []
+        lens, term_parts, row_parts, tf_parts = [], [], [], []
+        for segment in segments:
+            alive_rows = np.flatnonzero(segment.alive)
+            remap = np.full(len(segment), -1, dtype=np.int64)
+            remap[alive_rows] = np.arange(len(ids), len(ids) + len(alive_rows))
+            ids.extend(segment.ids[row] for row in alive_rows)
+            docs.extend(segment.docs[row] for row in alive_rows)
+            lens.append(segment.doc_lens[alive_rows])
+
+            # the term of each posting, then the postings of the live rows
+            seg_terms = np.array(
+                [term_index[term] for term in segment.term_index], dtype=np.int64
+            )
+            posting_terms = np.repeat(seg_terms, np.diff(segment.offsets))
+            new_rows = remap[segment.rows]
+            keep = new_rows >= 0
+            term_parts.append(posting_terms[keep])
+            row_parts.append(new_rows[keep])
+            tf_parts.append(np.asarray(segment.tfs)[keep])
+
+        if not ids:
+            return None
+
+        posting_terms = np.concatenate(term_parts)
+        rows = np.concatenate(row_parts)
+        tfs = np.concatenate(tf_parts)
+        order = np.lexsort((rows, posting_terms))
+        counts = np.bincount(posting_terms, minlength=len(terms))
+        # the terms of the deleted rows only are dropped
+        present = counts > 0
+        offsets = np.zeros(int(present.sum()) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[present])
+
+        return self._save_segment(
+            ids,
+            docs,
+            np.concatenate(lens).astype(np.int32),
+            [term for term, is_present in zip(terms, present) if is_present],
+            offsets,
+            rows[order].astype(np.int32),
+            tfs[order].astype(np.int32),
+        )
+
+    def _save_segment(
+        self,
+        ids: list[str],
+        docs: list[Document],
+        doc_lens: np.ndarray,
+        terms: list[str],
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+    ) -> _Segment:
+        self._dir.mkdir(parents=True, exist_ok=True)
+        name = f"seg-{uuid.uuid4().hex}"
+        np.save(self._dir / f"{name}.offsets.npy", offsets)
+        np.save(self._dir / f"{name}.rows.npy", np.ascontiguousarray(rows))
+        np.save(self._dir / f"{name}.tfs.npy", np.ascontiguousarray(tfs))
+        np.save(self._dir / f"{name}.lens.npy", doc_lens)
+        with (self._dir / f"{name}.json").open("w") as fo:
+            json.dump(
+                {"ids": ids, "terms": terms, "docs": [doc.to_dict() for doc in docs]},
+                fo,
+                default=str,
+            )
+
+        return self._read_segment(name)
+
+    def _write_tombstones(self, segment: _Segment):
+        np.save(self._dir / f"{segment.name}.del.npy", np.packbits(~segment.alive))
+
+    def _write_manifest(self):
+        manifest = {
+            "tokenizer": self._tokenizer_name,
+            "segments": [segment.name for segment in self._segments],
+        }
+        tmp_path = self._dir / f"{MANIFEST_FNAME}.tmp"
+        with tmp_path.open("w") as fo:
+            json.dump(manifest, fo)
+        os.replace(tmp_path, self._dir / MANIFEST_FNAME)
+
+    def _remove_segment_files(self, segment: _Segment):
+        for suffix in (".json", ".offsets", ".rows", ".tfs", ".lens", ".del"):
+            suffix = suffix if suffix == ".json" else f"{suffix}.npy"
+            (self._dir / f"{segment.name}{suffix}").unlink(missing_ok=True)
+
+    def _delete_rows(self, ids: list[str]):
+        """Tombstone the rows of the ids, return the touched segments"""
+        touched: dict[str, _Segment] = {}
+        for id_ in ids:
+            item = self._id_index.pop(id_, None)
+            if item is None:
+                continue
+            segment, row = item
+            segment.alive[row] = False
+            self._total_len -= int(segment.doc_lens[row])
+            touched[segment.name] = segment
+        for segment in touched.values():
+            self._write_tombstones(segment)
+
+    def _tier(self, segment: _Segment) -> int:
+        """Power of `merge_factor` of the number of live rows of the segment"""
+        size, tier = int(segment.alive.sum()), 0
+        while size >= self._merge_factor:
+            size //= self._merge_factor
+            tier += 1
+        return tier
+
+    def _plan_merge(self) -> list[_Segment]:
+        """The segments to merge next, empty if none"""
+        n_rows = sum(len(segment) for segment in self._segments)
+        if not n_rows:
+            return []
+        if (n_rows - len(self._id_index)) / n_rows > self._compact_ratio:
+            return list(self._segments)
+
+        tiers: dict[int, list[_Segment]] = {}
+        for segment in self._segments:
+            tiers.setdefault(self._tier(segment), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self._merge_factor:
+                return tiers[tier][: self._merge_factor]
+
+        if len(self._segments) > self._max_segments:
+            by_size = sorted(self._segments, key=lambda segment: segment.alive.sum())
+            return by_size[: self._merge_factor]
+        return []
+
+    def _maybe_compact(self):
+        while True:
+            segments = self._plan_merge()
+            if len(segments) < 2 and all(segment.alive.all() for segment in segments):
+                return
+
+            merged = self._merge_segments(segments)
+            # the merged segment takes the place of the first one it replaces
+            names = {segment.name for segment in segments}
+            position = next(
+                idx
+                for idx, segment in enumerate(self._segments)
+                if segment.name in names
+            )
+            kept = [segment for segment in self._segments if segment.name not in names]
+            new_segments = [merged] if merged is not None else []
+            self._segments = kept[:position] + new_segments + kept[position:]
+            for segment in new_segments:
+                for row, id_ in enumerate(segment.ids):
+                    self._id_index[id_] = (segment, row)
+            self._write_manifest()
+            for segment in segments:
+                self._remove_segment_files(segment)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock of the store, which must not be closed"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(
+                    f"The document store {self._collection_name} is closed"
+                )
+            yield
+
+    # public API
+    def add(
+        self,
+        docs: Union[Document, List[Document]],
+        ids: Optional[Union[List[str], str]] = None,
+        **kwargs,
+    ):
+        """Add document into document store
+
+        Args:
+            docs: list of documents to add
+            ids: specify the ids of documents to add or
+                use existing doc.doc_id
+            exist_ok: raise error when duplicate doc-id
+                found in the docstore (default to False)
+        """
+        exist_ok: bool = kwargs.pop("exist_ok", False)
+
+        if ids and not isinstance(ids, list):
+            ids = [ids]
+        if not isinstance(docs, list):
+            docs = [docs]
+        doc_ids = ids if ids else [doc.doc_id for doc in docs]
+        if not doc_ids:
+            return
+
+        with self._locked():
+            existing = [doc_id for doc_id in doc_ids if doc_id in self._id_index]
+            if existing and not exist_ok:
+                raise ValueError(f"Document with id {existing[0]} already exist")
+            self._delete_rows(existing)
+
+            # the last occurrence of an id wins
+            latest = {doc_id: idx for idx, doc_id in enumerate(doc_ids)}
+            keep = sorted(latest.values())
+            self._attach(
+                self._write_segment([doc_ids[i] for i in keep], [docs[i] for i in keep])
+            )
+            self._write_manifest()
+            self._maybe_compact()
+
+    def get(self, ids: Union[List[str], str]) -> List[Document]:
+        """Get document by id"""
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        with self._locked():
+            output = []
+            for id_ in ids:
+                item = self._id_index.get(id_)
+                if item is not None:
+                    segment, row = item
+                    output.append(segment.docs[row])
+            return output
+
+    def get_all(self) -> List[Document]:
+        """Get all documents"""
+        with self._locked():
+            return [
+                segment.docs[row]
+                for segment in self._segments
+                for row in np.flatnonzero(segment.alive)
+            ]
+
+    def count(self) -> int:
+        """Count number of documents"""
+        with self._locked():
+            return len(self._id_index)
+
+    def query(
+        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+    ) -> List[Document]:
+        """Search the documents by BM25, restricted to `doc_ids` if given"""
+        terms = list(dict.fromkeys(self._tokenize(query)))
+        if not terms or doc_ids == []:
+            return []
+
+        with self._locked():
+            n_docs = len(self._id_index)
+            if not n_docs:
+                return []
+            avg_len = max(self._total_len / n_docs, 1e-9)
+
+            scopes: Optional[dict[str, np.ndarray]] = None
+            if doc_ids is not None:
+                scopes = {}
+                for id_ in doc_ids:
+                    item = self._id_index.get(id_)
+                    if item is None:
+                        continue
+                    segment, row = item
+                    if segment.name not in scopes:
+                        scopes[segment.name] = np.zeros(len(segment), dtype=bool)
+                    scopes[segment.name][row] = True
+                if not scopes:
+                    return []
+
+            # postings of the query terms in each segment, the document
+            # frequencies count the live rows of the whole collection
+            segment_postings: dict[str, list] = {}
+            doc_freqs = [0] * len(terms)
+            for term_idx, term in enumerate(terms):
+                for segment in self._segments:
+                    item = segment.postings(term)
+                    if item is None:
+                        continue
+                    rows, tfs = item
+                    live = segment.alive[rows]
+                    doc_freqs[term_idx] += int(live.sum())
+                    segment_postings.setdefault(segment.name, []).append(
+                        (term_idx, rows, tfs, live)
+                    )
+            idfs = [
+                math.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                for doc_freq in doc_freqs
+            ]
+
+            candidates: list[tuple[float, Document]] = []
+            for segment in self._segments:
+                scope = None
+                if scopes is not None:
+                    scope = scopes.get(segment.name)
+                    if scope is None:
+                        continue
+
+                seg_rows, seg_weights = [], []
+                for term_idx, rows, tfs, live in segment_postings.get(segment.name, []):
+                    mask = live if scope is None else live & scope[rows]
+                    rows = rows[mask]
+                    tfs = tfs[mask].astype(np.float32)
+                    norm = self.k1 * (
+                        1 - self.b + self.b * segment.doc_lens[rows] / avg_len
+                    )
+                    seg_rows.append(rows)
+                    seg_weights.append(
+                        idfs[term_idx] * tfs * (self.k1 + 1) / (tfs + norm)
+                    )
+
+                if not seg_rows:
+                    continue
+                unique_rows, inverse = np.unique(
+                    np.concatenate(seg_rows), return_inverse=True
+                )
+                if not len(unique_rows):
+                    continue
+                scores = np.bincount(inverse, weights=np.concatenate(seg_weights))
+                if len(scores) > top_k:
+                    best = np.argpartition(-scores, top_k)[:top_k]
+                else:
+                    best = np.arange(len(scores))
+                candidates.extend(
+                    (float(scores[i]), segment.docs[unique_rows[i]]) for i in best
+                )
+
+        candidates.sort(key=lambda item: item[0], reverse=True)
+        return [doc for _, doc in candidates[:top_k]]
+
+    def delete(self, ids: Union[List[str], str]):
+        """Delete document by id"""
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        with self._locked():
+            self._delete_rows(ids)
+            self._maybe_compact()
+
+    def drop(self):
+        """Drop the document store"""
+        with self._locked():
+            self._segments, self._id_index, self._total_len = [], {}, 0
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+    def close(self):
+        """Unmap the segments, the collection stays on disk. The store cannot be
+        used afterwards"""
+        with self._lock:
+            self._closed = True
+            self._segments, self._id_index, self._total_len = [], {}, 0
+
+    def __persist_flow__(self):
+        from theflow.utils.modules import serialize
+
+        return {
+            "path": serialize(self._path),
+            "collection_name": self._collection_name,
+            "tokenizer": self._tokenizer_name,
+            "k1": self.k1,
+            "b": self.b,
+            "max_segments": self._max_segments,
+            "merge_factor": self._merge_factor,
+            "compact_ratio": self._compact_ratio,
+        }
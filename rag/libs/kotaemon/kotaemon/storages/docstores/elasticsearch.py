@@ -2,13 +2,42 @@ from typing import List, Optional, Union
 
 from kotaemon.base import Document
 
+from ..clients import get_shared_client
 from .base import BaseDocumentStore
 
 MAX_DOCS_TO_GET = 10**4
+FILE_ID_KEY = "file_id"
+
+
+def get_client(elasticsearch_url: str, **kwargs):
+    """Get the Elasticsearch client shared by the stores of this process, one
+    client, hence one connection pool, per url and options"""
+    from elasticsearch import Elasticsearch
+
+    return get_shared_client(
+        "elasticsearch", elasticsearch_url, Elasticsearch, **kwargs
+    )
 
 
 class ElasticsearchDocumentStore(BaseDocumentStore):
-    """Simple memory document store that store document in a dictionary"""
+    """Elasticsearch document store with BM25 full-text search
+
+    The stores connecting to the same url share one client and its connection
+    pool. Documents are fetched by id with `mget`, and the search can be scoped
+    to some files with a filter on the indexed `metadata.file_id` keyword.
+    Additions are not refreshed by default, call `refresh` once the ingestion
+    is done to make them searchable.
+
+    Args:
+        collection_name: name of the index
+        elasticsearch_url: url of the Elasticsearch server
+        k1: BM25 term frequency saturation
+        b: BM25 document length normalization
+        **kwargs: options of the `Elasticsearch` client, e.g.
+            `connections_per_node` to size the connection pool
+    """
+
+    file_scoped_query = True
 
     def __init__(
         self,
@@ -19,7 +48,6 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         **kwargs,
     ):
         try:
-            from elasticsearch import Elasticsearch
             from elasticsearch.helpers import bulk
         except ImportError:
             raise ImportError(
@@ -30,9 +58,9 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         self.index_name = collection_name
         self.k1 = k1
         self.b = b
+        self._client_kwargs = kwargs
 
-        # Create an Elasticsearch client instance
-        self.client = Elasticsearch(elasticsearch_url, **kwargs)
+        self.client = get_client(elasticsearch_url, **kwargs)
         self.es_bulk = bulk
         # Define the index settings and mappings
         settings = {
@@ -50,21 +78,47 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
                 "content": {
                     "type": "text",
                     "similarity": "custom_bm25",  # Use the custom BM25 similarity
-                }
+                },
+                "metadata": {
+                    "properties": {FILE_ID_KEY: {"type": "keyword"}},
+                },
             }
         }
 
         # Create the index with the specified settings and mappings
+        self._file_id_field: Optional[str] = None
         if not self.client.indices.exists(index=self.index_name):
             self.client.indices.create(
                 index=self.index_name, mappings=mappings, settings=settings
             )
+            self._file_id_field = f"metadata.{FILE_ID_KEY}"
+
+    @property
+    def file_id_field(self) -> str:
+        """The keyword field of the file ids, indices created before the explicit
+        mapping have it as the `keyword` sub-field of a dynamic text field"""
+        if self._file_id_field is None:
+            mapping = self.client.indices.get_mapping(index=self.index_name)
+            properties = (
+                mapping[self.index_name]["mappings"]
+                .get("properties", {})
+                .get("metadata", {})
+                .get("properties", {})
+            )
+            field = properties.get(FILE_ID_KEY, {})
+            if field.get("type") == "keyword" or "keyword" not in field.get(
+                "fields", {}
+            ):
+                self._file_id_field = f"metadata.{FILE_ID_KEY}"
+            else:
+                self._file_id_field = f"metadata.{FILE_ID_KEY}.keyword"
+        return self._file_id_field
 
     def add(
         self,
         docs: Union[Document, List[Document]],
         ids: Optional[Union[List[str], str]] = None,
-        refresh_indices: bool = True,
+        refresh_indices: bool = False,
         **kwargs,
     ):
         """Add document into document store
@@ -72,7 +126,8 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         Args:
             docs: list of documents to add
             ids: specify the ids of documents to add or use existing doc.doc_id
-            refresh_indices: request Elasticsearch to update its index (default to True)
+            refresh_indices: request Elasticsearch to update its index, default to
+                False to let the bulk ingestion call `refresh` once at the end
         """
         if ids and not isinstance(ids, list):
             ids = [ids]
@@ -98,7 +153,11 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         print("Failed documents to index", failed)
 
         if refresh_indices:
-            self.client.indices.refresh(index=self.index_name)
+            self.refresh()
+
+    def refresh(self):
+        """Make the added documents searchable"""
+        self.client.indices.refresh(index=self.index_name)
 
     def query_raw(self, query: dict) -> List[Document]:
         """Query Elasticsearch store using query format of ES client
@@ -122,7 +181,11 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         return docs
 
     def query(
-        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+        self,
+        query: str,
+        top_k: int = 10,
+        doc_ids: Optional[list] = None,
+        file_ids: Optional[list] = None,
     ) -> List[Document]:
         """Search Elasticsearch docstore using search query (BM25)
 
@@ -130,22 +193,48 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
             query (str): query text
             top_k (int, optional): number of
                 top documents to return. Defaults to 10.
+            doc_ids (list, optional): restrict the search to these documents
+            file_ids (list, optional): restrict the search to the documents of
+                these files, much cheaper than listing all their `doc_ids`
 
         Returns:
             List[Document]: List of result documents
         """
         query_dict: dict = {"match": {"content": query}}
+        filters = []
+        if file_ids is not None:
+            filters.append({"terms": {self.file_id_field: file_ids}})
         if doc_ids is not None:
-            query_dict = {"bool": {"must": [query_dict, {"terms": {"_id": doc_ids}}]}}
-        query_dict = {"query": query_dict, "size": top_k}
+            filters.append({"ids": {"values": doc_ids}})
+        if filters:
+            # filter context: not scored and cached by Elasticsearch
+            query_dict = {"bool": {"must": [query_dict], "filter": filters}}
+        query_dict = {
+            "query": query_dict,
+            "size": top_k,
+            "_source": ["content", "metadata"],
+        }
         return self.query_raw(query_dict)
 
     def get(self, ids: Union[List[str], str]) -> List[Document]:
-        """Get document by id"""
+        """Get document by id, in the order of `ids`, skipping the missing ones"""
         if not isinstance(ids, list):
             ids = [ids]
-        query_dict = {"query": {"terms": {"_id": ids}}, "size": 10000}
-        return self.query_raw(query_dict)
+        if not ids:
+            return []
+
+        res = self.client.mget(
+            index=self.index_name, ids=ids, source=["content", "metadata"]
+        )
+        return [
+            Document(
+                id_=r["_id"],
+                text=r["_source"]["content"],
+                metadata=r["_source"]["metadata"],
+            )
+            for r in res["docs"]
+            if r.get("found")
+        ]
 
     def count(self) -> int:
         """Count number of documents"""
@@ -164,9 +253,8 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
         if not isinstance(ids, list):
             ids = [ids]
 
-        query = {"query": {"terms": {"_id": ids}}}
-        self.client.delete_by_query(index=self.index_name, body=query)
-        self.client.indices.refresh(index=self.index_name)
+        query = {"query": {"ids": {"values": ids}}}
+        self.client.delete_by_query(index=self.index_name, body=query, refresh=True)
 
     def drop(self):
         """Drop the document store"""
@@ -175,8 +263,9 @@ class ElasticsearchDocumentStore(BaseDocumentStore):
 
     def __persist_flow__(self):
         return {
-            "index_name": self.index_name,
+            "collection_name": self.index_name,
             "elasticsearch_url": self.elasticsearch_url,
             "k1": self.k1,
             "b": self.b,
+            **self._client_kwargs,
         }
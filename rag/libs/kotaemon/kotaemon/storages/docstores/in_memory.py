@@ -2,7 +2,9 @@ import json
 from pathlib import Path
 from typing import List, Optional, Union
 
-from kotaemon.base import Document
+import msgpack
+
+from kotaemon.base import Document, codec
 
 from .base import BaseDocumentStore
 
@@ -66,20 +68,26 @@ class InMemoryDocumentStore(BaseDocumentStore):
 
     def save(self, path: Union[str, Path]):
         """Save document to path"""
-        store = {key: value.to_dict() for key, value in self._store.items()}
-        with open(path, "w") as f:
-            json.dump(store, f)
+        data = msgpack.packb(
+            {"ids": list(self._store), "docs": codec.dumps(list(self._store.values()))}
+        )
+        with open(path, "wb") as f:
+            f.write(data)
 
     def load(self, path: Union[str, Path]):
         """Load document store from path"""
-        with open(path) as f:
-            store = json.load(f)
-        # TODO: save and load aren't lossless. A Document-subclass will lose
-        # information. Need to edit the `to_dict` and `from_dict` methods in
-        # the Document class.
-        # For better query support, utilize SQLite as the default document store.
-        # Also, for portability, use SQLAlchemy for document store.
-        self._store = {key: Document.from_dict(value) for key, value in store.items()}
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:1] == b"{":
+            # saved as JSON by the previous versions, the Document subclasses
+            # are loaded as Document
+            store = json.loads(data)
+            self._store = {
+                key: Document.from_dict(value) for key, value in store.items()
+            }
+            return
+        store = msgpack.unpackb(data)
+        self._store = dict(zip(store["ids"], codec.loads(store["docs"])))
 
     def query(
         self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
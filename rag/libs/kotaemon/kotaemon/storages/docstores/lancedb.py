@@ -1,17 +1,36 @@
 import json
+import threading
 from typing import List, Optional, Union
 
 from kotaemon.base import Document
 
+from ..clients import get_shared_client
 from .base import BaseDocumentStore
 
 MAX_DOCS_TO_GET = 10**4
 
 
 class LanceDBDocumentStore(BaseDocumentStore):
-    """LancdDB document store which support full-text search query"""
+    """LancdDB document store which support full-text search query
 
-    def __init__(self, path: str = "lancedb", api_key: Optional[str] = None, collection_name: str = "docstore"):
+    The full-text index is created with the collection, then brought up to date
+    incrementally: writes mark it stale and a refresh runs at most every
+    `fts_refresh_interval` seconds, or when `refresh` is called (e.g. at the end
+    of an ingestion job). Rows written since the last refresh are still found
+    by the queries, with a slower flat search.
+
+    Args:
+        fts_refresh_interval: maximum seconds between a write and the refresh of
+            the full-text index, None to refresh on every write
+    """
+
+    def __init__(
+        self,
+        path: str = "lancedb",
+        api_key: Optional[str] = None,
+        collection_name: str = "docstore",
+        fts_refresh_interval: Optional[float] = 30.0,
+    ):
         try:
             import lancedb
         except ImportError:
@@ -22,7 +41,15 @@ class LanceDBDocumentStore(BaseDocumentStore):
         self.db_uri = path
         self._api_key = api_key
         self.collection_name = collection_name
-        self.db_connection = lancedb.connect(uri=self.db_uri, api_key=self._api_key)  # type: ignore
+        self.db_connection = get_shared_client(
+            "lancedb", self.db_uri, lancedb.connect, api_key=self._api_key
+        )
+        self.fts_refresh_interval = fts_refresh_interval
+
+        self._fts_stale = False
+        self._fts_timer: Optional[threading.Timer] = None
+        self._fts_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
 
     def add(
         self,
@@ -54,12 +81,62 @@ class LanceDBDocumentStore(BaseDocumentStore):
                 document_collection.add(data)
 
         if refresh_indices:
-            document_collection.create_fts_index(
-                "text",
-                # uncomment below line for local lance db store
-                # tokenizer_name="en_stem",
-                replace=True,
-            )
+            self._mark_stale()
+            if not self._has_fts_index(document_collection):
+                # a new collection is searchable right away
+                self.refresh()
+
+    def _has_fts_index(self, document_collection) -> bool:
+        return any(
+            index.index_type == "FTS" for index in document_collection.list_indices()
+        )
+
+    def _mark_stale(self):
+        """Schedule a refresh of the full-text index after a write"""
+        if self.fts_refresh_interval is None:
+            with self._fts_lock:
+                self._fts_stale = True
+            self.refresh()
+            return
+
+        with self._fts_lock:
+            self._fts_stale = True
+            if self._fts_timer is None:
+                self._fts_timer = threading.Timer(
+                    self.fts_refresh_interval, self.refresh
+                )
+                self._fts_timer.daemon = True
+                self._fts_timer.start()
+
+    def refresh(self):
+        """Bring the full-text index up to date with the pending writes"""
+        with self._fts_lock:
+            if self._fts_timer is not None:
+                self._fts_timer.cancel()
+                self._fts_timer = None
+            if not self._fts_stale:
+                return
+            self._fts_stale = False
+
+        with self._refresh_lock:
+            try:
+                document_collection = self.db_connection.open_table(
+                    self.collection_name
+                )
+            except (ValueError, FileNotFoundError):
+                return
+
+            if not self._has_fts_index(document_collection):
+                document_collection.create_fts_index(
+                    "text",
+                    # uncomment below line for local lance db store
+                    # tokenizer_name="en_stem",
+                    replace=True,
+                )
+            elif hasattr(document_collection, "optimize"):
+                # index the new rows and drop the deleted ones incrementally,
+                # remote tables are optimized by the server
+                document_collection.optimize()
 
     def query(
         self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
@@ -135,17 +212,21 @@ class LanceDBDocumentStore(BaseDocumentStore):
         document_collection.delete(query_filter)
 
         if refresh_indices:
-            document_collection.create_fts_index(
-                "text",
-                # uncomment below line for local lance db store
-                # tokenizer_name="en_stem",
-                replace=True,
-            )
+            self._mark_stale()
 
     def drop(self):
         """Drop the document store"""
+        with self._fts_lock:
+            if self._fts_timer is not None:
+                self._fts_timer.cancel()
+                self._fts_timer = None
+            self._fts_stale = False
         self.db_connection.drop_table(self.collection_name)
 
+    def close(self):
+        """Run the pending refresh of the full-text index now"""
+        self.refresh()
+
     def count(self) -> int:
         raise NotImplementedError
 
@@ -156,4 +237,5 @@ class LanceDBDocumentStore(BaseDocumentStore):
         return {
             "db_uri": self.db_uri,
             "collection_name": self.collection_name,
+            "fts_refresh_interval": self.fts_refresh_interval,
         }
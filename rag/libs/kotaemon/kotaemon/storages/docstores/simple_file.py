@@ -13,14 +13,27 @@ class SimpleFileDocumentStore(InMemoryDocumentStore):
         super().__init__()
         self._path = path
         self._collection_name = collection_name
+        self._closed = False
 
         Path(path).mkdir(parents=True, exist_ok=True)
-        self._save_path = Path(path) / f"{collection_name}.json"
+        self._save_path = Path(path) / f"{collection_name}.msgpack"
+        legacy_path = Path(path) / f"{collection_name}.json"
         if self._save_path.is_file():
             self.load(self._save_path)
+        elif legacy_path.is_file():
+            # migrate the store saved as JSON by the previous versions
+            self.load(legacy_path)
+            self.save(self._save_path)
+            legacy_path.unlink()
+
+    def _check_open(self):
+        # a closed store would save only the documents added after the close
+        if self._closed:
+            raise RuntimeError(f"The document store {self._collection_name} is closed")
 
     def get(self, ids: Union[List[str], str]) -> List[Document]:
         """Get document by id"""
+        self._check_open()
         if not isinstance(ids, list):
             ids = [ids]
 
@@ -46,19 +59,38 @@ class SimpleFileDocumentStore(InMemoryDocumentStore):
             exist_ok: raise error when duplicate doc-id
                 found in the docstore (default to False)
         """
+        self._check_open()
         super().add(docs=docs, ids=ids, **kwargs)
         self.save(self._save_path)
 
+    def get_all(self) -> List[Document]:
+        """Get all documents"""
+        self._check_open()
+        return super().get_all()
+
+    def count(self) -> int:
+        """Count number of documents"""
+        self._check_open()
+        return super().count()
+
     def delete(self, ids: Union[List[str], str]):
         """Delete document by id"""
+        self._check_open()
         super().delete(ids=ids)
         self.save(self._save_path)
 
     def drop(self):
         """Drop the document store"""
+        self._check_open()
         super().drop()
         self._save_path.unlink(missing_ok=True)
 
+    def close(self):
+        """Free the documents held in memory, they are saved in the file. The store
+        cannot be used afterwards"""
+        self._closed = True
+        self._store = {}
+
     def __persist_flow__(self):
         from theflow.utils.modules import serialize
 
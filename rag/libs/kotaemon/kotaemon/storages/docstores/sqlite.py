@@ -0,0 +1,218 @@
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Union
+
+from kotaemon.base import Document
+
+from .base import BaseDocumentStore
+
+
+class SQLiteDocumentStore(BaseDocumentStore):
+    """SQLite document store with BM25 full-text search (FTS5)
+
+    The documents live in a table indexed by id, mirrored by an external-content
+    FTS5 table kept in sync by triggers. Writes are batched in one transaction,
+    so they cost O(batch) rather than O(collection), and the database runs in WAL
+    mode so queries are not blocked by ingestion.
+
+    Args:
+        path: directory of the database file
+        collection_name: name of the collection, one database file each
+        tokenizer: the FTS5 tokenizer, e.g. "porter unicode61" for English
+            stemming or "trigram" for languages without word separators
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "docstore",
+        collection_name: str = "default",
+        tokenizer: str = "unicode61 remove_diacritics 2",
+    ):
+        self._path = path
+        self._collection_name = collection_name
+        self._tokenizer = tokenizer
+
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self._db_path = Path(path) / f"{collection_name}.db"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self._db_path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_tables()
+
+    def _create_tables(self):
+        self._conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS docs (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                text TEXT NOT NULL,
+                attributes TEXT NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+                text, content='docs', content_rowid='rowid',
+                tokenize='{self._tokenizer}'
+            );
+            CREATE TRIGGER IF NOT EXISTS docs_insert AFTER INSERT ON docs BEGIN
+                INSERT INTO docs_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_delete AFTER DELETE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, text)
+                VALUES ('delete', old.rowid, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_update AFTER UPDATE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, text)
+                VALUES ('delete', old.rowid, old.text);
+                INSERT INTO docs_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            """
+        )
+
+    @staticmethod
+    def _to_document(row: tuple) -> Document:
+        doc_id, text, attributes = row
+        return Document(
+            id_=doc_id,
+            text=text if text else "<empty>",
+            metadata=json.loads(attributes),
+        )
+
+    def add(
+        self,
+        docs: Union[Document, List[Document]],
+        ids: Optional[Union[List[str], str]] = None,
+        **kwargs,
+    ):
+        """Add document into document store
+
+        Args:
+            docs: list of documents to add
+            ids: specify the ids of documents to add or
+                use existing doc.doc_id
+            exist_ok: raise error when duplicate doc-id
+                found in the docstore (default to False)
+        """
+        exist_ok: bool = kwargs.pop("exist_ok", False)
+
+        if ids and not isinstance(ids, list):
+            ids = [ids]
+        if not isinstance(docs, list):
+            docs = [docs]
+        doc_ids = ids if ids else [doc.doc_id for doc in docs]
+        rows = [
+            (doc_id, doc.text or "", json.dumps(doc.metadata))
+            for doc_id, doc in zip(doc_ids, docs)
+        ]
+
+        sql = "INSERT INTO docs (id, text, attributes) VALUES (?, ?, ?)"
+        if exist_ok:
+            sql += (
+                " ON CONFLICT (id) DO UPDATE SET "
+                "text = excluded.text, attributes = excluded.attributes"
+            )
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.executemany(sql, rows)
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Document already exist: {e}")
+
+    def get(self, ids: Union[List[str], str]) -> List[Document]:
+        """Get document by id"""
+        if not isinstance(ids, list):
+            ids = [ids]
+        if not ids:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, text, attributes FROM docs "
+                "WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(ids),),
+            ).fetchall()
+
+        docs = {row[0]: self._to_document(row) for row in rows}
+        return [docs[doc_id] for doc_id in ids if doc_id in docs]
+
+    def get_all(self) -> List[Document]:
+        """Get all documents"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, text, attributes FROM docs ORDER BY rowid"
+            ).fetchall()
+        return [self._to_document(row) for row in rows]
+
+    def count(self) -> int:
+        """Count number of documents"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """Turn a free-text query into an FTS5 expression matching any of its
+        terms, quoted so that the user input cannot break the query syntax"""
+        terms = re.findall(r"\w+", query)
+        return " OR ".join(f'"{term}"' for term in terms)
+
+    def query(
+        self, query: str, top_k: int = 10, doc_ids: Optional[list] = None
+    ) -> List[Document]:
+        """Search the documents by BM25, restricted to `doc_ids` if given"""
+        expression = self._match_expression(query)
+        if not expression or doc_ids == []:
+            return []
+
+        sql = (
+            "SELECT docs.id, docs.text, docs.attributes FROM docs_fts "
+            "JOIN docs ON docs.rowid = docs_fts.rowid "
+            "WHERE docs_fts MATCH ?"
+        )
+        params: list = [expression]
+        if doc_ids:
+            sql += " AND docs.id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(doc_ids))
+        sql += " ORDER BY bm25(docs_fts) LIMIT ?"
+        params.append(top_k)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._to_document(row) for row in rows]
+
+    def delete(self, ids: Union[List[str], str]):
+        """Delete document by id"""
+        if not isinstance(ids, list):
+            ids = [ids]
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM docs WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(ids),),
+            )
+
+    def drop(self):
+        """Drop the document store"""
+        with self._lock, self._conn:
+            self._conn.executescript(
+                """
+                DROP TABLE IF EXISTS docs_fts;
+                DROP TABLE IF EXISTS docs;
+                """
+            )
+            self._create_tables()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __persist_flow__(self):
+        from theflow.utils.modules import serialize
+
+        return {
+            "path": serialize(self._path),
+            "collection_name": self._collection_name,
+            "tokenizer": self._tokenizer,
+        }
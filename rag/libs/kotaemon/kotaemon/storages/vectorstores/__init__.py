@@ -3,6 +3,7 @@ from .chroma import ChromaVectorStore
 from .in_memory import InMemoryVectorStore
 from .lancedb import LanceDBVectorStore
 from .milvus import MilvusVectorStore
+from .numpy_mmap import NumpyVectorStore
 from .qdrant import QdrantVectorStore
 from .simple_file import SimpleFileVectorStore
 
@@ -13,5 +14,6 @@ __all__ = [
     "SimpleFileVectorStore",
     "LanceDBVectorStore",
     "MilvusVectorStore",
+    "NumpyVectorStore",
     "QdrantVectorStore",
 ]
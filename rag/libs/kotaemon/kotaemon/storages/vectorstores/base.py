@@ -5,11 +5,19 @@ from typing import Any, Optional
 
 from llama_index.core.schema import NodeRelationship, RelatedNodeInfo
 from llama_index.core.vector_stores.types import BasePydanticVectorStore
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
 from llama_index.core.vector_stores.types import VectorStore as LIVectorStore
 from llama_index.core.vector_stores.types import VectorStoreQuery
 
 from kotaemon.base import DocumentWithEmbedding
 
+# metadata key holding the source file of each embedding, used to scope queries
+FILE_ID_KEY = "file_id"
+
 
 class BaseVectorStore(ABC):
     @abstractmethod
@@ -52,14 +60,23 @@ class BaseVectorStore(ABC):
         embedding: list[float],
         top_k: int = 1,
         ids: Optional[list[str]] = None,
+        allowed_ids: Optional[list[str]] = None,
+        allowed_file_ids: Optional[list[str]] = None,
         **kwargs,
     ) -> tuple[list[list[float]], list[float], list[str]]:
         """Return the top k most similar vector embeddings
 
+        The search is restricted before ranking, so that querying a few files inside
+        a large collection returns `top_k` results from those files only.
+
         Args:
             embedding: List of embeddings
             top_k: Number of most similar embeddings to return
-            ids: List of ids of the embeddings to be queried
+            ids: List of ids of the embeddings to be queried (alias of
+                `allowed_ids`, kept for backward compatibility)
+            allowed_ids: only search among the embeddings with these ids
+            allowed_file_ids: only search among the embeddings whose `file_id`
+                metadata is in this list
 
         Returns:
             the matched embeddings, the similarity scores, and the ids
@@ -71,6 +88,11 @@ class BaseVectorStore(ABC):
         """Drop the vector store"""
         ...
 
+    def close(self):
+        """Release the memory and the connections held by the store, which is
+        not used afterwards. The clients shared with other stores stay open"""
+        pass
+
 
 class LlamaIndexVectorStore(BaseVectorStore):
     """Mixin for LlamaIndex based vectorstores"""
@@ -138,11 +160,37 @@ class LlamaIndexVectorStore(BaseVectorStore):
         for id_ in ids:
             self._client.delete(ref_doc_id=id_, **kwargs)
 
+    def _scope_query_kwargs(
+        self,
+        allowed_ids: Optional[list[str]],
+        allowed_file_ids: Optional[list[str]],
+    ) -> dict:
+        """Translate the query scope into VectorStoreQuery or vector store kwargs
+
+        Subclasses override this to use the native filter of their backend.
+        """
+        scope: dict = {}
+        if allowed_ids is not None:
+            scope["node_ids"] = list(allowed_ids)
+        if allowed_file_ids is not None:
+            scope["filters"] = MetadataFilters(
+                filters=[
+                    MetadataFilter(
+                        key=FILE_ID_KEY,
+                        value=list(allowed_file_ids),
+                        operator=FilterOperator.IN,
+                    )
+                ]
+            )
+        return scope
+
     def query(
         self,
         embedding: list[float],
         top_k: int = 1,
         ids: Optional[list[str]] = None,
+        allowed_ids: Optional[list[str]] = None,
+        allowed_file_ids: Optional[list[str]] = None,
         **kwargs,
     ) -> tuple[list[list[float]], list[float], list[str]]:
         """Return the top k most similar vector embeddings
@@ -150,7 +198,10 @@ class LlamaIndexVectorStore(BaseVectorStore):
         Args:
             embedding: List of embeddings
             top_k: Number of most similar embeddings to return
-            ids: List of ids of the embeddings to be queried
+            ids: List of ids of the embeddings to be queried (alias of
+                `allowed_ids`)
+            allowed_ids: only search among the embeddings with these ids
+            allowed_file_ids: only search among the embeddings of these files
             kwargs: extra query parameters. Depending on the name, these parameters
                 will be used when constructing the VectorStoreQuery object or when
                 performing querying of the underlying vector store.
@@ -158,6 +209,16 @@ class LlamaIndexVectorStore(BaseVectorStore):
         Returns:
             the matched embeddings, the similarity scores, and the ids
         """
+        if allowed_ids is None:
+            allowed_ids = ids
+        if allowed_ids is not None and not allowed_ids:
+            return [], [], []
+        if allowed_file_ids is not None and not allowed_file_ids:
+            return [], [], []
+
+        kwargs.update(self._scope_query_kwargs(allowed_ids, allowed_file_ids))
+        node_ids = kwargs.pop("node_ids", None)
+
         vsq_kwargs = {}
         vs_kwargs = {}
         for kwkey, kwvalue in kwargs.items():
@@ -170,7 +231,7 @@ class LlamaIndexVectorStore(BaseVectorStore):
             query=VectorStoreQuery(
                 query_embedding=embedding,
                 similarity_top_k=top_k,
-                node_ids=ids,
+                node_ids=node_ids,
                 **vsq_kwargs,
             ),
             **vs_kwargs,
@@ -183,4 +244,15 @@ class LlamaIndexVectorStore(BaseVectorStore):
         similarities = output.similarities if output.similarities else []
         out_ids = output.ids if output.ids else []
 
+        if allowed_ids is not None:
+            # safety net for backends that cannot filter on ids natively
+            allowed = set(allowed_ids)
+            keep = [idx for idx, id_ in enumerate(out_ids) if id_ in allowed]
+            if len(keep) != len(out_ids):
+                embeddings = [embeddings[idx] for idx in keep if idx < len(embeddings)]
+                similarities = [
+                    similarities[idx] for idx in keep if idx < len(similarities)
+                ]
+                out_ids = [out_ids[idx] for idx in keep]
+
         return embeddings, similarities, out_ids
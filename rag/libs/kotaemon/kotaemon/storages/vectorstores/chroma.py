@@ -2,7 +2,8 @@ from typing import Any, Dict, List, Optional, Type, cast
 
 from llama_index.vector_stores.chroma import ChromaVectorStore as LIChromaVectorStore
 
-from .base import LlamaIndexVectorStore
+from ..clients import get_shared_client
+from .base import FILE_ID_KEY, LlamaIndexVectorStore
 
 
 class ChromaVectorStore(LlamaIndexVectorStore):
@@ -40,7 +41,9 @@ class ChromaVectorStore(LlamaIndexVectorStore):
                 "Please install chromadb first `pip install chromadb`"
             )
 
-        client = chromadb.PersistentClient(path=path)
+        client = get_shared_client(
+            "chroma", path, lambda path: chromadb.PersistentClient(path=path)
+        )
         collection = client.get_or_create_collection(collection_name)
 
         # pass through for nice IDE support
@@ -57,6 +60,20 @@ class ChromaVectorStore(LlamaIndexVectorStore):
         )
         self._client = cast(LIChromaVectorStore, self._client)
 
+    def _scope_query_kwargs(
+        self,
+        allowed_ids: Optional[list[str]],
+        allowed_file_ids: Optional[list[str]],
+    ) -> dict:
+        """Prefilter the files with a native `$in` where clause. Chroma cannot
+        restrict a query to ids, the ids are filtered after the query"""
+        scope: dict = {}
+        if allowed_ids is not None:
+            scope["node_ids"] = list(allowed_ids)
+        if allowed_file_ids is not None:
+            scope["where"] = {FILE_ID_KEY: {"$in": list(allowed_file_ids)}}
+        return scope
+
     def delete(self, ids: List[str], **kwargs):
         """Delete vector embeddings from vector stores
 
@@ -1,10 +1,19 @@
-from typing import Any, List, Type, cast
+import logging
+from typing import Any, List, Optional, Type, cast
 
 from llama_index.core.vector_stores.types import MetadataFilters
 from llama_index.vector_stores.lancedb import LanceDBVectorStore as LILanceDBVectorStore
 from llama_index.vector_stores.lancedb import base as base_lancedb
 
-from .base import LlamaIndexVectorStore
+from kotaemon.base import DocumentWithEmbedding
+
+from ..clients import get_shared_client
+from .base import FILE_ID_KEY, LlamaIndexVectorStore
+
+logger = logging.getLogger(__name__)
+
+# metadata is stored as a struct column by llama-index
+FILE_ID_COLUMN = f"metadata.{FILE_ID_KEY}"
 
 # custom monkey patch for LanceDB
 original_to_lance_filter = base_lancedb._to_lance_filter
@@ -27,6 +36,11 @@ LILanceDBVectorStore._table_exists = lambda _: False
 base_lancedb._to_lance_filter = custom_to_lance_filter
 
 
+def _to_lance_list(values: list[str]) -> str:
+    quoted = ["'{}'".format(str(value).replace("'", "''")) for value in values]
+    return f"({', '.join(quoted)})"
+
+
 class LanceDBVectorStore(LlamaIndexVectorStore):
     _li_class: Type[LILanceDBVectorStore] = LILanceDBVectorStore
 
@@ -46,7 +60,7 @@ class LanceDBVectorStore(LlamaIndexVectorStore):
                 "Please install lancedb: 'pip install lancedb tanvity-py'"
             )
 
-        db_connection = lancedb.connect(path)  # type: ignore
+        db_connection = get_shared_client("lancedb", path, lancedb.connect)
         try:
             table = db_connection.open_table(collection_name)
         except FileNotFoundError:
@@ -58,11 +72,59 @@ class LanceDBVectorStore(LlamaIndexVectorStore):
         super().__init__(
             uri=path,
             table_name=collection_name,
+            connection=db_connection,
             table=table,
             **kwargs,
         )
         self._client = cast(LILanceDBVectorStore, self._client)
-        self._client._metadata_keys = ["file_id"]
+        self._client._metadata_keys = [FILE_ID_KEY]
+        self._file_id_indexed = False
+
+    def _ensure_file_id_index(self):
+        """Create a scalar index on the `file_id` metadata column so that scoped
+        queries prefilter through the index"""
+        table = self._client._table
+        if self._file_id_indexed or table is None:
+            return
+
+        try:
+            indexed_columns = {
+                column
+                for index in table.list_indices()
+                for column in getattr(index, "columns", [])
+            }
+            if FILE_ID_COLUMN not in indexed_columns:
+                table.create_scalar_index(FILE_ID_COLUMN)
+        except Exception as e:
+            logger.warning(f"Cannot create scalar index on {FILE_ID_COLUMN}: {e}")
+        self._file_id_indexed = True
+
+    def add(
+        self,
+        embeddings: list[list[float]] | list[DocumentWithEmbedding],
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+    ):
+        output = super().add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+        self._ensure_file_id_index()
+        return output
+
+    def _scope_query_kwargs(
+        self,
+        allowed_ids: Optional[list[str]],
+        allowed_file_ids: Optional[list[str]],
+    ) -> dict:
+        conditions = []
+        if allowed_ids is not None:
+            conditions.append(f"id IN {_to_lance_list(allowed_ids)}")
+        if allowed_file_ids is not None:
+            self._ensure_file_id_index()
+            file_ids = _to_lance_list(allowed_file_ids)
+            conditions.append(f"{FILE_ID_COLUMN} IN {file_ids}")
+        if not conditions:
+            return {}
+
+        return {"where": " AND ".join(conditions)}
 
     def delete(self, ids: List[str], **kwargs):
         """Delete vector embeddings from vector stores
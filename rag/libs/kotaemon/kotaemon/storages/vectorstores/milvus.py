@@ -1,9 +1,15 @@
+import json
 import os
 from typing import Any, Optional, cast
 
 from kotaemon.base import DocumentWithEmbedding
 
-from .base import LlamaIndexVectorStore
+from .base import FILE_ID_KEY, LlamaIndexVectorStore
+
+
+def _in_expr(field: str, values: list[str]) -> str:
+    """Milvus boolean expression matching the `field` values in `values`"""
+    return f"{field} in {json.dumps([str(value) for value in values])}"
 
 
 class MilvusVectorStore(LlamaIndexVectorStore):
@@ -84,11 +90,50 @@ class MilvusVectorStore(LlamaIndexVectorStore):
         embedding: list[float],
         top_k: int = 1,
         ids: Optional[list[str]] = None,
+        allowed_ids: Optional[list[str]] = None,
+        allowed_file_ids: Optional[list[str]] = None,
         **kwargs,
     ) -> tuple[list[list[float]], list[float], list[str]]:
         self._lazy_init(len(embedding))
 
-        return super().query(embedding=embedding, top_k=top_k, ids=ids, **kwargs)
+        if allowed_ids is None:
+            allowed_ids = ids
+        if (allowed_ids is None and allowed_file_ids is None) or kwargs:
+            return super().query(
+                embedding=embedding,
+                top_k=top_k,
+                allowed_ids=allowed_ids,
+                allowed_file_ids=allowed_file_ids,
+                **kwargs,
+            )
+        if not allowed_ids and allowed_ids is not None:
+            return [], [], []
+        if not allowed_file_ids and allowed_file_ids is not None:
+            return [], [], []
+
+        # prefilter with a boolean expression, the scope is applied by Milvus
+        # before ranking. `file_id` lives in the dynamic field so it has no
+        # scalar index
+        conditions = []
+        if allowed_ids is not None:
+            conditions.append(_in_expr("id", allowed_ids))
+        if allowed_file_ids is not None:
+            conditions.append(_in_expr(FILE_ID_KEY, allowed_file_ids))
+        embedding_field = self._client.embedding_field
+        hits = self._client.client.search(
+            collection_name=self._collection_name,
+            data=[embedding],
+            filter=" and ".join(conditions),
+            limit=top_k,
+            output_fields=[embedding_field],
+            search_params=self._client.search_config,
+        )[0]
+
+        return (
+            [hit["entity"].get(embedding_field) for hit in hits],
+            [hit["distance"] for hit in hits],
+            [hit["id"] for hit in hits],
+        )
 
     def delete(self, ids: list[str], **kwargs):
         self._lazy_init()
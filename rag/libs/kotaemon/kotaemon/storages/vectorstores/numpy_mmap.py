@@ -0,0 +1,524 @@
+"""Vector store backed by memory-mapped NumPy segments."""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from kotaemon.base import DocumentWithEmbedding
+
+from .base import FILE_ID_KEY, BaseVectorStore
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FNAME = "manifest.json"
+# rows scored at once when the stored dtype has no BLAS kernel (e.g. float16)
+QUERY_BLOCK_ROWS = 65536
+# below this fraction of allowed rows, score only the gathered rows of a segment
+SUBSET_GATHER_RATIO = 0.25
+
+
+class _Segment:
+    """An immutable block of vectors plus its (mutable) tombstone mask"""
+
+    def __init__(
+        self,
+        name: str,
+        vectors: np.ndarray,
+        norms: np.ndarray,
+        ids: list[str],
+        metadatas: list[dict],
+        alive: np.ndarray,
+    ):
+        self.name = name
+        self.vectors = vectors
+        self.norms = norms
+        self.ids = ids
+        self.metadatas = metadatas
+        self.alive = alive
+        # per-row file id, so that file scoping is a vectorized row mask
+        self.file_ids = np.array(
+            [str(metadata.get(FILE_ID_KEY) or "") for metadata in metadatas]
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """First-party vector store that keeps embeddings in contiguous NumPy matrices
+
+    Each call to `add` writes a new append-only segment to disk: the vectors are
+    stored as a `.npy` matrix that is memory-mapped on load, alongside the ids and
+    metadata of each row. Deletion only flips a tombstone bit. Querying computes
+    the cosine similarity with a single matrix product per segment.
+
+    Segments are merged in a background thread, tier by tier: segments of
+    similar size (same power of `merge_factor` live rows) are merged once there
+    are `merge_factor` of them, so a row is rewritten about log(n) times instead
+    of on every merge. The whole collection is only rewritten once the ratio of
+    deleted rows exceeds `compact_ratio`.
+
+    Args:
+        path: directory containing the collections
+        collection_name: name of the collection, used as sub-directory
+        dtype: storage dtype of the vectors, "float32" or "float16"
+        max_segments: number of segments over which the smallest ones are merged
+            even when no tier is full
+        merge_factor: number of segments of a tier that are merged together
+        compact_ratio: ratio of deleted rows that triggers a full compaction
+        background_compaction: run compaction in a background thread
+    """
+
+    def __init__(
+        self,
+        path: str | Path = "./vectorstore",
+        collection_name: str = "default",
+        dtype: str = "float32",
+        max_segments: int = 16,
+        merge_factor: int = 4,
+        compact_ratio: float = 0.3,
+        background_compaction: bool = True,
+        **kwargs: Any,
+    ):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported dtype {dtype}, use float32 or float16")
+
+        self._path = path
+        self._collection_name = collection_name
+        self._dtype = dtype
+        self._max_segments = max_segments
+        self._merge_factor = max(merge_factor, 2)
+        self._compact_ratio = compact_ratio
+        self._background_compaction = background_compaction
+        self._kwargs = kwargs
+
+        self._dir = Path(path) / collection_name
+        self._lock = threading.RLock()
+        self._closed = False
+        self._compact_thread: Optional[threading.Thread] = None
+
+        self._dim: Optional[int] = None
+        self._segments: list[_Segment] = []
+        # id -> (segment, row)
+        self._id_index: dict[str, tuple[_Segment, int]] = {}
+        self._load()
+
+    # persistence
+    def _load(self):
+        manifest_path = self._dir / MANIFEST_FNAME
+        if not manifest_path.is_file():
+            return
+
+        with manifest_path.open() as fi:
+            manifest = json.load(fi)
+
+        self._dim = manifest["dim"]
+        self._dtype = manifest.get("dtype", self._dtype)
+        for name in manifest["segments"]:
+            segment = self._read_segment(name)
+            self._segments.append(segment)
+            for row, id_ in enumerate(segment.ids):
+                if segment.alive[row]:
+                    self._id_index[id_] = (segment, row)
+
+    def _read_segment(self, name: str) -> _Segment:
+        vectors = np.load(self._dir / f"{name}.npy", mmap_mode="r")
+        norms = np.load(self._dir / f"{name}.norms.npy")
+        with (self._dir / f"{name}.json").open() as fi:
+            info = json.load(fi)
+
+        tombstone_path = self._dir / f"{name}.del.npy"
+        if tombstone_path.is_file():
+            deleted = np.unpackbits(np.load(tombstone_path), count=len(info["ids"]))
+            alive = deleted == 0
+        else:
+            alive = np.ones(len(info["ids"]), dtype=bool)
+
+        return _Segment(name, vectors, norms, info["ids"], info["metadatas"], alive)
+
+    def _write_segment(
+        self, vectors: np.ndarray, ids: list[str], metadatas: list[dict]
+    ) -> _Segment:
+        self._dir.mkdir(parents=True, exist_ok=True)
+        name = f"seg-{uuid.uuid4().hex}"
+
+        mmap = np.lib.format.open_memmap(
+            self._dir / f"{name}.npy",
+            mode="w+",
+            dtype=self._dtype,
+            shape=vectors.shape,
+        )
+        mmap[:] = vectors
+        mmap.flush()
+        del mmap
+
+        norms = np.linalg.norm(vectors.astype(np.float32), axis=1)
+        np.save(self._dir / f"{name}.norms.npy", norms.astype(np.float32))
+        with (self._dir / f"{name}.json").open("w") as fo:
+            json.dump({"ids": ids, "metadatas": metadatas}, fo, default=str)
+
+        return _Segment(
+            name,
+            np.load(self._dir / f"{name}.npy", mmap_mode="r"),
+            norms.astype(np.float32),
+            ids,
+            metadatas,
+            np.ones(len(ids), dtype=bool),
+        )
+
+    def _write_tombstones(self, segment: _Segment):
+        np.save(self._dir / f"{segment.name}.del.npy", np.packbits(~segment.alive))
+
+    def _write_manifest(self):
+        manifest = {
+            "dim": self._dim,
+            "dtype": self._dtype,
+            "segments": [segment.name for segment in self._segments],
+        }
+        tmp_path = self._dir / f"{MANIFEST_FNAME}.tmp"
+        with tmp_path.open("w") as fo:
+            json.dump(manifest, fo)
+        os.replace(tmp_path, self._dir / MANIFEST_FNAME)
+
+    def _remove_segment_files(self, segment: _Segment):
+        for suffix in (".npy", ".norms.npy", ".json", ".del.npy"):
+            (self._dir / f"{segment.name}{suffix}").unlink(missing_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock of the store, which must not be closed"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(
+                    f"The vector store {self._collection_name} is closed"
+                )
+            yield
+
+    # public API
+    def add(
+        self,
+        embeddings: list[list[float]] | list[DocumentWithEmbedding],
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+    ) -> list[str]:
+        if not embeddings:
+            return []
+
+        if not isinstance(embeddings[0], list):
+            docs = embeddings
+            vectors = [doc.embedding for doc in docs]  # type: ignore
+            if metadatas is None:
+                metadatas = [dict(doc.metadata) for doc in docs]  # type: ignore
+            if ids is None:
+                ids = [doc.doc_id for doc in docs]  # type: ignore
+        else:
+            vectors = embeddings  # type: ignore
+
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in vectors]
+        if metadatas is None:
+            metadatas = [{} for _ in vectors]
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("Embeddings must all have the same dimension")
+
+        with self._locked():
+            if self._dim is None:
+                self._dim = matrix.shape[1]
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(
+                    f"Expected embeddings of dimension {self._dim}, "
+                    f"got {matrix.shape[1]}"
+                )
+
+            # re-adding an id overrides the previous embedding
+            self._tombstone([id_ for id_ in ids if id_ in self._id_index])
+
+            segment = self._write_segment(matrix, list(ids), list(metadatas))
+            self._segments.append(segment)
+            for row, id_ in enumerate(segment.ids):
+                self._id_index[id_] = (segment, row)
+            self._write_manifest()
+
+        self._maybe_compact()
+        return list(ids)
+
+    def _tombstone(self, ids: list[str]):
+        touched: dict[str, _Segment] = {}
+        for id_ in ids:
+            if id_ not in self._id_index:
+                continue
+            segment, row = self._id_index.pop(id_)
+            segment.alive[row] = False
+            touched[segment.name] = segment
+
+        for segment in touched.values():
+            self._write_tombstones(segment)
+
+    def delete(self, ids: list[str], **kwargs):
+        with self._locked():
+            self._tombstone(ids)
+        self._maybe_compact()
+
+    def get(self, id_: str) -> list[float]:
+        """Get the embedding of a stored id"""
+        with self._locked():
+            segment, row = self._id_index[id_]
+            return segment.vectors[row].astype(np.float32).tolist()
+
+    def count(self) -> int:
+        with self._locked():
+            return len(self._id_index)
+
+    def _segment_scores(
+        self, segment: _Segment, query: np.ndarray, rows: np.ndarray
+    ) -> np.ndarray:
+        """Cosine similarity between the query and the given rows of a segment"""
+        if len(rows) < len(segment) * SUBSET_GATHER_RATIO:
+            # small scope: gather the allowed rows instead of scoring everything
+            vectors = np.asarray(segment.vectors[rows], dtype=np.float32)
+            scores = vectors @ query
+        elif segment.vectors.dtype == np.float32:
+            scores = (segment.vectors @ query)[rows]
+        else:
+            scores = np.empty(len(segment), dtype=np.float32)
+            for start in range(0, len(segment), QUERY_BLOCK_ROWS):
+                block = segment.vectors[start : start + QUERY_BLOCK_ROWS]
+                scores[start : start + len(block)] = block.astype(np.float32) @ query
+            scores = scores[rows]
+
+        denom = segment.norms[rows] * float(np.linalg.norm(query))
+        return np.divide(scores, denom, out=np.zeros_like(scores), where=denom > 0)
+
+    def query(
+        self,
+        embedding: list[float],
+        top_k: int = 1,
+        ids: Optional[list[str]] = None,
+        allowed_ids: Optional[list[str]] = None,
+        allowed_file_ids: Optional[list[str]] = None,
+        **kwargs,
+    ) -> tuple[list[list[float]], list[float], list[str]]:
+        if allowed_ids is None:
+            allowed_ids = ids
+
+        query = np.asarray(embedding, dtype=np.float32)
+
+        with self._locked():
+            segments = list(self._segments)
+            masks = [segment.alive.copy() for segment in segments]
+            if allowed_ids is not None:
+                positions = {id(segment): i for i, segment in enumerate(segments)}
+                id_masks = [np.zeros_like(mask) for mask in masks]
+                for id_ in allowed_ids:
+                    if id_ in self._id_index:
+                        segment, row = self._id_index[id_]
+                        id_masks[positions[id(segment)]][row] = True
+                masks = [mask & id_mask for mask, id_mask in zip(masks, id_masks)]
+
+        if allowed_file_ids is not None:
+            file_ids = np.asarray([str(file_id) for file_id in allowed_file_ids])
+            masks = [
+                mask & np.isin(segment.file_ids, file_ids)
+                for segment, mask in zip(segments, masks)
+            ]
+
+        all_scores, all_refs = [], []
+        for seg_idx, (segment, mask) in enumerate(zip(segments, masks)):
+            rows = np.flatnonzero(mask)
+            if not len(rows):
+                continue
+            all_scores.append(self._segment_scores(segment, query, rows))
+            all_refs.append(np.stack([np.full(len(rows), seg_idx), rows], axis=1))
+
+        if not all_scores or top_k < 1:
+            return [], [], []
+
+        scores = np.concatenate(all_scores)
+        refs = np.concatenate(all_refs)
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        out_embeddings, out_scores, out_ids = [], [], []
+        for idx in top:
+            seg_idx, row = refs[idx]
+            segment = segments[seg_idx]
+            out_embeddings.append(segment.vectors[row].astype(np.float32).tolist())
+            out_scores.append(float(scores[idx]))
+            out_ids.append(segment.ids[row])
+
+        return out_embeddings, out_scores, out_ids
+
+    def drop(self):
+        """Delete the entire collection"""
+        self.wait_for_compaction()
+        with self._locked():
+            self._segments = []
+            self._id_index = {}
+            self._dim = None
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+    def close(self):
+        """Wait for the compaction and unmap the segments. The store cannot be used
+        afterwards"""
+        with self._lock:
+            self._closed = True
+        self.wait_for_compaction()
+        with self._lock:
+            self._segments = []
+            self._id_index = {}
+
+    # compaction
+    def _tier(self, segment: _Segment) -> int:
+        """Power of `merge_factor` of the number of live rows of the segment"""
+        size, tier = int(segment.alive.sum()), 0
+        while size >= self._merge_factor:
+            size //= self._merge_factor
+            tier += 1
+        return tier
+
+    def _plan_compaction(self) -> list[_Segment]:
+        """The segments to merge next, empty if none"""
+        total = sum(len(segment) for segment in self._segments)
+        if not total:
+            return []
+        if (total - len(self._id_index)) / total > self._compact_ratio:
+            return list(self._segments)
+
+        tiers: dict[int, list[_Segment]] = {}
+        for segment in self._segments:
+            tiers.setdefault(self._tier(segment), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self._merge_factor:
+                return tiers[tier][: self._merge_factor]
+
+        if len(self._segments) > self._max_segments:
+            # the tiers are spread out, the smallest segments are much smaller
+            # than the largest ones
+            by_size = sorted(self._segments, key=lambda segment: segment.alive.sum())
+            return by_size[: self._merge_factor]
+        return []
+
+    def _maybe_compact(self):
+        with self._lock:
+            if self._closed or not self._plan_compaction():
+                return
+            if self._compact_thread is not None and self._compact_thread.is_alive():
+                return
+
+            if not self._background_compaction:
+                self._run_compaction()
+                return
+
+            self._compact_thread = threading.Thread(
+                target=self._run_compaction, daemon=True
+            )
+            self._compact_thread.start()
+
+    def _run_compaction(self):
+        """Merge the planned segments until there is nothing left to merge"""
+        while True:
+            with self._lock:
+                segments = [] if self._closed else self._plan_compaction()
+            if not segments or not self._merge(segments):
+                return
+
+    def wait_for_compaction(self):
+        """Block until the running background compaction (if any) finishes"""
+        thread = self._compact_thread
+        if thread is not None:
+            thread.join()
+
+    def compact(self):
+        """Merge all segments into one, physically dropping deleted rows"""
+        with self._lock:
+            segments = list(self._segments)
+        self._merge(segments)
+
+    def _merge(self, old_segments: list[_Segment]) -> bool:
+        """Merge the segments into one, physically dropping their deleted rows
+
+        Returns:
+            whether the segments were merged
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            snapshots = [segment.alive.copy() for segment in old_segments]
+
+        if len(old_segments) < 2 and all(mask.all() for mask in snapshots):
+            return False
+
+        # the heavy copy happens outside of the lock, segments added meanwhile are
+        # kept after the compacted one
+        vectors, ids, metadatas, origins = [], [], [], []
+        for segment, mask in zip(old_segments, snapshots):
+            rows = np.flatnonzero(mask)
+            vectors.append(np.asarray(segment.vectors[rows], dtype=np.float32))
+            ids.extend(segment.ids[row] for row in rows)
+            metadatas.extend(segment.metadatas[row] for row in rows)
+            origins.extend((segment, row) for row in rows)
+
+        new_segments = []
+        if ids:
+            new_segments.append(
+                self._write_segment(np.concatenate(vectors), ids, metadatas)
+            )
+
+        with self._lock:
+            # re-apply deletes and overrides that happened during the copy
+            for new_row, (segment, row) in enumerate(origins):
+                if not segment.alive[row] or self._id_index.get(ids[new_row]) != (
+                    segment,
+                    row,
+                ):
+                    new_segments[0].alive[new_row] = False
+                else:
+                    self._id_index[ids[new_row]] = (new_segments[0], new_row)
+            if new_segments and not new_segments[0].alive.all():
+                self._write_tombstones(new_segments[0])
+
+            # the merged segment takes the place of the first one it replaces
+            merged = {segment.name for segment in old_segments}
+            position = next(
+                (
+                    idx
+                    for idx, segment in enumerate(self._segments)
+                    if segment.name in merged
+                ),
+                0,
+            )
+            kept = [segment for segment in self._segments if segment.name not in merged]
+            self._segments = kept[:position] + new_segments + kept[position:]
+            self._write_manifest()
+
+        for segment in old_segments:
+            self._remove_segment_files(segment)
+        logger.debug(
+            f"Merged {len(old_segments)} segments into {len(ids)} rows "
+            f"for collection {self._collection_name}"
+        )
+        return True
+
+    def __persist_flow__(self):
+        return {
+            "path": str(self._path),
+            "collection_name": self._collection_name,
+            "dtype": self._dtype,
+            "max_segments": self._max_segments,
+            "merge_factor": self._merge_factor,
+            "compact_ratio": self._compact_ratio,
+            "background_compaction": self._background_compaction,
+            **self._kwargs,
+        }
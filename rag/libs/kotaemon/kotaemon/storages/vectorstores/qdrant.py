@@ -1,6 +1,12 @@
+import logging
 from typing import Any, List, Optional, cast
 
-from .base import LlamaIndexVectorStore
+from kotaemon.base import DocumentWithEmbedding
+
+from ..clients import get_shared_client
+from .base import FILE_ID_KEY, LlamaIndexVectorStore
+
+logger = logging.getLogger(__name__)
 
 
 class QdrantVectorStore(LlamaIndexVectorStore):
@@ -32,13 +38,27 @@ class QdrantVectorStore(LlamaIndexVectorStore):
         self._api_key = api_key
         self._client_kwargs = client_kwargs
         self._kwargs = kwargs
+        self._file_id_indexed = False
+
+        li_kwargs = dict(kwargs)
+        if url and "client" not in li_kwargs:
+            # the collections on the same server share the connection pool
+            from qdrant_client import QdrantClient
+
+            li_kwargs["client"] = get_shared_client(
+                "qdrant",
+                url,
+                lambda url, **kw: QdrantClient(url=url, **kw),
+                api_key=api_key,
+                **(client_kwargs or {}),
+            )
 
         super().__init__(
             collection_name=collection_name,
             url=url,
             api_key=api_key,
             client_kwargs=client_kwargs,
-            **kwargs,
+            **li_kwargs,
         )
         from llama_index.vector_stores.qdrant import (
             QdrantVectorStore as LIQdrantVectorStore,
@@ -46,6 +66,56 @@ class QdrantVectorStore(LlamaIndexVectorStore):
 
         self._client = cast(LIQdrantVectorStore, self._client)
 
+    def _ensure_file_id_index(self):
+        """Create a keyword payload index on `file_id` so that scoped queries are
+        resolved by the index rather than by scanning the payloads"""
+        if self._file_id_indexed:
+            return
+
+        from qdrant_client import models
+
+        try:
+            self._client.client.create_payload_index(
+                collection_name=self._collection_name,
+                field_name=FILE_ID_KEY,
+                field_schema=models.PayloadSchemaType.KEYWORD,
+            )
+        except Exception as e:
+            logger.warning(f"Cannot create payload index on {FILE_ID_KEY}: {e}")
+        self._file_id_indexed = True
+
+    def add(
+        self,
+        embeddings: list[list[float]] | list[DocumentWithEmbedding],
+        metadatas: Optional[list[dict]] = None,
+        ids: Optional[list[str]] = None,
+    ):
+        output = super().add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+        self._ensure_file_id_index()
+        return output
+
+    def _scope_query_kwargs(
+        self,
+        allowed_ids: Optional[list[str]],
+        allowed_file_ids: Optional[list[str]],
+    ) -> dict:
+        from qdrant_client import models
+
+        conditions: list = []
+        if allowed_ids is not None:
+            conditions.append(models.HasIdCondition(has_id=list(allowed_ids)))
+        if allowed_file_ids is not None:
+            conditions.append(
+                models.FieldCondition(
+                    key=FILE_ID_KEY,
+                    match=models.MatchAny(any=list(allowed_file_ids)),
+                )
+            )
+        if not conditions:
+            return {}
+
+        return {"qdrant_filters": models.Filter(must=conditions)}
+
     def delete(self, ids: List[str], **kwargs):
         """Delete vector embeddings from vector stores
 
@@ -15,6 +15,14 @@ def mock_google_search(monkeypatch):
     monkeypatch.setattr(googlesearch, "search", result)
 
 
+@pytest.fixture(scope="session", autouse=True)
+def theflow_storage(tmp_path_factory):
+    """Persist the pipeline runs in a temporary directory, not in the repo"""
+    from theflow.storage import storage
+
+    storage._prefix = tmp_path_factory.mktemp("theflow")
+
+
 def if_haystack_not_installed():
     try:
         import haystack  # noqa: F401
@@ -61,6 +69,17 @@ def if_cohere_not_installed():
         return False
 
 
+def if_onnxruntime_not_installed():
+    try:
+        import onnx  # noqa: F401
+        import onnxruntime  # noqa: F401
+        import tokenizers  # noqa: F401
+    except ImportError:
+        return True
+    else:
+        return False
+
+
 def if_llama_cpp_not_installed():
     try:
         import llama_cpp  # noqa: F401
@@ -97,3 +116,7 @@ skip_openai_lc_wrapper_test = pytest.mark.skipif(
 skip_llama_cpp_not_installed = pytest.mark.skipif(
     if_llama_cpp_not_installed(), reason="llama_cpp is not installed"
 )
+
+skip_when_onnxruntime_not_installed = pytest.mark.skipif(
+    if_onnxruntime_not_installed(), reason="onnxruntime is not installed"
+)
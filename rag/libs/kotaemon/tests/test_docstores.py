@@ -1,3 +1,4 @@
+import json
 import os
 from unittest.mock import patch
 
@@ -5,10 +6,14 @@ import pytest
 from elastic_transport import ApiResponseMeta
 
 from kotaemon.base import Document
+from kotaemon.storages.docstores.bm25 import cjk_tokenize
 from kotaemon.storages import (
+    BM25DocumentStore,
     ElasticsearchDocumentStore,
     InMemoryDocumentStore,
+    LanceDBDocumentStore,
     SimpleFileDocumentStore,
+    SQLiteDocumentStore,
 )
 
 meta_success = ApiResponseMeta(
@@ -84,11 +89,6 @@ _elastic_search_responses = [
             ],
         },
     ),
-    # check exist
-    (
-        meta_success,
-        {"_shards": {"total": 2, "successful": 1, "failed": 0}},
-    ),
     # count
     (
         meta_success,
@@ -131,21 +131,16 @@ _elastic_search_responses = [
     (
         meta_success,
         {
-            "took": 1,
-            "timed_out": False,
-            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
-            "hits": {
-                "total": {"value": 1, "relation": "eq"},
-                "max_score": 1.0,
-                "hits": [
-                    {
-                        "_index": "test",
-                        "_id": "a3774dab-b8f1-43ba-adb8-842cb7a76eeb",
-                        "_score": 1.0,
-                        "_source": {"content": "Sample text 0", "metadata": {}},
-                    }
-                ],
-            },
+            "docs": [
+                {
+                    "_index": "test",
+                    "_id": "a3774dab-b8f1-43ba-adb8-842cb7a76eeb",
+                    "_version": 1,
+                    "found": True,
+                    "_source": {"content": "Sample text 0", "metadata": {}},
+                },
+                {"_index": "test", "_id": "missing", "found": False},
+            ]
         },
     ),
     # query
@@ -199,15 +194,20 @@ _elastic_search_responses = [
             "failures": [],
         },
     ),
-    # check exists
+    # count
     (
         meta_success,
-        {"_shards": {"total": 2, "successful": 1, "failed": 0}},
+        [{"epoch": "1700549363", "timestamp": "06:49:23", "count": "2"}],
     ),
-    # count
+    # query scoped by file
     (
         meta_success,
-        [{"epoch": "1700549363", "timestamp": "06:49:23", "count": "2"}],
+        {
+            "took": 1,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": 0, "relation": "eq"}, "hits": []},
+        },
     ),
 ]
 
@@ -313,13 +313,25 @@ def test_simplefile_document_store_base_interfaces(tmp_path):
     assert len(store.get_all()) == 17, "Document store should have 17 documents"
 
     # Test save
-    assert (tmp_path / "default.json").exists(), "File should exist"
+    assert (tmp_path / "default.msgpack").exists(), "File should exist"
 
     # Test load
     store2 = SimpleFileDocumentStore(path=tmp_path)
     assert len(store2.get_all()) == 17, "Laded document store should have 17 documents"
 
-    os.remove(tmp_path / "default.json")
+    os.remove(tmp_path / "default.msgpack")
+
+
+def test_simplefile_document_store_legacy_json(tmp_path):
+    """The stores saved as JSON are migrated on load"""
+    docs = [Document(text=f"Sample text {idx}") for idx in range(3)]
+    with open(tmp_path / "default.json", "w") as f:
+        json.dump({doc.doc_id: doc.to_dict() for doc in docs}, f)
+
+    store = SimpleFileDocumentStore(path=tmp_path)
+    assert [doc.text for doc in store.get_all()] == [doc.text for doc in docs]
+    assert (tmp_path / "default.msgpack").exists()
+    assert not (tmp_path / "default.json").exists()
 
 
 @patch(
@@ -343,7 +355,8 @@ def test_elastic_document_store(elastic_api):
     first_doc = docs[0]
     assert len(docs) == 3, "Document store get_all() failed"
 
-    doc_by_ids = store.get(first_doc.doc_id)
+    doc_by_ids = store.get([first_doc.doc_id, "missing"])
+    assert len(doc_by_ids) == 1, "Document store get() should skip missing docs"
     assert doc_by_ids[0].doc_id == first_doc.doc_id, "Document store get() failed"
 
     docs = store.query("text")
@@ -353,4 +366,189 @@ def test_elastic_document_store(elastic_api):
     store.delete(first_doc.doc_id)
     assert store.count() == 2, "Document store delete() failed"
 
+    # scoped by a filter on the file ids rather than on the chunk ids
+    assert store.query("text", file_ids=["file-1"]) == []
+    body = elastic_api.call_args.kwargs["body"]
+    assert body["query"]["bool"]["filter"] == [
+        {"terms": {"metadata.file_id": ["file-1"]}}
+    ]
+
     elastic_api.assert_called()
+
+
+def test_lancedb_document_store_deferred_fts(tmp_path):
+    store = LanceDBDocumentStore(path=str(tmp_path), fts_refresh_interval=3600)
+    store.add([Document(text="apple banana", id_="a")])
+    assert [doc.doc_id for doc in store.query("apple")] == ["a"]
+
+    collection = store.db_connection.open_table(store.collection_name)
+    with patch.object(
+        type(collection), "create_fts_index", autospec=True
+    ) as create_fts_index:
+        for idx in range(3):
+            store.add([Document(text=f"apple cherry {idx}", id_=f"c{idx}")])
+        store.delete(["a"])
+        create_fts_index.assert_not_called()
+
+    # the new rows are searchable before the index is refreshed
+    assert {doc.doc_id for doc in store.query("apple")} == {"c0", "c1", "c2"}
+    assert store._fts_timer is not None, "Expect a pending refresh"
+
+    store.refresh()
+    assert store._fts_timer is None
+    (index,) = [i for i in collection.list_indices() if i.index_type == "FTS"]
+    stats = collection.index_stats(index.name)
+    assert stats.num_unindexed_rows == 0
+    assert len(store.query("cherry")) == 3
+
+
+def test_sqlite_document_store_base_interfaces(tmp_path):
+    store = SQLiteDocumentStore(path=tmp_path)
+    docs = [
+        Document(text=f"Sample text {idx}", metadata={"meta_key": f"value_{idx}"})
+        for idx in range(10)
+    ]
+
+    assert store.count() == 0, "Document store should be empty"
+    store.add(docs)
+    assert store.count() == 10, "Document store should have 10 documents"
+
+    with pytest.raises(ValueError):
+        store.add(docs[0])
+    store.add(Document(text="Updated text", id_=docs[0].doc_id), exist_ok=True)
+    assert store.count() == 10
+
+    matched = store.get([docs[2].doc_id, "missing", docs[0].doc_id])
+    assert [doc.doc_id for doc in matched] == [docs[2].doc_id, docs[0].doc_id]
+    assert matched[0].metadata == {"meta_key": "value_2"}
+    assert matched[1].text == "Updated text"
+
+    # full-text search, also after the update and restricted to some ids
+    assert [doc.doc_id for doc in store.query("updated")] == [docs[0].doc_id]
+    assert len(store.query("sample", top_k=3)) == 3
+    matched = store.query("sample text", doc_ids=[docs[4].doc_id, docs[5].doc_id])
+    assert {doc.doc_id for doc in matched} == {docs[4].doc_id, docs[5].doc_id}
+    assert store.query('"unbalanced (query') == []
+
+    store.delete([docs[1].doc_id, docs[2].doc_id])
+    assert store.count() == 8
+    assert store.query("sample", doc_ids=[docs[1].doc_id]) == []
+
+    # persisted on disk
+    store2 = SQLiteDocumentStore(path=tmp_path)
+    assert len(store2.get_all()) == 8, "Loaded document store should have 8 documents"
+
+    store.drop()
+    assert store.count() == 0
+
+
+def test_bm25_document_store(tmp_path):
+    store = BM25DocumentStore(path=tmp_path, max_segments=2)
+    docs = [
+        Document(text="the quick brown fox", id_="fox"),
+        Document(text="the lazy dog sleeps", id_="dog"),
+        Document(text="a quick quick dog runs", id_="quick-dog"),
+    ]
+    store.add(docs[:2])
+    store.add(docs[2:])
+    assert store.count() == 3
+    with pytest.raises(ValueError):
+        store.add(docs[0])
+
+    matched = [doc.doc_id for doc in store.query("quick dog")]
+    assert matched[0] == "quick-dog" and sorted(matched[1:]) == ["dog", "fox"]
+    assert [doc.doc_id for doc in store.query("quick", top_k=1)] == ["quick-dog"]
+    # scoring restricted to the scope
+    assert [doc.doc_id for doc in store.query("quick", doc_ids=["fox", "dog"])] == [
+        "fox"
+    ]
+    assert store.query("quick", doc_ids=[]) == []
+
+    # incremental update and delete, then merge of the segments
+    store.add(Document(text="the quick cat", id_="fox"), exist_ok=True)
+    assert store.get("fox")[0].text == "the quick cat"
+    store.delete(["dog"])
+    assert "dog" not in [doc.doc_id for doc in store.query("dog")]
+    assert len(store._segments) <= 2
+
+    # persisted as memory-mapped arrays
+    store2 = BM25DocumentStore(path=tmp_path)
+    assert sorted(doc.doc_id for doc in store2.get_all()) == ["fox", "quick-dog"]
+    assert [doc.doc_id for doc in store2.query("cat")] == ["fox"]
+
+    store.drop()
+    assert store.count() == 0
+    assert not BM25DocumentStore(path=tmp_path).get_all()
+
+
+def _bm25_postings(store):
+    """The (doc id, term frequency, length) of the live postings of each term"""
+    postings = {}
+    for segment in store._segments:
+        for term in segment.term_index:
+            rows, tfs = segment.postings(term)
+            postings.setdefault(term, set()).update(
+                (segment.ids[row], int(tf), int(segment.doc_lens[row]))
+                for row, tf in zip(rows, tfs)
+                if segment.alive[row]
+            )
+    return {term: value for term, value in postings.items() if value}
+
+
+def test_bm25_tiered_merge(tmp_path):
+    words = ["alpha", "beta", "gamma", "delta", "epsilon"]
+    docs = [
+        Document(text=f"{words[idx % 5]} {words[idx % 3]} doc{idx}", id_=str(idx))
+        for idx in range(60)
+    ]
+    store = BM25DocumentStore(path=tmp_path / "segments")
+    with patch.object(
+        store, "_tokenize", wraps=store._tokenize
+    ) as tokenize, patch.object(
+        store, "_save_segment", wraps=store._save_segment
+    ) as save:
+        for doc in docs:
+            store.add(doc)
+
+    assert tokenize.call_count == 60, "Expect the merges not to tokenize again"
+    merged = sorted(len(call.args[0]) for call in save.call_args_list)
+    assert merged == [1] * 60 + [4] * 15 + [16] * 3
+    assert sorted(len(segment) for segment in store._segments) == [4] * 3 + [16] * 3
+
+    # the merged postings are those of a single segment
+    single = BM25DocumentStore(path=tmp_path / "single")
+    single.add(docs)
+    assert _bm25_postings(store) == _bm25_postings(single)
+    assert store.query("gamma doc7")[0].doc_id == "7"
+
+    # too many deleted rows merge the whole collection
+    store.delete([str(idx) for idx in range(20)])
+    assert [len(segment) for segment in store._segments] == [40]
+    assert store.query("doc3") == [] and store.query("doc33")[0].doc_id == "33"
+    assert BM25DocumentStore(path=tmp_path / "segments").count() == 40
+
+
+@pytest.mark.parametrize("store_class", [SimpleFileDocumentStore, BM25DocumentStore])
+def test_closed_document_store(tmp_path, store_class):
+    store = store_class(path=tmp_path)
+    store.add(Document(text="a", id_="a"))
+    store.close()
+
+    # a closed store would save only the documents added afterwards
+    with pytest.raises(RuntimeError):
+        store.add(Document(text="b", id_="b"))
+    with pytest.raises(RuntimeError):
+        store.count()
+    assert [doc.doc_id for doc in store_class(path=tmp_path).get_all()] == ["a"]
+
+
+def test_cjk_tokenize():
+    assert cjk_tokenize("東京タワー is tall") == [
+        "東京",
+        "京タ",
+        "タワ",
+        "ワー",
+        "is",
+        "tall",
+    ]
+    assert cjk_tokenize("GPT4模型") == ["gpt4", "模型"]
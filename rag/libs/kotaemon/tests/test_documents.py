@@ -1,4 +1,5 @@
-from kotaemon.base.schema import Document, RetrievedDocument
+from kotaemon.base import codec
+from kotaemon.base.schema import Document, DocumentWithEmbedding, RetrievedDocument
 
 from .conftest import skip_when_haystack_not_installed
 
@@ -50,3 +51,54 @@ def test_retrieved_document_attributes():
     assert retrieved_doc.text == sample_text
     assert retrieved_doc.score == score
     assert retrieved_doc.retrieval_metadata == metadata
+
+
+def test_retrieved_document_from_document():
+    doc = Document(text="text", metadata={"file_id": "1"})
+    retrieved_doc = RetrievedDocument.from_document(doc, score=0.5)
+    assert isinstance(retrieved_doc, RetrievedDocument)
+    assert retrieved_doc.doc_id == doc.doc_id
+    assert retrieved_doc.content == doc.content
+    assert retrieved_doc.score == 0.5
+    assert retrieved_doc.retrieval_metadata == {}
+
+    # the metadata is copied, the original document is left untouched
+    retrieved_doc.metadata["type"] = "image"
+    assert doc.metadata == {"file_id": "1"}
+
+    # the fields that the target class does not have are dropped
+    doc = Document.from_document(retrieved_doc)
+    assert type(doc) is Document
+    assert not hasattr(doc, "score")
+
+
+def _sample_documents():
+    return [
+        Document(text="text", metadata={"file_id": "1", "page": 2}),
+        RetrievedDocument(text="retrieved", score=0.25, retrieval_metadata={"rank": 1}),
+        DocumentWithEmbedding(text="embedded", embedding=[0.1, 0.2, 0.3]),
+    ]
+
+
+def test_codec_roundtrip():
+    docs = _sample_documents()
+    loaded = codec.loads(codec.dumps(docs))
+    assert [type(doc) for doc in loaded] == [type(doc) for doc in docs]
+    for doc, loaded_doc in zip(docs, loaded):
+        assert loaded_doc.doc_id == doc.doc_id
+        assert loaded_doc.text == doc.text
+        assert loaded_doc.content == doc.content
+        assert loaded_doc.metadata == doc.metadata
+    assert loaded[1].score == 0.25
+    assert loaded[1].retrieval_metadata == {"rank": 1}
+    assert loaded[2].embedding == [0.1, 0.2, 0.3]
+
+
+def test_codec_arrow_roundtrip():
+    docs = _sample_documents()
+    loaded = codec.from_arrow(codec.to_arrow(docs))
+    assert [type(doc) for doc in loaded] == [type(doc) for doc in docs]
+    assert [doc.doc_id for doc in loaded] == [doc.doc_id for doc in docs]
+    assert loaded[0].metadata == {"file_id": "1", "page": 2}
+    assert loaded[1].score == 0.25
+    assert loaded[2].embedding == [0.1, 0.2, 0.3]
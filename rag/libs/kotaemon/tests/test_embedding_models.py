@@ -1,18 +1,26 @@
 import json
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 from openai.types.create_embedding_response import CreateEmbeddingResponse
 
-from kotaemon.base import Document
+from kotaemon.base import Document, DocumentWithEmbedding
 from kotaemon.embeddings import (
     AzureOpenAIEmbeddings,
+    BaseEmbeddings,
+    CachedEmbeddings,
+    EmbeddingExecutor,
     FastEmbedEmbeddings,
+    InMemoryEmbeddingCache,
     LCCohereEmbeddings,
     LCHuggingFaceEmbeddings,
     OpenAIEmbeddings,
+    SQLiteEmbeddingCache,
+    TeiEndpointEmbeddings,
 )
 
+from kotaemon.embeddings.executor import AdaptiveLimiter
+
 from .conftest import (
     skip_when_cohere_not_installed,
     skip_when_fastembed_not_installed,
@@ -155,3 +163,110 @@ def test_fastembed_embeddings():
     model = FastEmbedEmbeddings()
     output = model("Hello World")
     assert_embedding_result(output)
+
+
+@patch(
+    "openai.resources.embeddings.Embeddings.create",
+    side_effect=lambda *args, **kwargs: openai_embedding,
+)
+def test_cached_embeddings(openai_embedding_call, tmp_path):
+    model = OpenAIEmbeddings(api_key="some-key", model="text-embedding-ada-002")
+    disk_cache = SQLiteEmbeddingCache(path=tmp_path / "cache.db")
+    cached = CachedEmbeddings(
+        embedding=model, cache=InMemoryEmbeddingCache(fallback=disk_cache)
+    )
+
+    output = cached("Hello world")
+    assert_embedding_result(output)
+    output_again = cached("  Hello   world ")
+    assert output_again[0].embedding == output[0].embedding
+    assert openai_embedding_call.call_count == 1, "Expect a cache hit"
+    assert cached.stats()["hits"] == 1
+
+    # the on-disk cache outlives the in-memory one
+    other_cached = CachedEmbeddings(
+        embedding=model, cache=InMemoryEmbeddingCache(fallback=disk_cache)
+    )
+    assert_embedding_result(other_cached("Hello world"))
+    assert openai_embedding_call.call_count == 1, "Expect an on-disk cache hit"
+
+    # a different model must not share the cached embeddings
+    other_model = CachedEmbeddings(
+        embedding=OpenAIEmbeddings(api_key="some-key", model="other-model"),
+        cache=cached.cache,
+    )
+    other_model("Hello world")
+    assert openai_embedding_call.call_count == 2, "Expect a cache miss"
+
+
+def test_embedding_cache_eviction(tmp_path):
+    cache = InMemoryEmbeddingCache(max_size=2)
+    cache.set_many({"a": [0.0], "b": [1.0]})
+    cache.get_many(["a"])
+    cache.set_many({"c": [2.0]})
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}, "Expect LRU eviction"
+
+    disk_cache = SQLiteEmbeddingCache(path=tmp_path / "cache.db", ttl=-1)
+    disk_cache.set_many({"a": [0.5]})
+    assert disk_cache.get_many(["a"]) == {}, "Expect expired entry"
+    assert len(disk_cache) == 0
+
+
+class _RateLimitError(Exception):
+    status_code = 429
+
+
+class _CountingEmbeddings(BaseEmbeddings):
+    def invoke(self, text, *args, **kwargs):
+        docs = self.prepare_input(text)
+        return [
+            DocumentWithEmbedding(content=doc, embedding=[float(len(doc.text))])
+            for doc in docs
+        ]
+
+
+def test_embedding_executor_batches():
+    executor = EmbeddingExecutor(max_batch_size=3, max_batch_tokens=10)
+    assert executor.make_batches(["a"] * 7) == [[0, 1, 2], [3, 4, 5], [6]]
+    # each text counts for 5 tokens, capped by the context length
+    assert executor.make_batches(["x" * 16] * 3) == [[0, 1], [2]]
+    assert executor.make_batches(["x" * 400] * 3, context_length=3) == [[0, 1, 2]]
+
+
+def test_embedding_executor_order_and_rate_limit():
+    calls = []
+
+    class FlakyEmbeddings(_CountingEmbeddings):
+        def invoke(self, text, *args, **kwargs):
+            calls.append(len(text))
+            if len(calls) == 1:
+                raise _RateLimitError()
+            return super().invoke(text, *args, **kwargs)
+
+    executor = EmbeddingExecutor(max_concurrency=4, max_batch_size=2, backoff=0)
+    output = executor.run(FlakyEmbeddings(), ["a" * i for i in range(1, 10)])
+
+    assert [doc.embedding for doc in output] == [[float(i)] for i in range(1, 10)]
+    assert len(calls) == 6, "Expect the rate-limited batch to be retried"
+    executor.shutdown()
+
+    limiter = AdaptiveLimiter(max_limit=4)
+    limiter.on_rate_limit()
+    assert limiter.limit == 2, "Expect the concurrency to back off"
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.limit == 3, "Expect the concurrency to grow back"
+
+
+def test_tei_embeddings_batches():
+    with patch(
+        "kotaemon.embeddings.tei_endpoint_embed.session.post",
+        side_effect=lambda url, json: Mock(
+            json=lambda: [[0.1] for _ in json["inputs"]]
+        ),
+    ) as post:
+        model = TeiEndpointEmbeddings(endpoint_url="http://tei", batch_size=4)
+        output = model([f"text {i}" for i in range(9)])
+
+    assert len(output) == 9
+    assert [len(c.kwargs["json"]["inputs"]) for c in post.call_args_list] == [4, 4, 1]
@@ -0,0 +1,118 @@
+import pytest
+import tiktoken
+
+from kotaemon.base import RetrievedDocument
+from kotaemon.indices.qa import format_context
+from kotaemon.indices.qa.format_context import (
+    EVIDENCE_MODE_TABLE,
+    PrepareEvidencePipeline,
+    count_tokens,
+)
+
+
+@pytest.fixture(autouse=True)
+def offline_encoding(monkeypatch):
+    """Count the bytes when the encoding cannot be downloaded"""
+    try:
+        format_context.get_encoding("cl100k_base")
+    except Exception:
+        encoding = tiktoken.Encoding(
+            name="cl100k_base",
+            pat_str=r"[\s\S]",
+            mergeable_ranks={bytes([i]): i for i in range(256)},
+            special_tokens={},
+        )
+        monkeypatch.setattr(format_context, "get_encoding", lambda name: encoding)
+    format_context.count_tokens.cache_clear()
+    yield
+    format_context.count_tokens.cache_clear()
+
+
+def _doc(text, page, **metadata):
+    return RetrievedDocument(
+        text=text, metadata={"file_name": "test.pdf", "page_label": page, **metadata}
+    )
+
+
+def _block_tokens(pipeline, doc):
+    return count_tokens(pipeline.format_block(doc)[2], pipeline.encoding_name)
+
+
+def test_prepare_evidence_dedup():
+    docs = [_doc("first chunk", 1), _doc("second chunk", 2), _doc("first chunk", 3)]
+    pipeline = PrepareEvidencePipeline()
+    output = pipeline(docs)
+    _, evidence, images = output.content
+
+    assert evidence.count("first chunk") == 1
+    assert "second chunk" in evidence
+    assert images == []
+    assert output.metadata["block_ids"] == [docs[0].doc_id, docs[1].doc_id]
+    assert output.metadata["block_tokens"] == [
+        _block_tokens(pipeline, doc) for doc in docs[:2]
+    ]
+    assert output.metadata["tokens"] == count_tokens(evidence, pipeline.encoding_name)
+
+
+def test_prepare_evidence_packing():
+    docs = [
+        _doc("a short chunk", 1),
+        _doc("a long chunk " * 50, 2),
+        _doc("another short chunk", 3),
+    ]
+    pipeline = PrepareEvidencePipeline()
+    pipeline.max_context_length = _block_tokens(pipeline, docs[0]) + _block_tokens(
+        pipeline, docs[2]
+    )
+    output = pipeline(docs)
+
+    # the long chunk does not fit, the next shorter one is packed
+    assert output.metadata["block_ids"] == [docs[0].doc_id, docs[2].doc_id]
+    assert sum(output.metadata["block_tokens"]) == pipeline.max_context_length
+    assert output.metadata["tokens"] == count_tokens(
+        output.content[1], pipeline.encoding_name
+    )
+
+    # the first block is truncated to the budget
+    pipeline.max_context_length = 10
+    output = pipeline(docs[1:])
+    assert output.metadata["block_ids"] == [docs[1].doc_id]
+    assert output.metadata["tokens"] <= 10
+    assert count_tokens(output.content[1], pipeline.encoding_name) <= 10
+
+
+def test_prepare_evidence_join_tokens(monkeypatch):
+    # the ">" ending a block and the "<" starting the next one make one token
+    ranks = {bytes([i]): i for i in range(256)}
+    ranks[b"><"] = 256
+    encoding = tiktoken.Encoding(
+        name="joins", pat_str=r"[\s\S]+", mergeable_ranks=ranks, special_tokens={}
+    )
+    encoded = []
+
+    class RecordingEncoding:
+        def encode(self, text, **kwargs):
+            encoded.append(text)
+            return encoding.encode(text, **kwargs)
+
+    monkeypatch.setattr(
+        format_context, "get_encoding", lambda name: RecordingEncoding()
+    )
+    format_context.count_tokens.cache_clear()
+
+    docs = [_doc(f"chunk {idx} " * 20, idx) for idx in range(3)]
+    output = PrepareEvidencePipeline()(docs)
+    evidence = output.content[1]
+
+    assert output.metadata["tokens"] == len(encoding.encode(evidence))
+    assert output.metadata["tokens"] == sum(output.metadata["block_tokens"]) - 2
+    assert max(len(text) for text in encoded) < len(evidence)
+
+
+def test_prepare_evidence_max_tables():
+    docs = [_doc(f"table {idx}", idx, type="table") for idx in range(4)]
+    output = PrepareEvidencePipeline(max_tables=2)(docs)
+    evidence_mode, evidence, _ = output.content
+
+    assert evidence_mode == EVIDENCE_MODE_TABLE
+    assert "table 1" in evidence and "table 2" not in evidence
@@ -5,9 +5,10 @@ from unittest.mock import patch
 
 from openai.types.create_embedding_response import CreateEmbeddingResponse
 
-from kotaemon.base import Document
-from kotaemon.embeddings import AzureOpenAIEmbeddings
+from kotaemon.base import Document, RetrievedDocument
+from kotaemon.embeddings import AzureOpenAIEmbeddings, SQLiteEmbeddingCache
 from kotaemon.indices import VectorIndexing, VectorRetrieval
+from kotaemon.indices.fusion import reciprocal_rank_fusion, weighted_score_fusion
 from kotaemon.storages import ChromaVectorStore, InMemoryDocumentStore
 
 with open(Path(__file__).parent / "resources" / "embedding_openai.json") as f:
@@ -18,7 +19,7 @@ with open(Path(__file__).parent / "resources" / "embedding_openai.json") as f:
     "openai.resources.embeddings.Embeddings.create",
     side_effect=lambda *args, **kwargs: openai_embedding,
 )
-def test_indexing(tmp_path):
+def test_indexing(openai_embedding_call, tmp_path):
     db = ChromaVectorStore(path=str(tmp_path))
     doc_store = InMemoryDocumentStore()
     embedding = AzureOpenAIEmbeddings(
@@ -42,7 +43,7 @@ def test_indexing(tmp_path):
     "openai.resources.embeddings.Embeddings.create",
     side_effect=lambda *args, **kwargs: openai_embedding,
 )
-def test_retrieving(tmp_path):
+def test_retrieving(openai_embedding_call, tmp_path):
     db = ChromaVectorStore(path=str(tmp_path))
     doc_store = InMemoryDocumentStore()
     embedding = AzureOpenAIEmbeddings(
@@ -65,3 +66,57 @@ def test_retrieving(tmp_path):
 
     assert len(output) == 1, "Expect 1 results"
     assert output == output1, "Expect identical results"
+
+
+@patch(
+    "openai.resources.embeddings.Embeddings.create",
+    side_effect=lambda *args, **kwargs: openai_embedding,
+)
+def test_indexing_embedding_cache(openai_embedding_call, tmp_path):
+    embedding = AzureOpenAIEmbeddings(
+        azure_deployment="text-embedding-ada-002",
+        azure_endpoint="https://test.openai.azure.com/",
+        api_key="some-key",
+        api_version="version",
+    )
+    cache = SQLiteEmbeddingCache(path=tmp_path / "cache.db")
+
+    for i in range(2):
+        pipeline = VectorIndexing(
+            vector_store=ChromaVectorStore(path=str(tmp_path / f"vs{i}")),
+            doc_store=InMemoryDocumentStore(),
+            embedding=embedding,
+            embedding_cache=cache,
+        )
+        pipeline(text=Document(text="Hello world"))
+        pipeline.vector_store = cast(ChromaVectorStore, pipeline.vector_store)
+        assert pipeline.vector_store._collection.count() == 1, "Index 1 item"
+
+    assert openai_embedding_call.call_count == 1, "Expect the chunk to be cached"
+
+
+def _retrieved(*doc_ids):
+    return [RetrievedDocument(text=doc_id, id_=doc_id) for doc_id in doc_ids]
+
+
+def test_reciprocal_rank_fusion():
+    output = reciprocal_rank_fusion(
+        [_retrieved("a", "b", "c"), _retrieved("c", "d", "a")], top_k=3
+    )
+    assert [doc.doc_id for doc in output] == ["a", "c", "b"], "Expect fused order"
+    assert output[0].metadata["fusion_score"] == 1 / 61 + 1 / 63
+
+    output = reciprocal_rank_fusion(
+        [_retrieved("a", "b"), _retrieved("b")], weights=[1.0, 0.0]
+    )
+    assert [doc.doc_id for doc in output] == ["a", "b"], "Expect weighted order"
+
+
+def test_weighted_score_fusion():
+    output = weighted_score_fusion(
+        [_retrieved("a", "b", "c"), _retrieved("c", "b")],
+        [[0.9, 0.5, 0.1], None],
+        weights=[1.0, 0.5],
+    )
+    assert [doc.doc_id for doc in output] == ["a", "b", "c"], "Expect fused order"
+    assert len(output) == 3, "Expect de-duplicated documents"
@@ -1,7 +1,25 @@
+import os
 from pathlib import Path
 
+import pytest
+
+from kotaemon.base import Document, DocumentWithEmbedding
 from kotaemon.indices.ingests import DocumentIngestor
+from kotaemon.indices.ingests.artifacts import (
+    SQLiteArtifactStore,
+    artifact_key,
+    file_hash,
+)
+from kotaemon.indices.ingests.concurrent import (
+    ConcurrentIngestion,
+    iter_file,
+    load_file,
+)
 from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.loaders import TxtReader
+from kotaemon.loaders.utils.thumbnails import PARSE_WORKER_ENV
+
+resources = Path(__file__).parent / "resources"
 
 
 def test_ingestor_include_src():
@@ -13,3 +31,136 @@ def test_ingestor_include_src():
     nodes = ingestor(dirpath / "resources" / "table.pdf")
     assert type(nodes) is list
     assert nodes[0].relationships
+
+
+def _ingestion_job(ingestion, name, n_steps):
+    def job():
+        fetched = ingestion.fetch(str.upper, name)
+        docs = ingestion.parse(load_file, TxtReader(), resources / "policy.md")
+        with ingestion.indexing():
+            for i in range(n_steps):
+                yield Document(f"{fetched} {i}", channel="debug")
+        return fetched, len(docs)
+
+    return job
+
+
+def test_concurrent_ingestion():
+    ingestion = ConcurrentIngestion(
+        fetch_workers=2, parse_workers=1, index_workers=2, max_files_in_flight=3
+    )
+    jobs = [_ingestion_job(ingestion, f"file{i}", i + 1) for i in range(5)]
+
+    def failing_job():
+        yield Document("start", channel="debug")
+        raise ValueError("cannot parse")
+
+    gen = ingestion.stream(jobs + [failing_job])
+    messages = []
+    while True:
+        try:
+            messages.append(next(gen).text)
+        except StopIteration as e:
+            results = e.value
+            break
+    ingestion.shutdown()
+
+    assert len(messages) == 1 + sum(i + 1 for i in range(5))
+    assert [r for r in results[:5]] == [(f"FILE{i}", 1) for i in range(5)]
+    assert isinstance(results[5], ValueError), "Expect the job error as result"
+    # progress of each job keeps its order
+    assert [m for m in messages if m.startswith("FILE4")] == [
+        f"FILE4 {i}" for i in range(5)
+    ]
+
+
+def test_concurrent_ingestion_parse_worker_env():
+    ingestion = ConcurrentIngestion(parse_workers=1)
+    try:
+        # the loaders know they run in a parse worker, and bound their pools
+        assert ingestion.parse(os.getenv, PARSE_WORKER_ENV) == "1"
+        assert os.getenv(PARSE_WORKER_ENV) is None
+    finally:
+        ingestion.shutdown()
+
+
+def _numbered_docs(n):
+    for i in range(n):
+        yield Document(f"page {i}")
+    if n > 5:
+        raise ValueError("too many pages")
+
+
+def test_concurrent_ingestion_windows():
+    ingestion = ConcurrentIngestion(
+        parse_workers=1, window_size=2, max_windows_in_flight=1
+    )
+    try:
+        windows = list(ingestion.parse_iter(_numbered_docs, 5))
+        assert [[doc.text for doc in window] for window in windows] == [
+            ["page 0", "page 1"],
+            ["page 2", "page 3"],
+            ["page 4"],
+        ]
+
+        # the worker error is raised after the windows parsed before it
+        stream = ingestion.parse_iter(_numbered_docs, 6)
+        assert len(next(stream)) == 2
+        with pytest.raises(ValueError, match="too many pages"):
+            list(stream)
+
+        # loaders without `iter_data` are loaded at once then windowed
+        windows = list(
+            ingestion.parse_iter(iter_file, TxtReader(), resources / "policy.md")
+        )
+        assert [len(window) for window in windows] == [1]
+    finally:
+        ingestion.shutdown()
+
+
+def test_artifact_store(tmp_path):
+    splitter = TokenSplitter(chunk_size=200, chunk_overlap=10)
+    content_hash = file_hash(resources / "policy.md")
+    key = artifact_key(content_hash, TxtReader(), splitter, None)
+    assert key == artifact_key(content_hash, TxtReader(), splitter, None)
+    assert key != artifact_key(
+        content_hash, TxtReader(), TokenSplitter(chunk_size=100), None
+    )
+    assert key != artifact_key(content_hash, TxtReader(), splitter, None, "adobe")
+
+    store = SQLiteArtifactStore(path=tmp_path / "artifacts.db")
+    assert not store.exists(key)
+    assert store.begin(key, "file-1")
+    # an identical file indexed meanwhile does not write the artifact again
+    assert not store.begin(key, "file-2")
+    store.add(
+        key,
+        "file-1",
+        [
+            DocumentWithEmbedding(id_="a", text="chunk a", embedding=[0.5, 1.0]),
+            Document(id_="b", text="chunk b", metadata={"page_label": "1"}),
+        ],
+    )
+    assert not store.exists(key)
+    store.commit(key, "file-1")
+    assert store.exists(key)
+
+    docs = store.get(key)
+    assert [doc.doc_id for doc in docs] == ["a", "b"]
+    assert docs[0].embedding == [0.5, 1.0]
+    assert docs[1].embedding == []
+    assert docs[1].metadata == {"page_label": "1"}
+
+    # the artifact is deleted with its last reference
+    assert store.acquire(key, "file-2") == 2
+    assert store.release(["file-1"]) == []
+    assert store.exists(key)
+    assert store.release(["file-2"]) == [key]
+    assert not store.exists(key)
+    assert store.get(key) == []
+
+    # an aborted artifact can be written again
+    assert store.begin(key, "file-3")
+    store.abort(key, "file-3")
+    assert store.begin(key, "file-4")
+    store.close()
@@ -1,8 +1,12 @@
+import os
+from io import BytesIO
 from pathlib import Path
 from unittest.mock import patch
 
+import fsspec
 from langchain.schema import Document as LangchainDocument
 from llama_index.core.node_parser import SimpleNodeParser
+from PIL import Image
 
 from kotaemon.base import Document
 from kotaemon.loaders import (
@@ -13,6 +17,7 @@ from kotaemon.loaders import (
     MhtmlReader,
     UnstructuredReader,
 )
+from kotaemon.loaders.utils.thumbnails import PARSE_WORKER_ENV, PageThumbnailer
 
 from .conftest import skip_when_unstructured_pdf_not_installed
 
@@ -93,3 +98,99 @@ def test_azureai_document_intelligence_reader(mock_client):
 
     assert len(docs) == 1
     mock_client.assert_called_once()
+
+
+class _MemoryThumbnailStore:
+    def __init__(self):
+        self.objects = {}
+
+    def get_key(self, file_hash, file_extension=""):
+        return f"thumbnails/{file_hash}{file_extension}"
+
+    def exists(self, key):
+        return key in self.objects
+
+    def upload_bytes(self, data, file_hash, file_extension, mime_type):
+        key = self.get_key(file_hash, file_extension)
+        self.objects[key] = (data, mime_type)
+        return key
+
+
+def test_page_thumbnailer():
+    store = _MemoryThumbnailStore()
+    thumbnailer = PageThumbnailer(
+        image_format="jpeg", max_size=64, render_workers=0, store=store
+    )
+    input_path = Path(__file__).parent / "resources" / "multimodal.pdf"
+    try:
+        keys = thumbnailer.thumbnails(input_path, [0, 1, 0])
+        assert keys[0] == keys[2], "Expect the same page to share its thumbnail"
+        assert keys[0] != keys[1]
+        assert len(store.objects) == 2
+
+        data, mime_type = store.objects[keys[0]]
+        assert mime_type == "image/jpeg" and keys[0].endswith(".jpg")
+        assert max(Image.open(BytesIO(data)).size) <= 64
+
+        # pages of a re-indexed file are not uploaded again
+        with patch.object(store, "upload_bytes") as upload_bytes:
+            assert PageThumbnailer(
+                image_format="jpeg", max_size=64, render_workers=0, store=store
+            ).thumbnails(input_path, [1, 0]) == [keys[1], keys[0]]
+            upload_bytes.assert_not_called()
+    finally:
+        thumbnailer.shutdown()
+
+
+def test_page_thumbnailer_in_parse_worker():
+    thumbnailer = PageThumbnailer(
+        image_format="jpeg",
+        max_size=64,
+        render_workers=4,
+        parse_worker_render_workers=1,
+        store=_MemoryThumbnailStore(),
+    )
+    input_path = Path(__file__).parent / "resources" / "multimodal.pdf"
+    try:
+        with patch.dict(os.environ, {PARSE_WORKER_ENV: "1"}):
+            assert thumbnailer.max_render_workers == 1
+            assert len(thumbnailer.thumbnails(input_path, [0, 1])) == 2
+            assert thumbnailer._render_pool is not None
+            assert thumbnailer._render_pool._max_workers == 1
+    finally:
+        thumbnailer.shutdown()
+
+
+def test_page_thumbnailer_remote_file(tmp_path):
+    """A file given as bytes or on a remote file system is rendered by the pool
+    from a temporary local copy"""
+    input_path = Path(__file__).parent / "resources" / "multimodal.pdf"
+    store = _MemoryThumbnailStore()
+    thumbnailer = PageThumbnailer(
+        image_format="jpeg",
+        max_size=64,
+        render_workers=2,
+        pages_per_task=1,
+        store=store,
+    )
+    fs = fsspec.filesystem("memory")
+    fs.pipe("/remote/multimodal.pdf", input_path.read_bytes())
+    try:
+        pool = thumbnailer.render_pool
+        with patch.object(pool, "submit", wraps=pool.submit) as submit:
+            keys = thumbnailer.thumbnails(input_path.read_bytes(), [0, 1])
+            assert submit.call_count == 2, "Expect each page rendered by the pool"
+            local_path = submit.call_args.args[1]
+            assert isinstance(local_path, str) and local_path.endswith(".pdf")
+            assert not Path(local_path).exists(), "Expect the copy to be removed"
+
+            store.objects.clear()
+            thumbnailer._known.clear()
+            submit.reset_mock()
+            assert (
+                thumbnailer.thumbnails("/remote/multimodal.pdf", [0, 1], fs=fs) == keys
+            )
+            assert submit.call_count == 2
+            assert not Path(submit.call_args.args[1]).exists()
+    finally:
+        thumbnailer.shutdown()
@@ -1,14 +1,27 @@
+import math
+import time
 from unittest.mock import patch
 
 import pytest
 from openai.types.chat.chat_completion import ChatCompletion
 
-from kotaemon.base import Document
-from kotaemon.indices.rankings import LLMReranking
+from kotaemon.base import Document, RetrievedDocument
+from kotaemon.indices.rankings import (
+    BaseReranking,
+    CascadeReranking,
+    CascadeStage,
+    LLMReranking,
+    LLMTrulensScoring,
+)
 from kotaemon.llms import AzureChatOpenAI
+from kotaemon.rerankings import InMemoryScoreCache, OnnxCrossEncoderReranking
+from kotaemon.rerankings.onnx_cross_encoder import length_batches
 
-_openai_chat_completion_responses = [
-    ChatCompletion.parse_obj(
+from .conftest import skip_when_onnxruntime_not_installed
+
+
+def _chat_completion(text):
+    return ChatCompletion.parse_obj(
         {
             "id": "chatcmpl-7qyuw6Q1CFCpcKsMdFkmUPUa7JP2x",
             "object": "chat.completion",
@@ -31,6 +44,10 @@ _openai_chat_completion_responses = [
             "usage": {"completion_tokens": 9, "prompt_tokens": 10, "total_tokens": 19},
         }
     )
+
+
+_openai_chat_completion_responses = [
+    _chat_completion(text)
     for text in [
         "YES",
         "NO",
@@ -61,3 +78,253 @@ def test_reranking(openai_completion, llm):
     rerank_docs = reranker(documents, query=query)
 
     assert len(rerank_docs) == 2
+
+
+@patch(
+    "openai.resources.chat.completions.Completions.create",
+    side_effect=[_chat_completion('```json\n{"1": 2, "2": 9, "3": 5}\n```')],
+)
+def test_llm_trulens_scoring_batch(openai_completion, llm):
+    documents = [Document(text=f"test {idx}") for idx in range(3)]
+
+    scorer = LLMTrulensScoring(llm=llm, concurrent=False, batch_size=10)
+    scored_docs = scorer(documents, query="test query")
+
+    assert openai_completion.call_count == 1
+    assert [doc.text for doc in scored_docs] == ["test 1", "test 2", "test 0"]
+    assert [doc.metadata["llm_trulens_score"] for doc in scored_docs] == [
+        0.9,
+        0.5,
+        0.2,
+    ]
+
+
+@patch(
+    "openai.resources.chat.completions.Completions.create",
+    side_effect=[
+        _chat_completion(text) for text in ['{"1": 3, "2": "high"}', "8", "1"]
+    ],
+)
+def test_llm_trulens_scoring_batch_fallback(openai_completion, llm):
+    documents = [Document(text=f"test {idx}") for idx in range(3)]
+
+    scorer = LLMTrulensScoring(llm=llm, concurrent=False, batch_size=10)
+    scored_docs = scorer(documents, query="test query")
+
+    # the unparsed scores are graded one call per document
+    assert openai_completion.call_count == 3
+    assert [doc.text for doc in scored_docs] == ["test 1", "test 0", "test 2"]
+
+
+@patch(
+    "openai.resources.chat.completions.Completions.create",
+    side_effect=[_chat_completion(text) for text in ["YES", "NO", "YES", "NO"]],
+)
+def test_reranking_score_cache(openai_completion, llm):
+    documents = [Document(text=f"test {idx}") for idx in range(3)]
+    cache = InMemoryScoreCache(max_size=10)
+    reranker = LLMReranking(llm=llm, concurrent=False, score_cache=cache)
+
+    assert len(reranker(documents, query="test query")) == 2
+    assert openai_completion.call_count == 3
+
+    # same query up to case and whitespaces, all scores are cached
+    assert len(reranker(documents, query="  Test   query ")) == 2
+    assert openai_completion.call_count == 3
+    assert cache.stats()["hits"] == 3
+
+    # the invalidated chunk is scored again
+    assert cache.invalidate([documents[0].doc_id]) == 1
+    assert len(reranker(documents, query="test query")) == 1
+    assert openai_completion.call_count == 4
+
+
+def test_length_batches():
+    lengths = [10, 200, 12, 190, 11]
+    batches = length_batches(lengths, batch_size=2, max_batch_tokens=1000)
+    assert batches == [[0, 4], [2, 3], [1]]
+
+    # a batch holds at most max_batch_tokens once padded
+    batches = length_batches(lengths, batch_size=8, max_batch_tokens=400)
+    assert batches == [[0, 4, 2], [3, 1]]
+
+
+@pytest.fixture
+def cross_encoder_dir(tmp_path):
+    """A toy cross-encoder scoring the pairs by their number of tokens"""
+    import onnx
+    from onnx import TensorProto, helper
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+
+    vocab = {"[PAD]": 0, "[UNK]": 1, "[CLS]": 2, "[SEP]": 3}
+    for word in "the query a b c d e f".split():
+        vocab[word] = len(vocab)
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]",
+        pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", 2), ("[SEP]", 3)],
+    )
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+
+    graph = helper.make_graph(
+        [
+            helper.make_node("Cast", ["attention_mask"], ["mask"], to=1),
+            helper.make_node("ReduceSum", ["mask", "axes"], ["sum"], keepdims=1),
+            helper.make_node("Sub", ["sum", "offset"], ["logits"]),
+        ],
+        "toy",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, [None, None]),
+            helper.make_tensor_value_info(
+                "attention_mask", TensorProto.INT64, [None, None]
+            ),
+        ],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, [None, 1])],
+        initializer=[
+            helper.make_tensor("axes", TensorProto.INT64, [1], [1]),
+            helper.make_tensor("offset", TensorProto.FLOAT, [], [8.0]),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    (tmp_path / "onnx").mkdir()
+    onnx.save(model, str(tmp_path / "onnx" / "model.onnx"))
+    return tmp_path
+
+
+@skip_when_onnxruntime_not_installed
+def test_onnx_cross_encoder_reranking(cross_encoder_dir):
+    documents = [
+        Document(text="a b"),
+        Document(text="a b c d e f a b c d e f"),
+        Document(text="a b c d"),
+        Document(text="a b c d e f a b c d e f a b c d e f"),
+    ]
+    reranker = OnnxCrossEncoderReranking(
+        model_path=str(cross_encoder_dir),
+        model_file="onnx/model.onnx",
+        max_length=16,
+        batch_size=2,
+        threads=1,
+    )
+    reranked = reranker(documents, query="the query")
+
+    # [CLS] the query [SEP] ... [SEP] is 5 tokens, 2 + 5 - 8 = -1
+    assert reranked[-1].text == "a b"
+    assert reranked[-1].metadata["reranking_score"] == pytest.approx(
+        1 / (1 + math.exp(1)), rel=1e-5
+    )
+    # the documents are truncated to the 16 tokens of the pair
+    assert reranked[0].metadata["reranking_score"] == pytest.approx(
+        reranked[1].metadata["reranking_score"]
+    )
+    assert reranked[0].metadata["reranking_score"] == pytest.approx(
+        1 / (1 + math.exp(-8)), rel=1e-5
+    )
+    assert reranked[2].text == "a b c d"
+
+
+class LengthReranking(BaseReranking):
+    """Score the documents by their number of words, after `delay` seconds"""
+
+    delay: float = 0.0
+
+    def run(self, documents, query):
+        time.sleep(self.delay)
+        for doc in documents:
+            doc.metadata["reranking_score"] = len(doc.text.split()) / 10
+        return sorted(
+            documents, key=lambda x: x.metadata["reranking_score"], reverse=True
+        )
+
+
+def _cascade_documents():
+    return [
+        RetrievedDocument(text=" ".join(["w"] * (idx + 1)), score=1 - idx / 10)
+        for idx in range(8)
+    ]
+
+
+def test_cascade_reranking():
+    cascade = CascadeReranking(
+        stages=[
+            CascadeStage(name="retrieval", top_k=6, min_score=0.25),
+            CascadeStage(
+                name="cross_encoder",
+                reranker=LengthReranking(),
+                score_key="reranking_score",
+                top_k=3,
+                min_score=0.3,
+            ),
+            CascadeStage(
+                name="llm",
+                reranker=LengthReranking(),
+                score_key="reranking_score",
+                top_k=2,
+            ),
+        ]
+    )
+    docs, timings = cascade.run_with_timings(_cascade_documents(), query="query")
+
+    assert [len(doc.text.split()) for doc in docs] == [6, 5]
+    assert [(t["stage"], t["status"], t["input"], t["output"]) for t in timings] == [
+        ("retrieval", "ok", 8, 6),
+        ("cross_encoder", "ok", 6, 3),
+        ("llm", "ok", 3, 2),
+    ]
+
+    # all the documents kept by the cross-encoder are relevant enough
+    cascade.stages[1].exit_score = 0.4
+    docs, timings = cascade.run_with_timings(_cascade_documents(), query="query")
+    assert len(docs) == 3
+    assert [t["status"] for t in timings] == ["ok", "early_exit", "skipped"]
+
+    # no document is relevant enough
+    cascade.stages[1].min_score = 0.9
+    docs, timings = cascade.run_with_timings(_cascade_documents(), query="query")
+    assert docs == []
+    assert [t["status"] for t in timings] == ["ok", "early_exit", "skipped"]
+
+
+def test_cascade_reranking_budget():
+    cascade = CascadeReranking(
+        stages=[
+            CascadeStage(
+                name="cross_encoder",
+                reranker=LengthReranking(delay=0.5),
+                score_key="reranking_score",
+                top_k=3,
+                budget=0.05,
+            ),
+            CascadeStage(name="llm", reranker=LengthReranking(), top_k=2),
+        ]
+    )
+    documents = _cascade_documents()
+    docs, timings = cascade.run_with_timings(documents, query="query")
+
+    # the stage over its budget keeps the retrieval order, the later stages
+    # are skipped
+    assert docs == documents[:3]
+    assert [t["status"] for t in timings] == ["timeout", "skipped"]
+    assert timings[0]["elapsed"] < 0.5
+
+    # the late stage does not edit the returned documents
+    time.sleep(0.6)
+    assert all("reranking_score" not in doc.metadata for doc in docs)
+
+
+def test_cascade_reranking_budget_exhausted():
+    cascade = CascadeReranking(
+        stages=[CascadeStage(name="llm", reranker=LengthReranking(), top_k=2)],
+        budget=0.0,
+    )
+    documents = _cascade_documents()
+    with patch.object(LengthReranking, "run", autospec=True) as run:
+        docs, timings = cascade.run_with_timings(documents, query="query")
+
+    # the stage is not started once the budget of the cascade is spent
+    run.assert_not_called()
+    assert docs == documents[:2]
+    assert [t["status"] for t in timings] == ["skipped"]
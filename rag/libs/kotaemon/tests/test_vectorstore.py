@@ -1,5 +1,6 @@
 import json
 import os
+from unittest.mock import MagicMock, patch
 
 import pytest
 
@@ -8,9 +9,11 @@ from kotaemon.storages import (
     ChromaVectorStore,
     InMemoryVectorStore,
     MilvusVectorStore,
+    NumpyVectorStore,
     QdrantVectorStore,
     SimpleFileVectorStore,
 )
+from kotaemon.storages.clients import shared_clients_stats
 
 
 class TestChromaVectorStore:
@@ -71,6 +74,28 @@ class TestChromaVectorStore:
         _, _, out_ids = db.query(embedding=[0.42, 0.52, 0.53], top_k=1)
         assert out_ids == ["b"]
 
+    def test_query_scope(self, tmp_path):
+        db = ChromaVectorStore(path=str(tmp_path))
+
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
+        metadatas = [{"file_id": "x"}, {"file_id": "y"}, {"file_id": "y"}]
+        ids = ["a", "b", "c"]
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+        li_class = type(db._client)
+        with patch.object(
+            li_class, "_query", autospec=True, side_effect=li_class._query
+        ) as chroma_query:
+            _, _, out_ids = db.query(
+                embedding=[0.1, 0.2, 0.3], top_k=3, allowed_file_ids=["y"]
+            )
+        assert sorted(out_ids) == ["b", "c"]
+        # the files are prefiltered by chroma
+        assert chroma_query.call_args.kwargs["where"] == {"file_id": {"$in": ["y"]}}
+
+        _, _, out_ids = db.query(embedding=[0.1, 0.2, 0.3], top_k=3, allowed_ids=[])
+        assert out_ids == []
+
     def test_save_load_delete(self, tmp_path):
         """Test that save/load func behave correctly."""
         embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
@@ -92,6 +117,16 @@ class TestChromaVectorStore:
             db2._collection.count() == 0
         ), "delete collection function does not work correctly"
 
+    def test_shared_client(self, tmp_path):
+        db = ChromaVectorStore(path=str(tmp_path), collection_name="first")
+        db2 = ChromaVectorStore(path=str(tmp_path), collection_name="second")
+        assert db._collection._client is db2._collection._client
+        assert shared_clients_stats().get("chroma", 0) >= 1
+
+        db.add(embeddings=[[0.1, 0.2, 0.3]], ids=["1"])
+        assert db._collection.count() == 1
+        assert db2._collection.count() == 0
+
 
 class TestInMemoryVectorStore:
     def test_add(self):
@@ -105,6 +140,23 @@ class TestInMemoryVectorStore:
         output = db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
         assert output == ids, "Excepted output to be the same as ids"
 
+    def test_query_scope(self):
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
+        metadatas = [{"file_id": "x"}, {"file_id": "y"}, {"file_id": "y"}]
+        ids = ["1", "2", "3"]
+        db = InMemoryVectorStore()
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3], top_k=3, allowed_file_ids=["y"]
+        )
+        assert sorted(out_ids) == ["2", "3"]
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3], top_k=3, allowed_ids=["1", "3"]
+        )
+        assert out_ids == ["1", "3"]
+
     def test_save_load_delete(self, tmp_path):
         """Test that delete func deletes correctly."""
         embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
@@ -159,6 +211,128 @@ class TestSimpleFileVectorStore:
         os.remove(tmp_path / collection_name)
 
 
+class TestNumpyVectorStore:
+    def test_add_query(self, tmp_path):
+        db = NumpyVectorStore(path=tmp_path)
+
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.1]]
+        metadatas = [{"a": 1, "b": 2}, {"a": 3, "b": 4}, {"a": 5, "b": 6}]
+        ids = ["a", "b", "c"]
+
+        output = db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+        assert output == ids, "Expected output to be the same as ids"
+        assert db.count() == 3, "Expected 3 added entries"
+
+        _, sim, out_ids = db.query(embedding=[0.1, 0.2, 0.3], top_k=1)
+        assert abs(sim[0] - 1.0) < 1e-6
+        assert out_ids == ["a"]
+
+        _, _, out_ids = db.query(embedding=[0.7, 0.8, 0.1], top_k=2, ids=["a", "b"])
+        assert out_ids == ["b", "a"], "Expected query restricted to given ids"
+
+    def test_query_scope(self, tmp_path):
+        db = NumpyVectorStore(path=tmp_path)
+        db.add(
+            embeddings=[[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]],
+            metadatas=[{"file_id": "x"}, {"file_id": "y"}],
+            ids=["a", "b"],
+        )
+        db.add(
+            embeddings=[[0.1, 0.2, 0.3]],
+            metadatas=[{"file_id": "z"}],
+            ids=["c"],
+        )
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3], top_k=3, allowed_file_ids=["y", "z"]
+        )
+        assert out_ids == ["c", "b"]
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3],
+            top_k=3,
+            allowed_ids=["a", "b"],
+            allowed_file_ids=["y"],
+        )
+        assert out_ids == ["b"]
+
+        _, _, out_ids = db.query(embedding=[0.1, 0.2, 0.3], allowed_file_ids=[])
+        assert out_ids == []
+
+    def test_delete_load(self, tmp_path):
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
+        ids = ["1", "2", "3"]
+        db = NumpyVectorStore(path=tmp_path, collection_name="test")
+        db.add(embeddings=embeddings[:2], ids=ids[:2])
+        db.add(embeddings=embeddings[2:], ids=ids[2:])
+        db.delete(["3"])
+        db.wait_for_compaction()
+        assert db.count() == 2, "Expected 1 deleted entry"
+
+        db2 = NumpyVectorStore(path=tmp_path, collection_name="test")
+        assert db2.count() == 2, "load function does not load data completely"
+        assert db2.get("2") == pytest.approx([0.4, 0.5, 0.6])
+        _, _, out_ids = db2.query(embedding=[0.7, 0.8, 0.9], top_k=3)
+        assert "3" not in out_ids, "Expected deleted entry to be skipped"
+
+        db2.drop()
+        db3 = NumpyVectorStore(path=tmp_path, collection_name="test")
+        assert db3.count() == 0, "drop function does not work correctly"
+
+    def test_close(self, tmp_path):
+        db = NumpyVectorStore(path=tmp_path, collection_name="test")
+        db.add(embeddings=[[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]], ids=["1", "2"])
+        db.close()
+        assert db._segments == [], "Expected the segments to be unmapped"
+        with pytest.raises(RuntimeError):
+            db.add(embeddings=[[0.7, 0.8, 0.9]], ids=["3"])
+
+        db2 = NumpyVectorStore(path=tmp_path, collection_name="test")
+        assert db2.count() == 2, "Expected the collection to stay on disk"
+
+    def test_compaction(self, tmp_path):
+        db = NumpyVectorStore(
+            path=tmp_path, max_segments=2, background_compaction=False
+        )
+        for idx in range(4):
+            db.add(embeddings=[[float(idx), 1.0, 0.0]], ids=[str(idx)])
+        db.delete(["0"])
+
+        assert len(db._segments) <= 2, "Expected segments to be merged"
+        assert db.count() == 3
+        _, _, out_ids = db.query(embedding=[3.0, 1.0, 0.0], top_k=1)
+        assert out_ids == ["3"]
+
+    def test_tiered_compaction(self, tmp_path):
+        db = NumpyVectorStore(path=tmp_path, background_compaction=False)
+        with patch.object(db, "_write_segment", wraps=db._write_segment) as write:
+            for idx in range(60):
+                db.add(embeddings=[[float(idx), 1.0, 0.0]], ids=[str(idx)])
+
+        merged = [len(call.args[1]) for call in write.call_args_list]
+        assert (
+            sorted(size for size in merged if size > 1) == [4] * 15 + [16] * 3
+        ), "Expect only segments of similar size to be merged"
+        assert sorted(len(segment) for segment in db._segments) == [4] * 3 + [16] * 3
+        assert db.count() == 60
+
+        # too many deleted rows rewrite the whole collection
+        db.delete([str(idx) for idx in range(20)])
+        assert [len(segment) for segment in db._segments] == [40]
+        _, _, out_ids = db.query(embedding=[59.0, 1.0, 0.0], top_k=1)
+        assert out_ids == ["59"]
+
+        db2 = NumpyVectorStore(path=tmp_path)
+        assert db2.count() == 40, "Expect the merged segments to be persisted"
+
+    def test_float16(self, tmp_path):
+        db = NumpyVectorStore(path=tmp_path, dtype="float16")
+        db.add(embeddings=[[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]], ids=["a", "b"])
+        _, sim, out_ids = db.query(embedding=[0.4, 0.5, 0.6], top_k=1)
+        assert out_ids == ["b"]
+        assert abs(sim[0] - 1.0) < 1e-3
+
+
 class TestMilvusVectorStore:
     def test_add(self, tmp_path):
         """Test that the DB add correctly"""
@@ -235,6 +409,65 @@ class TestMilvusVectorStore:
         _, _, out_ids = db.query(embedding=query_embedding, top_k=1)
         assert out_ids == ["b"]
 
+    def test_query_scope(self, tmp_path):
+        db = MilvusVectorStore(path=str(tmp_path), overwrite=True)
+
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
+        metadatas = [{"file_id": "x"}, {"file_id": "y"}, {"file_id": "y"}]
+        ids = ["a", "b", "c"]
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3], top_k=3, allowed_file_ids=["y"]
+        )
+        assert sorted(out_ids) == ["b", "c"]
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3], top_k=3, allowed_ids=["a", "c"]
+        )
+        assert sorted(out_ids) == ["a", "c"]
+
+        _, _, out_ids = db.query(embedding=[0.1, 0.2, 0.3], top_k=3, allowed_ids=[])
+        assert out_ids == []
+
+    def test_query_scope_filter(self):
+        """The scope is prefiltered by Milvus with a boolean expression"""
+        db = MilvusVectorStore(collection_name="test")
+        db._inited = True
+        db._client = MagicMock(embedding_field="embedding", search_config={})
+        search = db._client.client.search
+        search.return_value = [
+            [{"id": "b", "distance": 0.9, "entity": {"embedding": [0.4, 0.5, 0.6]}}]
+        ]
+
+        output = db.query(
+            embedding=[0.1, 0.2, 0.3],
+            top_k=2,
+            allowed_ids=["a", "b"],
+            allowed_file_ids=["y"],
+        )
+        assert output == ([[0.4, 0.5, 0.6]], [0.9], ["b"])
+        assert search.call_args.kwargs["filter"] == (
+            'id in ["a", "b"] and file_id in ["y"]'
+        )
+        assert search.call_args.kwargs["collection_name"] == "test"
+        assert search.call_args.kwargs["limit"] == 2
+
+        db.query(embedding=[0.1, 0.2, 0.3], top_k=2, allowed_file_ids=["x", "y"])
+        assert search.call_args.kwargs["filter"] == 'file_id in ["x", "y"]'
+
+        # the ids of the legacy `ids` argument are quoted like the others
+        db.query(embedding=[0.1, 0.2, 0.3], ids=[1, 'c"d'])
+        assert search.call_args.kwargs["filter"] == 'id in ["1", "c\\"d"]'
+
+        search.reset_mock()
+        assert db.query(embedding=[0.1, 0.2, 0.3], allowed_file_ids=[]) == (
+            [],
+            [],
+            [],
+        )
+        search.assert_not_called()
+
     def test_save_load_delete(self, tmp_path):
         """Test that save/load func behave correctly."""
         embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
@@ -333,6 +566,30 @@ class TestQdrantVectorStore:
         _, _, out_ids = db.query(embedding=[0.4, 0.5, 0.6], top_k=1)
         assert out_ids == ["90aba5d3-f4f8-47c6-bad9-5ea457442e07"]
 
+    def test_query_scope(self):
+        from qdrant_client import QdrantClient
+
+        db = QdrantVectorStore(collection_name="test", client=QdrantClient(":memory:"))
+
+        embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
+        metadatas = [{"file_id": "x"}, {"file_id": "y"}, {"file_id": "y"}]
+        ids = [
+            "0f0611b3-2d9c-4818-ab69-1f1c4cf66693",
+            "90aba5d3-f4f8-47c6-bad9-5ea457442e07",
+            "6bed07c3-d284-47a3-a711-c3f9186755b8",
+        ]
+        db.add(embeddings=embeddings, metadatas=metadatas, ids=ids)
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3], top_k=3, allowed_file_ids=["y"]
+        )
+        assert sorted(out_ids) == sorted(ids[1:])
+
+        _, _, out_ids = db.query(
+            embedding=[0.1, 0.2, 0.3], top_k=3, allowed_ids=[ids[2]]
+        )
+        assert out_ids == [ids[2]]
+
     def test_save_load_delete(self, tmp_path):
         """Test that save/load func behave correctly."""
         embeddings = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6], [0.7, 0.8, 0.9]]
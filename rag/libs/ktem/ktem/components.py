@@ -1,39 +1,205 @@
 """Common components, some kind of config"""
 
 import logging
-from functools import cache
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Generic, Iterator, Optional, TypeVar
 
 from theflow.settings import settings
 from theflow.utils.modules import deserialize
 
 from kotaemon.base import BaseComponent
 from kotaemon.storages import BaseDocumentStore, BaseVectorStore
+from kotaemon.storages.clients import shared_clients_stats
 
 logger = logging.getLogger(__name__)
 
+S = TypeVar("S", BaseDocumentStore, BaseVectorStore)
+
 
 filestorage_path = Path(settings.KH_FILESTORAGE_PATH)
 filestorage_path.mkdir(parents=True, exist_ok=True)
 
 
-@cache
-def get_docstore(collection_name: str = "default") -> BaseDocumentStore:
-    from copy import deepcopy
+class StoreRegistry(Generic[S]):
+    """Registry of the stores by collection name, least recently used first out
+
+    At most `max_size` stores are kept, the least recently used one is evicted
+    beyond. The pipelines using a store across calls lease it with `lease` (or
+    `acquire` and `release`): an evicted store is closed once its last lease is
+    released, so that the memory and the connections it holds are released.
+    Until then, getting its collection brings it back instead of creating a
+    second store of the collection, whose writes would overwrite each other. An
+    evicted store that is not leased is closed right away.
+
+    Args:
+        factory: create the store of a collection name
+        max_size: maximum number of resident stores, None for unbounded
+    """
+
+    def __init__(self, factory: Callable[[str], S], max_size: Optional[int] = 32):
+        self.factory = factory
+        self.max_size = max_size
+        self._stores: OrderedDict[str, S] = OrderedDict()
+        # evicted stores still leased by a running pipeline, by collection name
+        self._retired: dict[str, S] = {}
+        # number of leases by collection name
+        self._leases: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.closed = 0
+
+    def get(self, collection_name: str = "default") -> S:
+        """Get the store of the collection, created on first use
+
+        The store is not leased, it can be closed once evicted: lease it to use
+        it across calls.
+        """
+        with self._lock:
+            store = self._get(collection_name)
+            self._close_retired()
+        return store
+
+    def acquire(self, collection_name: str = "default") -> S:
+        """Get the store of the collection and lease it until `release`"""
+        with self._lock:
+            store = self._get(collection_name)
+            self._leases[collection_name] = self._leases.get(collection_name, 0) + 1
+            self._close_retired()
+        return store
+
+    def release(self, collection_name: str = "default"):
+        """Release a lease of `acquire`, closing the store if it was evicted and
+        this was its last lease"""
+        with self._lock:
+            count = self._leases.get(collection_name, 0) - 1
+            if count < 0:
+                raise ValueError(f"The store {collection_name} is not leased")
+            if count:
+                self._leases[collection_name] = count
+            else:
+                del self._leases[collection_name]
+                self._close_retired()
+
+    @contextmanager
+    def lease(self, collection_name: str = "default") -> Iterator[S]:
+        """Lease the store of the collection while in the context"""
+        store = self.acquire(collection_name)
+        try:
+            yield store
+        finally:
+            self.release(collection_name)
+
+    def _get(self, collection_name: str) -> S:
+        store = self._stores.get(collection_name)
+        if store is not None:
+            self._stores.move_to_end(collection_name)
+            self.hits += 1
+            return store
+
+        store = self._retired.pop(collection_name, None)
+        if store is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            store = self.factory(collection_name)
+        self._stores[collection_name] = store
+        while self.max_size is not None and len(self._stores) > self.max_size:
+            name, evicted = self._stores.popitem(last=False)
+            self._retired[name] = evicted
+            self.evictions += 1
+        return store
+
+    def evict(self, collection_name: str):
+        """Remove the store of the collection, e.g. once it is dropped"""
+        with self._lock:
+            store = self._stores.pop(collection_name, None)
+            if store is not None:
+                self._retired[collection_name] = store
+            self._close_retired()
+
+    def _close_retired(self):
+        """Close the evicted stores that are not leased"""
+        for name in [name for name in self._retired if name not in self._leases]:
+            store = self._retired.pop(name)
+            try:
+                store.close()
+            except Exception as e:
+                logger.warning(f"Cannot close the store {store}: {e}")
+            self.closed += 1
+
+    def close(self):
+        """Close all the stores, e.g. on shutdown"""
+        with self._lock:
+            stores = list(self._stores.values()) + list(self._retired.values())
+            self._stores.clear()
+            self._retired = {}
+        for store in stores:
+            store.close()
+            self.closed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "resident": len(self._stores),
+                "pending_close": len(self._retired),
+                "leases": sum(self._leases.values()),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "closed": self.closed,
+                "collections": list(self._stores),
+            }
+
+
+def _store_factory(setting: str) -> Callable[[str], S]:
+    def factory(collection_name: str) -> S:
+        conf = deepcopy(getattr(settings, setting))
+        conf["collection_name"] = collection_name
+        return deserialize(conf, safe=False)
+
+    return factory
+
+
+docstores: StoreRegistry[BaseDocumentStore] = StoreRegistry(
+    _store_factory("KH_DOCSTORE"),
+    max_size=getattr(settings, "KH_DOCSTORE_REGISTRY_SIZE", 32),
+)
+vectorstores: StoreRegistry[BaseVectorStore] = StoreRegistry(
+    _store_factory("KH_VECTORSTORE"),
+    max_size=getattr(settings, "KH_VECTORSTORE_REGISTRY_SIZE", 32),
+)
+
 
-    ds_conf = deepcopy(settings.KH_DOCSTORE)
-    ds_conf["collection_name"] = collection_name
-    return deserialize(ds_conf, safe=False)
+def get_docstore(collection_name: str = "default") -> BaseDocumentStore:
+    return docstores.get(collection_name)
 
 
-@cache
 def get_vectorstore(collection_name: str = "default") -> BaseVectorStore:
-    from copy import deepcopy
+    return vectorstores.get(collection_name)
+
+
+def store_stats() -> dict:
+    """Resident stores, shared clients and memory of the process"""
+    try:
+        import psutil
+
+        rss: Optional[int] = psutil.Process().memory_info().rss
+    except ImportError:
+        rss = None
 
-    vs_conf = deepcopy(settings.KH_VECTORSTORE)
-    vs_conf["collection_name"] = collection_name
-    return deserialize(vs_conf, safe=False)
+    return {
+        "docstores": docstores.stats(),
+        "vectorstores": vectorstores.stats(),
+        "shared_clients": shared_clients_stats(),
+        "rss_bytes": rss,
+    }
 
 
 class ModelPool:
@@ -1,4 +1,58 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Iterable, TypeVar
+
+from sqlalchemy.engine import URL, make_url
 from sqlmodel import create_engine
 from theflow.settings import settings
 
-engine = create_engine(settings.KH_DATABASE)
+T = TypeVar("T")
+
+
+def engine_options(url: str | URL) -> dict:
+    """The connection pool options of an engine, from the settings"""
+    if make_url(url).get_backend_name() == "sqlite":
+        # sqlite picks its own pool depending on the database being in memory
+        return {}
+    return {
+        "pool_size": getattr(settings, "KH_DATABASE_POOL_SIZE", 10),
+        "max_overflow": getattr(settings, "KH_DATABASE_MAX_OVERFLOW", 20),
+        "pool_timeout": getattr(settings, "KH_DATABASE_POOL_TIMEOUT", 30),
+        "pool_recycle": getattr(settings, "KH_DATABASE_POOL_RECYCLE", 1800),
+        "pool_pre_ping": getattr(settings, "KH_DATABASE_POOL_PRE_PING", True),
+    }
+
+
+_engine_options = engine_options(settings.KH_DATABASE)
+engine = create_engine(settings.KH_DATABASE, **_engine_options)
+
+
+# the blocking work (ORM sessions, synchronous pipelines) of the async endpoints
+# runs in this executor, sized so that its threads do not wait for a connection
+sync_executor = ThreadPoolExecutor(
+    max_workers=getattr(
+        settings,
+        "KH_SYNC_EXECUTOR_WORKERS",
+        _engine_options.get("pool_size", 10) + _engine_options.get("max_overflow", 20),
+    ),
+    thread_name_prefix="sync",
+)
+
+
+async def run_sync(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run the blocking `fn` off the event loop, in the sync executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(sync_executor, partial(fn, *args, **kwargs))
+
+
+async def iterate_sync(iterable: Iterable[T]) -> AsyncIterator[T]:
+    """Iterate a blocking iterator, e.g. the `stream` of a pipeline, off the
+    event loop: each item is produced in the sync executor"""
+    iterator = iter(iterable)
+    sentinel = object()
+    while True:
+        item = await run_sync(next, iterator, sentinel)
+        if item is sentinel:
+            break
+        yield item  # type: ignore
@@ -6,6 +6,8 @@ from theflow.settings import settings as flowsettings
 from theflow.utils.modules import deserialize
 
 from kotaemon.embeddings.base import BaseEmbeddings
+from kotaemon.embeddings.cache import BaseEmbeddingCache, CachedEmbeddings
+from kotaemon.embeddings.executor import EmbeddingExecutor
 
 from .db import EmbeddingTable, engine
 
@@ -18,6 +20,20 @@ class EmbeddingManager:
         self._info: dict[str, dict] = {}
         self._default: str = ""
         self._vendors: list[Type] = []
+        self._query_models: dict[str, BaseEmbeddings] = {}
+        self._query_cache: Optional[BaseEmbeddingCache] = None
+        self.chunk_embedding_cache: Optional[BaseEmbeddingCache] = None
+        self.embedding_executor: Optional[EmbeddingExecutor] = None
+
+        query_cache_spec = getattr(flowsettings, "KH_QUERY_EMBEDDING_CACHE", None)
+        if query_cache_spec:
+            self._query_cache = deserialize(query_cache_spec, safe=False)
+        chunk_cache_spec = getattr(flowsettings, "KH_CHUNK_EMBEDDING_CACHE", None)
+        if chunk_cache_spec:
+            self.chunk_embedding_cache = deserialize(chunk_cache_spec, safe=False)
+        executor_spec = getattr(flowsettings, "KH_EMBEDDING_EXECUTOR", None)
+        if executor_spec:
+            self.embedding_executor = deserialize(executor_spec, safe=False)
 
         # populate the pool if empty
         if hasattr(flowsettings, "KH_EMBEDDINGS"):
@@ -37,6 +53,7 @@ class EmbeddingManager:
     def load(self):
         """Load the model pool from database"""
         self._models, self._info, self._default = {}, {}, ""
+        self._query_models = {}
         with Session(engine) as sess:
             stmt = select(EmbeddingTable)
             items = sess.execute(stmt)
@@ -77,6 +94,27 @@ class EmbeddingManager:
         """Get model by name"""
         return self._models[key]
 
+    def get_query_embedding(self, key: str) -> BaseEmbeddings:
+        """Get model by name, wrapped with the shared query-embedding cache
+
+        Use it to embed the user questions, which are often repeated (regenerate,
+        follow-ups, question decomposition).
+        """
+        if self._query_cache is None:
+            return self._models[key]
+
+        if key not in self._query_models:
+            self._query_models[key] = CachedEmbeddings(
+                embedding=self._models[key], cache=self._query_cache
+            )
+        return self._query_models[key]
+
+    def query_cache_stats(self) -> dict:
+        """Hit/miss counters of the query-embedding cache"""
+        if self._query_cache is None:
+            return {}
+        return self._query_cache.stats()
+
     def __contains__(self, key: str) -> bool:
         """Check if model exists"""
         return key in self._models
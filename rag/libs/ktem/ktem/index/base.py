@@ -1,6 +1,7 @@
 import abc
 import logging
-from typing import TYPE_CHECKING, Any, Optional
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Iterator, Optional
 
 if TYPE_CHECKING:
     from ktem.app import BasePage
@@ -74,6 +75,11 @@ class BaseIndex(abc.ABC):
             config (dict): the config of the index
         """
 
+    @contextmanager
+    def lease(self) -> Iterator[None]:
+        """Keep the resources of the index open while its pipelines run"""
+        yield
+
     def get_selector_component_ui(self) -> Optional["BasePage"]:
         """The UI component to select the entities in the Chat page"""
         return None
@@ -1,8 +1,15 @@
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Optional, Type
-
-from ktem.components import filestorage_path, get_docstore, get_vectorstore
+from typing import Any, Iterator, Optional, Type
+
+from ktem.components import (
+    docstores,
+    filestorage_path,
+    get_docstore,
+    get_vectorstore,
+    vectorstores,
+)
 from ktem.db.engine import engine
 from ktem.index.base import BaseIndex
 from sqlalchemy import JSON, Column, DateTime, Integer, String, UniqueConstraint, Boolean
@@ -15,6 +22,7 @@ from tzlocal import get_localzone
 from kotaemon.storages import BaseDocumentStore, BaseVectorStore
 
 from .base import BaseFileIndexIndexing, BaseFileIndexRetriever
+from .relations import drop_relations
 
 
 def generate_uuid():
@@ -161,18 +169,35 @@ class FileIndex(BaseIndex):
             },
         )
 
-        self._vs: BaseVectorStore = get_vectorstore(f"index_{self.id}")
-        self._docstore: BaseDocumentStore = get_docstore(f"index_{self.id}")
         self._fs_path = filestorage_path / f"index_{self.id}"
         self._resources = {
             "Source": Source,
             "Index": Index,
             "FileGroup": FileGroup,
-            "VectorStore": self._vs,
-            "DocStore": self._docstore,
             "FileStoragePath": self._fs_path,
         }
 
+    @property
+    def _vs(self) -> BaseVectorStore:
+        """The vector store of the index, looked up on each use so that the
+        registry can evict it while the index is idle. It is only guaranteed to
+        stay open within `lease`."""
+        return get_vectorstore(f"index_{self.id}")
+
+    @property
+    def _docstore(self) -> BaseDocumentStore:
+        """The document store of the index, see `_vs`"""
+        return get_docstore(f"index_{self.id}")
+
+    @contextmanager
+    def lease(self) -> Iterator[None]:
+        """Keep the vector and document stores of the index open, for the
+        pipelines using them while in the context"""
+        with vectorstores.lease(f"index_{self.id}"), docstores.lease(
+            f"index_{self.id}"
+        ):
+            yield
+
     def _setup_indexing_cls(self):
         """Retrieve the indexing class for the file index
 
@@ -349,9 +374,12 @@ class FileIndex(BaseIndex):
         self._setup_resources()
         self._resources["Source"].__table__.drop(engine)  # type: ignore
         self._resources["Index"].__table__.drop(engine)  # type: ignore
+        drop_relations(self._resources["Index"])
         self._resources["FileGroup"].__table__.drop(engine)  # type: ignore
         self._vs.drop()
         self._docstore.drop()
+        vectorstores.evict(f"index_{self.id}")
+        docstores.evict(f"index_{self.id}")
         shutil.rmtree(self._fs_path)
 
     def on_start(self):
@@ -3,43 +3,58 @@ from __future__ import annotations
 import json
 import logging
 import os
+import queue
+import re
 import shutil
 import threading
 import time
+import uuid
 import warnings
 from collections import defaultdict
 from copy import deepcopy
-from functools import lru_cache
+from functools import lru_cache, partial
 from hashlib import sha256
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import Generator, Optional, Sequence
+from typing import Generator, Iterable, Iterator, Optional, Sequence
 
-import boto3
 import requests
 import tiktoken
 from decouple import config
+from fsspec import AbstractFileSystem
 from ktem.db.models import engine
 from ktem.embeddings.manager import embedding_models_manager
 from ktem.llms.manager import llms
 from ktem.rerankings.manager import reranking_models_manager
 from llama_index.core.readers.base import BaseReader
 from llama_index.core.readers.file.base import default_file_metadata_func
-from llama_index.core.vector_stores import (
-    FilterCondition,
-    FilterOperator,
-    MetadataFilter,
-    MetadataFilters,
-)
 from llama_index.core.vector_stores.types import VectorStoreQueryMode
 from sqlalchemy import delete, select
 from sqlalchemy.orm import Session
 from theflow.settings import settings
-from theflow.utils.modules import import_dotted_string
-
-from kotaemon.base import BaseComponent, Document, Node, Param, RetrievedDocument
+from theflow.utils.modules import deserialize, import_dotted_string
+
+from kotaemon.base import (
+    BaseComponent,
+    Document,
+    DocumentWithEmbedding,
+    Node,
+    Param,
+    RetrievedDocument,
+)
 from kotaemon.embeddings import BaseEmbeddings
 from kotaemon.indices import VectorIndexing, VectorRetrieval
+from kotaemon.indices.ingests.artifacts import (
+    BaseArtifactStore,
+    artifact_key,
+    file_hash,
+)
+from kotaemon.indices.ingests.concurrent import (
+    ConcurrentIngestion,
+    WindowStream,
+    iter_file,
+    iter_windows,
+)
 from kotaemon.indices.ingests.files import (
     KH_DEFAULT_FILE_EXTRACTORS,
     adobe_reader,
@@ -48,14 +63,30 @@ from kotaemon.indices.ingests.files import (
     unstructured,
     web_reader,
 )
-from kotaemon.indices.rankings import BaseReranking, LLMReranking, LLMTrulensScoring
+from kotaemon.indices.rankings import (
+    BaseReranking,
+    CascadeReranking,
+    CascadeStage,
+    LLMReranking,
+    LLMTrulensScoring,
+)
 from kotaemon.indices.splitters import BaseSplitter, TokenSplitter
+from kotaemon.loaders import PDFThumbnailReader, TxtReader
+from kotaemon.rerankings.cache import get_score_cache
 
 from .base import BaseFileIndexIndexing, BaseFileIndexRetriever
+from .relations import get_relations
 from theflow.settings import settings as flowsettings
-from ktem.storage.s3_storage import S3Storage
+from ktem.storage.s3_storage import S3Storage, S3StorageFileSystem
 logger = logging.getLogger(__name__)
 
+# the auto params of a component cannot be resolved by several threads at once
+_readers_lock = threading.Lock()
+
+SHA256_RE = re.compile(r"[0-9a-f]{64}")
+# the loaders parsing the S3 objects through a file system, without a local copy
+S3_STREAMED_READERS = (PDFThumbnailReader, TxtReader)
+
 
 @lru_cache
 def dev_settings():
@@ -79,6 +110,53 @@ def dev_settings():
     return file_extractors, chunk_size, chunk_overlap
 
 
+@lru_cache
+def ingestion_engine() -> ConcurrentIngestion:
+    """Get the ingestion engine shared by all the indexing requests"""
+    return ConcurrentIngestion(**getattr(settings, "KH_INGESTION", {}))
+
+
+@lru_cache
+def artifact_store() -> Optional[BaseArtifactStore]:
+    """Get the store of the indexing artifacts shared by all the files, None if
+    the deduplication of the files is disabled"""
+    spec = getattr(settings, "KH_INDEX_ARTIFACT_STORE", None)
+    if not spec:
+        return None
+    return deserialize(spec, safe=False)
+
+
+def reranking_cascade(
+    rerankers: Sequence[BaseReranking], llm_scorer: Optional[LLMReranking]
+) -> Optional[CascadeReranking]:
+    """Get the reranking cascade of the retrieval: the retrieval scores, then the
+    reranking models, then the LLM scorer. None if the cascade is disabled"""
+    spec = getattr(settings, "KH_RERANKING_CASCADE", None)
+    if not spec:
+        return None
+
+    stages = [CascadeStage(name="retrieval", **spec.get("retrieval", {}))]
+    for reranker in rerankers:
+        stages.append(
+            CascadeStage(
+                name="reranking",
+                reranker=reranker,
+                score_key="reranking_score",
+                **spec.get("reranking", {}),
+            )
+        )
+    if llm_scorer is not None:
+        stages.append(
+            CascadeStage(
+                name="llm",
+                reranker=llm_scorer,
+                score_key="llm_trulens_score",
+                **spec.get("llm", {}),
+            )
+        )
+    return CascadeReranking(stages=stages, budget=spec.get("budget"))
+
+
 _default_token_func = tiktoken.encoding_for_model("gpt-3.5-turbo").encode
 
 
@@ -151,28 +229,17 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             return []
 
         retrieval_kwargs: dict = {}
-        with Session(engine) as session:
-            stmt = select(self.Index).where(
-                self.Index.relation_type == "document",
-                self.Index.source_id.in_(doc_ids),
+        if self.retrieval_mode != "vector" and not self.DS.file_scoped_query:
+            # the full-text search of the doc store is scoped by chunk ids
+            retrieval_kwargs["scope"] = get_relations(self.Index).get(
+                doc_ids, "document"
             )
-            results = session.execute(stmt)
-            chunk_ids = [str(r[0].target_id) for r in results.all()]
 
         # do first round top_k extension
         retrieval_kwargs["do_extend"] = True
         retrieval_kwargs["thumbnail_count"] = 50
-        retrieval_kwargs["scope"] = chunk_ids
-        retrieval_kwargs["filters"] = MetadataFilters(
-            filters=[
-                MetadataFilter(
-                    key="file_id",
-                    value=doc_ids,
-                    operator=FilterOperator.IN,
-                )
-            ],
-            condition=FilterCondition.OR,
-        )
+        # the vector store, and the doc store if it can, prefilter by file id
+        retrieval_kwargs["allowed_file_ids"] = doc_ids
 
         if self.mmr:
             # TODO: double check that llama-index MMR works correctly
@@ -301,11 +368,11 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
             get_extra_table=user_settings["prioritize_table"],
             top_k=user_settings["num_retrieval"],
             mmr=user_settings["mmr"],
-            embedding=embedding_models_manager[
+            embedding=embedding_models_manager.get_query_embedding(
                 index_settings.get(
                     "embedding", embedding_models_manager.get_default_name()
                 )
-            ],
+            ),
             retrieval_mode=user_settings["retrieval_mode"],
             llm_scorer=(LLMTrulensScoring() if use_llm_reranking else None),
             rerankers=[
@@ -330,6 +397,12 @@ class DocumentRetrievalPipeline(BaseFileIndexRetriever):
                 user_settings["reranking_llm"], llms.get_default()
             )
 
+        cascade = reranking_cascade(retriever.rerankers, retriever.llm_scorer)
+        if cascade is not None:
+            retriever.rerankers = [cascade]  # type: ignore
+            # the LLM scores are computed by the last stage of the cascade
+            retriever.llm_scorer = None
+
         kwargs = {".doc_ids": selected}
         retriever.set_run(kwargs, temp=False)
         return retriever
@@ -352,82 +425,168 @@ class IndexPipeline(BaseComponent):
     private: bool = False
     run_embedding_in_thread: bool = False
     embedding: BaseEmbeddings
+    window_size: int = Param(
+        16, help="Number of parsed documents split, stored and embedded at once"
+    )
+    keep_docs: bool = Param(
+        True, help="Whether to return the parsed documents once indexed"
+    )
 
     @Node.auto(depends_on=["Source", "Index", "embedding"])
     def vector_indexing(self) -> VectorIndexing:
         return VectorIndexing(
-            vector_store=self.VS, doc_store=self.DS, embedding=self.embedding
+            vector_store=self.VS,
+            doc_store=self.DS,
+            embedding=self.embedding,
+            embedding_cache=embedding_models_manager.chunk_embedding_cache,
+            embedding_executor=embedding_models_manager.embedding_executor,
         )
 
     def handle_docs(self, docs, file_id, file_name) -> Generator[Document, None, int]:
-        s_time = time.time()
-        text_docs = []
-        non_text_docs = []
-        thumbnail_docs = []
-
-        for doc in docs:
-            doc_type = doc.metadata.get("type", "text")
-            if doc_type == "text":
-                text_docs.append(doc)
-            elif doc_type == "thumbnail":
-                thumbnail_docs.append(doc)
-            else:
-                non_text_docs.append(doc)
-
-        print(f"Got {len(thumbnail_docs)} page thumbnails")
-        page_label_to_thumbnail = {
-            doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs
-        }
+        return (yield from self.handle_doc_windows([docs], file_id, file_name))
 
-        if self.splitter:
-            all_chunks = self.splitter(text_docs)
-        else:
-            all_chunks = text_docs
-
-        # add the thumbnails doc_id to the chunks
-        for chunk in all_chunks:
-            page_label = chunk.metadata.get("page_label", None)
-            if page_label and page_label in page_label_to_thumbnail:
-                chunk.metadata["thumbnail_doc_id"] = page_label_to_thumbnail[page_label]
-
-        to_index_chunks = all_chunks + non_text_docs + thumbnail_docs
-
-        # add to doc store
-        chunks = []
+    def handle_doc_windows(
+        self,
+        doc_windows: Iterable[list[Document]],
+        file_id,
+        file_name,
+        artifact_key: Optional[str] = None,
+    ) -> Generator[Document, None, int]:
+        """Split, store and embed the documents window by window as they are parsed
+
+        Only one window of documents is held in memory at a time, and the first
+        pages are searchable before the whole file is parsed. Thumbnails must come
+        before the text of their page (or in the same window) to be linked.
+
+        With `artifact_key`, the indexed chunks and their embeddings are also
+        recorded in the artifact store, for the next files with the same content.
+        """
+        s_time = time.time()
+        page_label_to_thumbnail: dict[str, str] = {}
         n_chunks = 0
-        chunk_size = self.chunk_batch_size * 4
-        for start_idx in range(0, len(to_index_chunks), chunk_size):
-            chunks = to_index_chunks[start_idx : start_idx + chunk_size]
-            self.handle_chunks_docstore(chunks, file_id)
-            n_chunks += len(chunks)
-            yield Document(
-                f" => [{file_name}] Processed {n_chunks} chunks",
-                channel="debug",
-            )
+        n_embedded = 0
+
+        artifacts = artifact_store() if artifact_key else None
+        if artifacts is not None and not artifacts.begin(artifact_key, file_id):
+            # already stored, or being stored by an identical file
+            artifacts = None
+        completed = False
+
+        def finish_artifact():
+            if artifacts is None:
+                return
+            if completed:
+                artifacts.commit(artifact_key, file_id)
+            else:
+                artifacts.abort(artifact_key, file_id)
 
-        def insert_chunks_to_vectorstore():
-            chunks = []
-            n_chunks = 0
+        def insert_chunks_to_vectorstore(to_index_chunks):
+            nonlocal n_embedded
             chunk_size = self.chunk_batch_size
             for start_idx in range(0, len(to_index_chunks), chunk_size):
                 chunks = to_index_chunks[start_idx : start_idx + chunk_size]
-                self.handle_chunks_vectorstore(chunks, file_id)
-                n_chunks += len(chunks)
+                embedded = self.handle_chunks_vectorstore(chunks, file_id)
+                if artifacts is not None:
+                    artifacts.add(artifact_key, file_id, embedded)
+                n_embedded += len(chunks)
                 if self.VS:
                     yield Document(
-                        f" => [{file_name}] Created embedding for {n_chunks} chunks",
+                        f" => [{file_name}] Created embedding for {n_embedded} chunks",
                         channel="debug",
                     )
 
-        # run vector indexing in thread if specified
+        # run vector indexing in thread if specified, the windows are embedded
+        # in order by a single worker. The queue holds one window, so that the
+        # next window is split and stored while the previous one is embedded,
+        # without piling the windows up in memory
+        embedding_queue: Optional[queue.Queue] = None
+        embedding_thread: Optional[threading.Thread] = None
+        embedding_errors: list[BaseException] = []
         if self.run_embedding_in_thread:
             print("Running embedding in thread")
-            threading.Thread(
-                target=lambda: list(insert_chunks_to_vectorstore())
-            ).start()
-        else:
-            yield from insert_chunks_to_vectorstore()
+            embedding_queue = queue.Queue(maxsize=1)
+
+            def embedding_worker():
+                try:
+                    for to_index_chunks in iter(embedding_queue.get, None):
+                        list(insert_chunks_to_vectorstore(to_index_chunks))
+                except BaseException as e:
+                    embedding_errors.append(e)
+                    # unblock the windows being queued until the end signal
+                    for _ in iter(embedding_queue.get, None):
+                        pass
+
+            embedding_thread = threading.Thread(
+                target=embedding_worker, name=f"embedding_{file_id}"
+            )
+            embedding_thread.start()
+
+        try:
+            for docs in doc_windows:
+                text_docs = []
+                non_text_docs = []
+                thumbnail_docs = []
+
+                for doc in docs:
+                    doc_type = doc.metadata.get("type", "text")
+                    if doc_type == "text":
+                        text_docs.append(doc)
+                    elif doc_type == "thumbnail":
+                        thumbnail_docs.append(doc)
+                    else:
+                        non_text_docs.append(doc)
+
+                page_label_to_thumbnail.update(
+                    {doc.metadata["page_label"]: doc.doc_id for doc in thumbnail_docs}
+                )
 
+                if self.splitter and text_docs:
+                    all_chunks = self.splitter(text_docs)
+                else:
+                    all_chunks = text_docs
+
+                # add the thumbnails doc_id to the chunks
+                for chunk in all_chunks:
+                    page_label = chunk.metadata.get("page_label", None)
+                    if page_label and page_label in page_label_to_thumbnail:
+                        chunk.metadata["thumbnail_doc_id"] = page_label_to_thumbnail[
+                            page_label
+                        ]
+
+                to_index_chunks = all_chunks + non_text_docs + thumbnail_docs
+
+                # add to doc store
+                chunk_size = self.chunk_batch_size * 4
+                for start_idx in range(0, len(to_index_chunks), chunk_size):
+                    chunks = to_index_chunks[start_idx : start_idx + chunk_size]
+                    self.handle_chunks_docstore(chunks, file_id)
+                    n_chunks += len(chunks)
+                    yield Document(
+                        f" => [{file_name}] Processed {n_chunks} chunks",
+                        channel="debug",
+                    )
+
+                if embedding_queue is not None:
+                    if embedding_errors:
+                        break
+                    embedding_queue.put(to_index_chunks)
+                else:
+                    yield from insert_chunks_to_vectorstore(to_index_chunks)
+            else:
+                completed = True
+        finally:
+            if embedding_thread is not None:
+                # wait for the last windows to be embedded
+                embedding_queue.put(None)  # type: ignore[union-attr]
+                embedding_thread.join()
+                if embedding_errors:
+                    completed = False
+            finish_artifact()
+
+        if embedding_errors:
+            raise embedding_errors[0]
+
+        print(f"Got {len(page_label_to_thumbnail)} page thumbnails")
         print("indexing step took", time.time() - s_time)
         return n_chunks
 
@@ -437,39 +596,80 @@ class IndexPipeline(BaseComponent):
         self.vector_indexing.add_to_docstore(chunks)
 
         # record in the index
-        with Session(engine) as session:
-            nodes = []
-            for chunk in chunks:
-                nodes.append(
-                    self.Index(
-                        source_id=file_id,
-                        target_id=chunk.doc_id,
-                        relation_type="document",
-                    )
-                )
-            session.add_all(nodes)
-            session.commit()
+        get_relations(self.Index).add(
+            file_id, [chunk.doc_id for chunk in chunks], "document"
+        )
 
-    def handle_chunks_vectorstore(self, chunks, file_id):
-        """Run chunks"""
+    def handle_chunks_vectorstore(self, chunks, file_id) -> list[Document]:
+        """Run chunks, return them with their embedding if embedded"""
         # run embedding, add to both vector store and doc store
-        self.vector_indexing.add_to_vectorstore(chunks)
+        embedded = self.vector_indexing.add_to_vectorstore(chunks)
         self.vector_indexing.write_chunk_to_file(chunks)
 
         if self.VS:
             # record in the index
-            with Session(engine) as session:
-                nodes = []
-                for chunk in chunks:
-                    nodes.append(
-                        self.Index(
-                            source_id=file_id,
-                            target_id=chunk.doc_id,
-                            relation_type="vector",
-                        )
-                    )
-                session.add_all(nodes)
-                session.commit()
+            get_relations(self.Index).add(
+                file_id, [chunk.doc_id for chunk in chunks], "vector"
+            )
+        return embedded or chunks
+
+    def handle_artifact(
+        self, artifact_key: str, file_id, file_name, extra_info: dict
+    ) -> Generator[Document, None, list[Document]]:
+        """Index the file by copying the stored chunks and embeddings of an
+        identical file, without parsing, splitting nor embedding it
+
+        The chunks get new ids and the file-specific metadata of this file, so
+        that both files can be deleted independently.
+        """
+        artifacts = artifact_store()
+        assert artifacts is not None
+        stored = artifacts.get(artifact_key)
+        new_ids = {doc.doc_id: str(uuid.uuid4()) for doc in stored}
+
+        docs = []
+        for doc in stored:
+            metadata = {**doc.metadata, **extra_info}
+            thumbnail_doc_id = metadata.get("thumbnail_doc_id")
+            if thumbnail_doc_id in new_ids:
+                metadata["thumbnail_doc_id"] = new_ids[thumbnail_doc_id]
+            docs.append(
+                DocumentWithEmbedding(
+                    id_=new_ids[doc.doc_id],
+                    text=doc.text,
+                    metadata=metadata,
+                    embedding=doc.embedding,
+                )
+            )
+
+        chunk_size = self.chunk_batch_size * 4
+        for start_idx in range(0, len(docs), chunk_size):
+            chunks = docs[start_idx : start_idx + chunk_size]
+            self.handle_chunks_docstore(
+                [
+                    Document(id_=chunk.doc_id, text=chunk.text, metadata=chunk.metadata)
+                    for chunk in chunks
+                ],
+                file_id,
+            )
+            if self.VS:
+                embedded = [chunk for chunk in chunks if chunk.embedding]
+                if embedded:
+                    self.VS.add(embeddings=embedded, ids=[c.doc_id for c in embedded])
+                # stored while no vector store was configured
+                missing = [chunk for chunk in chunks if not chunk.embedding]
+                if missing:
+                    self.vector_indexing.add_to_vectorstore(missing)
+                get_relations(self.Index).add(
+                    file_id, [chunk.doc_id for chunk in chunks], "vector"
+                )
+            yield Document(
+                f" => [{file_name}] Copied {start_idx + len(chunks)} chunks",
+                channel="debug",
+            )
+
+        artifacts.acquire(artifact_key, file_id)
+        return docs
 
     def get_id_if_exists(self, file_path: str | Path) -> Optional[str]:
         """Check if the file is already indexed
@@ -559,6 +759,9 @@ class IndexPipeline(BaseComponent):
 
     def finish(self, file_id: str, file_path: str | Path) -> str:
         """Finish the indexing"""
+        # store the chunk ids of the file for the retrieval
+        relations = get_relations(self.Index).compact_source(file_id)
+
         with Session(engine) as session:
             stmt = select(self.Source).where(self.Source.id == file_id)
             result = session.execute(stmt).first()
@@ -568,11 +771,7 @@ class IndexPipeline(BaseComponent):
             item = result[0]
 
             # populate the number of tokens
-            doc_ids_stmt = select(self.Index.target_id).where(
-                self.Index.source_id == file_id,
-                self.Index.relation_type == "document",
-            )
-            doc_ids = [_[0] for _ in session.execute(doc_ids_stmt)]
+            doc_ids = relations.get("document", [])
             token_func = self.get_token_func()
             if doc_ids and token_func:
                 docs = self.DS.get(doc_ids)
@@ -598,23 +797,50 @@ class IndexPipeline(BaseComponent):
         """
         with Session(engine) as session:
             session.execute(delete(self.Source).where(self.Source.id == file_id))
-            vs_ids, ds_ids = [], []
-            index = session.execute(
-                select(self.Index).where(self.Index.source_id == file_id)
-            ).all()
-            for each in index:
-                if each[0].relation_type == "vector":
-                    vs_ids.append(str(each[0].target_id))
-                elif each[0].relation_type == "document":
-                    ds_ids.append(str(each[0].target_id))
-                session.delete(each[0])
             session.commit()
 
+        relations = get_relations(self.Index).delete([file_id])
+        vs_ids, ds_ids = relations["vector"], relations["document"]
         if vs_ids and self.VS:
             self.VS.delete(vs_ids)
         if ds_ids:
             self.DS.delete(ds_ids)
 
+        artifacts = artifact_store()
+        if artifacts is not None:
+            artifacts.release([file_id])
+
+        score_cache = get_score_cache()
+        if score_cache is not None:
+            score_cache.invalidate(ds_ids)
+
+    def get_extra_info(
+        self,
+        file_path: str | Path,
+        file_id: str,
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> dict:
+        """Get the metadata attached by the loader to the documents of the file,
+        read through `fs` if the file is not stored locally"""
+        if fs is not None:
+            extra_info = default_file_metadata_func(str(file_path), fs=fs)
+        elif isinstance(file_path, Path):
+            extra_info = default_file_metadata_func(str(file_path.resolve()))
+        else:
+            extra_info = {"file_name": file_path}
+
+        extra_info["file_id"] = file_id
+        extra_info["collection_name"] = self.collection_name
+
+        # the storage path of the source, so that the previews need no lookup
+        with Session(engine) as session:
+            storage_path = session.execute(
+                select(self.Source.file).where(self.Source.id == file_id)
+            ).scalar()
+        if storage_path:
+            extra_info["storage_path"] = storage_path
+        return extra_info
+
     def run(
         self, file_path: str | Path, reindex: bool, **kwargs
     ) -> tuple[str, list[Document]]:
@@ -623,8 +849,9 @@ class IndexPipeline(BaseComponent):
     def stream(
         self, file_path: str | Path, reindex: bool, **kwargs
     ) -> Generator[Document, None, tuple[str, list[Document]]]:
-        # check if the file is already indexed
-        if isinstance(file_path, Path):
+        # the file system of a file read from S3, None for a local file
+        fs = kwargs.get("fs")
+        if isinstance(file_path, Path) and fs is None:
             file_path = file_path.resolve()
 
         # disable file delete
@@ -633,26 +860,59 @@ class IndexPipeline(BaseComponent):
 
         yield Document({'file_id': file_id}, channel="info")
 
-        # extract the file
-        if isinstance(file_path, Path):
-            extra_info = default_file_metadata_func(str(file_path))
-            file_name = file_path.name
-        else:
-            extra_info = {"file_name": file_path}
-            file_name = file_path
-
-        extra_info["file_id"] = file_id
-        extra_info["collection_name"] = self.collection_name
+        file_name = file_path.name if isinstance(file_path, Path) else file_path
+        artifact_key = kwargs.get("artifact_key")
+        artifacts = artifact_store()
+        if artifact_key and artifacts is not None and artifacts.exists(artifact_key):
+            yield Document(
+                f" => Reusing the index of an identical file for {file_name}",
+                channel="debug",
+            )
+            docs = yield from self.handle_artifact(
+                artifact_key,
+                file_id,
+                file_name,
+                self.get_extra_info(file_path, file_id, fs),
+            )
+            self.DS.refresh()
+            self.finish(file_id, file_path)
+            yield Document(f" => Finished indexing {file_name}", channel="debug")
+            return file_id, docs if self.keep_docs else []
+
+        # extract the file, unless it was already parsed by the caller
+        docs = kwargs.get("docs")
+        doc_windows = kwargs.get("doc_windows")
+        if docs is not None:
+            doc_windows = [docs]
+        elif doc_windows is None:
+            extra_info = self.get_extra_info(file_path, file_id, fs)
+            yield Document(f" => Converting {file_name} to text", channel="debug")
+            doc_windows = iter_windows(
+                iter_file(self.loader, file_path, extra_info, fs), self.window_size
+            )
 
-        yield Document(f" => Converting {file_name} to text", channel="debug")
-        docs = self.loader.load_data(file_path, extra_info=extra_info)
+        kept_docs: list[Document] = []
+        if self.keep_docs:
+            doc_windows = self._keep(doc_windows, kept_docs)
+        yield from self.handle_doc_windows(
+            doc_windows, file_id, file_name, artifact_key=artifact_key
+        )
         yield Document(f" => Converted {file_name} to text", channel="debug")
-        yield from self.handle_docs(docs, file_id, file_name)
+        # the full-text index is refreshed once per file rather than per batch
+        self.DS.refresh()
 
         self.finish(file_id, file_path)
 
         yield Document(f" => Finished indexing {file_name}", channel="debug")
-        return file_id, docs
+        return file_id, kept_docs
+
+    @staticmethod
+    def _keep(
+        doc_windows: Iterable[list[Document]], kept_docs: list[Document]
+    ) -> Iterator[list[Document]]:
+        for docs in doc_windows:
+            kept_docs.extend(docs)
+            yield docs
 
 
 class IndexDocumentPipeline(BaseFileIndexIndexing):
@@ -670,6 +930,13 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
     reader_mode: str = Param("default", help="The reader mode")
     embedding: BaseEmbeddings
     run_embedding_in_thread: bool = False
+    keep_docs: bool = Param(
+        False,
+        help=(
+            "Whether to return the parsed documents of all files, disabled by "
+            "default to keep the memory bounded by the parse windows"
+        ),
+    )
 
     @Param.auto(depends_on="reader_mode")
     def readers(self):
@@ -687,6 +954,12 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
 
         return readers
 
+    def get_readers(self) -> dict:
+        """The readers by file extension, for the ingestion threads that route and
+        fetch the files concurrently"""
+        with _readers_lock:
+            return self.readers
+
     @classmethod
     def get_user_settings(cls):
         return {
@@ -751,20 +1024,9 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
         temp_path = temp_file.name
         temp_file.close()
 
-        # Get the S3 key from the file object
-        s3_key = file.file
-        bucket_name = flowsettings.AWS_STORAGE_BUCKET_NAME
-        region = 'ap-south-1'
-
-        # Download the file from S3
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=flowsettings.AWS_S3_ENDPOINT_URL,
-            region_name=region,
-            aws_access_key_id=flowsettings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=flowsettings.AWS_SECRET_ACCESS_KEY
-        )
-        s3_client.download_file(bucket_name, s3_key, temp_path)
+        # Download the file from S3, with the shared client and by concurrent
+        # ranged parts for large files
+        S3Storage(prefix="").download_key(file.file, temp_path)
 
         return temp_path
 
@@ -799,7 +1061,7 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
         else:
             assert isinstance(file_path, Path)
             ext = file_path.suffix.lower()
-            reader = self.readers.get(ext, unstructured)
+            reader = self.get_readers().get(ext, unstructured)
             if reader is None:
                 raise NotImplementedError(
                     f"No supported pipeline to index {file_path.name}. Please specify "
@@ -826,6 +1088,8 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
             user_id=self.user_id,
             private=self.private,
             embedding=self.embedding,
+            window_size=ingestion_engine().window_size,
+            keep_docs=self.keep_docs,
         )
 
         return pipeline
@@ -835,12 +1099,139 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
     ) -> tuple[list[str | None], list[str | None]]:
         raise NotImplementedError
 
+    def get_artifact_key(
+        self,
+        pipeline: IndexPipeline,
+        file_path: str | Path,
+        fs: Optional[AbstractFileSystem] = None,
+    ) -> Optional[str]:
+        """The key of the indexing artifacts of the file: its content hash, the
+        reader mode, the loader, the splitter and the embedding model"""
+        if artifact_store() is None or not isinstance(file_path, Path):
+            return None
+        if fs is not None and SHA256_RE.fullmatch(file_path.stem):
+            # `store_file` names the S3 objects by the hash of their content
+            content_hash = file_path.stem
+        else:
+            content_hash = file_hash(file_path, fs=fs)
+        return artifact_key(
+            content_hash,
+            pipeline.get_from_path("loader"),
+            pipeline.get_from_path("splitter"),
+            pipeline.get_from_path("embedding") if pipeline.VS else None,
+            mode=self.reader_mode,
+        )
+
+    def is_streamed(self, file) -> bool:
+        """Whether the loader of the source reads it from S3 directly"""
+        reader = self.get_readers().get(Path(file.file).suffix.lower())
+        return isinstance(reader, S3_STREAMED_READERS)
+
+    def fetch_file(
+        self, file_id: str
+    ) -> tuple[str, str | Path, Optional[AbstractFileSystem]] | None:
+        """Get the data type of the source, the path (or URL) to index and the
+        file system to read it, None for a local copy"""
+        with Session(engine) as session:
+            stmt = select(self.Source).where(self.Source.id == file_id)
+            result = session.execute(stmt).first()
+            if not result:
+                return None
+
+            file = result[0]
+            if file.data_type == 'url':
+                return file.data_type, file.title, None
+            if self.is_streamed(file):
+                # parsed with ranged reads of the S3 object
+                return file.data_type, Path(file.file), S3StorageFileSystem()
+            return file.data_type, Path(self.save_temp_file(file)), None
+
+    def index_file(
+        self, idx: int, n_files: int, file_id: str, reindex: bool, **kwargs
+    ) -> Generator[Document, None, tuple[str | None, list[Document]] | None]:
+        """Fetch, parse and index one file through the stages of the ingestion
+        engine, return the error if any and the indexed documents"""
+        ingestion = ingestion_engine()
+        fetched = ingestion.fetch(self.fetch_file, file_id)
+        if fetched is None:
+            return None
+
+        data_type, file_path, fs = fetched
+        print('file_path: ', file_path)
+        file_name = file_path.name if isinstance(file_path, Path) else file_path
+
+        yield Document(
+            content=f"Indexing [{idx + 1}/{n_files}]: {file_name}",
+            channel="debug",
+        )
+
+        try:
+            pipeline = self.route(file_path)
+            key = self.get_artifact_key(pipeline, file_path, fs)
+            if key is not None and artifact_store().exists(key):
+                # an identical file was indexed, its artifacts are copied
+                doc_windows = None
+            else:
+                yield Document(f" => Converting {file_name} to text", channel="debug")
+                # the parsing starts now and buffers a few windows while the file
+                # waits for an indexing slot
+                doc_windows = ingestion.parse_iter(
+                    iter_file,
+                    pipeline.get_from_path("loader"),
+                    file_path,
+                    pipeline.get_extra_info(file_path, file_id, fs),
+                    fs,
+                )
+            try:
+                with ingestion.indexing():
+                    _, docs = yield from pipeline.stream(
+                        file_path,
+                        reindex=reindex,
+                        file_id=file_id,
+                        doc_windows=doc_windows,
+                        artifact_key=key,
+                        fs=fs,
+                        **kwargs,
+                    )
+            finally:
+                if isinstance(doc_windows, WindowStream):
+                    doc_windows.close()
+            yield Document(
+                content={
+                    "file_path": file_path,
+                    "file_name": file_name,
+                    "status": "success",
+                },
+                channel="index",
+            )
+            return None, docs
+        except (Exception, requests.exceptions.HTTPError) as e:
+            logger.exception(e)
+            yield Document(
+                content={
+                    "file_path": file_path,
+                    "file_name": file_name,
+                    "status": "failed",
+                    "message": str(e),
+                },
+                channel="index",
+            )
+            return str(e), []
+        finally:
+            # the local copy of the file is removed whether it was indexed or not
+            if data_type != 'url' and fs is None:
+                self._clean_temp_files([file_path])
+
     def stream(
         self, file_ids: str | Path | list[str | Path], reindex: bool = False, **kwargs
     ) -> Generator[
         Document, None, tuple[list[str | None], list[str | None], list[Document]]
     ]:
-        """Return a list of indexed file ids, and a list of errors"""
+        """Return a list of indexed file ids, and a list of errors
+
+        The files are fetched, parsed and indexed concurrently by the shared
+        ingestion engine, the progress of all files is streamed as it comes.
+        """
         if not isinstance(file_ids, list):
             file_ids = [file_ids]
 
@@ -849,61 +1240,21 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
 
         n_files = len(file_ids)
         print('n_files: ', n_files)
-        for idx, file_id in enumerate(file_ids):
-            kwargs['file_id'] = file_id
-            with Session(engine) as session:
-                stmt = select(self.Source).where(self.Source.id == file_id)
-                result = session.execute(stmt).first()
-                if not result:
-                    continue
-
-                file = result[0]
-                if file.data_type == 'url':
-                    file_path = file.title
-                else:
-                    file_path = self.save_temp_file(file)
-            print('file_path: ', file_path)
-            if self.is_url(file_path):
-                file_name = file_path
-            else:
-                file_path = Path(file_path)
-                file_name = file_path.name
-
-            yield Document(
-                content=f"Indexing [{idx + 1}/{n_files}]: {file_name}",
-                channel="debug",
-            )
-
-            try:
-                pipeline = self.route(file_path)
-                file_id, docs = yield from pipeline.stream(
-                    file_path, reindex=reindex, **kwargs
-                )
-                all_docs.extend(docs)
-                if file.data_type != 'url':
-                    self._clean_temp_files([file_path])
-                errors.append(None)
-                yield Document(
-                    content={
-                        "file_path": file_path,
-                        "file_name": file_name,
-                        "status": "success",
-                    },
-                    channel="index",
-                )
-            except (Exception, requests.exceptions.HTTPError) as e:
-                logger.exception(e)
+        results = yield from ingestion_engine().stream(
+            partial(self.index_file, idx, n_files, file_id, reindex, **kwargs)
+            for idx, file_id in enumerate(list(file_ids))
+        )
+        for result in results:
+            if result is None:
+                # the source does not exist
+                continue
+            if isinstance(result, Exception):
+                result = (str(result), [])
+            error, docs = result
+            if error is not None:
                 file_ids.append(None)
-                errors.append(str(e))
-                yield Document(
-                    content={
-                        "file_path": file_path,
-                        "file_name": file_name,
-                        "status": "failed",
-                        "message": str(e),
-                    },
-                    channel="index",
-                )
+            errors.append(error)
+            all_docs.extend(docs)
 
         return file_ids, errors, all_docs
 
@@ -913,17 +1264,17 @@ class IndexDocumentPipeline(BaseFileIndexIndexing):
         Args:
             file_id: the file id
         """
-        with Session(engine) as session:
-            index = session.execute(
-                select(self.Index).where(self.Index.source_id.in_(file_ids))
-            ).all()
-            vs_ids, ds_ids = [], []
-            for each in index:
-                if each[0].relation_type == "vector":
-                    vs_ids.append(str(each[0].target_id))
-                elif each[0].relation_type == "document":
-                    ds_ids.append(str(each[0].target_id))
+        relations = get_relations(self.Index).delete(file_ids)
+        vs_ids, ds_ids = relations["vector"], relations["document"]
         if vs_ids and self.VS:
             self.VS.delete(vs_ids)
         if ds_ids:
-            self.DS.delete(ds_ids)
\ No newline at end of file
+            self.DS.delete(ds_ids)
+
+        artifacts = artifact_store()
+        if artifacts is not None:
+            artifacts.release(file_ids)
+
+        score_cache = get_score_cache()
+        if score_cache is not None:
+            score_cache.invalidate(ds_ids)
@@ -0,0 +1,377 @@
+"""Bulk access to the source to chunk relations of the file index"""
+
+import csv
+import io
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import Iterable, Optional
+
+from sqlalchemy import (
+    JSON,
+    Column,
+    MetaData,
+    String,
+    Table,
+    delete,
+    insert,
+    select,
+)
+from sqlalchemy.engine import Connection, Engine
+from theflow.settings import settings as flowsettings
+
+
+class ChunkRelations:
+    """Read and write the rows of the `Index` table by source, in bulk
+
+    The `Index` table holds one row per chunk and relation type, which makes it
+    large. This class writes the rows of a batch of chunks at once (`COPY` on
+    PostgreSQL for large batches, a multi-row insert otherwise), deletes the
+    rows of a source with a single `DELETE ... RETURNING`.
+
+    With `compact`, the chunk ids of a source are also stored as one array row
+    of a side table once the source is indexed, so that reading them costs one
+    row whatever the number of chunks. Each array row has a version, the arrays
+    are cached with it and only the versions are read on each turn, so that a
+    source re-indexed or deleted by another process is not served from the
+    cache. Without `compact`, the chunk ids are not cached.
+
+    Args:
+        Index: the SQLAlchemy Index table
+        engine: the database engine
+        compact: whether to keep the chunk id arrays of the indexed sources
+        cache_size: number of (source, relation type) chunk id arrays cached
+        copy_threshold: minimum number of rows written with `COPY`
+    """
+
+    def __init__(
+        self,
+        Index,
+        engine: Engine,
+        compact: bool = True,
+        cache_size: int = 1024,
+        copy_threshold: int = 1000,
+    ):
+        self.Index = Index
+        self.engine = engine
+        self.compact = compact
+        self.cache_size = cache_size
+        self.copy_threshold = copy_threshold
+
+        self._cache: OrderedDict[tuple[str, str], tuple[str, list[str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.compact_table_name = f"{Index.__tablename__}_compact"
+        self.compact_table: Optional[Table] = None
+        if compact:
+            metadata = Index.metadata
+            if self.compact_table_name in metadata.tables:
+                self.compact_table = metadata.tables[self.compact_table_name]
+            else:
+                self.compact_table = Table(
+                    self.compact_table_name,
+                    metadata,
+                    Column("source_id", String, primary_key=True),
+                    Column("relation_type", String, primary_key=True),
+                    Column("target_ids", JSON),
+                    Column("version", String),
+                )
+            self.compact_table.create(engine, checkfirst=True)
+
+    # cache
+
+    def _cache_get(self, key: tuple[str, str], version: str) -> Optional[list[str]]:
+        """The cached ids of the array row, None if not cached or outdated"""
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return None
+            if item[0] != version:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return item[1]
+
+    def _cache_set(self, key: tuple[str, str], version: str, ids: list[str]):
+        with self._lock:
+            self._cache[key] = (version, ids)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, source_ids: Iterable[str]):
+        """Forget the cached chunk ids of the sources"""
+        source_ids = set(source_ids)
+        with self._lock:
+            for key in [key for key in self._cache if key[0] in source_ids]:
+                del self._cache[key]
+
+    # write
+
+    def _rows(
+        self, source_id: str, target_ids: list[str], relation_type: str
+    ) -> list[dict]:
+        """The full rows, with the Python-side defaults of the table filled"""
+        defaults = {}
+        for column in self.Index.__table__.columns:
+            default = column.default
+            if default is None or column.name in (
+                "source_id",
+                "target_id",
+                "relation_type",
+            ):
+                continue
+            defaults[column.name] = default
+
+        rows = []
+        for target_id in target_ids:
+            row = {
+                "source_id": source_id,
+                "target_id": target_id,
+                "relation_type": relation_type,
+            }
+            for name, default in defaults.items():
+                row[name] = default.arg(None) if default.is_callable else default.arg
+            rows.append(row)
+        return rows
+
+    def _copy(self, conn: Connection, rows: list[dict]) -> bool:
+        """Write the rows with PostgreSQL `COPY`, return False if the driver
+        does not support it"""
+        cursor = conn.connection.dbapi_connection.cursor()  # type: ignore
+        if not hasattr(cursor, "copy_expert"):
+            cursor.close()
+            return False
+
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(
+                [
+                    value.isoformat() if hasattr(value, "isoformat") else value
+                    for value in (row[column] for column in columns)
+                ]
+            )
+        buffer.seek(0)
+        try:
+            cursor.copy_expert(
+                f"COPY {self.Index.__tablename__} ({', '.join(columns)}) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+        return True
+
+    def add(self, source_id: str, target_ids: list[str], relation_type: str):
+        """Record that the chunks `target_ids` belong to the source"""
+        if not target_ids:
+            return
+
+        rows = self._rows(source_id, target_ids, relation_type)
+        with self.engine.begin() as conn:
+            copied = (
+                len(rows) >= self.copy_threshold
+                and self.engine.dialect.name == "postgresql"
+                and self._copy(conn, rows)
+            )
+            if not copied:
+                conn.execute(insert(self.Index.__table__), rows)
+            if self.compact_table is not None:
+                # the source is being re-indexed, its array is outdated
+                conn.execute(
+                    delete(self.compact_table).where(
+                        self.compact_table.c.source_id == source_id
+                    )
+                )
+        self.invalidate([source_id])
+
+    def compact_source(self, source_id: str) -> dict[str, list[str]]:
+        """Store the chunk id arrays of an indexed source
+
+        Returns:
+            the chunk ids of the source by relation type
+        """
+        table = self.Index.__table__
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                select(table.c.relation_type, table.c.target_id).where(
+                    table.c.source_id == source_id
+                )
+            )
+            relations: dict[str, list[str]] = defaultdict(list)
+            for relation_type, target_id in result:
+                relations[relation_type].append(str(target_id))
+
+            version = uuid.uuid4().hex
+            if self.compact_table is not None:
+                conn.execute(
+                    delete(self.compact_table).where(
+                        self.compact_table.c.source_id == source_id
+                    )
+                )
+                if relations:
+                    conn.execute(
+                        insert(self.compact_table),
+                        [
+                            {
+                                "source_id": source_id,
+                                "relation_type": relation_type,
+                                "target_ids": ids,
+                                "version": version,
+                            }
+                            for relation_type, ids in relations.items()
+                        ],
+                    )
+
+        self.invalidate([source_id])
+        if self.compact_table is not None:
+            for relation_type, ids in relations.items():
+                self._cache_set((source_id, relation_type), version, ids)
+        return dict(relations)
+
+    def delete(self, source_ids: list[str]) -> dict[str, list[str]]:
+        """Delete the rows of the sources
+
+        Returns:
+            the chunk ids of the deleted rows by relation type
+        """
+        relations: dict[str, list[str]] = defaultdict(list)
+        if not source_ids:
+            return relations
+
+        table = self.Index.__table__
+        where = table.c.source_id.in_(source_ids)
+        with self.engine.begin() as conn:
+            if self.engine.dialect.delete_returning:
+                result = conn.execute(
+                    delete(table)
+                    .where(where)
+                    .returning(table.c.relation_type, table.c.target_id)
+                ).all()
+            else:
+                result = conn.execute(
+                    select(table.c.relation_type, table.c.target_id).where(where)
+                ).all()
+                conn.execute(delete(table).where(where))
+            for relation_type, target_id in result:
+                relations[relation_type].append(str(target_id))
+
+            if self.compact_table is not None:
+                conn.execute(
+                    delete(self.compact_table).where(
+                        self.compact_table.c.source_id.in_(source_ids)
+                    )
+                )
+
+        self.invalidate(source_ids)
+        return relations
+
+    def drop(self):
+        """Drop the side table of the chunk id arrays, when the `Index` table is
+        dropped, and forget the cached chunk ids"""
+        Table(self.compact_table_name, MetaData()).drop(self.engine, checkfirst=True)
+        if self.compact_table is not None:
+            self.Index.metadata.remove(self.compact_table)
+            self.compact_table = None
+        with self._lock:
+            self._cache.clear()
+
+    # read
+
+    def get(self, source_ids: list[str], relation_type: str = "document") -> list[str]:
+        """Get the chunk ids of the sources, in the order of the sources"""
+        source_ids = list(dict.fromkeys(source_ids))
+        if not source_ids:
+            return []
+
+        found: dict[str, list[str]] = {}
+        with self.engine.connect() as conn:
+            if self.compact_table is not None:
+                found.update(self._load_compact(conn, source_ids, relation_type))
+
+            # sources being indexed, or indexed before the arrays existed
+            rest = [source_id for source_id in source_ids if source_id not in found]
+            if rest:
+                table = self.Index.__table__
+                result = conn.execute(
+                    select(table.c.source_id, table.c.target_id).where(
+                        table.c.source_id.in_(rest),
+                        table.c.relation_type == relation_type,
+                    )
+                )
+                for source_id, target_id in result:
+                    found.setdefault(source_id, []).append(str(target_id))
+
+        return [
+            target_id
+            for source_id in source_ids
+            for target_id in found.get(source_id, [])
+        ]
+
+    def _load_compact(
+        self, conn: Connection, source_ids: list[str], relation_type: str
+    ) -> dict[str, list[str]]:
+        """The chunk ids of the sources having an array row, read from the cache
+        if its version is the current one"""
+        compact = self.compact_table
+        assert compact is not None
+        of_type = compact.c.relation_type == relation_type
+
+        loaded: dict[str, list[str]] = {}
+        outdated = []
+        for source_id, version in conn.execute(
+            select(compact.c.source_id, compact.c.version).where(
+                compact.c.source_id.in_(source_ids), of_type
+            )
+        ):
+            ids = self._cache_get((source_id, relation_type), version)
+            if ids is None:
+                outdated.append(source_id)
+            else:
+                loaded[source_id] = ids
+
+        if outdated:
+            result = conn.execute(
+                select(
+                    compact.c.source_id, compact.c.version, compact.c.target_ids
+                ).where(compact.c.source_id.in_(outdated), of_type)
+            )
+            for source_id, version, ids in result:
+                self._cache_set((source_id, relation_type), version, ids)
+                loaded[source_id] = ids
+        return loaded
+
+
+_relations: dict[str, ChunkRelations] = {}
+_relations_lock = threading.Lock()
+
+
+def get_relations(Index) -> ChunkRelations:
+    """The relations of an `Index` table, shared by the pipelines of its index"""
+    from ktem.db.engine import engine
+
+    with _relations_lock:
+        relations = _relations.get(Index.__tablename__)
+        if relations is None:
+            relations = ChunkRelations(
+                Index,
+                engine,
+                compact=getattr(flowsettings, "KH_INDEX_COMPACT_RELATIONS", True),
+                cache_size=getattr(flowsettings, "KH_INDEX_RELATIONS_CACHE_SIZE", 1024),
+            )
+            _relations[Index.__tablename__] = relations
+        return relations
+
+
+def drop_relations(Index):
+    """Drop the side table of an `Index` table and forget its relations, when its
+    index is deleted"""
+    from ktem.db.engine import engine
+
+    with _relations_lock:
+        relations = _relations.pop(Index.__tablename__, None)
+    if relations is None:
+        relations = ChunkRelations(Index, engine, compact=False)
+    relations.drop()
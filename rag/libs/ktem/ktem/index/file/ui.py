@@ -12,6 +12,7 @@ import gradio as gr
 import pandas as pd
 from gradio.data_classes import FileData
 from gradio.utils import NamedString
+from kotaemon.rerankings.cache import get_score_cache
 from ktem.app import BasePage
 from ktem.db.engine import engine
 from ktem.utils.render import Render
@@ -21,6 +22,8 @@ from theflow.settings import settings as flowsettings
 
 from ...utils.commands import WEB_SEARCH_COMMAND
 from ...utils.rate_limit import check_rate_limit
+from .pipelines import artifact_store
+from .relations import get_relations
 from .utils import download_arxiv_pdf, is_arxiv_url
 
 KH_DEMO_MODE = getattr(flowsettings, "KH_DEMO_MODE", False)
@@ -398,44 +401,38 @@ class FileIndexPage(BasePage):
             # get the chunks
 
             Index = self._index._resources["Index"]
-            with Session(engine) as session:
-                matches = session.execute(
-                    select(Index).where(
-                        Index.source_id == file_id,
-                        Index.relation_type == "document",
-                    )
-                )
-                doc_ids = [doc.target_id for (doc,) in matches]
+            doc_ids = get_relations(Index).get([file_id], "document")
+            with self._index.lease():
                 docs = self._index._docstore.get(doc_ids)
-                docs = sorted(
-                    docs, key=lambda x: x.metadata.get("page_label", float("inf"))
-                )
+            docs = sorted(
+                docs, key=lambda x: x.metadata.get("page_label", float("inf"))
+            )
 
-                for idx, doc in enumerate(docs):
-                    title = html.escape(
-                        f"{doc.text[:50]}..." if len(doc.text) > 50 else doc.text
+            for idx, doc in enumerate(docs):
+                title = html.escape(
+                    f"{doc.text[:50]}..." if len(doc.text) > 50 else doc.text
+                )
+                doc_type = doc.metadata.get("type", "text")
+                content = ""
+                if doc_type == "text":
+                    content = html.escape(doc.text)
+                elif doc_type == "table":
+                    content = Render.table(doc.text)
+                elif doc_type == "image":
+                    content = Render.image(
+                        url=doc.metadata.get("image_origin", ""), text=doc.text
                     )
-                    doc_type = doc.metadata.get("type", "text")
-                    content = ""
-                    if doc_type == "text":
-                        content = html.escape(doc.text)
-                    elif doc_type == "table":
-                        content = Render.table(doc.text)
-                    elif doc_type == "image":
-                        content = Render.image(
-                            url=doc.metadata.get("image_origin", ""), text=doc.text
-                        )
 
-                    header_prefix = f"[{idx+1}/{len(docs)}]"
-                    if doc.metadata.get("page_label"):
-                        header_prefix += f" [Page {doc.metadata['page_label']}]"
+                header_prefix = f"[{idx+1}/{len(docs)}]"
+                if doc.metadata.get("page_label"):
+                    header_prefix += f" [Page {doc.metadata['page_label']}]"
 
-                    chunks.append(
-                        Render.collapsible(
-                            header=f"{header_prefix} {title}",
-                            content=content,
-                        )
+                chunks.append(
+                    Render.collapsible(
+                        header=f"{header_prefix} {title}",
+                        content=content,
                     )
+                )
         return (
             gr.update(value="".join(chunks), visible=file_id is not None),
             gr.update(visible=file_id is not None),
@@ -455,24 +452,23 @@ class FileIndexPage(BasePage):
             if source:
                 file_name = source[0].name
                 session.delete(source[0])
-
-            vs_ids, ds_ids = [], []
-            index = session.execute(
-                select(self._index._resources["Index"]).where(
-                    self._index._resources["Index"].source_id == file_id
-                )
-            ).all()
-            for each in index:
-                if each[0].relation_type == "vector":
-                    vs_ids.append(each[0].target_id)
-                elif each[0].relation_type == "document":
-                    ds_ids.append(each[0].target_id)
-                session.delete(each[0])
             session.commit()
 
-        if vs_ids:
-            self._index._vs.delete(vs_ids)
-        self._index._docstore.delete(ds_ids)
+        relations = get_relations(self._index._resources["Index"]).delete([file_id])
+        vs_ids, ds_ids = relations["vector"], relations["document"]
+
+        with self._index.lease():
+            if vs_ids:
+                self._index._vs.delete(vs_ids)
+            self._index._docstore.delete(ds_ids)
+
+        artifacts = artifact_store()
+        if artifacts is not None:
+            artifacts.release([file_id])
+
+        score_cache = get_score_cache()
+        if score_cache is not None:
+            score_cache.invalidate(ds_ids)
 
         gr.Info(f"File {file_name} has been deleted")
 
@@ -1117,34 +1113,36 @@ class FileIndexPage(BasePage):
 
         gr.Info(f"Start indexing {len(files)} files...")
 
-        # get the pipeline
-        indexing_pipeline = self._index.get_indexing_pipeline(settings, user_id)
-
         outputs, debugs = [], []
-        # stream the output
-        output_stream = indexing_pipeline.stream(files, reindex=reindex)
-        try:
-            while True:
-                response = next(output_stream)
-                if response is None:
-                    continue
-                if response.channel == "index":
-                    if response.content["status"] == "success":
-                        outputs.append(f"\u2705 | {response.content['file_name']}")
-                    elif response.content["status"] == "failed":
-                        outputs.append(
-                            f"\u274c | {response.content['file_name']}: "
-                            f"{response.content['message']}"
-                        )
-                elif response.channel == "debug":
-                    debugs.append(response.text)
+        # the stores of the index stay open until the files are indexed
+        with self._index.lease():
+            # get the pipeline
+            indexing_pipeline = self._index.get_indexing_pipeline(settings, user_id)
+
+            # stream the output
+            output_stream = indexing_pipeline.stream(files, reindex=reindex)
+            try:
+                while True:
+                    response = next(output_stream)
+                    if response is None:
+                        continue
+                    if response.channel == "index":
+                        if response.content["status"] == "success":
+                            outputs.append(f"\u2705 | {response.content['file_name']}")
+                        elif response.content["status"] == "failed":
+                            outputs.append(
+                                f"\u274c | {response.content['file_name']}: "
+                                f"{response.content['message']}"
+                            )
+                    elif response.channel == "debug":
+                        debugs.append(response.text)
+                    yield "\n".join(outputs), "\n".join(debugs)
+            except StopIteration as e:
+                results, index_errors, docs = e.value
+            except Exception as e:
+                debugs.append(f"Error: {e}")
                 yield "\n".join(outputs), "\n".join(debugs)
-        except StopIteration as e:
-            results, index_errors, docs = e.value
-        except Exception as e:
-            debugs.append(f"Error: {e}")
-            yield "\n".join(outputs), "\n".join(debugs)
-            return
+                return
 
         n_successes = len([_ for _ in results if _])
         if n_successes:
@@ -1,4 +1,5 @@
-from typing import Optional, Type
+from contextlib import ExitStack, contextmanager
+from typing import Iterator, Optional, Type
 
 from ktem.db.models import engine
 from sqlmodel import Session, select
@@ -196,5 +197,14 @@ class IndexManager:
     def indices(self):
         return self._indices
 
+    @contextmanager
+    def lease(self) -> Iterator[None]:
+        """Keep the resources of all the indices open, e.g. while the retrievers
+        of a chat run"""
+        with ExitStack() as stack:
+            for index in self._indices:
+                stack.enter_context(index.lease())
+            yield
+
     def info(self):
         return {index.id: index for index in self._indices}
@@ -1299,71 +1299,75 @@ class ChatPage(BasePage):
 
         queue: asyncio.Queue[Optional[dict]] = asyncio.Queue()
 
-        # construct the pipeline
-        pipeline, reasoning_state = self.create_pipeline(
-            settings,
-            reasoning_type,
-            llm_type,
-            use_mind_map,
-            use_citation,
-            language,
-            chat_state,
-            command_state,
-            user_id,
-            *selecteds,
-        )
-        print("Reasoning state", reasoning_state)
-        pipeline.set_output_queue(queue)
+        # the stores of the indices stay open until the answer is streamed
+        with self._app.index_manager.lease():
+            # construct the pipeline
+            pipeline, reasoning_state = self.create_pipeline(
+                settings,
+                reasoning_type,
+                llm_type,
+                use_mind_map,
+                use_citation,
+                language,
+                chat_state,
+                command_state,
+                user_id,
+                *selecteds,
+            )
+            print("Reasoning state", reasoning_state)
+            pipeline.set_output_queue(queue)
 
-        text, refs, plot, plot_gr = "", "", None, gr.update(visible=False)
-        msg_placeholder = getattr(
-            flowsettings, "KH_CHAT_MSG_PLACEHOLDER", "Thinking ..."
-        )
-        print(msg_placeholder)
-        yield (
-            chat_history + [(chat_input, text or msg_placeholder)],
-            refs,
-            plot_gr,
-            plot,
-            chat_state,
-        )
+            text, refs, plot, plot_gr = "", "", None, gr.update(visible=False)
+            msg_placeholder = getattr(
+                flowsettings, "KH_CHAT_MSG_PLACEHOLDER", "Thinking ..."
+            )
+            print(msg_placeholder)
+            yield (
+                chat_history + [(chat_input, text or msg_placeholder)],
+                refs,
+                plot_gr,
+                plot,
+                chat_state,
+            )
 
-        try:
-            for response in pipeline.stream(chat_input, conversation_id, chat_history):
-
-                if not isinstance(response, Document):
-                    continue
-
-                if response.channel is None:
-                    continue
-
-                if response.channel == "chat":
-                    if response.content is None:
-                        text = ""
-                    else:
-                        text += response.content
-
-                if response.channel == "info":
-                    if response.content is None:
-                        refs = ""
-                    else:
-                        refs += response.content
-
-                if response.channel == "plot":
-                    plot = response.content
-                    plot_gr = self._json_to_plot(plot)
-
-                chat_state[pipeline.get_info()["id"]] = reasoning_state["pipeline"]
-
-                yield (
-                    chat_history + [(chat_input, text or msg_placeholder)],
-                    refs,
-                    plot_gr,
-                    plot,
-                    chat_state,
-                )
-        except ValueError as e:
-            print(e)
+            try:
+                for response in pipeline.stream(
+                    chat_input, conversation_id, chat_history
+                ):
+
+                    if not isinstance(response, Document):
+                        continue
+
+                    if response.channel is None:
+                        continue
+
+                    if response.channel == "chat":
+                        if response.content is None:
+                            text = ""
+                        else:
+                            text += response.content
+
+                    if response.channel == "info":
+                        if response.content is None:
+                            refs = ""
+                        else:
+                            refs += response.content
+
+                    if response.channel == "plot":
+                        plot = response.content
+                        plot_gr = self._json_to_plot(plot)
+
+                    chat_state[pipeline.get_info()["id"]] = reasoning_state["pipeline"]
+
+                    yield (
+                        chat_history + [(chat_input, text or msg_placeholder)],
+                        refs,
+                        plot_gr,
+                        plot,
+                        chat_state,
+                    )
+            except ValueError as e:
+                print(e)
 
         if not text:
             empty_msg = getattr(
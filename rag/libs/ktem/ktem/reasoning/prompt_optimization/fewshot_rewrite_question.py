@@ -54,6 +54,7 @@ class FewshotRewriteQuestionPipeline(RewriteQuestionPipeline):
                 ids=ids,
             )
             self.doc_store.add(documents[i : i + batch_size])
+        self.doc_store.refresh()
 
     @classmethod
     def get_pipeline(
@@ -3,7 +3,7 @@ import logging
 import threading
 from datetime import datetime
 from textwrap import dedent
-from typing import Generator
+from typing import Generator, Optional
 
 import tiktoken
 from decouple import config
@@ -146,6 +146,17 @@ class FullQAPipeline(BaseReasoning):
         tokenizer = self.get_token_counter(model_name)
         return len(tokenizer.encode(str(text)))
 
+    def count_evidence_tokens(
+        self, evidence_output: Document, model_name: Optional[str] = None
+    ) -> int:
+        """Count tokens in the evidence, reusing the token count of the evidence
+        pipeline when it counted them with the tokenizer of the model"""
+        metadata = evidence_output.metadata
+        encoding_name = self.get_token_counter(model_name).name
+        if "tokens" in metadata and metadata.get("encoding") == encoding_name:
+            return metadata["tokens"]
+        return self.count_tokens(evidence_output.content[1], model_name)
+
     def count_message_tokens(self, messages: list, model_name: str = None) -> dict:
         """Count tokens in a message list (for chat models)"""
         if not messages:
@@ -305,6 +316,7 @@ class FullQAPipeline(BaseReasoning):
 
             plot_docs.extend(retriever_docs_plot)
 
+        Render.prefetch_sources(docs)
         info = [
                 Document(
                     channel="info",
@@ -498,10 +510,11 @@ class FullQAPipeline(BaseReasoning):
 
         yield from infos
 
-        evidence_mode, evidence, images = self.evidence_pipeline(docs).content
+        evidence_output = self.evidence_pipeline(docs)
+        evidence_mode, evidence, images = evidence_output.content
 
         # Count tokens in evidence
-        evidence_tokens = self.count_tokens(evidence, model_name)
+        evidence_tokens = self.count_evidence_tokens(evidence_output, model_name)
         token_usage["components"]["evidence_pipeline"]["tokens"] = evidence_tokens
 
         def generate_relevant_scores():
@@ -686,6 +699,10 @@ class FullQAPipeline(BaseReasoning):
 
         answer_pipeline.llm = llm
         answer_pipeline.citation_pipeline.llm = llm
+        # count the evidence tokens with the tokenizer of the answering model
+        evidence_pipeline.encoding_name = pipeline.get_token_counter(
+            getattr(llm, "model", "default")
+        ).name
         answer_pipeline.n_last_interactions = settings[f"{prefix}.n_last_interactions"]
         answer_pipeline.enable_citation = (
                 settings[f"{prefix}.highlight_citation"] != "off"
@@ -886,10 +903,11 @@ class FullDecomposeQAPipeline(FullQAPipeline):
 
         yield from infos
 
-        evidence_mode, evidence, images = self.evidence_pipeline(docs).content
+        evidence_output = self.evidence_pipeline(docs)
+        evidence_mode, evidence, images = evidence_output.content
 
         # Count tokens in evidence
-        evidence_tokens = self.count_tokens(evidence, model_name)
+        evidence_tokens = self.count_evidence_tokens(evidence_output, model_name)
         sub_qa_tokens = self.count_tokens(sub_question_answer_output, model_name) if sub_question_answer_output else 0
         token_usage["components"]["evidence_pipeline"]["tokens"] = evidence_tokens + sub_qa_tokens
 
@@ -52,9 +52,13 @@ class RerankingManager:
                     self._default = item.name
 
     def load_vendors(self):
-        from kotaemon.rerankings import CohereReranking, TeiFastReranking
+        from kotaemon.rerankings import (
+            CohereReranking,
+            OnnxCrossEncoderReranking,
+            TeiFastReranking,
+        )
 
-        self._vendors = [TeiFastReranking, CohereReranking]
+        self._vendors = [TeiFastReranking, CohereReranking, OnnxCrossEncoderReranking]
 
     def __getitem__(self, key: str) -> BaseReranking:
         """Get model by name"""
@@ -1,10 +1,202 @@
+import asyncio
+import io
 import mimetypes
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from io import BytesIO
+from typing import Iterator, Optional
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from fsspec import AbstractFileSystem
 from theflow.settings import settings as flowsettings
 
+MB = 1024 * 1024
+
+_client_lock = threading.Lock()
+
+
+@lru_cache
+def _create_s3_client():
+    # the default boto3 session is not thread-safe, use a dedicated one
+    session = boto3.session.Session()
+    return session.client(
+        's3',
+        endpoint_url=flowsettings.AWS_S3_ENDPOINT_URL or None,
+        region_name=flowsettings.AWS_REGION,
+        aws_access_key_id=flowsettings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=flowsettings.AWS_SECRET_ACCESS_KEY,
+        config=Config(
+            max_pool_connections=getattr(
+                flowsettings, "AWS_S3_MAX_POOL_CONNECTIONS", 32
+            ),
+            retries={"max_attempts": 5, "mode": "adaptive"},
+            tcp_keepalive=True,
+        ),
+    )
+
+
+def get_s3_client():
+    """The S3 client shared by all storages, boto3 clients are thread-safe and
+    keep a pool of `AWS_S3_MAX_POOL_CONNECTIONS` connections"""
+    with _client_lock:
+        return _create_s3_client()
+
+
+@lru_cache
+def get_transfer_config() -> TransferConfig:
+    """The multipart settings of the uploads and downloads"""
+    return TransferConfig(
+        multipart_threshold=getattr(
+            flowsettings, "AWS_S3_MULTIPART_THRESHOLD", 16 * MB
+        ),
+        multipart_chunksize=getattr(
+            flowsettings, "AWS_S3_MULTIPART_CHUNKSIZE", 8 * MB
+        ),
+        max_concurrency=getattr(flowsettings, "AWS_S3_MAX_CONCURRENCY", 8),
+        use_threads=True,
+    )
+
+
+@lru_cache
+def _get_executor() -> ThreadPoolExecutor:
+    """The threads of the async variants, one per pooled connection"""
+    return ThreadPoolExecutor(
+        max_workers=getattr(flowsettings, "AWS_S3_MAX_POOL_CONNECTIONS", 32),
+        thread_name_prefix="s3",
+    )
+
+
+async def _run_async(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(fn, *args, **kwargs))
+
+
+class S3ObjectReader(io.RawIOBase):
+    """Read-only, seekable file object over an S3 object
+
+    The content is fetched lazily with ranged GETs of `block_size` bytes, so a
+    parser can read the parts of the object it needs without downloading it
+    all to a temporary file first.
+
+    Args:
+        client: the S3 client
+        bucket: the bucket name
+        key: the object key
+        block_size: number of bytes fetched per request
+        size: the object size, fetched with a HEAD request if not given
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        key: str,
+        block_size: int = MB,
+        size: Optional[int] = None,
+    ):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        if size is None:
+            size = client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.size: int = size
+        self._pos = 0
+        self._block_start = 0
+        self._block = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = pos
+        return pos
+
+    def read_range(self, start: int, end: int) -> bytes:
+        """Read the bytes from `start` to `end` (excluded) with one request"""
+        if start >= end:
+            return b""
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end - 1}"
+        )
+        return response["Body"].read()
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.size:
+            return 0
+
+        offset = self._pos - self._block_start
+        if not 0 <= offset < len(self._block):
+            # fetch at least a block, more for large reads
+            end = min(self._pos + max(self.block_size, len(buffer)), self.size)
+            self._block = self.read_range(self._pos, end)
+            self._block_start, offset = self._pos, 0
+
+        n = min(len(buffer), len(self._block) - offset)
+        buffer[:n] = self._block[offset : offset + n]
+        self._pos += n
+        return n
+
+
+class S3StorageFileSystem(AbstractFileSystem):
+    """Read-only fsspec file system over the objects of the storage bucket
+
+    The loaders taking a `fs` (e.g. `PDFThumbnailReader`, `TxtReader`) read the
+    objects with `S3Storage.open`, by ranged GETs, instead of a local copy. The
+    paths are the object keys. The file system is pickled by its arguments, so
+    the parse workers open the objects with their own client.
+
+    Args:
+        block_size: number of bytes fetched per request
+    """
+
+    protocol = "s3storage"
+
+    def __init__(self, block_size: int = 8 * MB):
+        super().__init__(block_size=block_size)
+        self.read_block_size = block_size
+        self.storage = S3Storage(prefix="")
+
+    def info(self, path, **kwargs) -> dict:
+        response = self.storage.s3_client.head_object(
+            Bucket=self.storage.bucket_name, Key=path
+        )
+        return {
+            "name": path,
+            "size": response["ContentLength"],
+            "type": "file",
+            "mtime": response["LastModified"].timestamp(),
+        }
+
+    def _open(self, path, mode="rb", **kwargs):
+        if mode != "rb":
+            raise NotImplementedError(f"{self.protocol} is read-only")
+        return io.BufferedReader(
+            self.storage.open(path, block_size=self.read_block_size)
+        )
+
 
 class S3Storage:
     def __init__(self, prefix):
@@ -12,13 +204,36 @@ class S3Storage:
         self.region = flowsettings.AWS_REGION
         self.prefix = prefix
 
-        self.s3_client = boto3.client(
-            's3',
-            endpoint_url=flowsettings.AWS_S3_ENDPOINT_URL,
-            region_name=self.region,
-            aws_access_key_id=flowsettings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=flowsettings.AWS_SECRET_ACCESS_KEY
-        )
+        self.s3_client = get_s3_client()
+
+    def get_key(self, file_hash, file_extension=""):
+        return f"{self.prefix}/{file_hash}{file_extension}"
+
+    def exists(self, s3_key):
+        """Check if an object exists in the S3 bucket"""
+        try:
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def upload_bytes(self, data, file_hash, file_extension, mime_type):
+        """Upload in-memory content to S3 bucket"""
+        s3_key = self.get_key(file_hash, file_extension)
+        try:
+            self.s3_client.upload_fileobj(
+                BytesIO(data),
+                self.bucket_name,
+                s3_key,
+                ExtraArgs={'ACL': 'public-read', 'ContentType': mime_type},
+                Config=get_transfer_config(),
+            )
+            return s3_key
+        except ClientError as e:
+            print(f"Error uploading file to S3: {e}")
+            raise
 
     def upload_file(self, file_path, file_hash):
         """Upload a file to S3 bucket"""
@@ -28,7 +243,7 @@ class S3Storage:
         if mime_type is None:
             mime_type = "application/octet-stream"  # Default if unknown
         file_extension = os.path.splitext(file_path)[1]
-        s3_key = f"{self.prefix}/{file_hash}{file_extension}"
+        s3_key = self.get_key(file_hash, file_extension)
 
         try:
             with open(file_path, 'rb') as file_data:
@@ -36,7 +251,8 @@ class S3Storage:
                     file_data,
                     self.bucket_name,
                     s3_key,
-                    ExtraArgs={'ACL': 'public-read', 'ContentType': mime_type}
+                    ExtraArgs={'ACL': 'public-read', 'ContentType': mime_type},
+                    Config=get_transfer_config(),
                 )
                 print("s3 key:::", s3_key)
             return s3_key
@@ -47,14 +263,40 @@ class S3Storage:
     def download_file(self, file_hash, local_path):
         """Download a file from S3 bucket to local path"""
         s3_key = f"{self.prefix}{file_hash}"
+        return self.download_key(s3_key, local_path)
 
+    def download_key(self, s3_key, local_path):
+        """Download an object to a local path, by concurrent parts if large"""
         try:
-            self.s3_client.download_file(self.bucket_name, s3_key, local_path)
+            self.s3_client.download_file(
+                self.bucket_name, s3_key, local_path, Config=get_transfer_config()
+            )
             return local_path
         except ClientError as e:
             print(f"Error downloading file from S3: {e}")
             raise
 
+    def open(self, s3_key, block_size: int = MB) -> S3ObjectReader:
+        """Open an object as a seekable file object read with ranged GETs"""
+        return S3ObjectReader(self.s3_client, self.bucket_name, s3_key, block_size)
+
+    def read_range(self, s3_key, start: int, end: Optional[int] = None) -> bytes:
+        """Read the bytes from `start` to `end` (excluded, default to the end)"""
+        range_ = f"bytes={start}-" if end is None else f"bytes={start}-{end - 1}"
+        response = self.s3_client.get_object(
+            Bucket=self.bucket_name, Key=s3_key, Range=range_
+        )
+        return response["Body"].read()
+
+    def iter_chunks(self, s3_key, chunk_size: int = MB) -> Iterator[bytes]:
+        """Stream the content of an object by chunks"""
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+        body = response["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
     def get_file_url(self, file_hash, expiration=3600):
         """Generate a presigned URL for the file"""
         s3_key = f"{self.prefix}{file_hash}"
@@ -82,3 +324,25 @@ class S3Storage:
         except ClientError as e:
             print(f"Error deleting file from S3: {e}")
             raise
+
+    # async variants, run in a thread pool sized like the connection pool
+
+    async def aexists(self, s3_key):
+        return await _run_async(self.exists, s3_key)
+
+    async def aupload_bytes(self, data, file_hash, file_extension, mime_type):
+        return await _run_async(
+            self.upload_bytes, data, file_hash, file_extension, mime_type
+        )
+
+    async def aupload_file(self, file_path, file_hash):
+        return await _run_async(self.upload_file, file_path, file_hash)
+
+    async def adownload_key(self, s3_key, local_path):
+        return await _run_async(self.download_key, s3_key, local_path)
+
+    async def aread_range(self, s3_key, start: int, end: Optional[int] = None):
+        return await _run_async(self.read_range, s3_key, start, end)
+
+    async def adelete_file(self, file_hash):
+        return await _run_async(self.delete_file, file_hash)
@@ -1,4 +1,7 @@
 import os
+import threading
+import time
+from typing import Iterable, Optional
 
 import markdown
 from fast_langdetect import detect
@@ -8,13 +11,64 @@ from sqlalchemy import Table, MetaData
 from theflow.settings import settings as flowsettings
 from libs.ktem.ktem.storage.s3_storage import S3Storage
 from sqlalchemy.orm import Session
-from libs.ktem.ktem.db.engine import engine
-from sqlalchemy import text
+from ktem.db.engine import engine
+from sqlalchemy import bindparam, text
 import os
 
 BASE_PATH = os.environ.get("GR_FILE_ROOT_PATH", "")
 
 
+class SourcePathResolver:
+    """Resolve the storage path of the source files, by batch
+
+    The paths are cached for `ttl` seconds, so rendering the evidences of an
+    answer costs at most one query for all its files.
+    """
+
+    def __init__(self, ttl: float = 300.0, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._paths: dict[str, tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, file_ids: Iterable[str]) -> dict[str, str]:
+        """Get the storage paths of the files, querying the missing ones at once"""
+        now = time.monotonic()
+        paths, missing = {}, []
+        with self._lock:
+            for file_id in dict.fromkeys(file_ids):
+                item = self._paths.get(file_id)
+                if item and item[0] > now:
+                    paths[file_id] = item[1]
+                else:
+                    missing.append(file_id)
+
+        if missing:
+            query = text(
+                "SELECT id, file FROM core_datasource WHERE id IN :file_ids"
+            ).bindparams(bindparam("file_ids", expanding=True))
+            with engine.connect() as connection:
+                rows = connection.execute(query, {"file_ids": missing}).fetchall()
+
+            with self._lock:
+                if len(self._paths) + len(rows) > self.maxsize:
+                    self._paths = {
+                        k: v for k, v in self._paths.items() if v[0] > now
+                    }
+                for file_id, path in rows:
+                    self._paths[str(file_id)] = (now + self.ttl, path)
+                    paths[str(file_id)] = path
+        return paths
+
+    def get(self, file_id: str) -> Optional[str]:
+        return self.resolve([file_id]).get(file_id)
+
+
+source_paths = SourcePathResolver(
+    ttl=getattr(flowsettings, "KH_SOURCE_PATH_CACHE_TTL", 300.0)
+)
+
+
 def is_close(val1, val2, tolerance=1e-9):
     return abs(val1 - val2) <= tolerance
 
@@ -93,29 +147,12 @@ class Render:
         from theflow.settings import settings as flowsettings
         use_s3 = getattr(flowsettings, "KH_USE_S3_STORAGE", False)
 
-        # If S3 is enabled and we have a file_id, generate an S3 URL
-
-        if use_s3 and "file_id" in doc.metadata:
-            from libs.ktem.ktem.storage.s3_storage import S3Storage
-            # Get file hash from database using file_id
-            from sqlalchemy.orm import Session
-            from libs.ktem.ktem.db.engine import engine
-            from sqlalchemy import select
-            from sqlalchemy import text
-
-            file_id = doc.metadata.get("file_id")
-            query = text("SELECT * FROM core_datasource WHERE id=:file_id")
-
-            # Execute the query
-            with engine.connect() as connection:
-                result = connection.execute(query, {"file_id": file_id})
-                row = result.fetchone()
-                if not result:
-                    raise ValueError(f"File with ID {file_id} not found")
-
-                # A better approach would be to include the index_id in the metadata
-                if row:
-                    pdf_path = row[2]
+        # If S3 is enabled, use the storage path of the file, recorded in the
+        # metadata at index time or resolved from the source table
+        if use_s3 and "storage_path" in doc.metadata:
+            pdf_path = doc.metadata["storage_path"]
+        elif use_s3 and "file_id" in doc.metadata:
+            pdf_path = source_paths.get(doc.metadata["file_id"]) or pdf_path
 
         # Check if the file exists locally if not using S3
         if not use_s3 and not pdf_path.startswith("http") and not os.path.isfile(pdf_path):
@@ -156,6 +193,17 @@ class Render:
         </a>
         """
 
+    @staticmethod
+    def prefetch_sources(docs: Iterable[RetrievedDocument]):
+        """Resolve the storage paths of the documents to preview in one query"""
+        if not getattr(flowsettings, "KH_USE_S3_STORAGE", False):
+            return
+        source_paths.resolve(
+            doc.metadata["file_id"]
+            for doc in docs
+            if "file_id" in doc.metadata and "storage_path" not in doc.metadata
+        )
+
     @staticmethod
     def highlight(text: str, elem_id: str | None = None) -> str:
         """Highlight text"""
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# ktem reads its settings from rag/flowsettings.py when it is imported, which
+# needs a database and the kinds of stores
+_rag_dir = Path(__file__).parents[3]
+_data_dir = Path(tempfile.mkdtemp(prefix="ktem_tests_"))
+
+os.environ.setdefault("THEFLOW_SETTINGS", "flowsettings")
+os.environ.setdefault("KH_DATABASE", f"sqlite:///{_data_dir / 'sql.db'}")
+os.environ.setdefault("KH_DOCSTORE_NAME", "sqlite")
+os.environ.setdefault("KH_VECTORSTORE_NAME", "chroma")
+if str(_rag_dir) not in sys.path:
+    sys.path.insert(0, str(_rag_dir))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def theflow_storage(tmp_path_factory):
+    """Persist the pipeline runs in a temporary directory, not in the repo"""
+    from theflow.storage import storage
+
+    storage._prefix = tmp_path_factory.mktemp("theflow")
@@ -0,0 +1,70 @@
+import pytest
+from ktem.components import StoreRegistry
+
+from kotaemon.base import Document
+from kotaemon.storages import BM25DocumentStore
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return StoreRegistry(
+        lambda name: BM25DocumentStore(path=tmp_path, collection_name=name),
+        max_size=1,
+    )
+
+
+def test_store_registry_lru(registry):
+    store = registry.get("a")
+    assert registry.get("a") is store
+
+    # not leased, it is closed once evicted
+    registry.get("b")
+    stats = registry.stats()
+    assert stats["collections"] == ["b"]
+    assert stats["evictions"] == 1 and stats["closed"] == 1
+
+
+def test_store_registry_evict_leased(registry):
+    with registry.lease("a") as store:
+        store.add(Document(text="first", id_="1"))
+
+        # "a" is evicted while a pipeline still uses it, it stays open
+        registry.get("b")
+        assert registry.stats()["pending_close"] == 1
+        store.add(Document(text="second", id_="2"))
+
+        # the evicted store is brought back, not created a second time
+        assert registry.get("a") is store
+        assert registry.stats()["pending_close"] == 0
+
+        # still open after the other references are gone
+        registry.get("b")
+        assert registry.stats()["pending_close"] == 1
+        assert registry.stats()["leases"] == 1
+
+    # closed with its last lease, with all its documents saved
+    assert registry.stats()["collections"] == ["b"]
+    assert registry.stats()["pending_close"] == 0
+    assert registry.get("a").count() == 2
+
+
+def test_store_registry_leases(registry):
+    store = registry.acquire("a")
+    assert registry.acquire("a") is store
+    registry.get("b")
+
+    registry.release("a")
+    assert registry.stats()["pending_close"] == 1
+    registry.release("a")
+    assert registry.stats()["pending_close"] == 0
+    with pytest.raises(RuntimeError):
+        store.add(Document(text="lost", id_="1"))
+    with pytest.raises(ValueError):
+        registry.release("a")
+
+
+def test_store_registry_close(registry):
+    store = registry.get("a")
+    registry.close()
+    with pytest.raises(RuntimeError):
+        store.add(Document(text="lost", id_="1"))
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import pytest
+from ktem.db.engine import iterate_sync, run_sync
+
+
+def test_run_sync():
+    def work(value, offset=0):
+        return value + offset, threading.current_thread().name
+
+    async def main():
+        return await run_sync(work, 1, offset=2), threading.current_thread().name
+
+    (result, worker), loop_thread = asyncio.run(main())
+    assert result == 3
+    assert worker.startswith("sync") and worker != loop_thread
+
+    async def failing():
+        await run_sync(int, "not a number")
+
+    with pytest.raises(ValueError):
+        asyncio.run(failing())
+
+
+def test_iterate_sync():
+    threads = []
+
+    def produce():
+        for idx in range(3):
+            threads.append(threading.current_thread().name)
+            yield idx
+        # a None item is not taken for the end of the iteration
+        yield None
+
+    async def main():
+        return [item async for item in iterate_sync(produce())]
+
+    assert asyncio.run(main()) == [0, 1, 2, None]
+    assert all(name.startswith("sync") for name in threads)
+
+    async def empty():
+        return [item async for item in iterate_sync([])]
+
+    assert asyncio.run(empty()) == []
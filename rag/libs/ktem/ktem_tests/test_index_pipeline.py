@@ -0,0 +1,305 @@
+import threading
+import uuid
+from unittest.mock import patch
+
+import pytest
+from ktem.db.engine import engine
+from ktem.index.file import pipelines
+from ktem.index.file.pipelines import IndexDocumentPipeline, IndexPipeline
+from ktem.index.file.relations import drop_relations, get_relations
+from sqlalchemy import JSON, Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.mutable import MutableDict
+from sqlalchemy.orm import Session
+
+from kotaemon.base import Document, DocumentWithEmbedding
+from kotaemon.embeddings import BaseEmbeddings
+from kotaemon.indices.ingests.artifacts import (
+    SQLiteArtifactStore,
+    artifact_key,
+    file_hash,
+)
+from kotaemon.indices.splitters import TokenSplitter
+from kotaemon.loaders import TxtReader
+from kotaemon.storages import InMemoryDocumentStore, InMemoryVectorStore
+
+
+class _LengthEmbeddings(BaseEmbeddings):
+    fail_on: str = ""
+
+    def invoke(self, text, *args, **kwargs):
+        docs = self.prepare_input(text)
+        if self.fail_on and any(doc.text.startswith(self.fail_on) for doc in docs):
+            raise RuntimeError(f"Cannot embed {self.fail_on}")
+        return [
+            DocumentWithEmbedding(content=doc, embedding=[float(len(doc.text)), 1.0])
+            for doc in docs
+        ]
+
+
+@pytest.fixture
+def tables():
+    Base = declarative_base()
+    name = uuid.uuid4().hex[:8]
+    Source = type(
+        "Source",
+        (Base,),
+        {
+            "__tablename__": f"test_source_{name}",
+            "id": Column(String, primary_key=True, default=lambda: str(uuid.uuid4())),
+            "title": Column(String),
+            "data_type": Column(String, default="document"),
+            "file": Column(String),
+            "size": Column(Integer, default=0),
+            "created_by_id": Column(String, default=""),
+            "data": Column(MutableDict.as_mutable(JSON), default={}),  # type: ignore
+        },
+    )
+    Index = type(
+        "IndexTable",
+        (Base,),
+        {
+            "__tablename__": f"test_index_{name}",
+            "id": Column(String, primary_key=True, default=lambda: str(uuid.uuid4())),
+            "source_id": Column(String),
+            "target_id": Column(String),
+            "relation_type": Column(String),
+        },
+    )
+    Base.metadata.create_all(engine)
+    yield Source, Index
+    Base.metadata.drop_all(engine)
+    drop_relations(Index)
+
+
+@pytest.fixture
+def make_pipeline(tables, tmp_path):
+    Source, Index = tables
+
+    def make(**kwargs):
+        params = {
+            "loader": TxtReader(),
+            "splitter": None,
+            "Source": Source,
+            "Index": Index,
+            "VS": InMemoryVectorStore(),
+            "DS": InMemoryDocumentStore(),
+            "FSPath": tmp_path,
+            "user_id": "user",
+            "embedding": _LengthEmbeddings(),
+            **kwargs,
+        }
+        return IndexPipeline(**params)
+
+    return make
+
+
+def _windows(n_windows, per_window=3):
+    return [
+        [Document(text=f"w{i} chunk {j}", id_=f"w{i}-{j}") for j in range(per_window)]
+        for i in range(n_windows)
+    ]
+
+
+def _embedding_threads():
+    return [t for t in threading.enumerate() if t.name.startswith("embedding_")]
+
+
+def _vector_ids(pipeline):
+    return list(pipeline.VS._client.data.embedding_dict)
+
+
+def _run(gen):
+    """Exhaust the indexing generator, return its result"""
+    try:
+        while True:
+            next(gen)
+    except StopIteration as e:
+        return e.value
+
+
+@pytest.mark.parametrize("in_thread", [False, True])
+def test_handle_doc_windows(make_pipeline, in_thread):
+    pipeline = make_pipeline(run_embedding_in_thread=in_thread, chunk_batch_size=2)
+
+    windows = _windows(4)
+    thumbnail = Document(
+        text="thumbnail",
+        id_="thumb-1",
+        metadata={"type": "thumbnail", "page_label": "1"},
+    )
+    windows[0].append(thumbnail)
+    windows[2][0].metadata["page_label"] = "1"
+
+    n_chunks = _run(pipeline.handle_doc_windows(windows, "file1", "file1.txt"))
+    assert not _embedding_threads(), "Expect the worker joined"
+
+    ids = [doc.doc_id for window in windows for doc in window]
+    assert n_chunks == len(ids) == 13
+    relations = get_relations(pipeline.Index)
+    assert sorted(relations.get(["file1"], "document")) == sorted(ids)
+    assert sorted(relations.get(["file1"], "vector")) == sorted(ids)
+    assert pipeline.DS.count() == len(ids)
+    assert len(_vector_ids(pipeline)) == len(ids)
+    assert pipeline.DS.get(["w2-0"])[0].metadata["thumbnail_doc_id"] == "thumb-1"
+
+
+@pytest.mark.parametrize("in_thread", [False, True])
+def test_handle_doc_windows_embedding_error(make_pipeline, in_thread):
+    pipeline = make_pipeline(
+        run_embedding_in_thread=in_thread, embedding=_LengthEmbeddings(fail_on="w2")
+    )
+
+    with pytest.raises(RuntimeError, match="Cannot embed w2"):
+        _run(pipeline.handle_doc_windows(_windows(8), "file1", "file1.txt"))
+    assert not _embedding_threads(), "Expect the worker joined"
+
+    # the windows before the failing one are embedded, the next ones are not
+    relations = get_relations(pipeline.Index)
+    embedded = [f"w{i}-{j}" for i in range(2) for j in range(3)]
+    assert sorted(relations.get(["file1"], "vector")) == embedded
+    assert sorted(_vector_ids(pipeline)) == embedded
+    stored = relations.get(["file1"], "document")
+    assert set(embedded + ["w2-0", "w2-1", "w2-2"]) <= set(stored)
+    if in_thread:
+        # the queue holds one window, so the windows stop being stored soon
+        # after the failure rather than going through the whole file
+        assert len(stored) <= 18
+    else:
+        assert len(stored) == 9
+
+
+def test_handle_doc_windows_parse_error(make_pipeline):
+    pipeline = make_pipeline(run_embedding_in_thread=True)
+
+    def windows():
+        yield from _windows(3)
+        raise ValueError("Cannot parse page 4")
+
+    with pytest.raises(ValueError, match="Cannot parse page 4"):
+        _run(pipeline.handle_doc_windows(windows(), "file1", "file1.txt"))
+    assert not _embedding_threads(), "Expect the worker joined"
+
+    # the windows parsed before the error are stored and embedded
+    relations = get_relations(pipeline.Index)
+    ids = [f"w{i}-{j}" for i in range(3) for j in range(3)]
+    assert sorted(relations.get(["file1"], "document")) == ids
+    assert sorted(relations.get(["file1"], "vector")) == ids
+
+
+def test_index_files_error(tables, tmp_path, monkeypatch):
+    Source, Index = tables
+    pipeline = IndexDocumentPipeline(
+        Source=Source,
+        Index=Index,
+        VS=InMemoryVectorStore(),
+        DS=InMemoryDocumentStore(),
+        FSPath=tmp_path,
+        user_id="user",
+        embedding=_LengthEmbeddings(fail_on="broken"),
+        run_embedding_in_thread=True,
+    )
+    files = {}
+    for name, text in [("a", "first file"), ("b", "broken file"), ("c", "last file")]:
+        with Session(engine) as session:
+            source = Source(title=f"{name}.txt", file=name)
+            session.add(source)
+            session.commit()
+            files[source.id] = (name, text)
+
+    def fetch_file(self, file_id):
+        # a local copy of the source, removed once indexed
+        name, text = files[file_id]
+        path = tmp_path / f"{name}.txt"
+        path.write_text(text)
+        return "document", path, None
+
+    monkeypatch.setattr(IndexDocumentPipeline, "fetch_file", fetch_file)
+    gen = pipeline.stream(list(files))
+    statuses = {}
+    try:
+        while True:
+            doc = next(gen)
+            if doc.channel == "index":
+                statuses[doc.content["file_name"]] = doc.content["status"]
+    except StopIteration as e:
+        file_ids, errors, _ = e.value
+    assert not _embedding_threads(), "Expect the workers joined"
+
+    assert statuses == {"a.txt": "success", "b.txt": "failed", "c.txt": "success"}
+    assert sorted(error for error in errors if error) == ["Cannot embed broken"]
+    relations = get_relations(Index)
+    for file_id, (name, text) in files.items():
+        ids = relations.get([file_id], "vector")
+        if name == "b":
+            assert not ids
+        else:
+            assert [doc.text for doc in pipeline.DS.get(ids)] == [text]
+    assert not list(tmp_path.glob("*.txt")), "Expect the local copies removed"
+
+
+def test_reuse_artifact(make_pipeline, tmp_path, monkeypatch):
+    artifacts = SQLiteArtifactStore(path=tmp_path / "artifacts.db")
+    monkeypatch.setattr(pipelines, "artifact_store", lambda: artifacts)
+    pipeline = make_pipeline(splitter=TokenSplitter(chunk_size=600, chunk_overlap=0))
+    text = " ".join(f"Sentence {i} of the shared content." for i in range(200))
+
+    file_ids = []
+    for name in ["first.txt", "second.txt"]:
+        path = tmp_path / name
+        path.write_text(text)
+        with Session(engine) as session:
+            source = pipeline.Source(title=name, file=str(path))
+            session.add(source)
+            session.commit()
+            file_ids.append(source.id)
+    first, second = file_ids
+    key = artifact_key(
+        file_hash(tmp_path / "first.txt"),
+        pipeline.loader,
+        pipeline.splitter,
+        pipeline.embedding,
+    )
+
+    _run(
+        pipeline.stream(tmp_path / "first.txt", False, file_id=first, artifact_key=key)
+    )
+    assert artifacts.exists(key)
+    with patch.object(TxtReader, "load_data") as load_data:
+        _, docs = _run(
+            pipeline.stream(
+                tmp_path / "second.txt", False, file_id=second, artifact_key=key
+            )
+        )
+    load_data.assert_not_called()
+
+    # the chunks are copied with new ids and the metadata of the second file
+    relations = get_relations(pipeline.Index)
+    first_ids = relations.get([first], "document")
+    second_ids = relations.get([second], "document")
+    assert len(second_ids) == len(first_ids) > 1
+    assert not set(first_ids) & set(second_ids)
+    assert relations.get([second], "vector") == second_ids
+    for first_doc, second_doc in zip(
+        pipeline.DS.get(first_ids), pipeline.DS.get(second_ids)
+    ):
+        assert second_doc.text == first_doc.text
+        assert first_doc.metadata["file_id"] == first
+        assert second_doc.metadata["file_id"] == second
+        assert second_doc.metadata["file_name"] == "second.txt"
+    assert [doc.doc_id for doc in docs] == second_ids
+
+    # the second file stays searchable once the first one is deleted
+    pipeline.delete_file(first)
+    assert artifacts.exists(key)
+    assert pipeline.DS.count() == len(second_ids)
+    assert [doc.doc_id for doc in pipeline.DS.get(second_ids)] == second_ids
+    embedding = pipeline.embedding(pipeline.DS.get(second_ids)[0].text)[0].embedding
+    _, _, found = pipeline.VS.query(embedding, top_k=len(first_ids) * 2)
+    assert sorted(found) == sorted(second_ids)
+
+    # the artifact is deleted with the last file referencing it
+    pipeline.delete_file(second)
+    assert not artifacts.exists(key)
+    assert not _vector_ids(pipeline)
+    artifacts.close()
@@ -0,0 +1,126 @@
+import uuid
+
+import pytest
+from ktem.index.file.relations import ChunkRelations, drop_relations, get_relations
+from sqlalchemy import Column, String, create_engine, inspect
+from sqlalchemy.ext.declarative import declarative_base
+
+
+def _index_table(name="test_index"):
+    Base = declarative_base()
+    return type(
+        "IndexTable",
+        (Base,),
+        {
+            "__tablename__": name,
+            "id": Column(String, primary_key=True, default=lambda: str(uuid.uuid4())),
+            "source_id": Column(String),
+            "target_id": Column(String),
+            "relation_type": Column(String),
+        },
+    )
+
+
+@pytest.fixture
+def relations(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sql.db'}")
+    Index = _index_table()
+    Index.metadata.create_all(engine)
+    return ChunkRelations(Index, engine)
+
+
+def test_chunk_relations_add_get(relations):
+    relations.add("file1", ["a", "b"], "document")
+    relations.add("file1", ["v"], "vector")
+    relations.add("file2", ["c"], "document")
+
+    assert relations.get(["file2", "file1"]) == ["c", "a", "b"]
+    assert relations.get(["file1"], "vector") == ["v"]
+    assert relations.get(["missing"]) == []
+
+    # the cached ids are dropped when the source is re-indexed
+    relations.add("file2", ["d"], "document")
+    assert relations.get(["file2"]) == ["c", "d"]
+
+
+def test_chunk_relations_compact_source(relations):
+    relations.add("file1", ["a", "b"], "document")
+    assert relations.compact_source("file1") == {"document": ["a", "b"]}
+
+    with relations.engine.connect() as conn:
+        rows = conn.execute(relations.compact_table.select()).all()
+    assert [(row.source_id, row.target_ids) for row in rows] == [("file1", ["a", "b"])]
+
+    # read from the array row once the cache is gone
+    relations.invalidate(["file1"])
+    assert relations.get(["file1"]) == ["a", "b"]
+
+    # re-indexing the source outdates its array
+    relations.add("file1", ["c"], "document")
+    with relations.engine.connect() as conn:
+        assert not conn.execute(relations.compact_table.select()).all()
+    assert relations.get(["file1"]) == ["a", "b", "c"]
+
+
+def test_chunk_relations_other_process(relations):
+    # another worker process sharing the database
+    other = ChunkRelations(relations.Index, relations.engine)
+    relations.add("file1", ["a", "b"], "document")
+    relations.compact_source("file1")
+    assert other.get(["file1"]) == ["a", "b"]
+
+    # the cached array is served while its version is the current one
+    compact = relations.compact_table
+    with relations.engine.begin() as conn:
+        conn.execute(compact.update().values(target_ids=["x"]))
+    assert other.get(["file1"]) == ["a", "b"]
+
+    # re-indexed then deleted by the first process
+    relations.delete(["file1"])
+    relations.add("file1", ["c"], "document")
+    relations.compact_source("file1")
+    assert other.get(["file1"]) == ["c"]
+    relations.delete(["file1"])
+    assert other.get(["file1"]) == []
+
+
+@pytest.mark.parametrize("delete_returning", [True, False])
+def test_chunk_relations_delete(relations, monkeypatch, delete_returning):
+    monkeypatch.setattr(relations.engine.dialect, "delete_returning", delete_returning)
+    relations.add("file1", ["a", "b"], "document")
+    relations.add("file1", ["v"], "vector")
+    relations.add("file2", ["c"], "document")
+    relations.compact_source("file1")
+
+    deleted = relations.delete(["file1"])
+    assert {key: sorted(ids) for key, ids in deleted.items()} == {
+        "document": ["a", "b"],
+        "vector": ["v"],
+    }
+    assert relations.get(["file1", "file2"]) == ["c"]
+    with relations.engine.connect() as conn:
+        assert not conn.execute(relations.compact_table.select()).all()
+    assert relations.delete([]) == {}
+
+
+def test_drop_relations():
+    from ktem.db.engine import engine
+
+    Index = _index_table("test_drop_index")
+    Index.metadata.create_all(engine)
+    relations = get_relations(Index)
+    assert get_relations(Index) is relations
+    relations.add("file1", ["a"], "document")
+
+    Index.__table__.drop(engine)
+    drop_relations(Index)
+    assert not inspect(engine).has_table(relations.compact_table_name)
+    assert relations.compact_table_name not in Index.metadata.tables
+
+    # a new index gets fresh relations, without the chunk ids of the dropped one
+    Index = _index_table("test_drop_index")
+    Index.metadata.create_all(engine)
+    assert get_relations(Index) is not relations
+    assert get_relations(Index).get(["file1"]) == []
+    Index.__table__.drop(engine)
+    drop_relations(Index)
@@ -0,0 +1,156 @@
+import asyncio
+import io
+import os
+import pickle
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pypdf
+import pytest
+from ktem.storage import s3_storage
+from ktem.storage.s3_storage import (
+    S3ObjectReader,
+    S3Storage,
+    S3StorageFileSystem,
+    get_s3_client,
+)
+from theflow.settings import settings as flowsettings
+
+from kotaemon.loaders import PDFThumbnailReader, TxtReader
+from kotaemon.loaders.utils.thumbnails import PageThumbnailer
+
+moto = pytest.importorskip("moto")
+
+BUCKET = "ktem-tests"
+resources = Path(__file__).parents[2] / "kotaemon" / "tests" / "resources"
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    for name, value in {
+        "AWS_STORAGE_BUCKET_NAME": BUCKET,
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_S3_ENDPOINT_URL": "",
+    }.items():
+        monkeypatch.setattr(flowsettings, name, value, raising=False)
+
+    with moto.mock_aws():
+        s3_storage._create_s3_client.cache_clear()
+        get_s3_client().create_bucket(Bucket=BUCKET)
+        yield S3Storage(prefix="tests")
+    s3_storage._create_s3_client.cache_clear()
+
+
+@pytest.fixture
+def data():
+    return os.urandom(3 * 1024 + 17)
+
+
+def test_shared_client(storage):
+    clients = []
+    threads = [
+        threading.Thread(target=lambda: clients.append(get_s3_client()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(client is storage.s3_client for client in clients)
+    assert S3Storage(prefix="other").s3_client is storage.s3_client
+
+
+def test_read_range(storage, data):
+    key = storage.upload_bytes(data, "hash", ".bin", "application/octet-stream")
+    assert key == "tests/hash.bin" and storage.exists(key)
+    assert not storage.exists("tests/missing.bin")
+
+    assert storage.read_range(key, 10, 20) == data[10:20]
+    assert storage.read_range(key, len(data) - 5) == data[-5:]
+    assert b"".join(storage.iter_chunks(key, chunk_size=1000)) == data
+    assert asyncio.run(storage.aread_range(key, 0, 4)) == data[:4]
+
+
+def test_object_reader(storage, data):
+    key = storage.upload_bytes(data, "hash", ".bin", "application/octet-stream")
+    reader = storage.open(key, block_size=1024)
+    assert reader.size == len(data) and reader.seekable()
+
+    with patch.object(
+        storage.s3_client, "get_object", wraps=storage.s3_client.get_object
+    ) as get_object:
+        assert reader.read(100) == data[:100]
+        assert reader.read(100) == data[100:200]
+        assert get_object.call_count == 1, "Expect the reads within a block"
+
+        reader.seek(-10, io.SEEK_END)
+        assert reader.tell() == len(data) - 10
+        assert reader.read() == data[-10:]
+        assert reader.read() == b""
+        assert get_object.call_args.kwargs["Range"] == (
+            f"bytes={len(data) - 10}-{len(data) - 1}"
+        )
+
+        reader.seek(1000)
+        assert reader.read(2048) == data[1000:3048]
+
+    with pytest.raises(ValueError):
+        reader.seek(-1)
+
+
+def test_file_system(storage, data):
+    key = storage.upload_bytes(data, "hash", ".bin", "application/octet-stream")
+    fs = S3StorageFileSystem(block_size=1024)
+    assert fs.info(key)["size"] == len(data)
+    with fs.open(key, "rb") as fi:
+        assert fi.read(10) == data[:10]
+        fi.seek(2000)
+        assert fi.read() == data[2000:]
+
+    # the parse workers get a copy opening the objects with their own client
+    with pickle.loads(pickle.dumps(fs)).open(key, "rb") as fi:
+        assert fi.read() == data
+    with pytest.raises(NotImplementedError):
+        fs.open(key, "wb")
+
+
+def test_loaders_read_s3(storage):
+    fs = S3StorageFileSystem()
+    text = "Some text\nwith ünïcode"
+    key = storage.upload_bytes(text.encode("utf-8"), "text", ".txt", "text/plain")
+    docs = TxtReader().load_data(Path(key), extra_info={"file_id": "1"}, fs=fs)
+    assert docs[0].text == text and docs[0].metadata == {"file_id": "1"}
+
+    pdf_path = resources / "multimodal.pdf"
+    key = storage.upload_bytes(pdf_path.read_bytes(), "pdf", ".pdf", "application/pdf")
+    thumbnailer = PageThumbnailer(
+        max_size=64, render_workers=2, store=S3Storage(prefix="thumbnails")
+    )
+    pool = thumbnailer.render_pool
+    try:
+        with patch(
+            "kotaemon.loaders.pdf_loader.get_thumbnailer", return_value=thumbnailer
+        ), patch("pypdf.PdfReader", wraps=pypdf.PdfReader) as pdf_reader, patch.object(
+            pool, "submit", wraps=pool.submit
+        ) as submit:
+            docs = PDFThumbnailReader().load_data(Path(key), fs=fs)
+            # pypdf seeks in the object, which is not read into memory
+            stream = pdf_reader.call_args.args[0]
+            assert isinstance(getattr(stream, "raw", None), S3ObjectReader)
+            # the thumbnails are rendered by the pool from a local copy
+            assert submit.call_count > 0
+            assert not Path(submit.call_args.args[1]).exists()
+
+            local_docs = PDFThumbnailReader().load_data(pdf_path)
+    finally:
+        thumbnailer.shutdown()
+
+    assert [doc.text for doc in docs] == [doc.text for doc in local_docs]
+    thumbnails = [doc for doc in docs if doc.metadata.get("type") == "thumbnail"]
+    assert thumbnails and all(
+        storage.exists(doc.metadata["image_origin"]) for doc in thumbnails
+    )
@@ -1,10 +1,12 @@
 # Add imports from __init__.py
-import asyncio
 import logging
+from contextlib import ExitStack
 from copy import deepcopy
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
+from ktem.db.engine import iterate_sync, run_sync
+
 # Import BasePage for proper inheritance
 from libs.ktem.ktem.utils import get_file_names_regex, get_urls
 from libs.ktem.ktem.utils.commands import WEB_SEARCH_COMMAND
@@ -329,9 +331,13 @@ class ChatService:
         if chat_output:
             chat_state["app"]["regen"] = True
 
+        # the stores of the indices stay open until the answer is streamed
+        leases = ExitStack()
+        leases.enter_context(self._app.index_manager.lease())
         try:
             # Construct the pipeline
-            pipeline, reasoning_state = self.create_pipeline(
+            pipeline, reasoning_state = await run_sync(
+                self.create_pipeline,
                 settings,
                 reasoning_type,
                 llm_type,
@@ -352,9 +358,10 @@ class ChatService:
             }
 
             async def async_wrapper():
-                for res in pipeline.stream(chat_input, conversation_id, chat_history):
+                # the retrieval blocks on the database and the models, keep it off the loop
+                stream = pipeline.stream(chat_input, conversation_id, chat_history)
+                async for res in iterate_sync(stream):
                     yield res
-                    await asyncio.sleep(0)
 
             i = 0
             async for response in async_wrapper():
@@ -482,6 +489,8 @@ class ChatService:
                 'mindmap': accumulated_mindmap_json
             }
             yield {k: v for k, v in final_exception_response.items() if v is not None}
+        finally:
+            leases.close()
 
         # Final yield outside the loop to ensure the last state is sent
         # Now uses potentially updated accumulated values from the StopIteration block
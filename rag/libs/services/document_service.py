@@ -1,11 +1,12 @@
 # Document service for handling document upload and indexing
-import asyncio
 import logging
 import os
 import uuid
 from dataclasses import dataclass
 from typing import Any, Dict, List
 
+from ktem.db.engine import iterate_sync, run_sync
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -68,47 +69,51 @@ class DocumentService:
         return file_path
 
     async def delete_file(self, file_ids):
-        indexing_pipeline = self.file_index.get_indexing_pipeline({}, '')
-        indexing_pipeline.delete_file(file_ids)
+        with self.file_index.lease():
+            indexing_pipeline = self.file_index.get_indexing_pipeline({}, '')
+            await run_sync(indexing_pipeline.delete_file, file_ids)
 
     async def process_upload_request(self, request: DocumentUploadRequest):
         """Process document upload request and return indexed document IDs"""
         settings = request.settings or {}
-        indexing_pipeline = self.file_index.get_indexing_pipeline(settings, request.user_id)
-
-        async def async_wrapper():
-            for res in indexing_pipeline.stream(request.file_ids, reindex=request.reindex):
-                yield res
-                await asyncio.sleep(0)
-
-        # Process files if provided
-        file_ids, outputs, debugs = [], [], []
-        if request.file_ids:
-            async for response in async_wrapper():
-                try:
-                    if response is None:
-                        continue
-                    if response.channel == "index":
-                        if response.content["status"] == "success":
-                            outputs.append(f"\u2705 | {response.content['file_name']}")
-                        elif response.content["status"] == "failed":
-                            yield 'failed'
-                            outputs.append(
-                                f"\u274c | {response.content['file_name']}: "
-                                f"{response.content['message']}"
-                            )
-                    elif response.channel == 'info':
-                        yield response.content
-                    elif response.channel == "debug":
-                        debugs.append(response.text)
-                except StopIteration as e:
-                    # StopIteration.value contains the final result from the stream
-                    results, index_errors, docs = e.value
-                    file_ids.extend([r for r in results if r])
-                    errors = index_errors
-                    yield {'file_ids': file_ids}
-                except Exception as e:
-                    logger.error(f"Error in processing stream: {str(e)}", exc_info=True)
-                    yield {'file_ids': file_ids}
+        # the stores of the index stay open until the files are indexed
+        with self.file_index.lease():
+            indexing_pipeline = self.file_index.get_indexing_pipeline(settings, request.user_id)
+
+            async def async_wrapper():
+                # the indexing blocks on the database and the models, keep it off the loop
+                stream = indexing_pipeline.stream(request.file_ids, reindex=request.reindex)
+                async for res in iterate_sync(stream):
+                    yield res
+
+            # Process files if provided
+            file_ids, outputs, debugs = [], [], []
+            if request.file_ids:
+                async for response in async_wrapper():
+                    try:
+                        if response is None:
+                            continue
+                        if response.channel == "index":
+                            if response.content["status"] == "success":
+                                outputs.append(f"\u2705 | {response.content['file_name']}")
+                            elif response.content["status"] == "failed":
+                                yield 'failed'
+                                outputs.append(
+                                    f"\u274c | {response.content['file_name']}: "
+                                    f"{response.content['message']}"
+                                )
+                        elif response.channel == 'info':
+                            yield response.content
+                        elif response.channel == "debug":
+                            debugs.append(response.text)
+                    except StopIteration as e:
+                        # StopIteration.value contains the final result from the stream
+                        results, index_errors, docs = e.value
+                        file_ids.extend([r for r in results if r])
+                        errors = index_errors
+                        yield {'file_ids': file_ids}
+                    except Exception as e:
+                        logger.error(f"Error in processing stream: {str(e)}", exc_info=True)
+                        yield {'file_ids': file_ids}
 
         yield {'file_ids': file_ids}